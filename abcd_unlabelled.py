@@ -23,6 +23,9 @@ options
      you will need to have created json service credentials at .google-credentials.json
      you will incur costs for using this over 500,000 chars in a month
 
+--gzip_output
+     write each month as .json.gz, examples are streamed to the file rather than built into a workspace
+
 
 Produces two files
 ./data/abcd_unlabelled05.json - example month of May unlabelled file to upload as a datasource
@@ -37,8 +40,9 @@ import json
 import os
 import random
 import math
-from datetime import datetime, timedelta
+from datetime import datetime
 from time import perf_counter
+from typing import Iterator
 
 # third party imports
 import numpy
@@ -50,6 +54,10 @@ import tqdm
 from google.cloud import translate_v2 as translate
 import humanfirst
 
+# custom imports
+import hf_example_builder
+import hf_json_writer
+
 # role mapping abcd roles to HF roles
 role_mapping = {
     'customer': 'client',
@@ -72,6 +80,8 @@ performance_log = []
               help='Filter for just this abcd_id')
 @click.option('-l', '--include_actions', is_flag=True, default=False, type=bool, required=False,
               help='Include system actions')
+@click.option('-g', '--gzip_output', is_flag=True, default=False, type=bool, required=False,
+              help='Write each month gzip compressed to .json.gz')
 def main(input_file: str,
          unlabelled: str,
          sample: int,
@@ -79,13 +89,14 @@ def main(input_file: str,
          translation: str,
          source: str,
          abcd_id: int,
-         include_actions: bool):
+         include_actions: bool,
+         gzip_output: bool):
     '''Main function'''
 
-    process(input_file, unlabelled, sample, anonymize, translation, source, abcd_id, include_actions)
+    process(input_file, unlabelled, sample, anonymize, translation, source, abcd_id, include_actions, gzip_output)
 
 def process(input_file: str, unlabelled: str, sample: int, anonymize: bool,
-            translation: str, source: str, abcd_id: int, include_actions: bool):
+            translation: str, source: str, abcd_id: int, include_actions: bool, gzip_output: bool = False):
     '''Process the file'''
     perf_log('Begin')
     start = datetime.now()
@@ -140,8 +151,7 @@ def process(input_file: str, unlabelled: str, sample: int, anonymize: bool,
     max_abcd_id = df['abcd_id'].max()
     seconds_between_utterances = 17
     perf_log('Commencing adding datatimes')
-    df = df.progress_apply(add_datetimes, axis=1, args=[
-                           start_date, period, max_abcd_id, seconds_between_utterances])
+    df = add_datetimes_column(df, start_date, period, max_abcd_id, seconds_between_utterances)
     perf_log('Created Timestamps')
 
     # abcd to hf roles
@@ -183,28 +193,16 @@ def process(input_file: str, unlabelled: str, sample: int, anonymize: bool,
         analyzer = None
         anonymizer = None
 
-    # set index
-    df = df.set_index(['abcd_id', 'idx'], drop=True)
-    perf_log('Set abcd_id,idx as index')
-
-    # build examples
-
-    perf_log('Commencing example build')
-    df = df.progress_apply(build_example, axis=1)
-    perf_log('Built all examples')
-
-    # make a workspace for each month and write to file
+    # stream each month's examples built from its columns straight to its file
+    # in the created_at order HFWorkspace.write_json would have used
     for m in list(df['month'].unique()):  # pylint: disable=invalid-name
-        unlabelled_workspace = humanfirst.objects.HFWorkspace()
-        df_month = df[df['month'] == m]['example']
-        for example in df_month:
-            unlabelled_workspace.add_example(example)
-        file_name = f'./data/{unlabelled}{m}{translation}.json'
-        file_out = open(file_name, 'w', encoding='utf8')
+        df_month = df[df['month'] == m].sort_values('created_at', kind='stable')
+        file_name = hf_json_writer.gzip_filename(f'./data/{unlabelled}{m}{translation}.json', gzip_output)
         perf_log(f'Starting write out: {file_name}')
-        unlabelled_workspace.write_json(file_out)
-        perf_log(f'Finished write out: {file_name}')
-        file_out.close()
+        with hf_json_writer.open_output_atomic(file_name) as file_out:
+            with hf_json_writer.HFJsonStreamWriter(file_out) as writer:
+                writer.write_example_dicts(build_example_dicts(df_month))
+        perf_log(f'Finished write out: {file_name} examples: {writer.count}')
 
     print(df[['utterance', 'abcd_role', 'created_at']])
     print(df[['month', 'utterance']].groupby(['month']).count())
@@ -284,15 +282,15 @@ def load_data_file(input_file: str, abcd_id: int) -> pandas.DataFrame:
     return df
 
 
-def add_datetimes(row: pandas.DataFrame, start_date: datetime, period: int,
-                  max_abcd_id: int, time_per_utterance: int) -> pandas.Series:
-    '''Adds a repeatable datetime based on the abcd_id'''
-    created_at = start_date + \
-        timedelta(seconds=(row.idx*time_per_utterance +
-                  int(period*24*60*60*int(row.abcd_id)/max_abcd_id)))
-    row['created_at'] = created_at
-    row['month'] = f'{created_at.month:02}'
-    return row
+def add_datetimes_column(df: pandas.DataFrame, start_date: datetime, period: int,
+                         max_abcd_id: int, time_per_utterance: int) -> pandas.DataFrame:
+    '''Adds a repeatable datetime based on the abcd_id to the whole frame at once'''
+    # int() of the positive float offset truncates, which is what astype(int) does
+    offset_seconds = (period*24*60*60*df['abcd_id'].astype(int)/max_abcd_id).astype(int)
+    seconds = df['idx'].astype(int)*time_per_utterance + offset_seconds
+    df['created_at'] = pandas.Timestamp(start_date) + pandas.to_timedelta(seconds, unit='s')
+    df['month'] = df['created_at'].dt.month.map(lambda m: f'{m:02}')
+    return df
 
 
 def abcd_to_hf_roles(role: str) -> str:
@@ -303,21 +301,14 @@ def abcd_to_hf_roles(role: str) -> str:
         raise humanfirst.objects.HFMapperException(f'Couldn\'t locate role: "{role}" in role mapping. KeyError: {exc}')
 
 
-def build_example(row: pandas.Series) -> pandas.Series:
-    '''Creates a HumanFirst unlabelled utterance example linking it to it's conversation and adding metadata'''
-    example = humanfirst.objects.HFExample(
-        text=row['utterance'],
-        id=f'example-{row.name[0]}-{row.name[1]}',
-        created_at=row['created_at'],
-        intents=[],  # no intents as unlabelled
-        tags=[],  # no tags only metadata on unlabelled
-        metadata=row['metadata'],
-        # abcd_id, conversation, hf_role
-        context=humanfirst.objects.HFContext(
-            str(row.name[0]), 'conversation', row['hf_role'])
-    )
-    row['example'] = example
-    return row
+def build_example_dicts(df: pandas.DataFrame) -> Iterator[dict]:
+    '''Creates HumanFirst unlabelled utterance examples linking them to their conversation and adding metadata'''
+    abcd_ids = df['abcd_id'].astype(str).to_list()
+    ids = [f'example-{abcd_id}-{idx}' for abcd_id, idx in zip(abcd_ids, df['idx'].to_list())]
+    # abcd_id, conversation, hf_role
+    return hf_example_builder.iter_example_dicts(df['utterance'], ids, df['created_at'],
+                                                 metadata=df['metadata'].to_list(),
+                                                 context_ids=abcd_ids, roles=df['hf_role'])
 
 
 def presidio_anonymize(text: str, analyzer: presidio_analyzer.AnalyzerEngine,
@@ -12,16 +12,27 @@
 # standard import
 import uuid
 import os
+import sys
+import pathlib
+import functools
 from os.path import join, exists
 from datetime import datetime
-from multiprocessing import Pool
+from typing import Union
 
 # 3rd party imports
 import click
 import pandas
 import openai
 import requests
-import numpy
+
+# Custom Imports
+hf_module_path = str(pathlib.Path(os.path.dirname(os.path.realpath(__file__))).parents[2])
+sys.path.insert(1, hf_module_path)
+import llm_executor # pylint: disable=wrong-import-position
+import llm_cache # pylint: disable=wrong-import-position
+
+# output tokens reserved for each openai reply
+MAX_TOKENS = 500
 
 class UnrecognisedEnvironmentException(Exception):
     """This happens when entered environmenis neither dev nor prod"""
@@ -57,7 +68,9 @@ class UnscuccessfulAPICallException(Exception):
 @click.option('-u','--username' ,type=str,default="",help='username of HTTP endpoint in Node-RED')
 @click.option('-p','--password' ,type=str,default="",help='password of HTTP endpoint in Node-RED')
 @click.option('-s','--sample',type=int,default=4,help='n text to sample from dataset')
-@click.option('-n', '--num_cores', type=int, default=2, help='Number of cores for parallelisation')
+@click.option('-n', '--num_cores', type=int, default=2, help='Number of calls to have in flight at once')
+@click.option('-q', '--requests_per_minute', type=int, default=0,
+              help='Maximum requests per minute across all calls default 0 no limit')
 @click.option('-v', '--use_adv_suffix', is_flag=True, default=False, help='Flag for adversarial suffix usage')
 @click.option('-k', '--use_dan_attack_prefix', is_flag=True, default=False, help='Flag for DAN attack usage as prefix')
 @click.option('-e','--env' ,type=click.Choice(['dev', 'prod']),default='dev',help='Dev or prod to update')
@@ -66,10 +79,12 @@ class UnscuccessfulAPICallException(Exception):
               default='openai',
               help='Get response from OpenAI or Charlie')
 @click.option('-m', '--model', type=str, required=True, help='model name - gpt-3.5-turbo-0301 or gpt-3.5-turbo-0613')
+@click.option('-c', '--cache_filename', type=str, default='',
+              help='SQLite file to cache openai replies in so identical prompts are not resent, default no cache')
 def main(openai_api_key: str, file_path: str, adversarial_suffix_file_path: str,
          dan_attack_file_path: str, reply_folder_path: str, sample: int, num_cores: int,
          use_adv_suffix: bool, use_dan_attack_prefix: bool, get_response_from: str, env: str,
-         username: str, password: str, model: str) -> None:
+         username: str, password: str, model: str, requests_per_minute: int, cache_filename: str) -> None:
     '''Main Function'''
 
     process(openai_api_key,
@@ -85,7 +100,9 @@ def main(openai_api_key: str, file_path: str, adversarial_suffix_file_path: str,
             env,
             username,
             password,
-            model)
+            model,
+            requests_per_minute,
+            cache_filename)
 
 
 def process(openai_api_key: str,
@@ -101,7 +118,9 @@ def process(openai_api_key: str,
             env: str,
             username: str,
             password: str,
-            model: str) -> None:
+            model: str,
+            requests_per_minute: int = 0,
+            cache_filename: str = '') -> None:
     '''calls_openai for the attack'''
 
     openai.api_key = openai_api_key
@@ -203,13 +222,27 @@ def process(openai_api_key: str,
 
     print(df["prompt_text"])
 
-    # parallelization
-    pool = Pool(num_cores)
-    dfs = numpy.array_split(df, num_cores)
-    pool_results = pool.map(parallelise_calls, dfs)
-    pool.close()
-    pool.join()
-    df = pandas.concat(pool_results)
+    # send concurrently, each worker takes the next text as soon as it is free
+    # failures are retried with backoff and each reply is written as soon as it is returned
+    # replies cached from previous runs are written without taking any of the budget
+    cache = None
+    lookup = None
+    if cache_filename != '':
+        cache = llm_cache.LLMResponseCache(cache_filename)
+        lookup = functools.partial(lookup_reply, cache=cache)
+    executor = llm_executor.LLMExecutor(call=functools.partial(send_text, cache=cache),
+                                        concurrency=num_cores,
+                                        requests_per_minute=requests_per_minute,
+                                        max_retries=10,
+                                        lookup=lookup)
+    jobs = [llm_executor.LLMJob(key=text_id, payload=row) for text_id, row in df[~df["completed"]].iterrows()]
+    for result in executor.run_sync(jobs):
+        if result.error == '':
+            df.loc[result.key, "response"] = result.value["response"]
+            df.loc[result.key, "completed"] = True
+    if cache is not None:
+        print(cache.summary())
+        cache.close()
 
     if get_response_from == "charlie":
         df.drop(columns=["username","password"],inplace=True)
@@ -247,17 +280,11 @@ def get_completed_text_ids(output_file_path: str) -> tuple:
     return completed_ids, completed_texts
 
 
-def parallelise_calls(df: pandas.DataFrame) -> pandas.DataFrame:
-    '''Parallelise dataframe processing'''
-
-    return df.apply(send_text, axis=1)
-
-
-def send_text(row: pandas.Series) -> pandas.Series:
+def send_text(row: pandas.Series, cache: llm_cache.LLMResponseCache = None) -> pandas.Series:
     """Send text"""
 
     if row["get_response_from"] == "openai":
-        return send_text_to_openai(row)
+        return send_text_to_openai(row, cache)
     elif row["get_response_from"] == "charlie":
         return send_text_to_charlie(row)
     else:
@@ -265,34 +292,45 @@ def send_text(row: pandas.Series) -> pandas.Series:
             f"The provided response generator - {row['get_response_from']} is neither openai nor charlie")
 
 
-def send_text_to_openai(row: pandas.Series) -> pandas.Series:
-    '''Send text to OpenAI'''
+def send_text_to_openai(row: pandas.Series, cache: llm_cache.LLMResponseCache = None) -> pandas.Series:
+    '''Send text to OpenAI, exceptions are retried by the executor'''
 
+    row = row.copy()
     if not row["completed"]:
 
-        try:
-            response  = call_openai(row["final_prompt"], row["model"])
-            if not response.choices[0].message.content:
-                raise ServerOverloadException("Unsuccessful API Call - may be dude to server overload")
+        response  = call_openai(row["final_prompt"], row["model"])
+        if not response.choices[0].message.content:
+            raise ServerOverloadException("Unsuccessful API Call - may be dude to server overload")
 
-            text = response.choices[0].message.content
+        text = response.choices[0].message.content.strip()
+        if text == "":
+            raise EmptyResponseException(f"Empty response generated for the text - {row.name}")
+        if cache is not None:
+            cache.put(row["model"], row["final_prompt"], 0.0, MAX_TOKENS, text, response.usage.total_tokens)
+        write_reply(row, text)
 
-            text = text.strip()
-            if text == "":
-                raise EmptyResponseException(f"Empty response generated for the text - {row.text}")
-
-            # Writing to text file
-            with open(row["reply_path"],mode="w",encoding="utf-8") as f:
-                f.write(text)
-            row["response"] = text
-            row["completed"] = True
+    return row
 
-        except (Exception, ServerOverloadException, EmptyResponseException) as e: # pylint: disable=broad-exception-caught
-            print(f"Rerunning {row.name} due to {e}")
-            row = send_text_to_openai(row) # rerun the text
+def lookup_reply(row: pandas.Series, cache: llm_cache.LLMResponseCache) -> Union[pandas.Series, None]:
+    '''The row with the reply to an identical previous OpenAI prompt from the cache written out, or None'''
 
+    if row["completed"] or row["get_response_from"] != "openai":
+        return None
+    cached = cache.get(row["model"], row["final_prompt"], 0.0, MAX_TOKENS)
+    if cached is None:
+        return None
+    row = row.copy()
+    write_reply(row, cached["content"])
     return row
 
+def write_reply(row: pandas.Series, text: str) -> None:
+    '''Write the reply to its text file and mark the row completed'''
+
+    with open(row["reply_path"],mode="w",encoding="utf-8") as f:
+        f.write(text)
+    row["response"] = text
+    row["completed"] = True
+
 def call_openai(text: str, model: str) -> str:
     '''Calling OpenAI'''
 
@@ -302,7 +340,7 @@ def call_openai(text: str, model: str) -> str:
             {"role": "user", "content": text}
         ],
         temperature=0.0,
-        max_tokens=500,
+        max_tokens=MAX_TOKENS,
         top_p=1,                # default value
         frequency_penalty=0.0,  # default value
         presence_penalty=0.0    # default value
@@ -311,8 +349,9 @@ def call_openai(text: str, model: str) -> str:
     return response
 
 def send_text_to_charlie(row: pandas.Series) -> pandas.Series:
-    """Send text to Charlie"""
+    """Send text to Charlie, exceptions are retried by the executor"""
 
+    row = row.copy()
     if not row["completed"]:
         data = {
             "id": row.name,
@@ -323,24 +362,19 @@ def send_text_to_charlie(row: pandas.Series) -> pandas.Series:
                                 auth=(row.username,row.password),
                                 json=data)
 
-        try:
-            if response.status_code != 200:
-                raise UnscuccessfulAPICallException(
-                    f"Status Code :{response.status_code} \n\nResponse:\n\n{response.json()}")
-
-            text = response.text.strip()
-            if text == "":
-                raise EmptyResponseException(f"Empty response generated for the text - {row.text}")
+        if response.status_code != 200:
+            raise UnscuccessfulAPICallException(
+                f"Status Code :{response.status_code} \n\nResponse:\n\n{response.text}")
 
-            # Writing to text file
-            with open(row["reply_path"],mode="w",encoding="utf-8") as f:
-                f.write(text)
-            row["response"] = text
-            row["completed"] = True
+        text = response.text.strip()
+        if text == "":
+            raise EmptyResponseException(f"Empty response generated for the text - {row.name}")
 
-        except (Exception, UnscuccessfulAPICallException, EmptyResponseException) as e: # pylint: disable=broad-exception-caught
-            print(f"Rerunning {row.name} due to {e}")
-            row = send_text_to_charlie(row) # rerun the text
+        # Writing to text file
+        with open(row["reply_path"],mode="w",encoding="utf-8") as f:
+            f.write(text)
+        row["response"] = text
+        row["completed"] = True
 
     return row
 
@@ -27,6 +27,9 @@ import json
 import pandas
 import click
 
+# custom imports
+import hf_json_reader
+
 class IncorrectColumnNameException(Exception):
     """This happens when a metadata column provided does not belong to the dataframe"""
 
@@ -36,9 +39,7 @@ def main(filename: str) -> None:
     """Main Function"""
 
     # load input data
-    with open(filename, mode="r", encoding="utf8") as file:
-        data = json.load(file)
-    df = pandas.json_normalize(data=data["examples"], sep="-")
+    df = hf_json_reader.read_examples(filename)
 
     df["col1"] = "Test1"
     df["col2"] = "Test2"
@@ -5,12 +5,27 @@ This script predicts the intents of utterances in batches
 The input CSV file should contain a column containing utterances for prediction
 The output CSV contains fully_qualified_intent_name, confidence, parent_intent, and child_intent columns additionally 
 
+With --workers greater than 1 chunks are dispatched concurrently with at most that many batch requests in flight.
+Results are always reassembled in input order and appended to the output CSV as each chunk completes,
+so a crash partway through keeps everything predicted up to that point.
+--max_rps optionally caps the number of batch requests started per second across all workers.
+
+--cache_filename keeps every prediction in a SQLite file keyed by namespace, playbook, model_id, revision_id
+and the hash of the utterance.  Repeated utterances are predicted once and a re-run after a failure
+(or over an overlapping dataset) only calls the NLU for utterances not already in the cache.
+
 Set HF_USERNAME and HF_PASSWORD as environment variables
 """
 # *********************************************************************************************************************
 
 # standard imports
 import os
+import time
+import json
+import sqlite3
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor
 
 # third party imports
 import click
@@ -31,10 +46,17 @@ import humanfirst
 @click.option('-c', '--chunk', type=int, default=500, help='Optional size of maximum chunk to send to batch predict default 500')
 @click.option('-m', '--model_id', type=str, default="", help='Optional Model ID to run a specific NLU version')
 @click.option('-r', '--revision_id', type=str, default="", help='Optional Revision ID to run a specific NLU version')
+@click.option('-w', '--workers', type=int, default=1,
+              help='Optional number of batch requests in flight at once default 1')
+@click.option('-s', '--max_rps', type=float, default=0.0,
+              help='Optional cap on batch requests started per second across all workers default 0 no cap')
+@click.option('-k', '--cache_filename', type=str, default='',
+              help='Optional SQLite file to cache predictions in and resume from default no cache')
 def main(input_filename: str, output_filename: str, uttr_col: str,
          username: str, password: int, namespace: bool, playbook: str, 
          delimiter: str, chunk: int,
-         model_id: str, revision_id: str) -> None:
+         model_id: str, revision_id: str,
+         workers: int, max_rps: float, cache_filename: str) -> None:
     """Main Function"""
     
     # must provide both model_id and revision_id 
@@ -99,51 +121,206 @@ def main(input_filename: str, output_filename: str, uttr_col: str,
            
         print(f'Confirmed model_id: {model_id} and revision_id: {revision_id}')
         
-    # loop through in the required chunks
-    fully_qualified_intent_name = []
-    confidence = []
-    num_processed = 0
-    for i in range(0, df['utterance'].size, chunk):
-        utterance_chunk = list(df['utterance'][i: i + chunk])
-        
-        # Batch predict will default model_id and revision_id
-        if model_id == "":
-            # example of simple normal call
-            response_dict = hf_api.batchPredict(
-                                            sentences=utterance_chunk,
-                                            namespace=namespace,
-                                            playbook=playbook)
-        else:
-            # example overriding the model and revision to use
-            response_dict = hf_api.batchPredict(
-                                sentences=utterance_chunk,
-                                namespace=namespace,
-                                playbook=playbook,
-                                model_id=model_id,
-                                revision_id=revision_id)
-
-
-        # expecting a result for every element in the chunk - will error if one doesn't exist
-        for j in range(len(utterance_chunk)):
-            
-            # Assign confidence to a list to make a DF later
-            confidence.append(response_dict[j]['matches'][0]['score'])
-                                   
-            # This gives you "id" which you can look up with FQIN - except that the ID may nolonger exist in the workspace
-            # fully_qualified_intent_name.append(workspace.get_fully_qualified_intent_name(response_dict[j]['matches'][0]["id"]))
-            # note response_dict[j]['matches'][0]['hierarchyNames'] will also give you the path and you can join themselves
-            fully_qualified_intent_name.append(delimiter.join(response_dict[j]['matches'][0]['hierarchyNames']))
-            
-        num_processed = num_processed + len(utterance_chunk)
-        print(f'Completed: {num_processed} utterances')
-    df['fully_qualified_intent_name'] = fully_qualified_intent_name
-    df['confidence'] = confidence
+    if workers < 1:
+        raise RuntimeError(f'workers must be 1 or more not: {workers}')
 
     if output_filename == '':
         output_filename = input_filename.replace(".csv","_predictions.csv")
 
-    df.to_csv(output_filename, index=False, encoding='utf8')
+    # cache of previous predictions
+    cache = None
+    if cache_filename != '':
+        if revision_id == '':
+            print('Warning caching predictions of the latest revision - delete the cache if the NLU is retrained')
+        cache = PredictionCache(cache_filename)
+        print(f'Using prediction cache: {cache_filename} with {len(cache)} predictions')
+
+    # predict chunks concurrently and append each to the output in input order
+    rate_limiter = RateLimiter(max_rps)
+    num_processed = 0
+    with open(output_filename, mode='w', encoding='utf8', newline='') as file_out:
+        for i, df_chunk in enumerate(predict_chunks(hf_api=hf_api, df=df, namespace=namespace, playbook=playbook,
+                                                    delimiter=delimiter, chunk=chunk,
+                                                    model_id=model_id, revision_id=revision_id,
+                                                    workers=workers, rate_limiter=rate_limiter,
+                                                    cache=cache)):
+            df_chunk.to_csv(file_out, index=False, header=(i == 0))
+            file_out.flush()
+            num_processed = num_processed + df_chunk.shape[0]
+            print(f'Completed: {num_processed} utterances')
+
+    if cache is not None:
+        print(f'Cache hits: {cache.hits} utterances predicted: {cache.misses}')
+        cache.close()
+
     print(f'Predictions CSV is saved at {output_filename}')
 
+def predict_chunks(hf_api: humanfirst.apis.HFAPI, df: pandas.DataFrame, namespace: str, playbook: str,
+                   delimiter: str, chunk: int, model_id: str = "", revision_id: str = "",
+                   workers: int = 1, rate_limiter: "RateLimiter" = None, cache: "PredictionCache" = None):
+    """Generator yielding each chunk of df with its predictions, in input order.
+
+    At most workers chunks are in flight at once, so memory is bounded by the window
+    rather than the size of the file"""
+
+    if rate_limiter is None:
+        rate_limiter = RateLimiter(0)
+
+    starts = iter(range(0, df['utterance'].size, chunk))
+    in_flight = collections.deque()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+
+        # keep the window full, always yielding the oldest chunk so output order matches input order
+        while True:
+            while len(in_flight) < workers:
+                i = next(starts, None)
+                if i is None:
+                    break
+                df_chunk = df.iloc[i: i + chunk].copy()
+                in_flight.append(executor.submit(predict_chunk, hf_api, df_chunk, namespace, playbook, delimiter,
+                                                 model_id, revision_id, rate_limiter, cache))
+            if len(in_flight) == 0:
+                break
+            yield in_flight.popleft().result()
+
+def predict_chunk(hf_api: humanfirst.apis.HFAPI, df_chunk: pandas.DataFrame, namespace: str, playbook: str,
+                  delimiter: str, model_id: str, revision_id: str,
+                  rate_limiter: "RateLimiter", cache: "PredictionCache" = None) -> pandas.DataFrame:
+    """Batch predict one chunk and add the fully_qualified_intent_name and confidence columns
+
+    With a cache only the distinct utterances not already cached are sent"""
+    utterance_chunk = list(df_chunk['utterance'])
+
+    if cache is None:
+        matches = call_batch_predict(hf_api, utterance_chunk, namespace, playbook, model_id, revision_id,
+                                     rate_limiter)
+    else:
+        keys = [cache.make_key(namespace, playbook, model_id, revision_id, u) for u in utterance_chunk]
+        found = cache.get_many(keys)
+        to_predict = {}
+        for key, utterance in zip(keys, utterance_chunk):
+            if key not in found:
+                to_predict[key] = utterance
+        if len(to_predict) > 0:
+            predicted = call_batch_predict(hf_api, list(to_predict.values()), namespace, playbook,
+                                           model_id, revision_id, rate_limiter)
+            predicted = dict(zip(to_predict.keys(), predicted))
+            cache.put_many(predicted)
+            found.update(predicted)
+        cache.record(hits=len(keys) - len(to_predict), misses=len(to_predict))
+        matches = [found[key] for key in keys]
+
+    # This gives you "id" which you can look up with FQIN - except that the ID may nolonger exist in the workspace
+    # fully_qualified_intent_name.append(workspace.get_fully_qualified_intent_name(response_dict[j]['matches'][0]["id"]))
+    # note response_dict[j]['matches'][0]['hierarchyNames'] will also give you the path and you can join themselves
+    df_chunk['fully_qualified_intent_name'] = [delimiter.join(m['hierarchyNames']) for m in matches]
+    df_chunk['confidence'] = [m['score'] for m in matches]
+    return df_chunk
+
+def call_batch_predict(hf_api: humanfirst.apis.HFAPI, utterances: list, namespace: str, playbook: str,
+                       model_id: str, revision_id: str, rate_limiter: "RateLimiter") -> list:
+    """Returns the top match dict with score and hierarchyNames for each utterance"""
+
+    rate_limiter.wait()
+
+    # Batch predict will default model_id and revision_id
+    if model_id == "":
+        # example of simple normal call
+        response_dict = hf_api.batchPredict(
+                                        sentences=utterances,
+                                        namespace=namespace,
+                                        playbook=playbook)
+    else:
+        # example overriding the model and revision to use
+        response_dict = hf_api.batchPredict(
+                            sentences=utterances,
+                            namespace=namespace,
+                            playbook=playbook,
+                            model_id=model_id,
+                            revision_id=revision_id)
+
+    # expecting a result for every element in the chunk - will error if one doesn't exist
+    matches = []
+    for j in range(len(utterances)):
+        top_match = response_dict[j]['matches'][0]
+        matches.append({"score": top_match['score'], "hierarchyNames": top_match['hierarchyNames']})
+    return matches
+
+class PredictionCache:
+    """SQLite store of top matches keyed by namespace, playbook, model_id, revision_id and utterance hash.
+
+    Shared between the worker threads so access is serialised with a lock"""
+
+    def __init__(self, filename: str):
+        self.conn = sqlite3.connect(filename, check_same_thread=False)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS predictions '
+                          '(key TEXT PRIMARY KEY, score REAL, hierarchy_names TEXT)')
+        self.conn.commit()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM predictions').fetchone()[0]
+
+    @staticmethod
+    def make_key(namespace: str, playbook: str, model_id: str, revision_id: str, utterance: str) -> str:
+        """Key for an utterance against a specific NLU version"""
+        return '|'.join([namespace, playbook, model_id, revision_id,
+                         humanfirst.objects.hash_string(str(utterance))])
+
+    def get_many(self, keys: list) -> dict:
+        """Returns a dict of key to match for those keys present"""
+        found = {}
+        unique_keys = list(set(keys))
+        with self.lock:
+            # stay under the SQLite host parameter limit
+            for i in range(0, len(unique_keys), 500):
+                batch = unique_keys[i: i + 500]
+                rows = self.conn.execute(
+                    f'SELECT key, score, hierarchy_names FROM predictions WHERE key IN ({",".join("?" * len(batch))})',
+                    batch)
+                for key, score, hierarchy_names in rows:
+                    found[key] = {"score": score, "hierarchyNames": json.loads(hierarchy_names)}
+        return found
+
+    def put_many(self, matches: dict):
+        """Store a dict of key to match and commit so it survives a crash"""
+        with self.lock:
+            self.conn.executemany('INSERT OR REPLACE INTO predictions VALUES (?,?,?)',
+                                  [(k, m["score"], json.dumps(m["hierarchyNames"])) for k, m in matches.items()])
+            self.conn.commit()
+
+    def record(self, hits: int, misses: int):
+        """Keep running totals for the end of run summary"""
+        with self.lock:
+            self.hits = self.hits + hits
+            self.misses = self.misses + misses
+
+    def close(self):
+        """Close the underlying connection"""
+        self.conn.close()
+
+class RateLimiter:
+    """Spaces out calls across threads so no more than max_per_second start each second.
+    A max_per_second of 0 or less means no limit"""
+
+    def __init__(self, max_per_second: float):
+        self.interval = 1.0 / max_per_second if max_per_second > 0 else 0.0
+        self.next_slot = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """Block until this caller's slot comes round"""
+        if self.interval == 0.0:
+            return
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
 if __name__ == '__main__':
     main() # pylint: disable=no-value-for-parameter
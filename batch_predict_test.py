@@ -0,0 +1,71 @@
+"""
+Test batch_predict.py chunk dispatch against a fake HF API
+
+"""
+# ***************************************************************************80**************************************120
+
+# standard imports
+import time
+import random
+
+# 3rd party imports
+import pandas
+
+# custom imports
+import batch_predict # file under test
+
+class FakeHFAPI:
+    """Answers batchPredict with the utterance as the intent name after a random delay"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def batchPredict(self, sentences: list, namespace: str, playbook: str, # pylint: disable=invalid-name,unused-argument
+                     model_id: str = "", revision_id: str = "") -> list: # pylint: disable=unused-argument
+        """Fake prediction"""
+        self.calls = self.calls + 1
+        time.sleep(random.uniform(0.0,0.02))
+        return [{"matches": [{"score": 0.5, "hierarchyNames": ["parent", s]}]} for s in sentences]
+
+def test_predict_chunks_keeps_input_order():
+    """Chunks completing out of order must still be yielded in input order"""
+    df = pandas.DataFrame({"utterance": [f'utt{i}' for i in range(103)]})
+    hf_api = FakeHFAPI()
+    chunks = list(batch_predict.predict_chunks(hf_api=hf_api, df=df, namespace="ns", playbook="pb",
+                                               delimiter="-", chunk=10, workers=4))
+    assert len(chunks) == 11
+    assert hf_api.calls == 11
+    df_out = pandas.concat(chunks)
+    assert df_out["utterance"].to_list() == df["utterance"].to_list()
+    assert df_out["fully_qualified_intent_name"].to_list() == [f'parent-utt{i}' for i in range(103)]
+    assert (df_out["confidence"] == 0.5).all()
+
+def test_rate_limiter_spaces_calls():
+    """Five calls at 50 per second should take at least 4 intervals"""
+    rate_limiter = batch_predict.RateLimiter(50)
+    start = time.monotonic()
+    for _ in range(5):
+        rate_limiter.wait()
+    assert time.monotonic() - start >= 0.075
+
+def test_cache_predicts_each_utterance_once(tmp_path):
+    """Duplicates within a run and everything on a re-run should come from the cache"""
+    df = pandas.DataFrame({"utterance": ["yes", "agent please", "yes", "no", "yes", "agent please"]})
+    cache = batch_predict.PredictionCache(str(tmp_path / "cache.sqlite"))
+    hf_api = FakeHFAPI()
+    df_out = pandas.concat(batch_predict.predict_chunks(hf_api=hf_api, df=df, namespace="ns", playbook="pb",
+                                                        delimiter="-", chunk=3, cache=cache))
+    assert df_out["fully_qualified_intent_name"].to_list() == [f'parent-{u}' for u in df["utterance"]]
+    assert len(cache) == 3
+    assert cache.misses == 3
+    assert cache.hits == 3
+    cache.close()
+
+    # restart with the same cache file
+    cache = batch_predict.PredictionCache(str(tmp_path / "cache.sqlite"))
+    hf_api = FakeHFAPI()
+    df_rerun = pandas.concat(batch_predict.predict_chunks(hf_api=hf_api, df=df, namespace="ns", playbook="pb",
+                                                          delimiter="-", chunk=3, cache=cache))
+    assert hf_api.calls == 0
+    assert df_rerun["fully_qualified_intent_name"].to_list() == df_out["fully_qualified_intent_name"].to_list()
+    cache.close()
@@ -1,14 +1,19 @@
 """
-ftest.py
+python bulk_call_csv_to_json_unlabeled.py -f ./data/daily -u text -c convo_id -t created_at -r role -w 16
+
+Runs csv_to_json_unlabelled.process over every csv (and xlsx) in a directory using a pool of worker processes.
+Files whose json output is already newer than the input are skipped unless --rebuild is set.
+Reports the time taken for each file using the why_so_long nanosecond return of process.
 """
 # ******************************************************************************************************************120
 
 # standard imports
 import os
+from multiprocessing import Pool
+from time import perf_counter_ns
 
 # 3rd party imports
 import click
-import pandas
 
 # custom imports
 import csv_to_json_unlabelled
@@ -37,35 +42,85 @@ import csv_to_json_unlabelled
               help='column:value,column:value;column:value,column:value')
 @click.option('-h', '--striphtml', is_flag=True, default=False,
               help='Whether to strip html tags from the utterance col')
-@click.option('-b', '--drop_blanks', is_flag=True, type=bool, default=False,
-              help='Whether to drop blanks')
+@click.option('-b', '--drop_blanks',
+              type=click.Choice(['NONE', 'DROP', 'BLANK']),
+              default='NONE',
+              help='Whether to drop or replace blanks')
+@click.option('-z', '--minimize_meta', is_flag=True, type=bool, default=False,
+              help='Reduce the number of metadata keys')
+@click.option('-w', '--workers', type=int, required=False, default=os.cpu_count(),
+              help='Number of files to convert in parallel defaults to the number of cores')
+@click.option('-a', '--rebuild', is_flag=True, type=bool, default=False,
+              help='Convert every file even if the json output is newer than the input')
 def main(filepath: str, metadata_keys: str, utterance_col: str, delimiter: str,
          convo_id_col: str, created_at_col: str, unix_date: bool, role_col: str,
-         role_mapper: str, encoding: str, filtering: str, striphtml: bool, drop_blanks: bool) -> None:
+         role_mapper: str, encoding: str, filtering: str, striphtml: bool, drop_blanks: str,
+         minimize_meta: bool, workers: int, rebuild: bool) -> None:
     """Main Function"""
 
     assert os.path.isdir(filepath)
-    list_filenames = os.listdir(filepath)
-    for file_name in list_filenames:
-        if file_name.endswith(".csv"):
-            df = pandas.read_csv(os.path.join(filepath,file_name),delimiter=delimiter)
-            print(df)
+    start = perf_counter_ns()
+
+    # work out which files need converting
+    to_convert = []
+    skipped = 0
+    for file_name in sorted(os.listdir(filepath)):
+        if not (file_name.endswith(".csv") or file_name.endswith(".xlsx")):
+            continue
+        filename = os.path.join(filepath, file_name)
+        if not rebuild and is_up_to_date(filename):
+            skipped = skipped + 1
+            continue
+        to_convert.append({
+            "filename": filename,
+            "metadata_keys": metadata_keys,
+            "created_at_col": created_at_col,
+            "utterance_col": utterance_col,
+            "delimiter": delimiter,
+            "convo_id_col": convo_id_col,
+            "role_col": role_col,
+            "role_mapper": role_mapper,
+            "unix_date": unix_date,
+            "encoding": encoding,
+            "filtering": filtering,
+            "striphtml": striphtml,
+            "drop_blanks": drop_blanks,
+            "minimize_meta": minimize_meta,
+            "why_so_long": True
+        })
+    print(f'Files to convert: {len(to_convert)} skipped as up to date: {skipped}')
+
+    # convert them in parallel reporting each as it finishes
+    timings = []
+    failures = []
+    with Pool(max(1, min(workers, len(to_convert)))) as pool:
+        for filename, nanoseconds, error in pool.imap_unordered(convert_file, to_convert):
+            if error != '':
+                failures.append(filename)
+                print(f'FAILED {filename}: {error}')
+            else:
+                timings.append(nanoseconds)
+                print(f'Converted {filename} in {nanoseconds/1e9:.2f}s')
+
+    elapsed = (perf_counter_ns() - start) / 1e9
+    total = sum(timings) / 1e9
+    print(f'Converted: {len(timings)} failed: {len(failures)} skipped: {skipped}')
+    print(f'Wall clock: {elapsed:.2f}s sum of per file times: {total:.2f}s')
+    if len(failures) > 0:
+        raise RuntimeError(f'Failed to convert: {failures}')
+
+def convert_file(kwargs: dict) -> tuple:
+    """Runs process on one file in a worker returning (filename, nanoseconds, error)"""
+    try:
+        nanoseconds = csv_to_json_unlabelled.process(**kwargs)
+        return (kwargs["filename"], nanoseconds, '')
+    except Exception as e: # pylint: disable=broad-exception-caught
+        return (kwargs["filename"], 0, f'{type(e).__name__}: {e}')
 
-            csv_to_json_unlabelled.process(
-                filename=os.path.join(filepath,file_name),
-                metadata_keys=metadata_keys,
-                created_at_col=created_at_col,
-                utterance_col=utterance_col,
-                delimiter=delimiter,
-                convo_id_col=convo_id_col,
-                role_col=role_col,
-                role_mapper=role_mapper,
-                unix_date=unix_date,
-                encoding=encoding,
-                filtering=filtering,
-                striphtml=striphtml,
-                drop_blanks=drop_blanks
-            )
+def is_up_to_date(filename: str) -> bool:
+    """Whether the json output exists and is newer than the input"""
+    filename_out = csv_to_json_unlabelled.get_output_filename(filename)
+    return os.path.isfile(filename_out) and os.path.getmtime(filename_out) >= os.path.getmtime(filename)
 
 if __name__ == '__main__':
-    main() # pylint: disable=no-value-for-parameter
\ No newline at end of file
+    main() # pylint: disable=no-value-for-parameter
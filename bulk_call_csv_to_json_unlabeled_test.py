@@ -0,0 +1,59 @@
+"""
+Test bulk_call_csv_to_json_unlabeled.py converts a directory and skips only complete up to date outputs
+
+"""
+# ***************************************************************************80**************************************120
+
+# standard imports
+import os
+import json
+import shutil
+
+# 3rd party imports
+from click.testing import CliRunner
+
+# custom imports
+import bulk_call_csv_to_json_unlabeled # file under test
+
+def _copy_examples(tmp_path) -> list:
+    """Two copies of the example upload in an otherwise empty directory"""
+    here = os.path.abspath(os.path.dirname(__file__))
+    filenames = []
+    for name in ["first.csv", "second.csv"]:
+        filenames.append(str(tmp_path / name))
+        shutil.copy(os.path.join(here, "examples", "ExampleUpload2.csv"), filenames[-1])
+    (tmp_path / "notes.txt").write_text("not a csv", encoding="utf8")
+    return filenames
+
+def _invoke(tmp_path, *args) -> str:
+    """Run the directory conversion and return its output"""
+    result = CliRunner().invoke(bulk_call_csv_to_json_unlabeled.main,
+                                ["-f", str(tmp_path), "-u", "text", "-c", "myid", "-t", "somedate",
+                                 "-m", "myid,scenario", "-r", "rolehere", "-w", "2", *args])
+    assert result.exit_code == 0, result.output
+    return result.output
+
+def test_directory_mode_skips_only_complete_outputs(tmp_path):
+    """Converts every csv, skips them on a rerun, redoes one whose run was killed and all with --rebuild"""
+    first, second = _copy_examples(tmp_path)
+
+    assert "Converted: 2 failed: 0 skipped: 0" in _invoke(tmp_path)
+    assert sorted(os.listdir(tmp_path)) == ["first.csv", "first.json", "notes.txt", "second.csv", "second.json"]
+    with open(str(tmp_path / "first.json"), mode="r", encoding="utf8") as file_in:
+        converted = json.load(file_in)
+    assert len(converted["examples"]) > 0
+
+    assert "Converted: 0 failed: 0 skipped: 2" in _invoke(tmp_path)
+
+    # a killed run leaves only the .tmp behind, never a newer looking json
+    os.remove(str(tmp_path / "second.json"))
+    (tmp_path / "second.json.tmp").write_text('{"examples": [', encoding="utf8")
+    assert not bulk_call_csv_to_json_unlabeled.is_up_to_date(second)
+    assert "Converted: 1 failed: 0 skipped: 1" in _invoke(tmp_path)
+    assert not os.path.isfile(str(tmp_path / "second.json.tmp"))
+    with open(str(tmp_path / "second.json"), mode="r", encoding="utf8") as file_in:
+        assert [example["text"] for example in json.load(file_in)["examples"]] == [
+            example["text"] for example in converted["examples"]]
+
+    assert bulk_call_csv_to_json_unlabeled.is_up_to_date(first)
+    assert "Converted: 2 failed: 0 skipped: 0" in _invoke(tmp_path, "-a")
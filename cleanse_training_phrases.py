@@ -9,10 +9,12 @@ import json
 import re
 
 # 3rd party imports
-import pandas
 import click
 import humanfirst
 
+# custom imports
+import hf_json_reader
+
 
 @click.command()
 @click.option('-f','--input_filepath',type=str,required=True,help='HF labelled json file')
@@ -26,25 +28,27 @@ def main(input_filepath: str, output_filepath: str, delimiter):
 def cleanse_training_phrases(input_filepath: str, output_filepath: str, delimiter: str):
     """Ensures the training phrases are unique in the workspace level"""
 
-    with open(input_filepath,mode="r",encoding="utf8") as f:
-        data = json.load(f)
-
-    df = pandas.json_normalize(data=data["examples"])
-
-    df["text_base"] = df["text"].apply(cleanse_text)
-    deduplicated_df = df.loc[~df["text_base"].duplicated()].reset_index(drop=True)
-    deduplicated_df =  deduplicated_df.drop(columns=["text_base"])
-    examples_json = deduplicated_df.to_json(orient="records")
-    examples_json = json.loads(examples_json)
-    data["examples"] = examples_json
+    # stream the examples keeping the first of each cleansed text, intents etc. are in the header
+    seen = set()
+    examples = []
+    duplicated = []
+    with hf_json_reader.open_input(input_filepath) as file_in:
+        reader = hf_json_reader.HFJsonStreamReader(file_in)
+        for example in reader.examples():
+            text_base = cleanse_text(example["text"])
+            if text_base in seen:
+                duplicated.append((example["text"], example["intents"][0]["intent_id"]))
+                continue
+            seen.add(text_base)
+            examples.append(example)
+    data = {key: examples if key == "examples" else reader.header[key] for key in reader.keys}
 
-    duplicated_df = df.loc[df["text_base"].duplicated()].reset_index(drop=True)
     workspace_only_with_intents = humanfirst.objects.HFWorkspace.from_json({"intents":data["intents"]},
                                                                            delimiter=delimiter)
     intent_index = workspace_only_with_intents.get_intent_index(delimiter="-")
     print("------Duplicated Texts -> Intent it was removed from------")
-    duplicated_df["intent_id"] = duplicated_df["intents"].apply(lambda intent_list: intent_list[0]["intent_id"])
-    duplicated_df.apply(lambda row: print(f"{row.text} -> {intent_index[row.intent_id]}"),axis=1)
+    for text, intent_id in duplicated:
+        print(f"{text} -> {intent_index[intent_id]}")
 
     if output_filepath == "":
         output_filepath = f"{input_filepath.split('.json')[0]}_deduplicated.json"
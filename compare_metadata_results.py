@@ -20,13 +20,16 @@ import math
 
 # third party imports
 import click
-import tiktoken
 import pandas
 import openai
 import numpy
 import math
 
 # custom imports
+import token_truncation
+import embedding_store
+
+EMBEDDING_MODEL = "text-embedding-3-large"
 
 
 @click.command()
@@ -40,8 +43,12 @@ import math
 @click.option('-t', '--trim_to', type=int, required=False, default=8190, help='How Many Tokens Wanted')
 @click.option('-d', '--delimiter', type=str, required=False, default=':', help='Metadata Context Delimiter')
 @click.option('-n', '--number_per_api_call', type=int, required=False, default=1024, help='How many to send to openai at once')
+@click.option('-w', '--workers', type=int, required=False, default=4, help='How many openai calls to have in flight')
+@click.option('-e', '--embeddings_dir', type=str, required=False, default='',
+              help='Directory to store embeddings in so a rerun does not re-embed, default not stored')
 def main(input_filename: str, lhs_col: str, rhs_col: str, sample: int, apikey: str, cosine_clip: float,
-         bucket_granularity: int, trim_to: int, delimiter: str, number_per_api_call: int):
+         bucket_granularity: int, trim_to: int, delimiter: str, number_per_api_call: int,
+         workers: int, embeddings_dir: str):
     """Main"""
 
     # fix names
@@ -61,18 +68,13 @@ def main(input_filename: str, lhs_col: str, rhs_col: str, sample: int, apikey: s
         df = df.head(sample)
 
     # encode_columns
-    for col_name in [lhs_col,rhs_col]:
-        df = encode_column(col_name, trim_to, df, number_per_api_call)
+    store = embedding_store.EmbeddingStore(embeddings_dir, EMBEDDING_MODEL)
+    lhs_embeddings = embed_column(lhs_col, trim_to, df, number_per_api_call, store, workers)
+    rhs_embeddings = embed_column(rhs_col, trim_to, df, number_per_api_call, store, workers)
     print('Encoded columns')
 
-    # get similarlity
-    df["cosine_similarity"] = df.apply(calculate_cosine_sim,
-                                       args=[
-                                           f'{lhs_col}_embeddings',
-                                           f'{rhs_col}_embeddings'
-                                        ],
-                                        axis=1
-                                       )
+    # get similarlity for all rows at once
+    df["cosine_similarity"] = embedding_store.row_cosine(lhs_embeddings, rhs_embeddings)
     print('Calculated similarlity')
 
     # print a list of things over the clip
@@ -102,55 +104,22 @@ def bucket_similarity(sim: float, division: int) -> float:
     else:
         return math.floor(sim * 100 / division) * division / 100
 
-def calculate_cosine_sim(row: pandas.Series, embeddings_col_lhs: str, embeddings_col_rhs:str) -> float:
-    "Calculate cosine"
-    # calculate similarity with simple dot product which openai embeddings support
-    return numpy.inner(row[embeddings_col_lhs],row[embeddings_col_rhs])
-
-def encode_column(column_name: str, trim_to: int, df: pandas.DataFrame, chunk_size: int) -> pandas.DataFrame:
-    """encode and embed a column"""
-
-    # names are
-    tokens_col = f'{column_name}_tokens_trimmed'
-    tokens_trimmed_col = f'{column_name}_tokens_trimmed'
-    embeddings_col = f'{column_name}_embeddings'
-   
-    # encode the tokens locally so we can send the maximum
-    print(f'Converting: {column_name} to tokens')
-    df[tokens_col] = df[column_name].apply(encode_this)
-
-    # trim to the maximum number of tokens
-    print(f'Trimming:   {column_name} to {trim_to} tokens')
-    df[tokens_trimmed_col] = df[tokens_col].apply(slice_this,args=[trim_to])
-
-    # ok so get an array of the trimmed tokens and parcel up into chunks for openi
-    embed_this = df[tokens_trimmed_col].to_list()
-    chunk_start = 0
-    chunk_end = chunk_start + chunk_size
-    chunk_estimate = math.ceil(len(embed_this)/chunk_size)
-    print(f'Chunk estimate: {chunk_estimate}')
-    
-    embeddings_result = []
-    while chunk_start < len(embed_this):
-        print(f'Processing: {chunk_start:>10} {chunk_end:>10}')
-        if chunk_end >= len(embed_this):
-            chunk_end = len(embed_this)
-            print(f'Adjusted final chunk {chunk_start:>10} {chunk_end:>10}')
-        embeddings_result.extend(get_batch_embedding(embed_this[chunk_start:chunk_end],"text-embedding-3-large"))
-        chunk_start = chunk_end
-        chunk_end = chunk_start + chunk_size
-    print(f'Embedded total number: {len(embeddings_result)}')
-    df[embeddings_col] = embeddings_result
-    return df
-
-def encode_this(text:str,model:str = "gpt-4") -> str:
-    "encode the column to tokens"
-    enc = tiktoken.encoding_for_model(model)
-    return enc.encode(str(text),disallowed_special=False)
-
-def slice_this(a_list:list, trim_to: int) -> list:
-    "slice a list like"
-    return a_list[0:trim_to]
+def embed_column(column_name: str, trim_to: int, df: pandas.DataFrame, chunk_size: int,
+                 store: embedding_store.EmbeddingStore = None, workers: int = 4) -> numpy.ndarray:
+    """Embed a column returning a float32 matrix with a row per df row"""
+
+    # encode the tokens locally in one batch with a shared encoder so we can send the maximum
+    print(f'Converting: {column_name} to tokens and trimming to {trim_to} tokens')
+    texts = df[column_name].astype(str).to_list()
+    trimmed, _ = token_truncation.encode_and_truncate(texts, trim_to, model="gpt-4")
+
+    # send the chunks not already stored to openai concurrently
+    print(f'Embedding:  {column_name} in chunks of {chunk_size} with {workers} workers')
+    embeddings = embedding_store.embed_texts(texts, lambda chunk: get_batch_embedding(chunk, EMBEDDING_MODEL),
+                                             store=store, extra=f'trim_to={trim_to}', inputs=trimmed,
+                                             chunk_size=chunk_size, workers=workers)
+    print(f'Embedded total number: {embeddings.shape[0]}')
+    return embeddings
 
 def get_embedding(text: str, model: str):
     "Get a single embedding"
@@ -22,6 +22,7 @@ import openai
 
 # custom imports
 import compare_metadata_results
+import embedding_store
 
 
 @click.command()
@@ -39,11 +40,14 @@ import compare_metadata_results
               help='How Many Tokens Wanted')
 @click.option('-n', '--number_per_api_call', type=int, required=False, default=1024,
               help='How many to send to openai at once')
+@click.option('-w', '--workers', type=int, required=False, default=4, help='How many openai calls to have in flight')
+@click.option('-e', '--embeddings_dir', type=str, required=False, default='',
+              help='Directory to store embeddings in so a rerun does not re-embed, default not stored')
 def main(input_filename: str, blindset_filename: str,
          index_col: str, lhs_col: str, rhs_col: str,
          apikey: str, cosine_clip: float,
          bucket_granularity: int, trim_to: int,
-         number_per_api_call: int):
+         number_per_api_call: int, workers: int, embeddings_dir: str):
     """Main"""
 
     # Read filenames CSV
@@ -82,18 +86,15 @@ def main(input_filename: str, blindset_filename: str,
     openai.api_key = apikey
 
     # encode_columns
-    df = compare_metadata_results.encode_column(rhs_col, trim_to, df, number_per_api_call)
-    df_blindset = compare_metadata_results.encode_column(lhs_col, trim_to, df, number_per_api_call)
+    store = embedding_store.EmbeddingStore(embeddings_dir, compare_metadata_results.EMBEDDING_MODEL)
+    rhs_embeddings = compare_metadata_results.embed_column(rhs_col, trim_to, df, number_per_api_call,
+                                                           store, workers)
+    lhs_embeddings = compare_metadata_results.embed_column(lhs_col, trim_to, df, number_per_api_call,
+                                                           store, workers)
     print('Encoded columns')
 
-    # get similarlity
-    df["cosine_similarity"] = df.apply(compare_metadata_results.calculate_cosine_sim,
-                                       args=[
-                                           f'{lhs_col}_embeddings',
-                                           f'{rhs_col}_embeddings'
-                                        ],
-                                        axis=1
-                                       )
+    # get similarlity for all rows at once
+    df["cosine_similarity"] = embedding_store.row_cosine(lhs_embeddings, rhs_embeddings)
     print('Calculated similarlity')
 
     # print a list of things over the clip
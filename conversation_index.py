@@ -0,0 +1,70 @@
+"""
+conversation_index.py
+
+Indexes where each utterance comes in its conversation so examples can be filtered to
+the start or end of conversations, shared by the transcript converters.
+
+For a frame with a conversation id, a role and the utterances of each conversation in order adds
+- idx, idx_max: position of the utterance in its conversation and the last position
+- idx_<role>, idx_max_<role>: position among that role's utterances in the conversation, 0 for other roles
+- first_<role>_utt, second_<role>_utt, last_<role>_utt: flags for the role's first, second and last utterance
+using groupby counts and boolean masks rather than row by row.
+
+If the rows aren't in conversation order pass order_col, positions are then taken in that order
+without reordering the frame.  With no convo_id_col the whole frame is one conversation.
+
+Usage:
+    df = conversation_index.index_conversations(df, 'convo_id')
+    df = conversation_index.index_conversations(df, 'convo_id', order_col='created_at')
+
+"""
+# ******************************************************************************************************************120
+
+# standard imports
+import typing
+
+# 3rd party imports
+import numpy
+import pandas
+
+ROLES = ['client', 'expert']
+
+
+def index_conversations(df: pandas.DataFrame, convo_id_col: str = '', role_col: str = 'role',
+                        order_col: str = '', roles: typing.Iterable = None) -> pandas.DataFrame:
+    """Adds idx, idx_max and the role relative index and first/second/last utterance flags
+    for each role, default client and expert"""
+
+    if roles is None:
+        roles = ROLES
+    ordered = df
+    if order_col != '':
+        if not df.index.is_unique:
+            raise RuntimeError('index_conversations needs a unique index to order by a column')
+        sort_cols = [convo_id_col, order_col] if convo_id_col != '' else [order_col]
+        ordered = df.sort_values(sort_cols, kind='stable')
+
+    if convo_id_col != '':
+        convo_ids = ordered[convo_id_col]
+    else:
+        convo_ids = pandas.Series(numpy.zeros(ordered.shape[0], dtype=int), index=ordered.index)
+
+    # Series results line up with df on the index whatever order they were counted in
+    idx = convo_ids.groupby(convo_ids).cumcount()
+    df['idx'] = idx
+    df['idx_max'] = idx.groupby(convo_ids).transform("max")
+
+    # This info lets you filter for the first or last thing the client says
+    # this is very useful in boot strapping bot design
+    # 0s for the other role
+    idx_role = convo_ids.groupby([convo_ids, ordered[role_col]]).cumcount()
+    for role in roles:
+        is_role = ordered[role_col] == role
+        idx_this_role = idx_role.where(is_role, 0)
+        idx_max_this_role = idx_this_role.groupby(convo_ids).transform("max")
+        df[f'idx_{role}'] = idx_this_role
+        df[f'idx_max_{role}'] = idx_max_this_role
+        df[f'first_{role}_utt'] = is_role & (idx_this_role == 0)
+        df[f'second_{role}_utt'] = is_role & (idx_this_role == 1)
+        df[f'last_{role}_utt'] = is_role & (idx_this_role == idx_max_this_role)
+    return df
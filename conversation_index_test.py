@@ -0,0 +1,45 @@
+"""
+Test conversation_index.py gives the same flags as the previous row by row version in any row order
+
+"""
+# ***************************************************************************80**************************************120
+
+# 3rd party imports
+import pandas
+
+# custom imports
+import conversation_index # file under test
+import csv_to_json_unlabelled_benchmark
+
+FLAG_COLS = csv_to_json_unlabelled_benchmark.FLAG_COLS
+
+def test_index_conversations_matches_row_wise_apply():
+    """The vectorised flags must match decide_role_filter_values on every row"""
+    df = csv_to_json_unlabelled_benchmark.make_synthetic_frame(rows=2000, convo_length=10, seed=7)
+    df_apply = csv_to_json_unlabelled_benchmark.index_by_apply(df.copy())
+    df_vector = conversation_index.index_conversations(df.copy(), 'convo_id')
+    assert df_apply[FLAG_COLS].astype(bool).equals(df_vector[FLAG_COLS])
+    assert df_apply['idx'].equals(df_vector['idx'])
+    assert df_apply['idx_max_client'].equals(df_vector['idx_max_client'])
+
+def test_order_col_leaves_rows_in_place():
+    """Shuffled rows with an order column get the flags of the sorted frame on the same rows"""
+    df = csv_to_json_unlabelled_benchmark.make_synthetic_frame(rows=500, convo_length=6, seed=3)
+    df['seq'] = range(df.shape[0])
+    expected = conversation_index.index_conversations(df.copy(), 'convo_id')
+    shuffled = df.sample(frac=1, random_state=11)
+    actual = conversation_index.index_conversations(shuffled.copy(), 'convo_id', order_col='seq')
+    assert actual.index.equals(shuffled.index)
+    assert actual.sort_index().equals(expected)
+
+def test_single_conversation_and_other_roles():
+    """No conversation id is one conversation and roles outside the list get no flags"""
+    df = pandas.DataFrame({'role': ['expert', 'client', 'bot', 'client', 'expert', 'client']})
+    df = conversation_index.index_conversations(df, roles=['client'])
+    assert df['idx'].to_list() == [0, 1, 2, 3, 4, 5]
+    assert df['idx_max'].to_list() == [5] * 6
+    assert df['idx_client'].to_list() == [0, 0, 0, 1, 0, 2]
+    assert df['first_client_utt'].to_list() == [False, True, False, False, False, False]
+    assert df['second_client_utt'].to_list() == [False, False, False, True, False, False]
+    assert df['last_client_utt'].to_list() == [False, False, False, False, False, True]
+    assert 'first_expert_utt' not in df.columns
@@ -2,6 +2,7 @@
 python count_tokens.py
 
 Recursively scan a directory and count the tokens in each file
+using a pool of worker processes
 
 """
 # ******************************************************************************************************************120
@@ -14,42 +15,54 @@ import click
 import tiktoken
 
 # custom imports
+import directory_map
+
+# set in each worker on first use
+worker_state = {}
 
 @click.command()
 @click.option('-d', '--directory', type=str, required=True, help='Directory')
 @click.option('-r', '--reverse', type=bool, required=False, default=False,
               help='String sort ascheding or descending')
+@click.option('-w', '--workers', type=int, required=False, default=os.cpu_count(),
+              help='Number of processes to count with')
 def main(directory: str,
-         reverse: bool) -> None: # pylint: disable=unused-argument
+         reverse: bool,
+         workers: int) -> None: # pylint: disable=unused-argument
     """Main Function"""
 
-    embeddings = tiktoken.encoding_for_model("gpt-4o")
-
-    process_dir(directory,reverse,embeddings)
-
-def process_dir(directory:str, reverse: bool, embeddings):
-    """Process Directory"""
-    dir_count = 0
-    dir_tokens = 0
-    assert os.path.isdir(directory)
-    list_files = os.listdir(directory)
-    list_files.sort(reverse=reverse)
-    for fn in list_files:
-        fqp = os.path.join(directory,fn)
-        if os.path.isfile(fqp):
-            with open(fqp,mode='r',encoding='utf8') as file_in:
-                tokens = len(embeddings.encode(file_in.read()))
-                dir_tokens = dir_tokens + tokens
-                dir_count = dir_count + 1
-        elif os.path.isdir(fqp):
-            sub_tokens,sub_count = process_dir(fqp,reverse,embeddings)
-            dir_tokens=dir_tokens+sub_tokens
-            dir_count=dir_count + sub_count
-        else:
-            print(fqp)
-            raise RuntimeError("WTF?")
-    print(f'tokens: {dir_tokens:>20} count: {dir_count:>10} {directory}')
-    return dir_tokens,dir_count
+    process_dir(directory,reverse,workers)
+
+def process_dir(directory:str, reverse: bool, workers: int = os.cpu_count()) -> tuple:
+    """Count the tokens in every file in parallel reporting the totals for each directory including
+    its subdirectories, returns the total tokens and count"""
+    dir_tokens = {}
+    dir_counts = {}
+    for result in directory_map.map_files(directory, count_tokens, suffix='', reverse=reverse,
+                                          workers=workers, load_json=False):
+        if result.error != '':
+            raise RuntimeError(f'{result.path} {result.error}')
+        # add to this directory and every one above it up to directory
+        parent = os.path.dirname(result.path)
+        while True:
+            dir_tokens[parent] = dir_tokens.get(parent, 0) + result.value
+            dir_counts[parent] = dir_counts.get(parent, 0) + 1
+            if os.path.normpath(parent) == os.path.normpath(directory):
+                break
+            parent = os.path.dirname(parent)
+    dir_tokens.setdefault(directory, 0)
+    dir_counts.setdefault(directory, 0)
+
+    # subdirectories before their parents
+    for path in sorted(dir_tokens, key=lambda path: path + os.sep + '\uffff', reverse=reverse):
+        print(f'tokens: {dir_tokens[path]:>20} count: {dir_counts[path]:>10} {path}')
+    return dir_tokens[directory],dir_counts[directory]
+
+def count_tokens(text: str) -> int:
+    """Tokens in a file, the encoder is built once per worker"""
+    if "embeddings" not in worker_state:
+        worker_state["embeddings"] = tiktoken.encoding_for_model("gpt-4o")
+    return len(worker_state["embeddings"].encode(text))
 
 if __name__ == '__main__':
     main()  # pylint: disable=no-value-for-parameter
@@ -0,0 +1,190 @@
+"""
+Test visualization/coverage.py pages with prefetch, retries failed pages, streams the same outputs and merges deltas
+
+"""
+# ***************************************************************************80**************************************120
+
+# standard imports
+import json
+import csv
+
+# custom imports
+from visualization import coverage # file under test
+
+PROPERTIES = ["distribution", "embedding_metrics", "entities", "inputs_intents", "language", "metrics"]
+
+def make_result(convoid: str, scores: list, updated_at: str = "2024-01-02T00:00:00Z") -> dict:
+    """Query end point result for a conversation with a client/expert utterance per score"""
+    annotations = {prop: {"@type": f"type.{prop}"} for prop in PROPERTIES}
+    annotations["entities"]["inputEntities"] = [{}]
+    annotations["inputs_intents"]["inputs"] = [
+        {"matches": [{"intentId": "intent-1", "score": score}]} if score is not None else {} for score in scores
+    ]
+    inputs = [{"value": f"{convoid} says {i}", "createdAt": f"2024-01-01T00:00:0{i}Z",
+               "source": "client" if i % 2 == 0 else "expert"} for i in range(len(scores))]
+    return {"annotatedConversation": {
+        "conversation": {"id": convoid, "createdAt": "2024-01-01T00:00:00Z",
+                         "updatedAt": updated_at, "inputs": inputs},
+        "annotations": annotations}}
+
+class FakeHFAPI:
+    """Three pages then a totalCount, failing the first request for the second page"""
+
+    def __init__(self, failures: int = 1):
+        self.pages = {
+            '': {"results": [make_result("c1", [0.9, None]), make_result("c2", [0.2])], "nextPageToken": "p2"},
+            'p2': {"results": [make_result("c3", [0.5, 0.1, 0.3])], "nextPageToken": "p3"},
+            'p3': {"results": [make_result("c4", [None])], "nextPageToken": "p4"},
+            'p4': {"totalCount": 4}
+        }
+        self.failures = failures
+        self.tokens = []
+        self.start_isodates = []
+
+    def __call__(self, **kwargs):
+        return self
+
+    def get_playbook(self, namespace, playbook):
+        """Only the name is used"""
+        return {"name": "my-play book"}
+
+    def query_conversation_set(self, namespace, playbook, next_page_token='', start_isodate='', **kwargs):
+        """Next page for the token"""
+        self.tokens.append(next_page_token)
+        self.start_isodates.append(start_isodate)
+        if next_page_token == 'p2' and self.failures > 0:
+            self.failures = self.failures - 1
+            raise ConnectionError("dropped")
+        page = json.loads(json.dumps(self.pages[next_page_token]))
+        # only conversations updated since the start, like the query end point
+        if "results" in page:
+            page["results"] = [result for result in page["results"]
+                               if result["annotatedConversation"]["conversation"]["updatedAt"] >= start_isodate]
+        return page
+
+def test_iter_pages_retries_and_quits():
+    """Rows come back in order without shared dicts and quit_after_pages stops fetching"""
+    hf_api = FakeHFAPI()
+    pages = list(coverage.iter_pages(hf_api, "ns", "pb", "", "", "", "", backoff=0))
+    assert hf_api.tokens == ['', 'p2', 'p2', 'p3', 'p4']
+    assert [len(page["results"]) for page in pages] == [2, 1, 1]
+    assert pages[0]["results"][0]["annotatedConversation"]["annotations"]["metrics"] == {"type": "type.metrics"}
+
+    rows = []
+    for page in pages:
+        rows = coverage.extract_results(rows, {"intent-1": "billing-refund"}, page)
+    assert [row["convoid"] for row in rows] == ["c1", "c1", "c2", "c3", "c3", "c3", "c4"]
+    assert [row["seq"] for row in rows] == [0, 1, 0, 0, 1, 2, 0]
+    assert rows[1]["score"] is None and rows[0]["intent"] == "billing-refund"
+    assert len({id(row) for row in rows}) == len(rows)
+
+    hf_api = FakeHFAPI(failures=0)
+    assert len(list(coverage.iter_pages(hf_api, "ns", "pb", "", "", "", "", quit_after_pages=2))) == 2
+    assert hf_api.tokens == ['', 'p2']
+
+    hf_api = FakeHFAPI(failures=10)
+    try:
+        list(coverage.iter_pages(hf_api, "ns", "pb", "", "", "", "", max_retries=2, backoff=0))
+        assert False
+    except RuntimeError:
+        assert hf_api.tokens == ['', 'p2', 'p2', 'p2']
+
+def test_extract_results_skips_results_without_predictions(capsys):
+    """A result without inputs_intents or its inputs is reported and skipped rather than ending the download"""
+    no_inputs = make_result("c2", [0.2])
+    del no_inputs["annotatedConversation"]["annotations"]["inputs_intents"]["inputs"]
+    no_intents = make_result("c3", [0.5])
+    del no_intents["annotatedConversation"]["annotations"]["inputs_intents"]
+    page = {"results": [make_result("c1", [0.9]), no_inputs, no_intents, make_result("c4", [0.1])]}
+    rows = coverage.extract_results([], {"intent-1": "billing-refund"}, page)
+    assert [row["convoid"] for row in rows] == ["c1", "c4"]
+    assert capsys.readouterr().out.count("No idea what's up with this:") == 2
+
+def test_write_coverage_csv_streams(tmp_path, monkeypatch, capsys):
+    """JSON matches a dump of the whole list and the coverage is counted over client utterances"""
+    hf_api = FakeHFAPI()
+    monkeypatch.setattr(coverage.humanfirst.apis, "HFAPI", hf_api)
+    monkeypatch.setattr(coverage, "get_intent_name_index", lambda playbook_dict, delimiter: {"intent-1": "refund"})
+    monkeypatch.setattr(coverage.time, "sleep", lambda seconds: None)
+    coverage.write_coverage_csv("", "", "ns", "pb", "", "", "-", str(tmp_path), confidence_threshold=0.4)
+
+    expected = []
+    for token in ['', 'p2', 'p3']:
+        expected.extend(coverage.rename_type_property(FakeHFAPI().pages[token]["results"]))
+    with open(tmp_path / "my_play_book.json", mode="r", encoding="utf8") as file_in:
+        assert file_in.read() == json.dumps(expected, indent=2)
+    with open(tmp_path / "my_play_book.jsonl", mode="r", encoding="utf8") as file_in:
+        assert [json.loads(line) for line in file_in] == expected
+    with open(tmp_path / "my_play_book.csv", mode="r", encoding="utf8") as file_in:
+        rows = list(csv.DictReader(file_in))
+    assert list(rows[0].keys()) == coverage.COLUMNS
+    assert len(rows) == 7
+    assert rows[1]["score"] == ""
+    # client utterances 0.9, 0.2, 0.5, 0.3, None
+    assert "Coverage is 40.0% at confidence threshold 0.4" in capsys.readouterr().out
+
+def test_incremental_merges_delta(tmp_path, monkeypatch, capsys):
+    """Second run asks from the watermark, replaces the updated conversation and recalculates over the store"""
+    hf_api = FakeHFAPI(failures=0)
+    monkeypatch.setattr(coverage.humanfirst.apis, "HFAPI", hf_api)
+    monkeypatch.setattr(coverage, "get_intent_name_index", lambda playbook_dict, delimiter: {"intent-1": "refund"})
+    coverage.write_coverage_csv("", "", "ns", "pb", "", "", "-", str(tmp_path), incremental=True)
+    assert hf_api.start_isodates[0] == '1970-01-01T00:00:00Z'
+    assert "Coverage is 40.0%" in capsys.readouterr().out
+
+    # c3 rescored later with a fractional timestamp, c5 is new
+    hf_api.tokens = []
+    hf_api.start_isodates = []
+    hf_api.pages = {'': {"results": [make_result("c3", [0.1, 0.1, 0.1], "2024-01-03T00:00:00.500Z"),
+                                     make_result("c5", [0.8], "2024-01-03T00:00:00Z")]}}
+    coverage.write_coverage_csv("", "", "ns", "pb", "", "", "-", str(tmp_path), incremental=True)
+    assert hf_api.start_isodates == ['2024-01-02T00:00:00Z']
+    with open(tmp_path / "my_play_book.csv", mode="r", encoding="utf8") as file_in:
+        rows = list(csv.DictReader(file_in))
+    assert [row["convoid"] for row in rows] == ["c1", "c1", "c2", "c4", "c5", "c3", "c3", "c3"]
+    # client utterances 0.9, 0.2, None, 0.8, 0.1, 0.1
+    output = capsys.readouterr().out
+    assert "Coverage is 33.33% at confidence threshold 0.4" in output
+    assert "Total number of utterance is 8" in output
+
+    # the watermark moved on and a different scope is refused
+    store = coverage.CoverageStore(str(tmp_path / "my_play_book_coverage.sqlite"),
+                                   {"namespace": "ns", "playbook": "pb", "convsetsource": "", "searchtext": ""})
+    assert store.watermark() == "2024-01-03T00:00:00.500Z"
+    assert len(store) == 5
+    store.close()
+    try:
+        coverage.CoverageStore(str(tmp_path / "my_play_book_coverage.sqlite"), {"namespace": "other"})
+        assert False
+    except RuntimeError:
+        pass
+
+def test_incremental_watermark_only_after_complete_sync(tmp_path, monkeypatch):
+    """A run cut short by quit_after_pages or a narrower startisodate never hides older conversations"""
+    hf_api = FakeHFAPI(failures=0)
+    hf_api.pages['']["results"] = [make_result("c1", [0.9], "2024-03-02T00:00:00Z"),
+                                   make_result("c2", [0.2], "2024-03-02T00:00:00Z")]
+    hf_api.pages['p2']["results"] = [make_result("c3", [0.5], "2024-01-05T00:00:00Z")]
+    hf_api.pages['p3']["results"] = [make_result("c4", [0.3], "2024-02-01T00:00:00Z")]
+    monkeypatch.setattr(coverage.humanfirst.apis, "HFAPI", hf_api)
+    monkeypatch.setattr(coverage, "get_intent_name_index", lambda playbook_dict, delimiter: {"intent-1": "refund"})
+    scope = {"namespace": "ns", "playbook": "pb", "convsetsource": "", "searchtext": ""}
+    store_filename = str(tmp_path / "my_play_book_coverage.sqlite")
+
+    def run(**kwargs) -> tuple:
+        hf_api.start_isodates = []
+        coverage.write_coverage_csv("", "", "ns", "pb", "", "", "-", str(tmp_path), incremental=True, **kwargs)
+        store = coverage.CoverageStore(store_filename, scope)
+        synced = (len(store), store.covered_start(), store.watermark())
+        store.close()
+        return sorted(set(hf_api.start_isodates)), synced
+
+    # stopped after a page, nothing is marked as covered
+    assert run(quit_after_pages=1) == (['1970-01-01T00:00:00Z'], (2, '', ''))
+    # the first complete run only covers from its own start
+    assert run(startisodate='2024-03-01T00:00:00Z') == (
+        ['2024-03-01T00:00:00Z'], (2, '2024-03-01T00:00:00Z', '2024-03-02T00:00:00Z'))
+    # an earlier start downloads from there rather than the watermark so c3 and c4 arrive
+    assert run() == (['1970-01-01T00:00:00Z'], (4, '1970-01-01T00:00:00Z', '2024-03-02T00:00:00Z'))
+    # now the whole range is covered only the delta is asked for
+    assert run() == (['2024-03-02T00:00:00Z'], (4, '1970-01-01T00:00:00Z', '2024-03-02T00:00:00Z'))
@@ -5,7 +5,10 @@ python csv_to_json_unlabelled.py
 # *********************************************************************************************************************
 
 # standard imports
+import os
 import re
+import zlib
+import tempfile
 import json
 import datetime
 import time
@@ -16,10 +19,18 @@ from copy import deepcopy
 import pandas
 import numpy
 import click
-from dateutil import parser
 import tqdm
 import humanfirst
 
+# custom imports
+import hf_json_writer
+import hf_example_builder
+import date_parsing
+import conversation_index
+
+# without a convo id streamed examples are deduped across this many partitions unless --partitions is given
+DEFAULT_ID_PARTITIONS = 16
+
 
 @click.command()
 @click.option('-f', '--filename', type=str, required=True, help='Input File Path')
@@ -53,12 +64,21 @@ import humanfirst
               help='Reduce the number of metadata keys')
 @click.option('-y', '--why_so_long', is_flag=True, type=bool, default=False,
               help='Return the number of nanoseconds to execute main process method otherwise returns 0')
+@click.option('-s', '--chunksize', type=int, required=False, default=0,
+              help='Stream the csv in chunks of this many rows writing examples as it goes, '
+                   'conversations must be contiguous unless using --partitions')
+@click.option('-n', '--partitions', type=int, required=False, default=0,
+              help='With --chunksize first split unsorted input into this many partitions by convo id, '
+                   'or without a convo id the examples by id to dedupe them')
+@click.option('-g', '--gzip_output', is_flag=True, type=bool, default=False,
+              help='Write the output gzip compressed to <output>.json.gz')
 def main(filename: str, metadata_keys: str, utterance_col: str,
          convo_id_col: str, created_at_col: str,
          role_col: str, role_mapper: str, 
          encoding: str, delimiter: str, unix_date: bool,
          filtering: str, striphtml: bool, drop_blanks: bool,
-         minimize_meta: bool, why_so_long: bool) -> int:
+         minimize_meta: bool, why_so_long: bool,
+         chunksize: int, partitions: int, gzip_output: bool) -> int:
     """Main Function"""
     
 
@@ -66,7 +86,8 @@ def main(filename: str, metadata_keys: str, utterance_col: str,
             role_col,role_mapper,
             encoding,delimiter,unix_date,
             filtering, striphtml, drop_blanks,
-            minimize_meta, why_so_long)
+            minimize_meta, why_so_long,
+            chunksize, partitions, gzip_output)
 
 
 def process(filename: str, 
@@ -83,7 +104,10 @@ def process(filename: str,
             striphtml: bool = False,
             drop_blanks: str = "NONE",
             minimize_meta: bool = False,
-            why_so_long: bool = False
+            why_so_long: bool = False,
+            chunksize: int = 0,
+            partitions: int = 0,
+            gzip_output: bool = False
     ) -> None:
     """Helper function to allow calling by directory"""
 
@@ -106,21 +130,204 @@ def process(filename: str,
     print(f'used_cols: {used_cols}')
     print('\n')
 
-    # read the input csv only for the columns we care about - all as strings
-    if not excel:
-        df = pandas.read_csv(filename, encoding=encoding,
-                             usecols=used_cols, dtype=str, delimiter=delimiter)
+    filename_out = hf_json_writer.gzip_filename(get_output_filename(filename), gzip_output)
+
+    if chunksize > 0:
+        if excel:
+            raise RuntimeError('Streaming in chunks is only supported for csv input')
+        write_examples_streaming(filename, filename_out, used_cols, encoding, delimiter,
+                                 chunksize, partitions, metadata_keys,
+                                 convert_kwargs={
+                                     "utterance_col": utterance_col,
+                                     "convo_id_col": convo_id_col,
+                                     "created_at_col": created_at_col,
+                                     "role_col": role_col,
+                                     "role_mapper": role_mapper,
+                                     "unix_date": unix_date,
+                                     "filtering": filtering,
+                                     "striphtml": striphtml,
+                                     "drop_blanks": drop_blanks,
+                                     "minimize_meta": minimize_meta
+                                 })
+    else:
+        # read the input csv only for the columns we care about - all as strings
+        if not excel:
+            df = pandas.read_csv(filename, encoding=encoding,
+                                 usecols=used_cols, dtype=str, delimiter=delimiter)
+        else:
+            df = pandas.read_excel(filename, usecols=used_cols, dtype=str)
+        assert isinstance(df, pandas.DataFrame)
+
+        examples = convert_frame(df, list(metadata_keys), utterance_col, convo_id_col, created_at_col,
+                                 role_col, role_mapper, unix_date, filtering, striphtml, drop_blanks,
+                                 minimize_meta)
+
+        # stream straight to the output in the created_at order HFWorkspace.write_json would use
+        # rather than building the workspace and its whole serialised string in memory
+        # utterance ids are a hash of the text so repeat, keep the last of each as the workspace would
+        if convo_id_col == '':
+            examples = hf_json_writer.keep_last_by_id(examples)
+        examples.sort(key=lambda example: example.created_at)
+        print("Commencing write")
+        with hf_json_writer.open_output_atomic(filename_out) as file_out:
+            with hf_json_writer.HFJsonStreamWriter(file_out) as writer:
+                writer.write_examples(tqdm.tqdm(examples))
+        print(f"Write complete to {filename_out}")
+
+    end = time.perf_counter_ns()
+    if why_so_long:
+        return end - start
+    else:
+        return 0
+
+def get_output_filename(filename: str) -> str:
+    """Output is the input with a .json extension"""
+    filename_out = filename
+    for ending in ['.csv','.xlsx']:
+        filename_out = filename.replace(ending, '.json')
+        if filename_out != filename:
+            break
+    if filename_out == filename:
+        raise humanfirst.objects.HFOutputFileMustBeDifferent(
+            f'Output filename: {filename_out} == input filename: {filename}')
+    return filename_out
+
+def write_examples_streaming(filename: str, filename_out: str, used_cols: list,
+                             encoding: str, delimiter: str, chunksize: int, partitions: int,
+                             metadata_keys: list, convert_kwargs: dict) -> int:
+    """Converts the csv a chunk at a time writing the examples to filename_out as it goes.
+
+    Without partitions each conversation's rows must be contiguous in the input (i.e. sorted by convo id).
+    With partitions the input is first split by a hash of the convo id into that many
+    temporary files next to the output, each of which must fit in memory.
+    Without a convo id the examples are split by a hash of their id instead, so every repeat of an utterance
+    lands in one partition where the last is kept as in memory, see dedupe_examples_by_id."""
+
+    convo_id_col = convert_kwargs["convo_id_col"]
+    if partitions > 0 and convo_id_col != '':
+        output_dir = os.path.dirname(os.path.abspath(filename_out))
+        frames = partition_conversations(filename, used_cols, encoding, delimiter, chunksize,
+                                         partitions, convo_id_col, output_dir)
     else:
-        df = pandas.read_excel(filename, usecols=used_cols, dtype=str)
-    assert isinstance(df, pandas.DataFrame)
+        frames = read_conversation_chunks(filename, used_cols, encoding, delimiter, chunksize, convo_id_col)
+
+    # convert_frame extends the metadata keys so give it a fresh copy every time
+    example_lists = (convert_frame(df, list(metadata_keys), verbose=(i == 0), **convert_kwargs)
+                     for i, df in enumerate(frames))
+    if convo_id_col == '':
+        output_dir = os.path.dirname(os.path.abspath(filename_out))
+        example_lists = dedupe_examples_by_id(example_lists, partitions or DEFAULT_ID_PARTITIONS, output_dir)
+
+    with hf_json_writer.open_output_atomic(filename_out) as file_out:
+        with hf_json_writer.HFJsonStreamWriter(file_out) as writer:
+            for i, examples in enumerate(example_lists):
+                if convo_id_col == '':
+                    writer.write_example_dicts(examples)
+                else:
+                    writer.write_examples(examples)
+                print(f'Chunk: {i} wrote: {writer.count} examples')
+    print(f"Write complete to {filename_out}")
+    return writer.count
+
+def read_conversation_chunks(filename: str, used_cols: list, encoding: str, delimiter: str,
+                             chunksize: int, convo_id_col: str = ''):
+    """Generator of frames of about chunksize rows from the csv never splitting a conversation.
+
+    Rows of the last conversation in each chunk are held back and prepended to the next chunk,
+    so a conversation's rows must be contiguous in the file"""
+
+    carry = None
+    for df in pandas.read_csv(filename, encoding=encoding, usecols=used_cols, dtype=str,
+                              delimiter=delimiter, chunksize=chunksize):
+        if carry is not None:
+            df = pandas.concat([carry, df], ignore_index=True)
+        if convo_id_col == '':
+            yield df
+            continue
+        convo_ids = df[convo_id_col].fillna('')
+        is_last_convo = convo_ids == convo_ids.iloc[-1]
+        carry = df[is_last_convo]
+        df = df[~is_last_convo]
+        if df.shape[0] > 0:
+            yield df
+    if carry is not None and carry.shape[0] > 0:
+        yield carry
+
+def partition_conversations(filename: str, used_cols: list, encoding: str, delimiter: str,
+                            chunksize: int, partitions: int, convo_id_col: str, temp_dir: str):
+    """Generator of frames each holding every row of the conversations whose id hashes to that partition.
+
+    Used where the input is not sorted by conversation, reads the csv once in chunks appending each row to
+    one of partitions temporary csvs then reads each back in turn"""
+
+    with tempfile.TemporaryDirectory(dir=temp_dir) as partition_dir:
+        partition_files = [os.path.join(partition_dir, f'partition-{i:05d}.csv') for i in range(partitions)]
+        written = [False] * partitions
+        for df in pandas.read_csv(filename, encoding=encoding, usecols=used_cols, dtype=str,
+                                  delimiter=delimiter, chunksize=chunksize):
+            partition = df[convo_id_col].fillna('').map(lambda x: zlib.crc32(x.encode('utf8')) % partitions)
+            for i, df_partition in df.groupby(partition):
+                df_partition.to_csv(partition_files[i], mode='a', header=not written[i], index=False,
+                                    encoding='utf8')
+                written[i] = True
+        for i in range(partitions):
+            if written[i]:
+                yield pandas.read_csv(partition_files[i], encoding='utf8', dtype=str)
+
+def dedupe_examples_by_id(example_lists, partitions: int, temp_dir: str):
+    """Generator of lists of example dicts one per id, the last content at the first position as keep_last_by_id.
+
+    Utterance ids are a hash of the text so repeat anywhere in the input, each example is appended to
+    one of partitions temporary jsonl files by a hash of its id then each is read back and deduped in turn"""
+
+    with tempfile.TemporaryDirectory(dir=temp_dir) as partition_dir:
+        partition_files = [os.path.join(partition_dir, f'examples-{i:05d}.jsonl') for i in range(partitions)]
+        written = [False] * partitions
+        for examples in example_lists:
+            lines = {}
+            for example in examples:
+                i = zlib.crc32(example.id.encode('utf8')) % partitions
+                lines.setdefault(i, []).append(json.dumps(example.to_dict()) + '\n')
+            for i, partition_lines in lines.items():
+                with open(partition_files[i], mode='a', encoding='utf8') as file_out:
+                    file_out.writelines(partition_lines)
+                written[i] = True
+        for i in range(partitions):
+            if written[i]:
+                by_id = {}
+                with open(partition_files[i], mode='r', encoding='utf8') as file_in:
+                    for line in file_in:
+                        example = json.loads(line)
+                        by_id[example["id"]] = example
+                yield list(by_id.values())
+
+def convert_frame(df: pandas.DataFrame,
+                  metadata_keys: list,
+                  utterance_col: str,
+                  convo_id_col: str,
+                  created_at_col: str,
+                  role_col: str,
+                  role_mapper: str = "",
+                  unix_date: bool = False,
+                  filtering: str = "",
+                  striphtml: bool = False,
+                  drop_blanks: str = "NONE",
+                  minimize_meta: bool = False,
+                  verbose: bool = True) -> list:
+    """Converts a frame read from the input file into a list of HFExamples.
+
+    Conversations must be wholly contained within df"""
+
     df.fillna('', inplace=True)
 
+
     assert isinstance(metadata_keys, list)
 
     # assume role all to start with and overwrite later
     df['role'] = 'client'
 
-    print(df)
+    if verbose:
+        print(df)
 
     # filtering
     if filtering != '':
@@ -186,12 +393,14 @@ def process(filename: str,
             df[created_at_col] = df[created_at_col].astype(float)
             df['created_at'] = df[created_at_col].apply(
                 datetime.datetime.fromtimestamp)
-            print('Dates are:')
-            print(df)
-            print('\n')
+            if verbose:
+                print('Dates are:')
+                print(df)
+                print('\n')
         else:
             print("Copying created_at column")
-            df['created_at'] = df[created_at_col].apply(parse_dates)
+            df['created_at'] = date_parsing.parse_dates_column(df[created_at_col], dayfirst=True,
+                                                               default="1999-01-01", verbose=verbose)
 
         # check roles
         if role_col == '':
@@ -223,47 +432,14 @@ def process(filename: str,
 
         # produce roles
         df['role'] = df[role_col].apply(translate_roles, args=[role_mapper])
-        print('Role summary:')
-        print(df[['role', role_col, convo_id_col]].groupby(
-            ['role', role_col]).count())
-        print('\n')
+        if verbose:
+            print('Role summary:')
+            print(df[['role', role_col, convo_id_col]].groupby(
+                ['role', role_col]).count())
+            print('\n')
 
         # index the speakers
-        df['idx'] = df.groupby([convo_id_col]).cumcount()
-        df['idx_max'] = df.groupby([convo_id_col])[
-            'idx'].transform("max")
-
-        # This info lets you filter for the first or last thing the client says
-        # this is very useful in boot strapping bot design
-        # 0s for expert
-        df['idx_client'] = df.groupby(
-            [convo_id_col, 'role']).cumcount().where(df.role == 'client', 0)
-        df['idx_max_client'] = df.groupby([convo_id_col])[
-            'idx_client'].transform("max")
-        df['first_client_utt'] = df.apply(decide_role_filter_values,
-                                          args=['idx_client','client',0,"idx_max_client"],
-                                          axis=1)
-        df['second_client_utt'] = df.apply(decide_role_filter_values,
-                                           args=['idx_client','client',1,"idx_max_client"],
-                                           axis=1)
-        df['last_client_utt'] = df.apply(decide_role_filter_values,
-                                         args=['idx_client','client',-1,"idx_max_client"],
-                                         axis=1)
-
-        # same for expert
-        df['idx_expert'] = df.groupby(
-            [convo_id_col, 'role']).cumcount().where(df.role == 'expert', 0)
-        df['idx_max_expert'] = df.groupby([convo_id_col])[
-            'idx_expert'].transform("max")
-        df['first_expert_utt'] = df.apply(decide_role_filter_values,
-                                          args=['idx_expert','expert',0,'idx_max_expert'],
-                                          axis=1)
-        df['second_expert_utt'] = df.apply(decide_role_filter_values,
-                                           args=['idx_expert','expert',1,'idx_max_expert'],
-                                           axis=1)
-        df['last_expert_utt'] = df.apply(decide_role_filter_values,
-                                         args=['idx_expert','expert',-1,'idx_max_expert'],
-                                         axis=1)
+        df = conversation_index.index_conversations(df, convo_id_col)
 
         # make sure convo id on the metadata as well for summarisation linking
         if not minimize_meta:
@@ -300,67 +476,12 @@ def process(filename: str,
     print(dict_of_file_level_values)
     print(f'created_at_col: {created_at_col}')
 
-    df['metadata'] = df.apply(create_metadata, args=[
-                              metadata_keys, dict_of_file_level_values], axis=1)
+    metadata = create_metadata_column(df, metadata_keys, dict_of_file_level_values)
 
     # build examples
     print("Commencing build examples")
-    tqdm.tqdm.pandas()
-    df = df.progress_apply(build_examples,
-                           args=[utterance_col, convo_id_col, "created_at"], axis=1)
-
-    # A workspace is used to upload labelled or unlabelled data
-    # unlabelled data will have no intents on the examples and no intents defined.
-    unlabelled = humanfirst.objects.HFWorkspace()
-
-    # add the examples to workspace
-    print("Adding examples to workspace")
-    for example in df['example']:
-        unlabelled.add_example(example)
-
-    # write to output
-    print("Commencing write")
-    filename_out = filename
-    for ending in ['.csv','.xlsx']:
-        filename_out = filename.replace(ending, '.json')
-        if filename_out != filename:
-            break
-    if filename_out == filename:
-        raise humanfirst.objects.HFOutputFileMustBeDifferent(
-            f'Output filename: {filename_out} == input filename: {filename}')
-    file_out = open(filename_out, mode='w', encoding='utf8')
-    unlabelled.write_json(file_out)
-    file_out.close()
-    print(f"Write complete to {filename_out}")
-    
-    end = time.perf_counter_ns()
-    if why_so_long:
-        return end - start
-    else:
-        return 0
-
-def decide_role_filter_values(row: pandas.Series,
-                              column_name: str,
-                              role_filter: str,
-                              value_filter: str,
-                              idx_max_col_name: str) -> bool:
-    """Determine whether this is the 0,1,2 where the role is also somt hing"""
-    if value_filter >=0 and row[column_name] == value_filter and row["role"] == role_filter:
-        return True
-    elif value_filter < 0 and row[column_name] == row[idx_max_col_name] and row["role"] == role_filter:
-        return True
-    else:
-        return False
-
-def parse_dates(date: str) -> datetime.datetime:
-    """Parse the date"""
-
-    try:
-        candidate_date = parser.parse(timestr=date, dayfirst=True)
-    except Exception: # pylint: disable=broad-exception-caught
-        print(f"WARNING-could not parse:{date}")
-        candidate_date = parser.parse(timestr="1999-01-01")
-    return candidate_date
+    examples = build_examples_from_columns(df, metadata, utterance_col, convo_id_col, "created_at")
+    return examples
 
 def build_examples(row: pandas.Series, utterance_col: str, convo_id_col: str = '', created_at_col: str = ''):
     '''Build the examples'''
@@ -399,6 +520,41 @@ def build_examples(row: pandas.Series, utterance_col: str, convo_id_col: str = '
     return row
 
 
+def build_examples_from_columns(df: pandas.DataFrame, metadata: list, utterance_col: str,
+                                convo_id_col: str = '', created_at_col: str = '') -> list:
+    """Builds the same examples as build_examples but from whole columns without a Series per row"""
+
+    texts = df[utterance_col].to_list()
+    if created_at_col == '':
+        now = datetime.datetime.now().isoformat()
+        created_ats = [now] * len(texts)
+    else:
+        created_ats = df[created_at_col].to_list()
+
+    if convo_id_col == '':
+        ids = [humanfirst.objects.hash_string(text, 'example') for text in texts]
+        return list(hf_example_builder.iter_examples(texts, ids, created_ats, metadata=metadata))
+
+    convo_ids = df[convo_id_col].to_list()
+    ids = [f'example-{convo_id}-{idx}' for convo_id, idx in zip(convo_ids, df["idx"].to_list())]
+    return list(hf_example_builder.iter_examples(texts, ids, created_ats, metadata=metadata,
+                                                 context_ids=convo_ids, roles=df["role"]))
+
+def create_metadata_column(df: pandas.DataFrame, metadata_keys_to_extract: list, dict_of_values: dict = None) -> list:
+    """Builds the same metadata dicts as create_metadata for every row at once"""
+
+    if dict_of_values is None:
+        dict_of_values = {}
+    columns = [[str(v) for v in df[key].to_list()] for key in metadata_keys_to_extract]
+    metadata = []
+    for values in zip(*columns):
+        row_metadata = dict_of_values.copy()
+        row_metadata.update(zip(metadata_keys_to_extract, values))
+        metadata.append(row_metadata)
+    if len(columns) == 0:
+        metadata = [dict_of_values.copy() for _ in range(df.shape[0])]
+    return metadata
+
 def create_metadata(row: Union[pandas.Series, dict], metadata_keys_to_extract:
                     list, dict_of_values: dict = None) -> dict:
     '''Build the HF metadata object for the pandas line using the column names passed'''
@@ -0,0 +1,114 @@
+"""
+python csv_to_json_unlabelled_benchmark.py -r 100000
+
+Compares the row-wise apply path for conversation indexing, metadata and example building
+against the vectorised path now used by csv_to_json_unlabelled.process on a synthetic frame.
+Checks both produce the same flags, metadata and examples.
+
+"""
+# ******************************************************************************************************************120
+
+# standard imports
+import time
+import random
+
+# 3rd party imports
+import click
+import pandas
+
+# custom imports
+import csv_to_json_unlabelled
+import conversation_index
+
+FLAG_COLS = ['first_client_utt', 'second_client_utt', 'last_client_utt',
+             'first_expert_utt', 'second_expert_utt', 'last_expert_utt']
+
+@click.command()
+@click.option('-r', '--rows', type=int, required=False, default=100000, help='Number of synthetic utterances')
+@click.option('-l', '--convo_length', type=int, required=False, default=20, help='Average utterances per conversation')
+@click.option('-s', '--seed', type=int, required=False, default=42, help='Random seed')
+def main(rows: int, convo_length: int, seed: int) -> None:
+    """Main Function"""
+
+    df = make_synthetic_frame(rows, convo_length, seed)
+    print(f'Synthetic frame: {df.shape} conversations: {df["convo_id"].nunique()}')
+
+    metadata_keys = ['convo_id', 'idx'] + FLAG_COLS
+    file_level = {'script_name': 'csv_to_json_unlabelled_benchmark.py'}
+
+    start = time.perf_counter()
+    df_apply = index_by_apply(df.copy())
+    apply_index_secs = time.perf_counter() - start
+    start = time.perf_counter()
+    df_apply['metadata'] = df_apply.apply(csv_to_json_unlabelled.create_metadata,
+                                          args=[metadata_keys, file_level], axis=1)
+    df_apply = df_apply.apply(csv_to_json_unlabelled.build_examples,
+                              args=['text', 'convo_id', 'created_at'], axis=1)
+    apply_examples_secs = time.perf_counter() - start
+
+    start = time.perf_counter()
+    df_vector = conversation_index.index_conversations(df.copy(), 'convo_id')
+    vector_index_secs = time.perf_counter() - start
+    start = time.perf_counter()
+    metadata = csv_to_json_unlabelled.create_metadata_column(df_vector, metadata_keys, file_level)
+    examples = csv_to_json_unlabelled.build_examples_from_columns(df_vector, metadata,
+                                                                  'text', 'convo_id', 'created_at')
+    vector_examples_secs = time.perf_counter() - start
+
+    # same answers
+    assert df_apply[FLAG_COLS].astype(bool).equals(df_vector[FLAG_COLS])
+    assert df_apply['metadata'].to_list() == metadata
+    assert [e.to_dict() for e in df_apply['example']] == [e.to_dict() for e in examples]
+    print('Outputs identical')
+
+    print(f'{"step":<12} {"apply_s":>10} {"vector_s":>10} {"speedup":>8} {"vector_rows_per_s":>18}')
+    for step, apply_secs, vector_secs in [('index', apply_index_secs, vector_index_secs),
+                                          ('examples', apply_examples_secs, vector_examples_secs)]:
+        print(f'{step:<12} {apply_secs:>10.3f} {vector_secs:>10.3f} {apply_secs/vector_secs:>8.1f} '
+              f'{rows/vector_secs:>18,.0f}')
+
+def make_synthetic_frame(rows: int, convo_length: int, seed: int) -> pandas.DataFrame:
+    """Conversations of varying length alternating mostly between client and expert"""
+    rng = random.Random(seed)
+    convo_ids = []
+    convo = 0
+    while len(convo_ids) < rows:
+        length = rng.randint(1, convo_length * 2)
+        convo_ids.extend([f'convo-{convo:08d}'] * length)
+        convo = convo + 1
+    convo_ids = convo_ids[:rows]
+    return pandas.DataFrame({
+        'convo_id': convo_ids,
+        'text': [f'utterance {i}' for i in range(rows)],
+        'role': [rng.choice(['client', 'expert', 'expert']) for _ in range(rows)],
+        'created_at': ['2024-05-13T09:15:00'] * rows
+    })
+
+def index_by_apply(df: pandas.DataFrame) -> pandas.DataFrame:
+    """The previous row-wise implementation from csv_to_json_unlabelled.process"""
+    df['idx'] = df.groupby(['convo_id']).cumcount()
+    df['idx_max'] = df.groupby(['convo_id'])['idx'].transform("max")
+    for role in ['client', 'expert']:
+        df[f'idx_{role}'] = df.groupby(['convo_id', 'role']).cumcount().where(df.role == role, 0)
+        df[f'idx_max_{role}'] = df.groupby(['convo_id'])[f'idx_{role}'].transform("max")
+        for name, value in [('first', 0), ('second', 1), ('last', -1)]:
+            df[f'{name}_{role}_utt'] = df.apply(decide_role_filter_values,
+                                                args=[f'idx_{role}', role, value, f'idx_max_{role}'],
+                                                axis=1)
+    return df
+
+def decide_role_filter_values(row: pandas.Series,
+                              column_name: str,
+                              role_filter: str,
+                              value_filter: str,
+                              idx_max_col_name: str) -> bool:
+    """The previous row-wise flag, whether this is the 0,1,last where the role is also something"""
+    if value_filter >=0 and row[column_name] == value_filter and row["role"] == role_filter:
+        return True
+    elif value_filter < 0 and row[column_name] == row[idx_max_col_name] and row["role"] == role_filter:
+        return True
+    else:
+        return False
+
+if __name__ == '__main__':
+    main() # pylint: disable=no-value-for-parameter
@@ -116,4 +116,61 @@ def _verify_output_as_expected(expected_output: str, actual_output: str):
         return True
     else:
         print(jsondiff.diff(expected_json,actual_json))
-        return False
\ No newline at end of file
+        return False
+
+
+@pytest.mark.parametrize("partitions", [0, 3])
+def test_csv_to_json_unlabelled_streaming_matches_in_memory(source_files, partitions):
+    """Small chunks split conversations across chunk boundaries but must give the same examples"""
+    args = {
+        "metadata_keys": "myid,scenario",
+        "utterance_col": "text",
+        "convo_id_col": "myid",
+        "created_at_col": "somedate",
+        "role_col": "rolehere",
+        "encoding": "utf8"
+    }
+    csv_to_json_unlabelled.process(filename=source_files["test_file"], **args)
+    in_memory = _load_examples_by_id(source_files["actual_output"])
+    csv_to_json_unlabelled.process(filename=source_files["test_file"], chunksize=3, partitions=partitions, **args)
+    streamed = _load_examples_by_id(source_files["actual_output"])
+    assert len(streamed) == 20
+    assert streamed == in_memory
+
+
+def _load_examples_by_id(filename: str) -> dict:
+    """Examples keyed by id without the load time"""
+    with open(filename,mode="r",encoding="utf8") as file_in:
+        examples = json.load(file_in)["examples"]
+    for example in examples:
+        del example["metadata"]["loaded_date"]
+    return {example["id"]: example for example in examples}
+
+
+@pytest.mark.parametrize("partitions", [0, 2])
+def test_csv_to_json_unlabelled_streaming_keeps_last_repeated_utterance(tmp_path, partitions):
+    """Without a convo id a repeated utterance in another chunk must keep its last example as in memory does"""
+    test_file = tmp_path / "repeats.csv"
+    rows = ["text,created_at,scenario"]
+    for i in range(10):
+        rows.append(f"utterance {i % 4},2023-01-{i + 1:02d}T00:00:00Z,row {i}")
+    test_file.write_text("\n".join(rows) + "\n", encoding="utf8")
+    args = {
+        "metadata_keys": "scenario",
+        "utterance_col": "text",
+        "convo_id_col": "",
+        "created_at_col": "created_at",
+        "role_col": "",
+        "encoding": "utf8"
+    }
+    actual_output = str(tmp_path / "repeats.json")
+    csv_to_json_unlabelled.process(filename=str(test_file), **args)
+    in_memory = _load_examples_by_id(actual_output)
+    csv_to_json_unlabelled.process(filename=str(test_file), chunksize=3, partitions=partitions, **args)
+    streamed = _load_examples_by_id(actual_output)
+    assert len(streamed) == 4
+    assert streamed == in_memory
+    assert sorted(example["metadata"]["scenario"] for example in streamed.values()) == [
+        "row 6", "row 7", "row 8", "row 9"]
+    # the temporary partitions are cleaned up
+    assert sorted(os.listdir(tmp_path)) == ["repeats.csv", "repeats.json"]
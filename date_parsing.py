@@ -0,0 +1,194 @@
+"""
+date_parsing.py
+
+Parses a whole column of date strings at once rather than calling dateutil on every row.
+
+- Each distinct value is only parsed once, timestamp columns repeat heavily.
+- The format is detected from a sample of the distinct values by finding the strptime format
+  covering most of the sample that never gives anything different to dateutil.
+- Everything that format parses is done in one pandas.to_datetime call, anything left over
+  falls back to a memoised dateutil parse.
+- The sample can't show how dateutil reads every value, so values the format could read differently
+  from dateutil also fall back: ones the format with day and month swapped reads as another date,
+  and two digit years outside the 50 years either side of now that dateutil puts them in.
+
+Usage:
+    df['created_at'] = date_parsing.parse_dates_column(df['somedate'], dayfirst=True, default='1999-01-01')
+
+"""
+# ******************************************************************************************************************120
+
+# standard imports
+import datetime
+import functools
+from typing import Union
+
+# 3rd party imports
+import pandas
+from dateutil import parser
+
+# Most common first, dateutil decides between day and month first using dayfirst
+CANDIDATE_FORMATS = [
+    '%Y-%m-%dT%H:%M:%S.%f%z',
+    '%Y-%m-%dT%H:%M:%S%z',
+    '%Y-%m-%dT%H:%M:%S.%f',
+    '%Y-%m-%dT%H:%M:%S',
+    '%Y-%m-%d %H:%M:%S.%f%z',
+    '%Y-%m-%d %H:%M:%S%z',
+    '%Y-%m-%d %H:%M:%S.%f',
+    '%Y-%m-%d %H:%M:%S',
+    '%Y-%m-%d %H:%M',
+    '%Y-%m-%d',
+    '%d/%m/%Y %H:%M:%S',
+    '%m/%d/%Y %H:%M:%S',
+    '%d/%m/%Y %H:%M',
+    '%m/%d/%Y %H:%M',
+    '%d/%m/%Y',
+    '%m/%d/%Y',
+    '%d-%m-%Y %H:%M:%S',
+    '%m-%d-%Y %H:%M:%S',
+    '%d-%m-%Y',
+    '%d-%m-%y %H:%M:%S',
+    '%y-%m-%d %H:%M:%S',
+    '%d/%m/%y %H:%M:%S',
+    '%m/%d/%y %H:%M:%S',
+    '%d/%m/%y',
+    '%m/%d/%y',
+    '%d.%m.%Y %H:%M:%S',
+    '%d.%m.%Y',
+    '%Y/%m/%d %H:%M:%S',
+    '%Y/%m/%d',
+    '%d %b %Y %H:%M:%S',
+    '%d %b %Y',
+    '%b %d, %Y %H:%M:%S',
+    '%b %d, %Y',
+    '%a, %d %b %Y %H:%M:%S %z'
+]
+
+
+class DateParsingException(Exception):
+    """This happens when a date can't be parsed and there is no default"""
+
+
+def parse_dates_column(dates: pandas.Series, dayfirst: bool = False, default: str = None,
+                       sample_size: int = 200, verbose: bool = True) -> pandas.Series:
+    """Returns a Series of datetimes with the same index as dates.
+
+    Gives the same result as applying dateutil.parser.parse(value, dayfirst=dayfirst) to every row.
+    If default is given anything dateutil can't parse becomes that date with a warning,
+    otherwise a DateParsingException is raised."""
+
+    codes, uniques = pandas.factorize(dates.astype(str), sort=False)
+    uniques = list(uniques)
+
+    fmt = detect_format(uniques[:sample_size], dayfirst=dayfirst)
+    if fmt is None:
+        parsed = [None] * len(uniques)
+    else:
+        parsed = drop_ambiguous(uniques, parse_with_format(uniques, fmt), fmt, dayfirst=dayfirst)
+
+    fallbacks = 0
+    for i, value in enumerate(uniques):
+        if parsed[i] is None:
+            fallbacks = fallbacks + 1
+            parsed[i] = parse_date_cached(value, dayfirst=dayfirst, default=default)
+
+    if verbose:
+        print(f'Parsed {len(dates)} dates with {len(uniques)} distinct values using format: {fmt} '
+              f'dateutil fallbacks: {fallbacks}')
+
+    # pylint: disable=unsubscriptable-object
+    return pandas.Series([parsed[code] for code in codes], index=dates.index, name=dates.name)
+
+
+def detect_format(sample: list, dayfirst: bool = False) -> Union[str, None]:
+    """Returns the candidate format which parses the most values in the sample, never disagreeing with dateutil,
+    or None if none covers at least half of them.
+
+    Agreeing on the sample does not make it agree on every value, see drop_ambiguous."""
+
+    pairs = []
+    for value in sample:
+        try:
+            pairs.append((value, parser.parse(value, dayfirst=dayfirst)))
+        except (ValueError, OverflowError):
+            # leave the odd ones for the fallback
+            continue
+    if len(pairs) == 0:
+        return None
+
+    best_fmt = None
+    best_matched = 0
+    for fmt in CANDIDATE_FORMATS:
+        matched = 0
+        agrees = True
+        for value, expected in pairs:
+            try:
+                candidate = datetime.datetime.strptime(value, fmt)
+            except ValueError:
+                continue
+            # isoformat also catches the same instant with a different utc offset
+            if candidate.isoformat() != expected.isoformat():
+                agrees = False
+                break
+            matched = matched + 1
+        if agrees and matched > best_matched:
+            best_fmt = fmt
+            best_matched = matched
+    if best_matched * 2 < len(pairs):
+        return None
+    return best_fmt
+
+
+def drop_ambiguous(values: list, parsed: list, fmt: str, dayfirst: bool = False) -> list:
+    """None in place of each parsed value dateutil might read differently, leaving it to the fallback.
+
+    That is any value the format with day and month swapped reads as another date, unless the format
+    has a four digit year and the day where dayfirst puts it, as dateutil only swaps from dayfirst
+    when it has to.  With %y also any year dateutil would put in another century"""
+
+    swapped = fmt.replace('%d', '%D').replace('%m', '%d').replace('%D', '%m')
+    day_where_dateutil_reads_it = '%Y' in fmt and (fmt.find('%d') < fmt.find('%m')) == dayfirst
+    if swapped != fmt and not day_where_dateutil_reads_it:
+        for i, other in enumerate(parse_with_format(values, swapped)):
+            if parsed[i] is not None and other is not None and other != parsed[i]:
+                parsed[i] = None
+
+    if '%y' in fmt:
+        # dateutil puts two digit years within 50 years of now, strptime in 1969 to 2068
+        this_year = datetime.datetime.now().year
+        for i, value in enumerate(parsed):
+            if value is not None and not this_year - 50 <= value.year < this_year + 50:
+                parsed[i] = None
+    return parsed
+
+
+def parse_with_format(values: list, fmt: str) -> list:
+    """Parses every value with fmt in one go returning None for those that don't match"""
+
+    try:
+        parsed = pandas.to_datetime(pandas.Series(values, dtype=object), format=fmt, errors='coerce')
+        return [None if pandas.isna(p) else p.to_pydatetime() for p in parsed]
+    except (ValueError, TypeError):
+        # for instance a mix of utc offsets can't go in one column
+        result = []
+        for value in values:
+            try:
+                result.append(datetime.datetime.strptime(value, fmt))
+            except ValueError:
+                result.append(None)
+        return result
+
+
+@functools.lru_cache(maxsize=65536)
+def parse_date_cached(value: str, dayfirst: bool = False, default: str = None) -> datetime.datetime:
+    """Memoised dateutil parse for the strings the detected format doesn't cover"""
+
+    try:
+        return parser.parse(timestr=value, dayfirst=dayfirst)
+    except (ValueError, OverflowError) as e:
+        if default is None:
+            raise DateParsingException(f'Could not parse date: {value}') from e
+        print(f"WARNING-could not parse:{value}")
+        return parser.parse(timestr=default)
+
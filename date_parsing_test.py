@@ -0,0 +1,62 @@
+"""
+Test date_parsing.py gives the same dates as dateutil row by row
+
+"""
+# ***************************************************************************80**************************************120
+
+# 3rd party imports
+import pytest
+import pandas
+from dateutil import parser
+
+# custom imports
+import date_parsing # file under test
+
+DEFAULT = "1999-01-01"
+
+CASES = {
+    "iso_mixed_separators": ["2024-05-13T09:15:00", "2024-05-13T09:15:01", "2024-05-13 09:15:02", "2024-05-13",
+                             "junk"],
+    "two_digit_years": ["24-05-13 09:15:00", "13-05-24 09:15:00", "01-02-03 00:00:00"],
+    "slashes": ["05/13/2024 10:00:00", "12/01/2024 10:00:00", "01/02/2024 10:00:00"],
+    "utc_offsets": ["2024-05-13T09:15:00Z", "2024-05-13T09:15:00+01:00", "2024-05-13T09:15:00.123Z"],
+    "fractional_seconds": ["2024-05-13 09:15:00.5", "2024-05-13 09:15:00.123456", "2024-05-13 09:15:01"],
+}
+
+def _dateutil_with_default(value: str, dayfirst: bool):
+    """The row by row behaviour being replaced"""
+    try:
+        return parser.parse(value, dayfirst=dayfirst)
+    except ValueError:
+        return parser.parse(DEFAULT)
+
+@pytest.mark.parametrize("values", CASES.values(), ids=CASES.keys())
+@pytest.mark.parametrize("dayfirst", [False, True])
+def test_parse_dates_column_matches_dateutil(values: list, dayfirst: bool):
+    """Same datetime and same isoformat for every row"""
+    dates = pandas.Series(values * 3, index=range(100, 100 + len(values) * 3))
+    parsed = date_parsing.parse_dates_column(dates, dayfirst=dayfirst, default=DEFAULT)
+    assert parsed.index.equals(dates.index)
+    for actual, value in zip(parsed.to_list(), dates):
+        expected = _dateutil_with_default(value, dayfirst)
+        assert actual.isoformat() == expected.isoformat()
+
+def test_detect_format_day_first():
+    """Two digit years with the day first"""
+    assert date_parsing.detect_format(CASES["two_digit_years"], dayfirst=True) == '%d-%m-%y %H:%M:%S'
+
+def test_no_default_raises():
+    """Without a default an unparseable date is an error"""
+    with pytest.raises(date_parsing.DateParsingException):
+        date_parsing.parse_dates_column(pandas.Series(["2024-05-13", "not a date"]))
+
+@pytest.mark.parametrize("dayfirst", [False, True])
+def test_values_past_the_sample_the_format_could_misread(dayfirst: bool):
+    """A sample with only days over 12 picks a format, later values with both parts 12 or under
+    and two digit years in another century still come out as dateutil reads them"""
+    for values in [[f"{day}/05/2024 10:00" for day in range(13, 29)] + ["05/06/2024 10:00", "01/02/2024 10:00"],
+                   [f"{day}-05-24 09:15:00" for day in range(13, 29)] + ["13-05-70 09:15:00"]]:
+        dates = pandas.Series(values)
+        parsed = date_parsing.parse_dates_column(dates, dayfirst=dayfirst, default=DEFAULT, sample_size=16)
+        for actual, value in zip(parsed.to_list(), dates):
+            assert actual.isoformat() == _dateutil_with_default(value, dayfirst).isoformat()
@@ -2,17 +2,31 @@
 # -*- coding: utf-8 -*-
 # *********************************************************************************************************************
 #
-# python deepgram_audio_transcribe.py
+# python deepgram_audio_transcribe.py -d <wav dir> -k <key> -o <output dir> -c 16
+#
+# Keeps --concurrency uploads in flight through llm_executor, writing each json as soon as it
+# completes and retrying timeouts, connection errors, 429s, 5xxs and empty responses with backoff,
+# any other error fails that file straight away.  Outputs are written beside and renamed so an
+# interrupted run can be started again and only does what is missing (unless --rebuild).
 #
 # *********************************************************************************************************************
 
 # standard imports
 import os
 import json
+import asyncio
 
 # 3rd party imports
+import aiohttp
 import asyncclick as click
-from deepgram import Deepgram
+from deepgram import Deepgram, DeepgramApiError
+
+# custom imports
+import llm_executor
+
+
+class NoResponseException(Exception):
+    """The sdk returned None, which it does for some error responses"""
 
 @click.command()
 @click.option('-d', '--directory', type=str, required=True,
@@ -25,7 +39,14 @@ from deepgram import Deepgram
               help='Whether to rebuild all transcriptions or look for delta')
 @click.option('-s', '--sample',  type=int, required=False, default=0,
               help='Number of transcriptions to do (on top of skipped)')
-async def main(directory: str, deepgramkey: str, outputdir: str, rebuild: bool, sample: int) -> None:
+@click.option('-c', '--concurrency', type=int, required=False, default=8,
+              help='Number of uploads to keep in flight')
+@click.option('-m', '--max_retries', type=int, required=False, default=5,
+              help='Retries per file before giving up on it')
+@click.option('-u', '--api_url', type=str, required=False, default='',
+              help='Deepgram API url if not the default, e.g. a local test endpoint')
+async def main(directory: str, deepgramkey: str, outputdir: str, rebuild: bool, sample: int,
+               concurrency: int, max_retries: int, api_url: str) -> None:
     """Main Function"""
 
     # Check ends with /
@@ -35,15 +56,14 @@ async def main(directory: str, deepgramkey: str, outputdir: str, rebuild: bool,
         outputdir = outputdir + '/'
 
     # work out how many files
-    file_list = os.listdir(directory)
-    wav_files = []
-    for file in file_list:
-        if file.endswith(".wav"):
-            wav_files.append(f'{directory}{file}')
+    wav_files = list_wav_files(directory)
     print(f'Wav files to be processed: {len(wav_files)}')
 
     # get deepgram client
-    dg_client = Deepgram(deepgramkey)
+    options = {'api_key': deepgramkey}
+    if api_url != '':
+        options['api_url'] = api_url
+    dg_client = Deepgram(options)
 
     # transcription options
     opts = {
@@ -54,23 +74,80 @@ async def main(directory: str, deepgramkey: str, outputdir: str, rebuild: bool,
         'smart_format': True
     }
 
-    count_samples = 0
+    results = await transcribe_files(wav_files, outputdir, dg_client, opts, rebuild=rebuild, sample=sample,
+                                     concurrency=concurrency, max_retries=max_retries)
+    failed = [result for result in results if result.error != '']
+    print(f'Transcribed: {len(results) - len(failed)} failed: {len(failed)}')
+    for result in failed:
+        print(f'Failed {result.key}: {result.error}')
+
+def list_wav_files(directory: str) -> list:
+    """The .wav files in directory, which must end with /"""
+    wav_files = []
+    for file in os.listdir(directory):
+        if file.endswith(".wav"):
+            wav_files.append(f'{directory}{file}')
+    return wav_files
+
+def select_files(wav_files: list, outputdir: str, rebuild: bool, sample: int) -> list:
+    """Files still to transcribe, up to sample of them if set, skipping those already output unless rebuild"""
+    todo = []
     for wav in wav_files:
-        with open(wav, 'rb') as wav_rb:
-            source = {'buffer': wav_rb, 'mimetype': 'audio/x-wav'}
-
-            output_file_name = get_output_name(wav, outputdir)
-
-            if not rebuild and os.path.isfile(output_file_name):
-                print(f'Skipping file {wav} as ouptut exists')
-            else:
-                response = await dg_client.transcription.prerecorded(source, opts)
-                print(f'Writing to {output_file_name}')
-                with open(output_file_name,"w",encoding='utf8') as output_file:
-                    output_file.write(json.dumps(response,indent=2))
-                count_samples = count_samples + 1
-        if sample > 0 and count_samples >= sample:
+        if sample > 0 and len(todo) >= sample:
             break
+        if not rebuild and os.path.isfile(get_output_name(wav, outputdir)):
+            print(f'Skipping file {wav} as ouptut exists')
+            continue
+        todo.append(wav)
+    return todo
+
+async def transcribe_files(wav_files: list, outputdir: str, dg_client: Deepgram, opts: dict,
+                           rebuild: bool = False, sample: int = 0, concurrency: int = 8,
+                           max_retries: int = 5, backoff_base: float = 1.0) -> list:
+    """Transcribe wav_files concurrently writing each response to outputdir as it completes.
+    Returns an llm_executor.LLMResult per file transcribed with the output file name as the value
+    or the error for any that failed"""
+
+    todo = select_files(wav_files, outputdir, rebuild, sample)
+
+    async def transcribe(wav: str) -> str:
+        """Upload one file and write the response, so only the file name is held on to"""
+        buffer = await asyncio.to_thread(read_bytes, wav)
+        source = {'buffer': buffer, 'mimetype': 'audio/x-wav'}
+        response = await dg_client.transcription.prerecorded(source, opts)
+        # the sdk swallows error responses with a json body and returns None
+        if response is None:
+            raise NoResponseException('No response from Deepgram')
+        output_file_name = get_output_name(wav, outputdir)
+        print(f'Writing to {output_file_name}')
+        await asyncio.to_thread(write_response, response, output_file_name)
+        return output_file_name
+
+    executor = llm_executor.LLMExecutor(call=transcribe, concurrency=concurrency, max_retries=max_retries,
+                                        backoff_base=backoff_base, retryable=is_transient)
+    return await executor.run([llm_executor.LLMJob(key=wav, payload=wav) for wav in todo])
+
+def is_transient(error: Exception) -> bool:
+    """Timeouts, connection errors, 429, 5xx and no response are worth retrying, anything else won't change"""
+    if isinstance(error, (asyncio.TimeoutError, ConnectionError, aiohttp.ClientConnectionError, NoResponseException)):
+        return True
+    if isinstance(error, DeepgramApiError):
+        if error.http_error_status is None:
+            # the sdk wraps connection errors without a status
+            return isinstance(error.http_library_error, aiohttp.ClientConnectionError)
+        return error.http_error_status == 429 or error.http_error_status >= 500
+    return False
+
+def write_response(response: dict, output_file_name: str):
+    """Write beside and rename so a killed run never leaves a partial file to be skipped next time"""
+    with open(output_file_name + '.tmp', "w", encoding='utf8') as output_file:
+        output_file.write(json.dumps(response, indent=2))
+    os.replace(output_file_name + '.tmp', output_file_name)
+
+def read_bytes(filename: str) -> bytes:
+    """Whole file as bytes"""
+    with open(filename, 'rb') as file_in:
+        return file_in.read()
 
 def get_output_name(input_name: str, outputdir: str) -> str:
     """Transform input name to output name"""
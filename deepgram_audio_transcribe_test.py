@@ -0,0 +1,124 @@
+"""
+Test deepgram_audio_transcribe.py keeps several uploads in flight against a local fake Deepgram endpoint
+
+"""
+# ***************************************************************************80**************************************120
+
+# standard imports
+import os
+import json
+import time
+import asyncio
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# 3rd party imports
+import pytest
+from deepgram import Deepgram
+
+# custom imports
+import deepgram_audio_transcribe # file under test
+
+class FakeDeepgramHandler(BaseHTTPRequestHandler):
+    """/v1/listen returning the size of the upload, the first upload of each file gets a 503,
+    uploads starting bad get an error body"""
+
+    def do_POST(self): # pylint: disable=invalid-name
+        """Prerecorded transcription"""
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        with self.server.lock:
+            self.server.in_flight = self.server.in_flight + 1
+            self.server.max_in_flight = max(self.server.max_in_flight, self.server.in_flight)
+            first = body not in self.server.seen
+            self.server.seen.add(body)
+        time.sleep(0.05)
+        with self.server.lock:
+            self.server.in_flight = self.server.in_flight - 1
+        if first:
+            self.send_response(503)
+            self.end_headers()
+            return
+        if body.startswith(b"bad"):
+            response = {"err_msg": "Bad Request: failed to process audio: corrupt or unsupported data"}
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(json.dumps(response).encode("utf8"))
+            return
+        response = {"metadata": {"query": self.path}, "results": {"bytes": len(body), "audio": body.decode("utf8")}}
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(json.dumps(response).encode("utf8"))
+
+    def log_message(self, format, *args): # pylint: disable=redefined-builtin
+        """Quiet"""
+
+@pytest.fixture
+def fake_deepgram():
+    """Run the fake endpoint on a free port for the test"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeDeepgramHandler)
+    server.lock = threading.Lock()
+    server.in_flight = 0
+    server.max_in_flight = 0
+    server.seen = set()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+
+def _transcribe(server, directory: str, outputdir: str, **kwargs) -> list:
+    """Run transcribe_files against the fake endpoint"""
+    dg_client = Deepgram({"api_key": "0" * 40, "api_url": f'http://127.0.0.1:{server.server_address[1]}/v1'})
+    wav_files = sorted(deepgram_audio_transcribe.list_wav_files(directory))
+    return asyncio.run(deepgram_audio_transcribe.transcribe_files(
+        wav_files, outputdir, dg_client, {"diarize": True}, backoff_base=0.01, **kwargs))
+
+def test_concurrent_with_retries_sample_and_rebuild(fake_deepgram, tmp_path):
+    """Uploads overlap, 503s are retried, existing outputs are skipped unless rebuilding"""
+    directory = str(tmp_path / "wav") + "/"
+    outputdir = str(tmp_path / "json") + "/"
+    os.makedirs(directory)
+    os.makedirs(outputdir)
+    for i in range(12):
+        with open(f'{directory}call{i:02}.wav', mode="w", encoding="utf8") as file_out:
+            file_out.write(f'audio {i}')
+
+    results = _transcribe(fake_deepgram, directory, outputdir, sample=5, concurrency=4)
+    assert [os.path.basename(r.key) for r in results] == [f'call{i:02}.wav' for i in range(5)]
+    assert all(r.error == '' and r.attempts == 2 for r in results)
+    assert [r.value for r in results] == [f'{outputdir}call{i:02}.json' for i in range(5)]
+    assert sorted(os.listdir(outputdir)) == [f'call{i:02}.json' for i in range(5)]
+    with open(f'{outputdir}call03.json', mode="r", encoding="utf8") as file_in:
+        response = json.load(file_in)
+    assert response["results"] == {"bytes": 7, "audio": "audio 3"}
+    assert "diarize=true" in response["metadata"]["query"]
+
+    # the rest, picking up where the sample left off
+    results = _transcribe(fake_deepgram, directory, outputdir, concurrency=4)
+    assert len(results) == 7
+    assert len(os.listdir(outputdir)) == 12
+    assert 1 < fake_deepgram.max_in_flight <= 4
+
+    # rebuild does them all again, no 503s now every file has been seen
+    results = _transcribe(fake_deepgram, directory, outputdir, rebuild=True, sample=3, concurrency=4)
+    assert [r.attempts for r in results] == [1, 1, 1]
+
+def test_only_transient_errors_are_retried(fake_deepgram, tmp_path):
+    """A 503 is retried, an error body from Deepgram or an unreadable file fails on the first attempt"""
+    directory = str(tmp_path / "wav") + "/"
+    outputdir = str(tmp_path / "json") + "/"
+    os.makedirs(directory)
+    os.makedirs(outputdir)
+    for name, audio in [("good", "audio"), ("bad", "bad audio")]:
+        with open(f'{directory}{name}.wav', mode="w", encoding="utf8") as file_out:
+            file_out.write(audio)
+
+    results = _transcribe(fake_deepgram, directory, outputdir + "missing/", max_retries=3)
+    assert [(os.path.basename(r.key), r.attempts) for r in results] == [("bad.wav", 2), ("good.wav", 2)]
+    assert results[0].error.startswith("DeepgramApiError")
+    assert results[1].error.startswith("FileNotFoundError")
+
+    results = _transcribe(fake_deepgram, directory, outputdir, max_retries=3)
+    assert [(r.attempts, r.error == '') for r in results] == [(1, False), (1, True)]
+    assert os.listdir(outputdir) == ["good.json"]
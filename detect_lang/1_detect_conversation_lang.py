@@ -11,7 +11,9 @@
 # *********************************************************************************************************************
 
 # standard imports
-import json
+import os
+import sys
+import pathlib
 
 # 3rd party imports
 import pandas
@@ -20,6 +22,11 @@ from spacy_langdetect import LanguageDetector
 import spacy
 from spacy.language import Language
 
+# custom imports
+hf_module_path = str(pathlib.Path(os.path.dirname(os.path.realpath(__file__))).parent)
+sys.path.insert(1, hf_module_path)
+import hf_json_reader # pylint: disable=wrong-import-position
+
 @click.command()
 @click.option('-f', '--filename', type=str, required=True, help='Input HF JSON File Path')
 def main(filename: str) -> None:
@@ -28,12 +35,9 @@ def main(filename: str) -> None:
     input_filepath = filename
 
     # load input data
-    with open(input_filepath, mode="r", encoding="utf8") as file:
-        data = json.load(file)
-    df = pandas.json_normalize(data=data["examples"], sep="-",)
-
-    # enforce id is string
-    df["context-context_id"] = df["context-context_id"].astype(str)
+    # only the fields used, enforcing id is string
+    df = hf_json_reader.read_examples(input_filepath, columns=["context-context_id", "created_at", "text"],
+                                      dtypes={"context-context_id": str})
 
     # give a sequence number to each utterance
     df = df.sort_values(["context-context_id", "created_at"])
@@ -5,7 +5,11 @@ python cx_convo_to_hf_json.py -f filepath
 # *********************************************************************************************************************
 
 # standard imports
+import os
+import sys
 import json
+import pathlib
+from typing import Iterator
 from dateutil import parser
 import numpy
 
@@ -14,6 +18,11 @@ import pandas
 import click
 import humanfirst
 
+# custom imports
+hf_module_path = str(pathlib.Path(os.path.dirname(os.path.realpath(__file__))).parent)
+sys.path.insert(1, hf_module_path)
+import hf_example_builder # pylint: disable=wrong-import-position
+
 
 @click.command()
 @click.option('-f', '--filepath', type=str, required=True, help='Cx conversation json file')
@@ -104,18 +113,14 @@ def main(filepath: str):
     hf_df = pandas.concat([hf_df_user, hf_df_expert])
     hf_df = hf_df.sort_values(['created_at']).reset_index(drop=True)
     hf_df["idx"] = hf_df.groupby(["conversation_id"]).cumcount()
-    hf_df = hf_df.set_index(["conversation_id", "idx"])
     print(hf_df)
 
-    # build examples
-    hf_df = hf_df.apply(build_examples, axis=1)
-
     # A workspace is used to upload labelled or unlabelled data
     # unlabelled data will have no intents on the examples and no intents defined.
     unlabelled = humanfirst.objects.HFWorkspace()
 
-    # add the examples to workspace
-    for example in hf_df['example']:
+    # build examples and add them to workspace
+    for example in build_examples(hf_df):
         unlabelled.add_example(example)
 
     # write to output
@@ -165,28 +170,19 @@ def humanfirst_format_expert(row: pandas.Series, role: str) -> pandas.Series:
     return hf_expert
 
 
-def build_examples(row: pandas.Series) -> pandas.Series:
-    '''Build the examples'''
-
-    # build examples
-    example = humanfirst.objects.HFExample(
-        text=row['utterance'],
-        id=f'example-{row.name[0]}-{row.name[1]}',
-        created_at=row['created_at'],
-        intents=[],  # no intents as unlabelled
-        tags=[],  # recommend uploading metadata for unlabelled and tags for labelled
-        metadata=row['metadata'],
-        # this links the individual utterances into their conversation
-        context=humanfirst.objects.HFContext(
-            str(row.name[0]),
-            # any ID can be used recommend a hash of the text
-            # which is repeatable or the external conversation id if there is one.
-            'conversation',  # the type of document
-            row['role']  # the speakers role in the conversations
-        )
-    )
-    row['example'] = example
-    return row
+def build_examples(hf_df: pandas.DataFrame) -> Iterator[humanfirst.objects.HFExample]:
+    '''Build the examples from the whole columns'''
+
+    # this links the individual utterances into their conversation
+    # any ID can be used recommend a hash of the text
+    # which is repeatable or the external conversation id if there is one.
+    conversation_ids = hf_df["conversation_id"].astype(str).to_list()
+    ids = [f'example-{conversation_id}-{idx}'
+           for conversation_id, idx in zip(conversation_ids, hf_df["idx"].to_list())]
+    return hf_example_builder.iter_examples(hf_df['utterance'], ids, hf_df['created_at'],
+                                            metadata=hf_df['metadata'].to_list(),
+                                            context_ids=conversation_ids,
+                                            roles=hf_df['role'])  # the speakers role in the conversations
 
 
 def get_response_text(responses: list) -> list:
@@ -0,0 +1,146 @@
+"""
+python dialogflow_cx_benchmark.py -i 10000
+
+Writes a synthetic exported CX agent with a hierarchy of intents spread across flows and pages
+then compares the previous concat per page ingestion and pairwise parent intent search
+against dialogflow_cx_helper.  Checks both find the same intents.
+
+"""
+# ******************************************************************************************************************120
+
+# standard imports
+import os
+import re
+import json
+import time
+import random
+import tempfile
+from os.path import join
+
+# 3rd party imports
+import click
+import pandas
+
+# custom imports
+import dialogflow_cx_helper
+
+
+@click.command()
+@click.option('-i', '--intents', type=int, required=False, default=10000, help='Number of synthetic intents')
+@click.option('-f', '--flows', type=int, required=False, default=20, help='Number of flows')
+@click.option('-p', '--pages', type=int, required=False, default=100, help='Pages per flow')
+@click.option('-s', '--seed', type=int, required=False, default=42, help='Random seed')
+def main(intents: int, flows: int, pages: int, seed: int) -> None:
+    """Main Function"""
+
+    with tempfile.TemporaryDirectory() as filedir:
+        intent_names = write_agent(filedir, intents, flows, pages, seed)
+        print(f'Synthetic agent: {len(intent_names)} intents {flows} flows {flows * pages} pages')
+
+        start = time.perf_counter()
+        old_all, old_flow = find_all_and_flow_intents_concat(filedir)
+        old_ingest_secs = time.perf_counter() - start
+
+        start = time.perf_counter()
+        new_all, new_flow = dialogflow_cx_helper.find_all_and_flow_intents(filedir)
+        new_ingest_secs = time.perf_counter() - start
+
+    assert old_all == new_all
+    assert old_flow == new_flow
+
+    start = time.perf_counter()
+    old_parents = find_parent_intent_with_examples_pairwise(new_flow)
+    old_parent_secs = time.perf_counter() - start
+
+    start = time.perf_counter()
+    new_parents = dialogflow_cx_helper.find_parent_intent_with_examples(new_flow)
+    new_parent_secs = time.perf_counter() - start
+
+    assert old_parents == new_parents
+    print(f'Outputs identical, {len(new_flow)} flow intents {len(new_parents)} parents')
+
+    print(f'{"step":<10} {"before_s":>10} {"after_s":>10} {"speedup":>10}')
+    for step, before, after in [("ingest", old_ingest_secs, new_ingest_secs),
+                                ("parents", old_parent_secs, new_parent_secs)]:
+        print(f'{step:<10} {before:>10.3f} {after:>10.3f} {before/after:>9.1f}x')
+
+
+def write_agent(filedir: str, intents: int, flows: int, pages: int, seed: int) -> list:
+    """Exported agent layout with intents like topic_3 and its children topic_3_1, topic_3_2"""
+    rng = random.Random(seed)
+    intent_names = []
+    topic = 0
+    while len(intent_names) < intents:
+        intent_names.append(f'topic_{topic}')
+        for child in range(rng.randint(0, 6)):
+            intent_names.append(f'topic_{topic}_{child}')
+        topic = topic + 1
+    intent_names = intent_names[0:intents]
+
+    for intent in intent_names:
+        intent_folder = join(filedir, "intents", intent)
+        os.makedirs(intent_folder)
+        with open(join(intent_folder, f'{intent}.json'), mode="w", encoding="utf8") as file_out:
+            json.dump({"displayName": intent}, file_out)
+
+    for flow in range(flows):
+        flow_name = f'flow_{flow}'
+        os.makedirs(join(filedir, "flows", flow_name, "pages"))
+        page_names = [flow_name] + [f'page_{page}' for page in range(pages - 1)]
+        for page_name in page_names:
+            routes = []
+            for _ in range(rng.randint(0, 2 * intents // (flows * pages) + 1)):
+                routes.append({"intent": rng.choice(intent_names),
+                               "triggerFulfillment": {"messages": [{"text": {"text": ["ok"]}}]},
+                               "targetPage": rng.choice(page_names)})
+            # condition only routes used to read parameters
+            routes.append({"condition": "$page.params.status = \"FINAL\"", "targetPage": "End Session"})
+            if page_name == flow_name:
+                page_file = join(filedir, "flows", flow_name, f'{flow_name}.json')
+            else:
+                page_file = join(filedir, "flows", flow_name, "pages", f'{page_name}.json')
+            with open(page_file, mode="w", encoding="utf8") as file_out:
+                json.dump({"displayName": page_name, "transitionRoutes": routes}, file_out)
+    return intent_names
+
+
+def find_all_and_flow_intents_concat(filedir: str) -> tuple:
+    """What dialogflow_cx_helper.find_all_and_flow_intents did before, concat for every page"""
+    final_df = pandas.DataFrame()
+    for root, _, files in os.walk(join(filedir, "flows"), topdown=False):
+        for file in files:
+            page_file = join(root, file)
+            flow_name = dialogflow_cx_helper.find_flow_name_from_path(page_file)
+            with open(page_file, mode="r", encoding="utf8") as f:
+                page = json.load(f)
+                if "transitionRoutes" in page:
+                    df = pandas.json_normalize(page["transitionRoutes"], sep="-")
+                    df["page"] = re.sub(".json$", "", file)
+                    df["flow_name"] = flow_name
+                    final_df = pandas.concat([final_df, df], ignore_index=True)
+    final_df["tags"] = final_df[["flow_name", "page"]].apply(
+        lambda row: dialogflow_cx_helper.set_tag(row.flow_name, row.page), axis=1)
+    final_df["page"] = final_df[["flow_name", "page"]].apply(
+        lambda row: dialogflow_cx_helper.set_start_page(row.flow_name, row.page), axis=1)
+    final_df = final_df[["intent", "page", "tags", "flow_name"]][pandas.notna(final_df["intent"])]
+
+    all_intents = set()
+    for intent in os.listdir(join(filedir, "intents")):
+        for json_file in os.listdir(join(filedir, "intents", intent)):
+            all_intents.add(re.sub(".json", "", json_file))
+    return all_intents, set(final_df.intent.values.tolist())
+
+
+def find_parent_intent_with_examples_pairwise(flow_intents: set) -> set:
+    """What dialogflow_cx_helper.find_parent_intent_with_examples did before, every pair compared"""
+    parent_intent_with_examples = set()
+    for intent1 in flow_intents:
+        for intent2 in flow_intents:
+            if intent2.startswith(intent1) and intent1 != intent2:
+                parent_intent_with_examples.add(intent1)
+                break
+    return parent_intent_with_examples
+
+
+if __name__ == '__main__':
+    main() # pylint: disable=no-value-for-parameter
@@ -185,15 +185,17 @@ def list_intents(location: str, agent_name: str) -> dialogflowcx_v3.ListIntentsR
 
 
 def find_parent_intent_with_examples(flow_intents: set) -> set:
-    """Finds set of parent intents with training phrases"""
+    """Finds set of parent intents with training phrases
+
+    An intent is a parent if another intent name starts with it.  Once sorted every name starting
+    with an intent comes straight after it, so only each name and the next one need comparing"""
 
     # parent intents with examples
     parent_intent_with_examples = set()
-    for intent1 in flow_intents:
-        for intent2 in flow_intents:
-            if intent2.startswith(intent1) and intent1 != intent2:
-                parent_intent_with_examples.add(intent1)
-                break
+    sorted_intents = sorted(set(flow_intents))
+    for intent1, intent2 in zip(sorted_intents, sorted_intents[1:]):
+        if intent2.startswith(intent1):
+            parent_intent_with_examples.add(intent1)
 
     # print(*parent_intent_with_examples,sep="\n")
 
@@ -208,26 +210,27 @@ def find_all_and_flow_intents(filedir: str) -> tuple:
     else:
         raise Exception("flows does not exist in the given dir")
 
-    final_df = pandas.DataFrame()
-    for root, dirs, files in os.walk(join(filedir, "flows"), topdown=False):
+    # collect a record per transition route and make the frame once at the end
+    records = []
+    for root, dirs, files in os.walk(flow_paths, topdown=False):
         for file in files:
             page_file = join(root, file)
             flow_name = find_flow_name_from_path(page_file)
             with open(page_file, mode="r", encoding="utf8") as f:
                 page = json.load(f)
-                if "transitionRoutes" in page:
-                    df = pandas.json_normalize(page["transitionRoutes"], sep="-")
-                    df["page"] = re.sub(".json$", "", file)
-                    df["flow_name"] = flow_name
-                    final_df = pandas.concat([final_df, df], ignore_index=True)
-                else:
-                    # print(f"tr is not present in {page_file}")
-                    pass
-    final_df["tags"] = final_df[["flow_name", "page"]].apply(set_tag, axis=1)
-    final_df["page"] = final_df[["flow_name", "page"]].apply(set_start_page, axis=1)
-
-    # to avoid cases with transition route defined but does not detect any intents (for reading params)
-    final_df = final_df[["intent", "page", "tags", "flow_name"]][pandas.notna(final_df["intent"])]
+            if "transitionRoutes" in page:
+                page_name = re.sub(".json$", "", file)
+                tag = set_tag(flow_name, page_name)
+                page_name = set_start_page(flow_name, page_name)
+                for transition_route in page["transitionRoutes"]:
+                    # to avoid cases with transition route defined but does not detect any intents (for reading params)
+                    if transition_route.get("intent") is not None:
+                        records.append({"intent": transition_route["intent"], "page": page_name,
+                                        "tags": tag, "flow_name": flow_name})
+            else:
+                # print(f"tr is not present in {page_file}")
+                pass
+    final_df = pandas.DataFrame(records, columns=["intent", "page", "tags", "flow_name"])
 
     print(final_df)
     intent_path = join(filedir, "intents")
@@ -244,21 +247,21 @@ def find_all_and_flow_intents(filedir: str) -> tuple:
     return all_intents, flow_intents
 
 
-def set_start_page(row: pandas.Series) -> str:
+def set_start_page(flow_name: str, page: str) -> str:
     """Sets the start page"""
 
     # if page name and the flow name are same, then it is a start page
-    if row.page == row.flow_name:
+    if page == flow_name:
         return "start"
-    return row.page
+    return page
 
 
-def set_tag(row: pandas.Series) -> str:
+def set_tag(flow_name: str, page: str) -> str:
     """Sets the tag"""
 
-    if row.flow_name == row.page:
-        return row.flow_name
-    return f'{row.flow_name}:{row.page}'
+    if flow_name == page:
+        return flow_name
+    return f'{flow_name}:{page}'
 
 
 def find_flow_name_from_path(path: str) -> str:
@@ -8,12 +8,20 @@ python convert_es_to_hf.py -f filepath
 import json
 import yaml
 import re
+import os
+import sys
+import pathlib
 
 # 3rd party imports
 import pandas
 import click
 import humanfirst
 
+# custom imports
+hf_module_path = str(pathlib.Path(os.path.dirname(os.path.realpath(__file__))).parent)
+sys.path.insert(1, hf_module_path)
+import conversation_index # pylint: disable=wrong-import-position
+
 
 @click.command()
 @click.option('-f', '--filepath', type=str, required=True, help='ES conversation json file')
@@ -100,24 +108,7 @@ def main(filepath: str):
     df["utterance"] = df["utterance"].fillna("")
 
     # index the speakers
-    df['idx'] = df.groupby(["convo_id"]).cumcount()
-    df['idx_max'] = df.groupby(["convo_id"])[
-        'idx'].transform("max")
-
-    # This info lets you filter for the first or last thing the client says
-    # this is very useful in boot strapping bot design
-    # 0s for expert
-    df['idx_client'] = df.groupby(
-        ["convo_id", 'role']).cumcount().where(df.role == 'client', 0)
-    df['first_client_utt'] = df.apply(decide_role_filter_values,args=['idx_client','client',0],axis=1)
-    df['second_client_utt'] = df.apply(decide_role_filter_values,args=['idx_client','client',1],axis=1)
-
-    # same for expert
-    df['idx_expert'] = df.groupby(
-        ["convo_id", 'role']).cumcount().where(df.role == 'expert', 0)
-    df['first_expert_utt'] = df.apply(decide_role_filter_values,args=['idx_expert','expert',0],axis=1)
-    df['second_expert_utt'] = df.apply(decide_role_filter_values,args=['idx_expert','expert',1],axis=1)
-
+    df = conversation_index.index_conversations(df, "convo_id")
 
     df = df.sort_values(["convo_id","created_at"]).reset_index(drop=True)
 
@@ -170,13 +161,6 @@ def main(filepath: str):
     file_out.close()
     print(f"{output_filepath} is successfully created")
 
-def decide_role_filter_values(row: pandas.Series, column_name: str, role_filter: str, value_filter: str) -> bool:
-    """Determine whether this is the 0,1,2 where the role is also somthing"""
-    if row[column_name] == value_filter and row["role"] == role_filter:
-        return True
-    else:
-        return False
-
 def build_examples(row: pandas.Series) -> pandas.Series:
     '''Build the examples'''
 
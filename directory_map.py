@@ -0,0 +1,120 @@
+"""
+directory_map.py
+
+Parallel map over every file in a directory tree.
+
+- The tree is walked once up front in the same order as the recursive os.listdir loops it replaces,
+  directories depth first with files sorted (optionally reversed).
+- Files are handed to a pool of worker processes in chunks, results come back in file order.
+- With an output_directory each result is written to the mirror path as indented json and any
+  output which already exists is skipped so an interrupted run can simply be started again.
+- A file that can't be read or processed is reported in the result rather than stopping the run.
+
+call_this must be a module level function so it can be sent to the workers, it is passed the
+loaded file (a dict for json with 'filename' set to the file name, otherwise the text).
+
+Usage:
+    for result in directory_map.map_files('./data/mbox/output', do_all_these_things,
+                                          output_directory='./data/mbox/output_pp', workers=8):
+        if result.error != '':
+            print(result.path, result.error)
+
+"""
+# ******************************************************************************************************************120
+
+# standard imports
+import os
+import json
+import typing
+import functools
+from dataclasses import dataclass
+from multiprocessing import Pool
+
+
+@dataclass
+class FileResult:
+    """What happened to one file, value is None when it was written to the output_directory"""
+    path: str
+    value: typing.Any = None
+    error: str = ''
+    skipped: bool = False
+
+
+def list_files(directory: str, suffix: str = '', reverse: bool = False) -> list:
+    """Every file under directory ending in suffix, depth first in sorted order"""
+    assert os.path.isdir(directory)
+    files = []
+    names = os.listdir(directory)
+    names.sort(reverse=reverse)
+    for name in names:
+        path = os.path.join(directory, name)
+        if os.path.isfile(path):
+            if path.endswith(suffix):
+                files.append(path)
+        elif os.path.isdir(path):
+            files.extend(list_files(path, suffix, reverse))
+        else:
+            raise RuntimeError(f'Neither a file nor a directory: {path}')
+    return files
+
+
+def mirror_path(path: str, directory: str, output_directory: str) -> str:
+    """Where path under directory goes under output_directory"""
+    return os.path.join(output_directory, os.path.relpath(path, directory))
+
+
+def map_files(directory: str, call_this: typing.Callable, output_directory: str = '',
+              suffix: str = '.json', reverse: bool = False, workers: int = os.cpu_count(),
+              skip_existing: bool = True, max_records: int = 0, chunksize: int = 16,
+              load_json: bool = True) -> typing.Iterator[FileResult]:
+    """Yields a FileResult per file in file order calling call_this on each in a pool of workers"""
+
+    paths = list_files(directory, suffix, reverse)
+    skipped = []
+    if output_directory != '' and skip_existing:
+        todo = []
+        for path in paths:
+            if os.path.isfile(mirror_path(path, directory, output_directory)):
+                skipped.append(path)
+            else:
+                todo.append(path)
+        paths = todo
+    if max_records > 0:
+        paths = paths[0:max_records]
+    print(f'Files to process: {len(paths)} skipped as already output: {len(skipped)}')
+    for path in skipped:
+        yield FileResult(path=path, skipped=True)
+
+    work = functools.partial(process_file, call_this=call_this, directory=directory,
+                             output_directory=output_directory, load_json=load_json)
+    if workers <= 1:
+        for path in paths:
+            yield work(path)
+        return
+    with Pool(workers) as pool:
+        for result in pool.imap(work, paths, chunksize=chunksize):
+            yield result
+
+
+def process_file(path: str, call_this: typing.Callable, directory: str, output_directory: str,
+                 load_json: bool) -> FileResult:
+    """Load, call and optionally write one file in a worker"""
+    try:
+        with open(path, mode='r', encoding='utf8') as file_in:
+            if load_json:
+                loaded = json.load(file_in)
+                loaded['filename'] = os.path.basename(path)
+            else:
+                loaded = file_in.read()
+        value = call_this(loaded)
+        if output_directory == '':
+            return FileResult(path=path, value=value)
+        output_path = mirror_path(path, directory, output_directory)
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        # write beside and rename so a killed run never leaves a partial file to be skipped next time
+        with open(output_path + '.tmp', mode='w', encoding='utf8') as file_out:
+            json.dump(value, file_out, indent=2)
+        os.replace(output_path + '.tmp', output_path)
+        return FileResult(path=path)
+    except Exception as e: # pylint: disable=broad-exception-caught
+        return FileResult(path=path, error=f'{type(e).__name__}: {e}')
@@ -0,0 +1,65 @@
+"""
+Test directory_map.py walks in the same order as os.listdir recursion and restarts by skipping outputs
+
+"""
+# ***************************************************************************80**************************************120
+
+# standard imports
+import os
+import json
+
+# custom imports
+import directory_map # file under test
+
+def add_length(record: dict) -> dict:
+    """Module level so it can go to the workers"""
+    record["length"] = len(record["text"])
+    return record
+
+def _make_tree(root: str) -> list:
+    """2023/12 and 2024/01 folders of json plus one bad file"""
+    paths = []
+    for year, month, names in [("2024", "01", ["b.json", "a.json"]), ("2023", "12", ["c.json", "notes.txt"])]:
+        folder = os.path.join(root, year, month)
+        os.makedirs(folder)
+        for name in names:
+            with open(os.path.join(folder, name), mode="w", encoding="utf8") as file_out:
+                json.dump({"text": name * 2}, file_out)
+            paths.append(os.path.join(folder, name))
+    with open(os.path.join(root, "2024", "broken.json"), mode="w", encoding="utf8") as file_out:
+        file_out.write("{not json")
+    return paths
+
+def test_list_files_order(tmp_path):
+    """Depth first sorted and filtered by suffix"""
+    root = str(tmp_path / "in")
+    _make_tree(root)
+    relative = [os.path.relpath(p, root) for p in directory_map.list_files(root, ".json")]
+    assert relative == ["2023/12/c.json", "2024/01/a.json", "2024/01/b.json", "2024/broken.json"]
+    relative = [os.path.relpath(p, root) for p in directory_map.list_files(root, ".json", reverse=True)]
+    assert relative == ["2024/broken.json", "2024/01/b.json", "2024/01/a.json", "2023/12/c.json"]
+
+def test_map_files_writes_mirror_and_skips_existing(tmp_path):
+    """Outputs mirror the tree, errors are reported and a rerun only does what is missing"""
+    root = str(tmp_path / "in")
+    output = str(tmp_path / "out")
+    _make_tree(root)
+    results = list(directory_map.map_files(root, add_length, output_directory=output, workers=2))
+    assert [r.error == '' for r in results] == [True, True, True, False]
+    with open(os.path.join(output, "2024", "01", "a.json"), mode="r", encoding="utf8") as file_in:
+        assert json.load(file_in) == {"text": "a.jsona.json", "filename": "a.json", "length": 12}
+
+    os.remove(os.path.join(output, "2024", "01", "b.json"))
+    results = list(directory_map.map_files(root, add_length, output_directory=output, workers=2))
+    done = [os.path.relpath(r.path, root) for r in results if not r.skipped]
+    assert done == ["2024/01/b.json", "2024/broken.json"]
+    assert os.path.isfile(os.path.join(output, "2024", "01", "b.json"))
+
+def test_map_files_returns_values_in_order(tmp_path):
+    """Without an output directory the values come back in file order"""
+    root = str(tmp_path / "in")
+    _make_tree(root)
+    values = [r.value for r in directory_map.map_files(root, len, suffix=".txt", load_json=False, workers=1)]
+    assert values == [len(json.dumps({"text": "notes.txtnotes.txt"}))]
+    values = [r.value["length"] for r in directory_map.map_files(root, add_length, workers=2) if r.error == '']
+    assert values == [12, 12, 12]
@@ -0,0 +1,168 @@
+"""
+embedding_store.py
+
+Local store of embeddings so a re-run doesn't pay to embed the same text twice,
+plus concurrent batched embedding and matrix cosine similarity.
+
+- Embeddings are held as one float32 matrix saved as <name>.npy next to <name>_ids.json,
+  the row for each key is its position in the ids list.  The matrix is opened memory mapped so
+  large stores aren't read into memory to look up a few rows.
+- Keys are a hash of the model, any extra setting like a token limit, and the text so a changed
+  text or model is embedded again.
+- embed_texts only sends the distinct texts not already in the store, in chunks dispatched concurrently.
+- Similarity is computed for all rows at once on the matrices rather than row by row.
+
+Usage:
+    store = embedding_store.EmbeddingStore('./data/embeddings', 'text-embedding-3-large')
+    lhs = embedding_store.embed_texts(df['lhs'].to_list(), get_batch_embedding, store=store, workers=4)
+    rhs = embedding_store.embed_texts(df['rhs'].to_list(), get_batch_embedding, store=store, workers=4)
+    df['cosine_similarity'] = embedding_store.row_cosine(lhs, rhs)
+
+"""
+# ******************************************************************************************************************120
+
+# standard imports
+import os
+import json
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+# 3rd party imports
+import numpy
+
+
+class EmbeddingStore:
+    """float32 matrix of embeddings on disk with an id index, a directory of '' keeps it in memory only"""
+
+    def __init__(self, directory: str, name: str):
+        self.directory = directory
+        self.name = name
+        self.matrix_filename = os.path.join(directory, f'{name}.npy')
+        self.ids_filename = os.path.join(directory, f'{name}_ids.json')
+        self.matrix = None
+        self.ids = []
+        if directory != '':
+            os.makedirs(directory, exist_ok=True)
+        if directory != '' and os.path.isfile(self.matrix_filename) and os.path.isfile(self.ids_filename):
+            self.matrix = numpy.load(self.matrix_filename, mmap_mode='r')
+            with open(self.ids_filename, mode='r', encoding='utf8') as file_in:
+                self.ids = json.load(file_in)
+            if self.matrix.shape[0] != len(self.ids):
+                raise RuntimeError(f'{self.matrix_filename} has {self.matrix.shape[0]} rows '
+                                   f'but {self.ids_filename} has {len(self.ids)} ids')
+        self.index = {key: i for i, key in enumerate(self.ids)}
+        self.pending_ids = []
+        self.pending_rows = []
+
+    @staticmethod
+    def make_key(model: str, text: str, extra: str = '') -> str:
+        """Hash of what decides the embedding"""
+        return hashlib.sha256('\x1f'.join([model, extra, text]).encode('utf8')).hexdigest()
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.index
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def get_many(self, keys: list) -> numpy.ndarray:
+        """Rows for keys which must all be present"""
+        if len(keys) == 0:
+            return numpy.zeros((0, 0), dtype=numpy.float32)
+        saved = [self.index[key] for key in keys if self.index[key] < len(self.ids)]
+        if len(saved) == len(keys):
+            return numpy.asarray(self.matrix[saved], dtype=numpy.float32)
+        rows = []
+        for key in keys:
+            i = self.index[key]
+            rows.append(self.matrix[i] if i < len(self.ids) else self.pending_rows[i - len(self.ids)])
+        return numpy.asarray(rows, dtype=numpy.float32)
+
+    def put_many(self, keys: list, rows: numpy.ndarray):
+        """Add rows for keys not already present, kept in memory until save"""
+        for key, row in zip(keys, rows):
+            if key in self.index:
+                continue
+            self.index[key] = len(self.ids) + len(self.pending_ids)
+            self.pending_ids.append(key)
+            self.pending_rows.append(numpy.asarray(row, dtype=numpy.float32))
+
+    def save(self):
+        """Write the matrix and ids including anything added since the last save"""
+        if len(self.pending_ids) == 0 or self.directory == '':
+            return
+        pending = numpy.vstack(self.pending_rows).astype(numpy.float32)
+        if self.matrix is not None and len(self.ids) > 0:
+            matrix = numpy.concatenate([numpy.asarray(self.matrix), pending])
+        else:
+            matrix = pending
+        ids = self.ids + self.pending_ids
+
+        # write beside and swap in so an interrupted save leaves the previous store intact
+        self.matrix = None
+        with open(self.matrix_filename + '.tmp', mode='wb') as file_out:
+            numpy.save(file_out, matrix)
+        with open(self.ids_filename + '.tmp', mode='w', encoding='utf8') as file_out:
+            json.dump(ids, file_out)
+        os.replace(self.matrix_filename + '.tmp', self.matrix_filename)
+        os.replace(self.ids_filename + '.tmp', self.ids_filename)
+
+        self.matrix = numpy.load(self.matrix_filename, mmap_mode='r')
+        self.ids = ids
+        self.pending_ids = []
+        self.pending_rows = []
+
+
+def embed_texts(texts: list, embed_batch: Callable, store: EmbeddingStore = None,
+                extra: str = '', inputs: list = None, chunk_size: int = 1024, workers: int = 4) -> numpy.ndarray:
+    """Returns a float32 matrix with a row for each text.
+
+    embed_batch(list of inputs) returns a list of embeddings, inputs default to the texts
+    but can be anything derived from them like trimmed token lists.
+    Only distinct texts not already in the store are sent, chunks are dispatched on workers threads.
+    Keys use the store name as the model, the store is saved afterwards."""
+
+    if inputs is None:
+        inputs = texts
+    if store is None:
+        store = EmbeddingStore('', '')
+
+    keys = [EmbeddingStore.make_key(store.name, str(text), extra) for text in texts]
+    to_embed = {}
+    for key, value in zip(keys, inputs):
+        if key not in store and key not in to_embed:
+            to_embed[key] = value
+    missing_keys = list(to_embed.keys())
+    missing_inputs = list(to_embed.values())
+    chunks = [(missing_keys[i:i + chunk_size], missing_inputs[i:i + chunk_size])
+              for i in range(0, len(missing_keys), chunk_size)]
+    print(f'Embedding {len(missing_keys)} of {len(texts)} texts in {len(chunks)} chunks, '
+          f'{len(texts) - len(missing_keys)} already stored or repeated')
+
+    if len(chunks) > 0:
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(chunks)))) as pool:
+            for (chunk_keys, _), rows in zip(chunks, pool.map(lambda chunk: embed_batch(chunk[1]), chunks)):
+                if len(rows) != len(chunk_keys):
+                    raise RuntimeError(f'Asked for {len(chunk_keys)} embeddings got {len(rows)}')
+                store.put_many(chunk_keys, rows)
+    store.save()
+    return store.get_many(keys)
+
+
+def normalise(matrix: numpy.ndarray) -> numpy.ndarray:
+    """Rows scaled to unit length, zero rows stay zero"""
+    matrix = numpy.asarray(matrix, dtype=numpy.float32)
+    norms = numpy.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+
+def row_cosine(lhs: numpy.ndarray, rhs: numpy.ndarray) -> numpy.ndarray:
+    """Cosine similarity of each lhs row with the same rhs row"""
+    return numpy.einsum('ij,ij->i', normalise(lhs), normalise(rhs))
+
+
+def cosine_matrix(lhs: numpy.ndarray, rhs: numpy.ndarray) -> numpy.ndarray:
+    """Cosine similarity of every lhs row with every rhs row"""
+    return normalise(lhs) @ normalise(rhs).T
@@ -0,0 +1,64 @@
+"""
+Test embedding_store.py only embeds what it hasn't seen and gives the same similarities as row by row
+
+"""
+# ***************************************************************************80**************************************120
+
+# standard imports
+import threading
+
+# 3rd party imports
+import numpy
+
+# custom imports
+import embedding_store # file under test
+
+class FakeEmbedder:
+    """Deterministic embedding from the text counting what it was asked for"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.embedded = []
+
+    def __call__(self, chunk: list) -> list:
+        with self.lock:
+            self.calls = self.calls + 1
+            self.embedded.extend(chunk)
+        return [[len(text), text.count('a'), 1.0] for text in chunk]
+
+def test_embed_texts_store_reused(tmp_path):
+    """Repeats are sent once and a second run with a reopened store sends nothing"""
+    texts = ["a cat", "a dog", "a cat", "banana", "fish"]
+    embedder = FakeEmbedder()
+    store = embedding_store.EmbeddingStore(str(tmp_path), "fake-model")
+    first = embedding_store.embed_texts(texts, embedder, store=store, chunk_size=2, workers=3)
+    assert first.dtype == numpy.float32
+    assert first.shape == (5, 3)
+    assert sorted(embedder.embedded) == ["a cat", "a dog", "banana", "fish"]
+    assert embedder.calls == 2
+    numpy.testing.assert_array_equal(first[0], first[2])
+    numpy.testing.assert_array_equal(first[3], [6, 3, 1])
+
+    embedder = FakeEmbedder()
+    store = embedding_store.EmbeddingStore(str(tmp_path), "fake-model")
+    assert len(store) == 4
+    second = embedding_store.embed_texts(texts + ["new"], embedder, store=store, chunk_size=2)
+    assert embedder.embedded == ["new"]
+    numpy.testing.assert_array_equal(first, second[0:5])
+
+    # a different model or setting is a different key
+    embedder = FakeEmbedder()
+    embedding_store.embed_texts(texts, embedder, store=store, extra="trim_to=10")
+    assert len(embedder.embedded) == 4
+
+def test_cosine_matches_row_by_row():
+    """Matrix versions agree with numpy.inner on normalised rows"""
+    rng = numpy.random.default_rng(7)
+    lhs = rng.normal(size=(20, 8))
+    rhs = rng.normal(size=(20, 8))
+    expected = [numpy.inner(l / numpy.linalg.norm(l), r / numpy.linalg.norm(r)) for l, r in zip(lhs, rhs)]
+    numpy.testing.assert_allclose(embedding_store.row_cosine(lhs, rhs), expected, atol=1e-6)
+    matrix = embedding_store.cosine_matrix(lhs, rhs)
+    assert matrix.shape == (20, 20)
+    numpy.testing.assert_allclose(numpy.diag(matrix), expected, atol=1e-6)
@@ -7,7 +7,9 @@ python epinions_openai.py
 # standard imports
 import json
 import os
+import sys
 import time
+import pathlib
 
 # 3rd party imports
 import click
@@ -15,6 +17,9 @@ import pandas
 import openai
 
 # custom imports
+hf_module_path = str(pathlib.Path(os.path.dirname(os.path.realpath(__file__))).parent)
+sys.path.insert(1, hf_module_path)
+import llm_cache # pylint: disable=wrong-import-position
 
 MODEL="gpt-4o"
 TIMEOUT=5
@@ -36,11 +41,14 @@ BACKOFF_BASE=2
              help='Output directory')
 @click.option('-t', '--start_at', type=int, required=False,default=0,
              help='Where to start at')
+@click.option('-c', '--cache_filename', type=str, required=False, default='',
+             help='SQLite file to cache responses in so a rerun does not resend identical prompts')
 def main(filename: str,
         api_key: str,
         sample: int,
         output_dir: str,
-        start_at: int) -> None: # pylint: disable=unused-argument
+        start_at: int,
+        cache_filename: str) -> None: # pylint: disable=unused-argument
     """Main Function"""
 
     # Read input and sample
@@ -51,6 +59,9 @@ def main(filename: str,
 
     # authorise
     openai.api_key = api_key
+    cache = None
+    if cache_filename != '':
+        cache = llm_cache.LLMResponseCache(cache_filename)
 
     # iterate df
     for i,row in df.iterrows():
@@ -70,7 +81,7 @@ def main(filename: str,
         # where we will write success or errors to
 
         # perform openai call (single thread with retries
-        response_content_raw = get_openai_response(prompt)
+        response_content_raw = get_openai_response(prompt, cache=cache)
 
         # see if actually json and write value or errors
         try:
@@ -85,8 +96,16 @@ def main(filename: str,
                 file_out.write(response_content_raw + "\n\n\n" + e.msg + "\n" + str(e.pos))
                 print(f'Invalid JSON: {output_filename} {e}')
 
-def get_openai_response(prompt, retries: int = 0) -> dict:
-    """Call open"""
+    if cache is not None:
+        print(cache.summary())
+        cache.close()
+
+def get_openai_response(prompt, retries: int = 0, cache: llm_cache.LLMResponseCache = None) -> dict:
+    """Call open, or return the cached response to an identical earlier call"""
+    if cache is not None and retries == 0:
+        cached = cache.get(MODEL, prompt, TEMPERATURE, MAX_TOKENS, extra="json_object")
+        if cached is not None:
+            return cached["content"]
     try:
         response = openai.ChatCompletion.create(
             model=MODEL,
@@ -101,14 +120,18 @@ def get_openai_response(prompt, retries: int = 0) -> dict:
             response_format = { "type": "json_object" },
             timeout=TIMEOUT
         )
-        return response["choices"][0]["message"]["content"]
+        content = response["choices"][0]["message"]["content"]
+        if cache is not None:
+            cache.put(MODEL, prompt, TEMPERATURE, MAX_TOKENS, content,
+                      response["usage"]["total_tokens"], extra="json_object")
+        return content
     except Exception as e: # pylint: disable=broad-exception-caught
         print(f'Retry {retries} exception: {e}')
         retries = retries + 1
         if retries >= RETRY_ATTEMPTS:
             raise RuntimeError("Out of retry attempts") # pylint: disable=raise-missing-from
         time.sleep(BACKOFF_BASE**retries)
-        return get_openai_response(prompt,retries)
+        return get_openai_response(prompt,retries,cache)
 
 
 def get_prompt(review_id: str, item: str, loaded_date: str, stars: str, paid: str, text: str) -> str:
@@ -11,11 +11,18 @@ Accepts list of agent ids to perform role mappings to ensure conversion of trans
 import json
 from datetime import datetime, timedelta
 import os
+import sys
+import pathlib
 
 # third Party imports
 import pandas
 import click
 
+# custom imports
+hf_module_path = str(pathlib.Path(os.path.dirname(os.path.realpath(__file__))).parent)
+sys.path.insert(1, hf_module_path)
+import conversation_index # pylint: disable=wrong-import-position
+
 
 @click.command()
 @click.option('-f', '--folder_path', type=str, required=True, help='Gong json folder')
@@ -96,41 +103,7 @@ def process(data: str, expert_speaker_id_list: str) -> pandas.DataFrame:
     convo_id_col = "convo_guid"
 
     # index the speakers
-    df['idx'] = df.groupby([convo_id_col]).cumcount()
-    df['idx_max'] = df.groupby([convo_id_col])[
-        'idx'].transform("max")
-
-    # This info lets you filter for the first or last thing the client says
-    # this is very useful in boot strapping bot design
-    # 0s for expert
-    df['idx_client'] = df.groupby(
-        [convo_id_col, 'role']).cumcount().where(df.role == 'client', 0)
-    df['idx_max_client'] = df.groupby([convo_id_col])[
-        'idx_client'].transform("max")
-    df['first_client_utt'] = df.apply(decide_role_filter_values,
-                                        args=['idx_client','client',0,"idx_max_client"],
-                                        axis=1)
-    df['second_client_utt'] = df.apply(decide_role_filter_values,
-                                        args=['idx_client','client',1,"idx_max_client"],
-                                        axis=1)
-    df['last_client_utt'] = df.apply(decide_role_filter_values,
-                                        args=['idx_client','client',-1,"idx_max_client"],
-                                        axis=1)
-
-    # same for expert
-    df['idx_expert'] = df.groupby(
-        [convo_id_col, 'role']).cumcount().where(df.role == 'expert', 0)
-    df['idx_max_expert'] = df.groupby([convo_id_col])[
-        'idx_expert'].transform("max")
-    df['first_expert_utt'] = df.apply(decide_role_filter_values,
-                                        args=['idx_expert','expert',0,'idx_max_expert'],
-                                        axis=1)
-    df['second_expert_utt'] = df.apply(decide_role_filter_values,
-                                        args=['idx_expert','expert',1,'idx_max_expert'],
-                                        axis=1)
-    df['last_expert_utt'] = df.apply(decide_role_filter_values,
-                                        args=['idx_expert','expert',-1,'idx_max_expert'],
-                                        axis=1)
+    df = conversation_index.index_conversations(df, convo_id_col)
 
     df.drop(['idx',
             'idx_max',
@@ -145,20 +118,5 @@ def process(data: str, expert_speaker_id_list: str) -> pandas.DataFrame:
     return df
 
 
-def decide_role_filter_values(row: pandas.Series,
-                              column_name: str,
-                              role_filter: str,
-                              value_filter: str,
-                              idx_max_col_name: str) -> bool:
-    """Determine whether this is the 0,1,2 where the role is also somthing"""
-    if value_filter >=0 and row[column_name] == value_filter and row["role"] == role_filter:
-        return True
-    elif value_filter < 0 and row[column_name] == row[
-        idx_max_col_name] and row["role"] == role_filter:
-        return True
-    else:
-        return False
-
-
 if __name__ == '__main__':
     main() # pylint: disable=no-value-for-parameter
@@ -0,0 +1,133 @@
+"""
+hf_example_builder.py
+
+Builds HF examples from whole columns rather than a pandas Series per row with df.apply(..., axis=1).
+
+Takes lists (or Series) of text, id, created_at and optionally metadata dicts, context ids and roles
+and either yields humanfirst.objects.HFExample objects to add to a workspace, or yields the dicts
+HFExample.to_dict() would give without creating the objects, ready for hf_json_writer.
+
+- created_at strings are used as is, datetimes become isoformat() + 'Z' the same as HFExample.
+- roles and the context type are validated once per distinct role with HFContext rather than per example.
+- With no context ids examples have no context, as HFExample(context=None).
+- intents and tags are optional per example lists for labelled data.
+
+Usage:
+    examples = hf_example_builder.iter_examples(df['text'], ids, df['created_at'], metadata=metadata,
+                                                context_ids=df['convo_id'], roles=df['role'])
+    for example in examples:
+        unlabelled.add_example(example)
+
+    writer.write_example_dicts(hf_example_builder.iter_example_dicts(df['text'], ids, df['created_at']))
+
+"""
+# ******************************************************************************************************************120
+
+# standard imports
+import datetime
+from typing import Iterator, Union
+
+# 3rd party imports
+import pandas
+import humanfirst
+
+
+def iter_examples(texts: Union[list, pandas.Series], ids: Union[list, pandas.Series],
+                  created_ats: Union[list, pandas.Series], metadata: list = None,
+                  context_ids: Union[list, pandas.Series] = None, roles: Union[list, pandas.Series, str] = None,
+                  context_type: str = 'conversation', intents: list = None,
+                  tags: list = None) -> Iterator[humanfirst.objects.HFExample]:
+    """Yields an HFExample for each position in the columns"""
+
+    columns = _columns(texts, ids, created_ats, metadata, context_ids, roles, context_type, intents, tags)
+    for text, example_id, created_at, example_metadata, context_id, role, example_intents, example_tags in columns:
+        context = None
+        if context_id is not None:
+            context = humanfirst.objects.HFContext(context_id, context_type, role)
+        yield humanfirst.objects.HFExample(
+            text=text,
+            id=example_id,
+            created_at=created_at,
+            intents=example_intents,
+            tags=example_tags,
+            metadata=example_metadata,
+            context=context
+        )
+
+
+def iter_example_dicts(texts: Union[list, pandas.Series], ids: Union[list, pandas.Series],
+                       created_ats: Union[list, pandas.Series], metadata: list = None,
+                       context_ids: Union[list, pandas.Series] = None, roles: Union[list, pandas.Series, str] = None,
+                       context_type: str = 'conversation', intents: list = None,
+                       tags: list = None) -> Iterator[dict]:
+    """Yields the HF JSON dict HFExample.to_dict() would give for each position in the columns"""
+
+    columns = _columns(texts, ids, created_ats, metadata, context_ids, roles, context_type, intents, tags)
+    for text, example_id, created_at, example_metadata, context_id, role, example_intents, example_tags in columns:
+        context = {}
+        if context_id is not None:
+            context = {'context_id': context_id, 'type': context_type if context_type else None,
+                       'role': role if role else None}
+        yield {
+            'id': example_id,
+            'text': text,
+            'created_at': format_created_at(created_at),
+            'intents': [intent_ref_dict(intent) for intent in example_intents],
+            'tags': [tag.to_dict() for tag in example_tags],
+            'metadata': example_metadata,
+            'context': context
+        }
+
+
+def format_created_at(created_at: Union[str, datetime.datetime]) -> str:
+    """created_at as HFExample stores it"""
+    if isinstance(created_at, str):
+        return created_at
+    return created_at.isoformat() + 'Z'
+
+
+def intent_ref_dict(intent: Union[str, humanfirst.objects.HFIntent, humanfirst.objects.HFIntentRef]) -> dict:
+    """HF JSON for a reference to an intent given as an id, HFIntent or HFIntentRef"""
+    if isinstance(intent, str):
+        return {'intent_id': intent}
+    if isinstance(intent, humanfirst.objects.HFIntent):
+        return {'intent_id': intent.id}
+    return {'intent_id': intent.intent_id}
+
+
+def _columns(texts, ids, created_ats, metadata, context_ids, roles, context_type, intents, tags) -> zip:
+    """Zip of the columns as lists with the optional ones filled in, checks lengths and roles"""
+    texts = _to_list(texts)
+    size = len(texts)
+    ids = _to_list(ids)
+    created_ats = _to_list(created_ats)
+    if metadata is None:
+        metadata = [{} for _ in range(size)]
+    if context_ids is None:
+        context_ids = [None] * size
+        roles = [None] * size
+    else:
+        context_ids = _to_list(context_ids)
+        if roles is None or isinstance(roles, str):
+            roles = [roles] * size
+        else:
+            roles = _to_list(roles)
+        # HFContext raises for an unknown type or role, check each distinct one once
+        for role in set(roles):
+            humanfirst.objects.HFContext(None, context_type, role)
+    if intents is None:
+        intents = [[] for _ in range(size)]
+    if tags is None:
+        tags = [[] for _ in range(size)]
+    for name, column in [('ids', ids), ('created_ats', created_ats), ('metadata', metadata),
+                         ('context_ids', context_ids), ('roles', roles), ('intents', intents), ('tags', tags)]:
+        if len(column) != size:
+            raise RuntimeError(f'{name} has {len(column)} values for {size} texts')
+    return zip(texts, ids, created_ats, metadata, context_ids, roles, intents, tags)
+
+
+def _to_list(values: Union[list, pandas.Series]) -> list:
+    """Series and other sequences as a plain list"""
+    if isinstance(values, pandas.Series):
+        return values.to_list()
+    return list(values)
@@ -0,0 +1,91 @@
+"""
+python hf_example_builder_benchmark.py -r 1000000
+
+Compares building HFExamples with df.apply(build_examples, axis=1) as the converters did, a Series per row
+written back to an 'example' column, against hf_example_builder on the same synthetic conversation frame.
+Times building the objects and building the serialised dicts.  Checks all paths give the same JSON.
+
+"""
+# ******************************************************************************************************************120
+
+# standard imports
+import time
+import random
+import datetime
+
+# 3rd party imports
+import click
+import pandas
+import humanfirst
+
+# custom imports
+import hf_example_builder
+
+WORDS = ['the', 'customer', 'asked', 'about', 'their', 'refund', 'order', 'delivery', 'was', 'late', 'and',
+         'agent', 'apologised', 'password', 'reset', 'account', 'locked', 'please', 'help', 'thanks']
+
+@click.command()
+@click.option('-r', '--rows', type=int, required=False, default=1000000, help='Number of synthetic rows')
+@click.option('-c', '--convo_length', type=int, required=False, default=20, help='Utterances per conversation')
+@click.option('-s', '--seed', type=int, required=False, default=42, help='Random seed')
+def main(rows: int, convo_length: int, seed: int) -> None:
+    """Main Function"""
+
+    rng = random.Random(seed)
+    start_date = datetime.datetime(2024, 1, 1)
+    df = pandas.DataFrame({
+        'utterance': [' '.join(rng.choices(WORDS, k=rng.randint(1, 20))) for _ in range(rows)],
+        'convo_id': [f'convo-{i // convo_length}' for i in range(rows)],
+        'idx': [i % convo_length for i in range(rows)],
+        'role': [rng.choice(['client', 'expert']) for _ in range(rows)],
+        'created_at': [start_date + datetime.timedelta(seconds=i) for i in range(rows)]
+    })
+    df['metadata'] = [{'convo_id': convo_id, 'seq': f'{idx:03}'} for convo_id, idx in zip(df['convo_id'], df['idx'])]
+    print(f'Synthetic frame: {df.shape[0]} rows')
+
+    start = time.perf_counter()
+    df_apply = df.set_index(['convo_id', 'idx'], drop=False).apply(build_examples_per_row, axis=1)
+    apply_objects = df_apply['example'].to_list()
+    apply_secs = time.perf_counter() - start
+
+    start = time.perf_counter()
+    apply_dicts = [example.to_dict() for example in apply_objects]
+    apply_dict_secs = apply_secs + time.perf_counter() - start
+
+    ids = [f'example-{convo_id}-{idx}' for convo_id, idx in zip(df['convo_id'].to_list(), df['idx'].to_list())]
+    kwargs = {'metadata': df['metadata'].to_list(), 'context_ids': df['convo_id'], 'roles': df['role']}
+
+    start = time.perf_counter()
+    bulk_objects = list(hf_example_builder.iter_examples(df['utterance'], ids, df['created_at'], **kwargs))
+    bulk_secs = time.perf_counter() - start
+
+    start = time.perf_counter()
+    bulk_dicts = list(hf_example_builder.iter_example_dicts(df['utterance'], ids, df['created_at'], **kwargs))
+    bulk_dict_secs = time.perf_counter() - start
+
+    assert [example.to_dict() for example in bulk_objects] == apply_dicts
+    assert bulk_dicts == apply_dicts
+    print('Outputs identical')
+
+    print(f'{"path":<14} {"seconds":>10} {"rows_per_s":>14}')
+    print(f'{"apply":<14} {apply_secs:>10.3f} {rows/apply_secs:>14,.0f}')
+    print(f'{"bulk":<14} {bulk_secs:>10.3f} {rows/bulk_secs:>14,.0f}')
+    print(f'{"apply_dicts":<14} {apply_dict_secs:>10.3f} {rows/apply_dict_secs:>14,.0f}')
+    print(f'{"bulk_dicts":<14} {bulk_dict_secs:>10.3f} {rows/bulk_dict_secs:>14,.0f}')
+    print(f'Speedup objects: {apply_secs/bulk_secs:.1f}x dicts: {apply_dict_secs/bulk_dict_secs:.1f}x')
+
+def build_examples_per_row(row: pandas.Series) -> pandas.Series:
+    """What the converters did before, an HFExample from each row written back to the row"""
+    row['example'] = humanfirst.objects.HFExample(
+        text=row['utterance'],
+        id=f'example-{row.name[0]}-{row.name[1]}',
+        created_at=row['created_at'],
+        intents=[],
+        tags=[],
+        metadata=row['metadata'],
+        context=humanfirst.objects.HFContext(str(row.name[0]), 'conversation', row['role'])
+    )
+    return row
+
+if __name__ == '__main__':
+    main() # pylint: disable=no-value-for-parameter
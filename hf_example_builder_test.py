@@ -0,0 +1,80 @@
+"""
+Test hf_example_builder.py builds the same examples as constructing HFExample row by row
+
+"""
+# ***************************************************************************80**************************************120
+
+# standard imports
+import datetime
+
+# 3rd party imports
+import pandas
+import pytest
+import humanfirst
+
+# custom imports
+import hf_example_builder # file under test
+
+def _make_frame() -> pandas.DataFrame:
+    """Two short conversations with a mix of datetime and string created_at"""
+    return pandas.DataFrame({
+        "text": ["hello", "hi how can I help", "my order is late", "bonjour"],
+        "convo_id": ["c1", "c1", "c1", "c2"],
+        "idx": [0, 1, 2, 0],
+        "role": ["client", "expert", "client", "client"],
+        "created_at": [datetime.datetime(2024, 5, 13, 9, 15, i) for i in range(4)],
+        "metadata": [{"seq": str(i)} for i in range(4)]
+    })
+
+def _row_by_row(df: pandas.DataFrame, conversation: bool) -> list:
+    """How the converters built them with df.apply(..., axis=1)"""
+    examples = []
+    for _, row in df.iterrows():
+        context = None
+        if conversation:
+            context = humanfirst.objects.HFContext(row["convo_id"], "conversation", row["role"])
+        examples.append(humanfirst.objects.HFExample(
+            text=row["text"],
+            id=f'example-{row["convo_id"]}-{row["idx"]}',
+            created_at=row["created_at"],
+            intents=[],
+            tags=[],
+            metadata=row["metadata"],
+            context=context
+        ))
+    return examples
+
+@pytest.mark.parametrize("conversation", [False, True])
+def test_matches_row_by_row(conversation: bool):
+    """Objects and dicts both serialise to what HFExample gives"""
+    df = _make_frame()
+    ids = [f'example-{c}-{i}' for c, i in zip(df["convo_id"], df["idx"])]
+    kwargs = {"metadata": df["metadata"].to_list()}
+    if conversation:
+        kwargs["context_ids"] = df["convo_id"]
+        kwargs["roles"] = df["role"]
+    expected = [example.to_dict() for example in _row_by_row(df, conversation)]
+    built = [example.to_dict() for example in hf_example_builder.iter_examples(df["text"], ids, df["created_at"],
+                                                                                **kwargs)]
+    assert built == expected
+    assert list(hf_example_builder.iter_example_dicts(df["text"], ids, df["created_at"], **kwargs)) == expected
+
+def test_labelled_intents_and_tags():
+    """Intents as ids or HFIntents and tags come out as HFExample would write them"""
+    workspace = humanfirst.objects.HFWorkspace()
+    intent = workspace.intent(name_or_hier=["billing"])
+    tag = workspace.tag("scenario")
+    expected = humanfirst.objects.HFExample(text="pay my bill", id="example-1", created_at="2024-05-13T09:15:00Z",
+                                            intents=[intent], tags=[tag]).to_dict()
+    for intents in [[intent], [intent.id]]:
+        built = list(hf_example_builder.iter_example_dicts(["pay my bill"], ["example-1"], ["2024-05-13T09:15:00Z"],
+                                                           intents=[intents], tags=[[tag]]))
+        assert built == [expected]
+
+def test_checks_lengths_and_roles():
+    """A short column or a role HFContext would refuse is raised before anything is built"""
+    with pytest.raises(RuntimeError):
+        list(hf_example_builder.iter_example_dicts(["a", "b"], ["1"], ["2024-05-13T09:15:00Z"] * 2))
+    with pytest.raises(humanfirst.objects.HFContextRoleException):
+        list(hf_example_builder.iter_example_dicts(["a"], ["1"], ["2024-05-13T09:15:00Z"],
+                                                   context_ids=["c1"], roles=["customer"]))
@@ -0,0 +1,275 @@
+"""
+hf_json_reader.py
+
+Reads HF workspace JSON one example at a time instead of json.load of the whole file
+followed by pandas.json_normalize, which holds the file twice over.
+
+The examples list is decoded incrementally with the stdlib decoder's raw_decode, one example
+object at a time from a buffer that is refilled as it is used.  Anything else at the top level,
+e.g. intents and tags, ends up in header as it is passed.
+
+Columns are named as json_normalize(sep="-") would name them, e.g. text, created_at,
+context-context_id or metadata-<key>.  Asking for only the columns a script uses means only those
+are materialised, "metadata-*" takes every metadata key.  With no columns every field is flattened
+like json_normalize.  frames yields DataFrames of chunk_size rows for files bigger than memory.
+
+open_input reads through gzip if the name ends .gz, the same as hf_json_writer.open_output.
+
+Usage:
+    df = hf_json_reader.read_examples(filename, columns=["context-context_id", "created_at", "text"],
+                                      dtypes={"context-context_id": str})
+
+    for df in hf_json_reader.iter_frames(filename, columns=["text", "metadata-*"], chunk_size=100000):
+        ...
+
+"""
+# ******************************************************************************************************************120
+
+# standard imports
+import re
+import gzip
+import json
+import itertools
+from typing import IO, Iterator
+
+# 3rd party imports
+import numpy
+import pandas
+
+# custom imports
+import hf_json_writer
+
+EXAMPLES = "examples"
+WILDCARD = "*"
+
+# what json_normalize leaves where an example does not have a field, an explicit null stays None
+MISSING = numpy.nan
+
+# the decoder does not skip leading whitespace itself
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+
+def open_input(filename: str) -> IO:
+    """Open filename to read text, through gzip if it ends .gz"""
+    if filename.endswith(hf_json_writer.GZIP_SUFFIX):
+        return gzip.open(filename, mode='rt', encoding='utf8')
+    return open(filename, mode='r', encoding='utf8')
+
+
+def iter_examples(filename: str) -> Iterator[dict]:
+    """Each example dict in the file in order"""
+    with open_input(filename) as file_in:
+        yield from HFJsonStreamReader(file_in).examples()
+
+
+def iter_frames(filename: str, columns: list = None, chunk_size: int = 100000, sep: str = "-",
+                dtypes: dict = None) -> Iterator[pandas.DataFrame]:
+    """DataFrames of up to chunk_size examples projected to columns"""
+    with open_input(filename) as file_in:
+        yield from HFJsonStreamReader(file_in).frames(columns=columns, chunk_size=chunk_size, sep=sep, dtypes=dtypes)
+
+
+def read_examples(filename: str, columns: list = None, sep: str = "-", dtypes: dict = None) -> pandas.DataFrame:
+    """All the examples in one DataFrame projected to columns"""
+    with open_input(filename) as file_in:
+        return HFJsonStreamReader(file_in).read(columns=columns, sep=sep, dtypes=dtypes)
+
+
+class HFJsonStreamReader:
+    """Streams the examples out of an HF workspace JSON text file,
+    the other top level values are kept in header as they are read and keys has them all in file order"""
+
+    def __init__(self, file_in: IO, read_size: int = 1 << 20):
+        self.file_in = file_in
+        self.read_size = read_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        self.header = {}
+        self.keys = []
+
+    def examples(self) -> Iterator[dict]:
+        """Each example dict in order, header is complete once this is exhausted"""
+        self._expect('{')
+        while True:
+            char = self._next_char()
+            if char == '}':
+                self.pos = self.pos + 1
+                return
+            if char == ',':
+                self.pos = self.pos + 1
+                continue
+            key = self._decode()
+            self._expect(':')
+            self.keys.append(key)
+            if key == EXAMPLES:
+                yield from self._array()
+            else:
+                self.header[key] = self._decode()
+
+    def frames(self, columns: list = None, chunk_size: int = 100000, sep: str = "-",
+               dtypes: dict = None) -> Iterator[pandas.DataFrame]:
+        """DataFrames of up to chunk_size examples, an empty one if there are none"""
+        examples = self.examples()
+        first = True
+        while True:
+            df = to_frame(itertools.islice(examples, chunk_size), columns=columns, sep=sep, dtypes=dtypes)
+            if len(df) == 0 and not first:
+                return
+            first = False
+            yield df
+            if len(df) < chunk_size:
+                return
+
+    def read(self, columns: list = None, sep: str = "-", dtypes: dict = None) -> pandas.DataFrame:
+        """All the examples in one DataFrame"""
+        return to_frame(self.examples(), columns=columns, sep=sep, dtypes=dtypes)
+
+    def _array(self) -> Iterator[dict]:
+        """Decode the values of the list one at a time"""
+        self._expect('[')
+        while True:
+            char = self._next_char()
+            if char == ']':
+                self.pos = self.pos + 1
+                return
+            if char == ',':
+                self.pos = self.pos + 1
+                continue
+            yield self._decode()
+
+    def _decode(self):
+        """Decode the next value, reading more until it is all in the buffer"""
+        self._next_char()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+                self._fill()
+                continue
+            # a number running to the end of the buffer may carry on in the next read
+            if end == len(self.buffer) and not self.eof:
+                self._fill()
+                continue
+            self.pos = end
+            return value
+
+    def _expect(self, char: str):
+        """Step over char which must be next"""
+        found = self._next_char()
+        if found != char:
+            raise json.JSONDecodeError(f"Expecting '{char}'", self.buffer, self.pos)
+        self.pos = self.pos + 1
+
+    def _next_char(self) -> str:
+        """Skip whitespace and return the next character without consuming it"""
+        while True:
+            self.pos = WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if self.eof:
+                raise json.JSONDecodeError("Unexpected end of file", self.buffer, self.pos)
+            self._fill()
+
+    def _fill(self):
+        """Drop what has been used and read more, at least as much again as is left so a value
+        bigger than read_size is not decoded over and over"""
+        remaining = self.buffer[self.pos:]
+        text = self.file_in.read(max(self.read_size, len(remaining)))
+        if text == '':
+            self.eof = True
+        self.buffer = remaining + text
+        self.pos = 0
+
+
+def to_frame(examples, columns: list = None, sep: str = "-", dtypes: dict = None) -> pandas.DataFrame:
+    """DataFrame of example dicts with just columns, missing values are NaN"""
+    if columns is None:
+        values = _from_rows(_flatten(example, sep) for example in examples)
+        df = pandas.DataFrame(values, columns=list(values))
+    elif any(column.endswith(sep + WILDCARD) for column in columns):
+        values = _from_rows(_project_row(example, columns, sep) for example in examples)
+        df = pandas.DataFrame(values, columns=_expand_columns(list(values), columns, sep))
+    else:
+        values = {column: [] for column in columns}
+        appends = [(column, values[column].append) for column in columns]
+        for example in examples:
+            for column, append in appends:
+                append(get_field(example, column, sep))
+        df = pandas.DataFrame(values, columns=columns)
+    if dtypes:
+        df = df.astype({column: dtype for column, dtype in dtypes.items() if column in df.columns})
+    return df
+
+
+def get_field(example: dict, column: str, sep: str = "-"):
+    """Value for a json_normalize style column name or MISSING, keys containing sep are matched whole first"""
+    value = example.get(column)
+    if value is not None or column in example:
+        return value
+    head, _, rest = column.partition(sep)
+    if rest != '' and isinstance(example.get(head), dict):
+        return get_field(example[head], rest, sep)
+    return MISSING
+
+
+def _from_rows(rows: Iterator[dict]) -> dict:
+    """Column lists from row dicts in the order keys are first seen, MISSING where a row has no value"""
+    values = {}
+    count = 0
+    for row in rows:
+        for key, value in row.items():
+            column = values.get(key)
+            if column is None:
+                column = values[key] = [MISSING] * count
+            column.append(value)
+        count = count + 1
+        if len(row) < len(values):
+            for column in values.values():
+                if len(column) < count:
+                    column.append(MISSING)
+    return values
+
+
+def _project_row(example: dict, columns: list, sep: str) -> dict:
+    """Row dict of the columns with any parent-* expanded to all its keys"""
+    row = {}
+    for column in columns:
+        if column.endswith(sep + WILDCARD):
+            parent = column[:-len(sep + WILDCARD)]
+            value = get_field(example, parent, sep)
+            if isinstance(value, dict):
+                row.update(_flatten(value, sep, parent + sep))
+        else:
+            row[column] = get_field(example, column, sep)
+    return row
+
+
+def _expand_columns(found: list, columns: list, sep: str) -> list:
+    """Column order as asked for with each wildcard replaced by the columns found under it"""
+    expanded = []
+    for column in columns:
+        if column.endswith(sep + WILDCARD):
+            prefix = column[:-len(WILDCARD)]
+            expanded.extend(name for name in found if name.startswith(prefix) and name not in columns)
+        else:
+            expanded.append(column)
+    return expanded
+
+
+def _flatten(value: dict, sep: str, prefix: str = '') -> dict:
+    """Nested dicts to sep joined keys like json_normalize, lists are left as they are"""
+    flat = {}
+    nested = []
+    for key, item in value.items():
+        if isinstance(item, dict):
+            nested.append((key, item))
+        else:
+            flat[f'{prefix}{key}'] = item
+    # json_normalize puts the flattened keys after the others
+    for key, item in nested:
+        flat.update(_flatten(item, sep, f'{prefix}{key}{sep}'))
+    return flat
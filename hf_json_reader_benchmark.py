@@ -0,0 +1,54 @@
+"""
+python hf_json_reader_benchmark.py -f ./data/hf_json_writer_benchmark.json -m stream
+
+Time and peak RSS of getting the conversation columns out of an HF JSON file with hf_json_reader
+against json.load followed by pandas.json_normalize.  Make a file with hf_json_writer_benchmark.py.
+Peak RSS only ever grows within a process so run each mode separately and compare.
+
+"""
+# ******************************************************************************************************************120
+
+# standard imports
+import json
+import time
+import resource
+
+# 3rd party imports
+import click
+import pandas
+
+# custom imports
+import hf_json_reader
+
+COLUMNS = ["context-context_id", "created_at", "text", "metadata-*"]
+
+@click.command()
+@click.option('-f', '--filename', type=str, required=True, help='HF JSON file, .gz to read gzip compressed')
+@click.option('-m', '--mode', type=click.Choice(['load', 'stream', 'frames']), default='stream',
+              help='json.load and json_normalize, read_examples of the columns or iter_frames of them')
+@click.option('-c', '--chunk_size', type=int, required=False, default=100000, help='Rows per frame')
+def main(filename: str, mode: str, chunk_size: int) -> None:
+    """Main Function"""
+
+    start = time.perf_counter()
+    if mode == 'load':
+        with hf_json_reader.open_input(filename) as file_in:
+            data = json.load(file_in)
+        df = pandas.json_normalize(data["examples"], sep="-")
+        rows = len(df)
+    elif mode == 'stream':
+        df = hf_json_reader.read_examples(filename, columns=COLUMNS)
+        rows = len(df)
+    else:
+        rows = 0
+        for df in hf_json_reader.iter_frames(filename, columns=COLUMNS, chunk_size=chunk_size):
+            rows = rows + len(df)
+    secs = time.perf_counter() - start
+
+    # ru_maxrss is in kilobytes on linux
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f'{"mode":<10} {"rows":>12} {"seconds":>10} {"peak_rss_mb":>12}')
+    print(f'{mode:<10} {rows:>12,} {secs:>10.3f} {peak_mb:>12,.0f}')
+
+if __name__ == '__main__':
+    main() # pylint: disable=no-value-for-parameter
@@ -0,0 +1,82 @@
+"""
+Test hf_json_reader.py reads the same examples as json.load and json_normalize a piece at a time
+
+"""
+# ***************************************************************************80**************************************120
+
+# standard imports
+import io
+import json
+import gzip
+
+# 3rd party imports
+import pytest
+import pandas
+
+# custom imports
+import hf_json_reader # file under test
+
+def _workspace() -> dict:
+    """Examples with missing and extra fields, escapes, unicode and numbers, intents after the examples"""
+    examples = []
+    for i in range(23):
+        example = {
+            "id": f"example-{i}",
+            "text": f"utterance {i} café \"quoted\" \\ {'x' * (i * 7)}",
+            "created_at": f"2024-05-13T09:15:{i:02}Z",
+            "context": {"context_id": str(i // 4), "type": "conversation", "role": "client"},
+            "metadata": {"seq": str(i), "score": i * 1234567}
+        }
+        if i % 3 == 0:
+            example["metadata"]["call-reason"] = "billing"
+            example["intents"] = [{"intent_id": "intent-1"}]
+        if i % 5 == 0:
+            del example["context"]
+        examples.append(example)
+    return {"$schema": "schema", "examples": examples, "intents": [{"id": "intent-1", "name": "billing"}], "n": 12345}
+
+@pytest.mark.parametrize("read_size", [1, 7, 1 << 20])
+@pytest.mark.parametrize("indent", [None, 2])
+def test_matches_json_normalize(read_size: int, indent: int):
+    """Every column as json_normalize names them, with the rest of the file in header"""
+    data = _workspace()
+    reader = hf_json_reader.HFJsonStreamReader(io.StringIO(json.dumps(data, indent=indent)), read_size=read_size)
+    df = reader.read()
+    pandas.testing.assert_frame_equal(df, pandas.json_normalize(data["examples"], sep="-"), check_dtype=False)
+    assert reader.header == {"$schema": "schema", "intents": data["intents"], "n": 12345}
+    assert reader.keys == ["$schema", "examples", "intents", "n"]
+
+def test_projection_frames_and_gzip(tmp_path):
+    """Only the columns asked for in chunks, metadata-* expands, keys containing the separator are found"""
+    data = _workspace()
+    filename = str(tmp_path / "workspace.json.gz")
+    with gzip.open(filename, mode="wt", encoding="utf8") as file_out:
+        json.dump(data, file_out)
+
+    columns = ["context-context_id", "text", "metadata-call-reason", "metadata-*"]
+    frames = list(hf_json_reader.iter_frames(filename, columns=columns, chunk_size=10,
+                                             dtypes={"context-context_id": str}))
+    assert [len(df) for df in frames] == [10, 10, 3]
+    df = pandas.concat(frames, ignore_index=True)
+    assert df.columns.to_list() == ["context-context_id", "text", "metadata-call-reason", "metadata-seq",
+                                    "metadata-score"]
+    assert df["context-context_id"].isna().to_list() == [i % 5 == 0 for i in range(23)]
+    assert df["context-context_id"][1] == "0"
+    assert df["metadata-call-reason"].notna().to_list() == [i % 3 == 0 for i in range(23)]
+    assert df["metadata-score"].to_list() == [i * 1234567 for i in range(23)]
+    assert df["text"].to_list() == [example["text"] for example in data["examples"]]
+
+    assert [example["id"] for example in hf_json_reader.iter_examples(filename)] == [
+        f"example-{i}" for i in range(23)]
+
+def test_empty_and_truncated(tmp_path):
+    """No examples gives the columns with no rows, a cut off file raises"""
+    filename = str(tmp_path / "empty.json")
+    with open(filename, mode="w", encoding="utf8") as file_out:
+        json.dump({"$schema": "schema", "examples": []}, file_out)
+    frames = list(hf_json_reader.iter_frames(filename, columns=["text", "created_at"]))
+    assert len(frames) == 1 and frames[0].columns.to_list() == ["text", "created_at"] and len(frames[0]) == 0
+
+    truncated = json.dumps(_workspace())[:-200]
+    with pytest.raises(json.JSONDecodeError):
+        hf_json_reader.HFJsonStreamReader(io.StringIO(truncated), read_size=64).read()
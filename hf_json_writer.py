@@ -0,0 +1,168 @@
+"""
+hf_json_writer.py
+
+Writes HF workspace JSON one example at a time instead of building an HFWorkspace
+and serialising it all at the end, so memory does not grow with the number of examples.
+
+For the same examples in the same order the output is byte for byte what
+HFWorkspace.write_json produces.  Note write_json sorts examples by created_at,
+whereas this writes them in the order they are given.
+
+Where ids repeat the workspace keeps the last example's content in the first one's place,
+keep_last_by_id does the same to a list before it is sorted and written.  The writer's own
+dedupe can only keep the first example written for an id, so it differs from the workspace
+whenever repeats differ in content, e.g. the same text at another created_at.
+
+open_output opens the file to write to, gzip compressed if asked or the name ends .gz,
+so large uploads never exist uncompressed on disk either.  open_output_atomic does the same
+via a .tmp file renamed into place when the writing is complete.
+
+Usage:
+    with hf_json_writer.open_output_atomic(filename_out, compress=gzip_output) as file_out:
+        with hf_json_writer.HFJsonStreamWriter(file_out) as writer:
+            for example in examples:
+                writer.write_example(example)
+
+"""
+# ******************************************************************************************************************120
+
+# standard imports
+import os
+import gzip
+import json
+import contextlib
+from typing import IO, Iterable, Iterator
+
+# 3rd party imports
+import humanfirst
+
+HF_JSON_SCHEMA = "https://docs.humanfirst.ai/hf-json-schema.json"
+GZIP_SUFFIX = ".gz"
+
+
+def open_output(filename: str, compress: bool = False) -> IO:
+    """Open filename to write text, through gzip if compress or it ends .gz"""
+    if compress or filename.endswith(GZIP_SUFFIX):
+        return gzip.open(filename, mode='wt', encoding='utf8')
+    return open(filename, mode='w', encoding='utf8')
+
+
+@contextlib.contextmanager
+def open_output_atomic(filename: str, compress: bool = False) -> Iterator[IO]:
+    """open_output to filename.tmp renamed to filename once closed without error,
+    so an interrupted run never leaves a partial file that looks newer than its input"""
+    tmp_filename = filename + '.tmp'
+    try:
+        with open_output(tmp_filename, compress=compress or filename.endswith(GZIP_SUFFIX)) as file_out:
+            yield file_out
+    except BaseException:
+        if os.path.isfile(tmp_filename):
+            os.remove(tmp_filename)
+        raise
+    os.replace(tmp_filename, filename)
+
+
+def gzip_filename(filename: str, compress: bool) -> str:
+    """filename with .gz appended if compressing and not already there"""
+    if compress and not filename.endswith(GZIP_SUFFIX):
+        return filename + GZIP_SUFFIX
+    return filename
+
+
+def keep_last_by_id(examples: Iterable[humanfirst.objects.HFExample]) -> list:
+    """One example per id as HFWorkspace.add_example keeps them, the last content at the first position"""
+    by_id = {}
+    for example in examples:
+        by_id[example.id] = example
+    return list(by_id.values())
+
+
+class HFJsonStreamWriter:
+    """Streams an unlabelled HF workspace JSON envelope and its examples to an open text file.
+
+    If dedupe is set examples with an id already written are skipped, this keeps a set
+    of the ids written so far.  That is the first not the last example for an id, see keep_last_by_id.
+    Leaving the with block on an exception leaves the envelope open, so use it within open_output_atomic."""
+
+    def __init__(self, output: IO, indent: int = 2, dedupe: bool = False):
+        self.output = output
+        self.indent = indent
+        self.dedupe = dedupe
+        self.ids = set()
+        self.count = 0
+        self.started = False
+        self.closed = False
+
+    def __enter__(self) -> 'HFJsonStreamWriter':
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # closing the envelope after a failure would make a truncated list load as valid JSON
+        if exc_type is None:
+            self.close()
+
+    def start(self):
+        """Write the opening of the envelope up to the examples list"""
+        if self.started:
+            return
+        self.started = True
+        if self.indent is None:
+            self.output.write('{' + f'"$schema": {json.dumps(HF_JSON_SCHEMA)}, "examples": [')
+        else:
+            pad = ' ' * self.indent
+            self.output.write('{\n' + f'{pad}"$schema": {json.dumps(HF_JSON_SCHEMA)},\n{pad}"examples": [')
+
+    def write_example(self, example: humanfirst.objects.HFExample):
+        """Write a single HFExample"""
+        self.write_example_dict(example.to_dict())
+
+    def write_examples(self, examples: Iterable[humanfirst.objects.HFExample]) -> int:
+        """Write each of an iterable of HFExamples returning how many were written"""
+        before = self.count
+        for example in examples:
+            self.write_example(example)
+        return self.count - before
+
+    def write_example_dicts(self, examples: Iterable[dict]) -> int:
+        """Write each of an iterable of HF JSON example dicts returning how many were written"""
+        before = self.count
+        for example in examples:
+            self.write_example_dict(example)
+        return self.count - before
+
+    def write_example_dict(self, example: dict):
+        """Write an example which is already a dict in HF JSON format"""
+        if not self.started:
+            self.start()
+        if self.dedupe:
+            if example["id"] in self.ids:
+                return
+            self.ids.add(example["id"])
+
+        if self.indent is None:
+            if self.count > 0:
+                self.output.write(', ')
+            self.output.write(json.dumps(example))
+        else:
+            # list items sit two levels deep in the envelope
+            pad = ' ' * (self.indent * 2)
+            text = json.dumps(example, indent=self.indent)
+            if self.count > 0:
+                self.output.write(',')
+            self.output.write('\n' + pad + text.replace('\n', '\n' + pad))
+        self.count = self.count + 1
+
+    def close(self):
+        """Close the examples list and the envelope, leaves the underlying file open"""
+        if self.closed:
+            return
+        if not self.started:
+            self.start()
+        self.closed = True
+        if self.indent is None:
+            self.output.write(']}\n')
+        elif self.count == 0:
+            self.output.write(']\n}')
+        else:
+            self.output.write('\n' + ' ' * self.indent + ']\n}')
@@ -0,0 +1,82 @@
+"""
+python hf_json_writer_benchmark.py -r 10000000 -m stream -g
+
+Peak RSS of writing synthetic unlabelled conversation examples with HFJsonStreamWriter
+against adding them all to an HFWorkspace and calling write_json.
+Peak RSS only ever grows within a process so run each mode separately and compare.
+
+"""
+# ******************************************************************************************************************120
+
+# standard imports
+import os
+import time
+import resource
+import datetime
+from typing import Iterator
+
+# 3rd party imports
+import click
+import humanfirst
+
+# custom imports
+import hf_json_writer
+import hf_example_builder
+
+@click.command()
+@click.option('-r', '--rows', type=int, required=False, default=1000000, help='Number of synthetic examples')
+@click.option('-m', '--mode', type=click.Choice(['stream', 'workspace']), default='stream',
+              help='Stream with HFJsonStreamWriter or build an HFWorkspace')
+@click.option('-g', '--gzip_output', is_flag=True, type=bool, default=False, help='Stream gzip compressed')
+@click.option('-o', '--output', type=str, required=False, default='./data/hf_json_writer_benchmark.json',
+              help='Output file')
+def main(rows: int, mode: str, gzip_output: bool, output: str) -> None:
+    """Main Function"""
+
+    start = time.perf_counter()
+    if mode == 'stream':
+        output = hf_json_writer.gzip_filename(output, gzip_output)
+        with hf_json_writer.open_output(output) as file_out:
+            with hf_json_writer.HFJsonStreamWriter(file_out) as writer:
+                for chunk in iter_chunks(rows):
+                    writer.write_example_dicts(chunk)
+    else:
+        workspace = humanfirst.objects.HFWorkspace()
+        for chunk in iter_chunks(rows):
+            for example in to_hf_examples(chunk):
+                workspace.add_example(example)
+        with open(output, mode='w', encoding='utf8') as file_out:
+            workspace.write_json(file_out)
+    secs = time.perf_counter() - start
+
+    # ru_maxrss is in kilobytes on linux
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f'{"mode":<10} {"rows":>12} {"seconds":>10} {"peak_rss_mb":>12} {"file_mb":>10}')
+    print(f'{mode:<10} {rows:>12,} {secs:>10.3f} {peak_mb:>12,.0f} {os.path.getsize(output)/1024/1024:>10,.0f}')
+
+def iter_chunks(rows: int, chunksize: int = 10000) -> Iterator[Iterator[dict]]:
+    """Example dicts a chunk at a time, 20 utterance conversations a second apart"""
+    start_date = datetime.datetime(2024, 1, 1)
+    for chunk_start in range(0, rows, chunksize):
+        positions = range(chunk_start, min(rows, chunk_start + chunksize))
+        convo_ids = [f'convo-{i // 20}' for i in positions]
+        yield hf_example_builder.iter_example_dicts(
+            [f'utterance {i} about my order' for i in positions],
+            [f'example-{convo_id}-{i % 20}' for convo_id, i in zip(convo_ids, positions)],
+            [start_date + datetime.timedelta(seconds=i) for i in positions],
+            metadata=[{'seq': f'{i % 20:03}'} for i in positions],
+            context_ids=convo_ids,
+            roles=['client' if i % 2 == 0 else 'expert' for i in positions])
+
+def to_hf_examples(chunk: Iterator[dict]) -> Iterator[humanfirst.objects.HFExample]:
+    """The same examples as HFExamples for the workspace"""
+    for example in chunk:
+        yield humanfirst.objects.HFExample(
+            text=example['text'],
+            id=example['id'],
+            created_at=example['created_at'],
+            metadata=example['metadata'],
+            context=humanfirst.objects.HFContext(**example['context']))
+
+if __name__ == '__main__':
+    main() # pylint: disable=no-value-for-parameter
@@ -0,0 +1,134 @@
+"""
+Test hf_json_writer.py streams the same JSON as HFWorkspace.write_json
+
+"""
+# ***************************************************************************80**************************************120
+
+# standard imports
+import io
+import os
+import gzip
+import json
+
+# 3rd party imports
+import pytest
+import humanfirst
+
+# custom imports
+import hf_json_writer # file under test
+
+def _make_examples(n: int) -> list:
+    """Conversation examples already in created_at order"""
+    return [
+        humanfirst.objects.HFExample(
+            text=f"utterance {i} café",
+            id=f"example-convo-{i}",
+            created_at=f"2024-05-13T09:15:0{i}",
+            metadata={"myid": "convo"},
+            context=humanfirst.objects.HFContext(context_id="convo", type="conversation", role="client")
+        ) for i in range(n)
+    ]
+
+@pytest.mark.parametrize("n", [0, 1, 5])
+@pytest.mark.parametrize("jsonl", [False, True])
+def test_stream_matches_write_json(n: int, jsonl: bool):
+    """Same bytes as the workspace for examples in created_at order"""
+    examples = _make_examples(n)
+    workspace = humanfirst.objects.HFWorkspace()
+    for example in examples:
+        workspace.add_example(example)
+    expected = io.StringIO()
+    workspace.write_json(expected, jsonl=jsonl)
+
+    actual = io.StringIO()
+    with hf_json_writer.HFJsonStreamWriter(actual, indent=None if jsonl else 2) as writer:
+        assert writer.write_examples(examples) == n
+    assert actual.getvalue() == expected.getvalue()
+
+def test_dedupe_skips_repeated_ids():
+    """Only the first example with an id is written"""
+    examples = _make_examples(2)
+    actual = io.StringIO()
+    with hf_json_writer.HFJsonStreamWriter(actual, dedupe=True) as writer:
+        writer.write_examples(examples + examples)
+    assert writer.count == 2
+
+def test_repeated_ids_keep_last_like_workspace():
+    """keep_last_by_id then sorting gives the workspace's bytes, writer dedupe keeps the first instead"""
+    examples = _make_examples(3)
+    # same id as the first at a later time with other metadata
+    repeat = humanfirst.objects.HFExample(
+        text=examples[0].text, id=examples[0].id, created_at="2024-05-13T09:15:09",
+        metadata={"myid": "repeat"},
+        context=humanfirst.objects.HFContext(context_id="convo", type="conversation", role="client"))
+    workspace = humanfirst.objects.HFWorkspace()
+    for example in examples + [repeat]:
+        workspace.add_example(example)
+    expected = io.StringIO()
+    workspace.write_json(expected)
+
+    kept = hf_json_writer.keep_last_by_id(examples + [repeat])
+    kept.sort(key=lambda example: example.created_at)
+    actual = io.StringIO()
+    with hf_json_writer.HFJsonStreamWriter(actual) as writer:
+        writer.write_examples(kept)
+    assert actual.getvalue() == expected.getvalue()
+
+    first = io.StringIO()
+    with hf_json_writer.HFJsonStreamWriter(first, dedupe=True) as writer:
+        writer.write_examples(examples + [repeat])
+    assert first.getvalue() != expected.getvalue()
+    assert '"repeat"' not in first.getvalue()
+
+def test_gzip_output_and_dicts(tmp_path):
+    """A .gz name or compress gives the same JSON gzipped, dicts write the same as examples"""
+    examples = _make_examples(3)
+    expected = io.StringIO()
+    with hf_json_writer.HFJsonStreamWriter(expected) as writer:
+        writer.write_examples(examples)
+
+    filename = hf_json_writer.gzip_filename(str(tmp_path / "out.json"), compress=True)
+    assert filename.endswith(".json.gz")
+    with hf_json_writer.open_output(filename) as file_out:
+        with hf_json_writer.HFJsonStreamWriter(file_out) as writer:
+            assert writer.write_example_dicts(example.to_dict() for example in examples) == 3
+    with gzip.open(filename, mode="rt", encoding="utf8") as file_in:
+        assert file_in.read() == expected.getvalue()
+
+def test_atomic_output_only_renames_complete_files(tmp_path):
+    """The .gz name still compresses, a write that raises leaves neither the file nor the .tmp"""
+    examples = _make_examples(3)
+    filename = str(tmp_path / "out.json.gz")
+    with hf_json_writer.open_output_atomic(filename) as file_out:
+        with hf_json_writer.HFJsonStreamWriter(file_out) as writer:
+            writer.write_examples(examples)
+    with gzip.open(filename, mode="rt", encoding="utf8") as file_in:
+        assert len(file_in.read()) > 0
+
+    failed = str(tmp_path / "failed.json")
+    with pytest.raises(RuntimeError):
+        with hf_json_writer.open_output_atomic(failed) as file_out:
+            file_out.write('{"examples": [')
+            raise RuntimeError("killed")
+    assert sorted(os.listdir(tmp_path)) == ["out.json.gz"]
+
+def test_failing_generator_leaves_no_output(tmp_path):
+    """An exception part way through the examples neither closes the envelope nor leaves a file"""
+    def failing_examples():
+        yield from _make_examples(2)
+        raise RuntimeError("killed")
+
+    actual = io.StringIO()
+    with pytest.raises(RuntimeError):
+        with hf_json_writer.HFJsonStreamWriter(actual) as writer:
+            writer.write_examples(failing_examples())
+    assert writer.count == 2
+    with pytest.raises(json.JSONDecodeError):
+        json.loads(actual.getvalue())
+
+    filename = str(tmp_path / "out.json")
+    with pytest.raises(RuntimeError):
+        with hf_json_writer.open_output_atomic(filename) as file_out:
+            with hf_json_writer.HFJsonStreamWriter(file_out) as writer:
+                writer.write_examples(failing_examples())
+    assert not os.listdir(tmp_path)
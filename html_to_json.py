@@ -15,10 +15,10 @@ import json
 # 3rd party imports
 import click
 import pandas
-import tiktoken
 
 # custom imports
 import humanfirst
+import token_truncation
 
 @click.command()
 @click.option('-d', '--directory', type=str, required=True, help='Directory with html files in')
@@ -54,12 +54,10 @@ def main(directory: str,
                           columns=["filename","contents"])
     df = df.fillna('')
     
-    # embed the records
-    embeddings = tiktoken.encoding_for_model("gpt-4o")
-    df["embedded"] = df["contents"].apply(embeddings.encode)
-    
-    # count them
-    df["original_token_count"] = df["embedded"].apply(len)
+    # tokenise and truncate the records in one batch with a shared encoder
+    contents, original_counts, truncated_counts = token_truncation.truncate_texts(
+        df["contents"].to_list(), truncate, model="gpt-4o")
+    df["original_token_count"] = original_counts
     
     # print some info
     print(f'Max tokens is: {df["original_token_count"].max()}')
@@ -67,15 +65,11 @@ def main(directory: str,
     
     # truncate where necessary 
     df["truncated_record"] = df["original_token_count"] >= truncate
-    df["embedded_truncated"] = df["embedded"].apply(lambda x: x[0:truncate])
-    df["truncated_token_count"] = df["embedded_truncated"].apply(len)
-    df["contents"] = df["embedded_truncated"].apply(embeddings.decode)
+    df["truncated_token_count"] = truncated_counts
+    df["contents"] = contents
     
     # summarise truncation
     print(df[["original_token_count","truncated_record"]].groupby("truncated_record").count())
-    
-    # drop embeddings
-    df = df.drop(columns=["embedded","embedded_truncated"])
       
     # build examples
     workspace = humanfirst.objects.HFWorkspace()
@@ -18,7 +18,6 @@ https://github.com/xliuhw/NLU-Evaluation-Data
 
 # standard imports
 import datetime
-import copy
 import re
 
 # third party imports
@@ -27,6 +26,9 @@ import numpy
 import click
 import humanfirst
 
+# custom imports
+import hf_example_builder
+
 
 # define regex
 re_deannotate = re.compile(r"\[\s*([A-Za-z0-9-_]+)\s*:\s*([A-Za-z0-9@-_’'\. ]+)\]")
@@ -119,8 +121,8 @@ def main(name: str, sample: int, workspace: str):
     after = df.shape[0]
     print(f'After deduplication {after}')
 
-    # create example for each row.
-    df = df.apply(create_example,axis=1,args=[unlabelled_workspace,labelled_workspace])
+    # create examples for every row.
+    create_examples(df,unlabelled_workspace,labelled_workspace)
 
     # write unlabelled
     with open(f'./data/{name}_unlabelled.json', 'w', encoding='utf8') as file_out:
@@ -130,59 +132,50 @@ def main(name: str, sample: int, workspace: str):
     with open(f'./data/{name}_labelled.json', 'w', encoding='utf8') as file_out:
         labelled_workspace.write_json(file_out)
 
-def create_example(row: pandas.Series,
-                   unlabelled_workspace: humanfirst.objects.HFWorkspace,
-                   labelled_workspace: humanfirst.objects.HFWorkspace) -> list:
-    '''Parse a single utterance to an example'''
+def create_examples(df: pandas.DataFrame,
+                    unlabelled_workspace: humanfirst.objects.HFWorkspace,
+                    labelled_workspace: humanfirst.objects.HFWorkspace):
+    '''Parse every utterance to an unlabelled and a labelled example working on whole columns'''
 
     # HFMetadata just dict[str,all]
     # extract these keys into the metadata dict
     keys_to_extract = ['userid', 'answerid','scenario','intent','status','notes','suggested_entities','question']
-    convo_metadata_dict = {}
-    for key in keys_to_extract:
-        if row[key]:
-            convo_metadata_dict[key] = str(row[key])
-        else:
-            convo_metadata_dict[key] = ''
-
-    # Tags
-    tags=[]
+    columns = [[str(value) if value else '' for value in df[key].to_list()] for key in keys_to_extract]
+    metadata = [dict(zip(keys_to_extract, values)) for values in zip(*columns)]
+
+    # Tags - get or create each distinct tag once rather than per row
     tags_to_label = ['scenario'] # 'scenario_subflow' - removed as too noisy with speaker role and seq
+    tag_columns = []
     for tag in tags_to_label:
-        tags.append(unlabelled_workspace.tag(row[tag]))
-        labelled_workspace.tag(row[tag])
+        tag_objects = {}
+        for name in df[tag].unique():
+            tag_objects[name] = unlabelled_workspace.tag(name)
+            labelled_workspace.tag(name)
+        tag_columns.append(df[tag].map(tag_objects).to_list())
+    tags = [list(row_tags) for row_tags in zip(*tag_columns)]
 
     # Context with the conversation_id linking utterances (here none just role: client
-    context = humanfirst.objects.HFContext(f'convo-{row["answerid"]}','conversation', 'client')
-
-    # Create the unlabelled example without intents
-    example = humanfirst.objects.HFExample(
-        text=row['deannotated_text'],
-        id=f'example-unlabelled-{row["uid"]}',
-        created_at=row['created_at'],
-        intents=[],
-        tags=tags,
-        metadata=copy.deepcopy(convo_metadata_dict),
-        context=context
-    )
-
-    # add to the unlabelled_workspace
-    unlabelled_workspace.add_example(example)
+    context_ids = [f'convo-{answerid}' for answerid in df["answerid"].to_list()]
+    uids = df["uid"].to_list()
+
+    # Create the unlabelled examples without intents and add to the unlabelled_workspace
+    unlabelled_examples = hf_example_builder.iter_examples(
+        df['deannotated_text'], [f'example-unlabelled-{uid}' for uid in uids], df['created_at'],
+        metadata=metadata, context_ids=context_ids, roles='client', tags=tags)
+    for example in unlabelled_examples:
+        unlabelled_workspace.add_example(example)
 
     # get or create the intent in the labelled_workspace using parent as scenario and child as intent
-    # i.e alarm/query, alarm/remove with no metadata
-    intents = [labelled_workspace.intent(name_or_hier=[row['scenario_intent']])]
-
-    labelled_example = humanfirst.objects.HFExample(
-        text=row["deannotated_text"],
-        id=f'example-labelled-{row["uid"]}',
-        created_at=row['created_at'],
-        intents=intents,
-        tags=[],
-        metadata={},
-        context={}
-    )
-    labelled_workspace.add_example(labelled_example)
+    # i.e alarm/query, alarm/remove with no metadata, once per distinct intent
+    intent_objects = {}
+    for name in df['scenario_intent'].unique():
+        intent_objects[name] = labelled_workspace.intent(name_or_hier=[name])
+    intents = [[intent] for intent in df['scenario_intent'].map(intent_objects).to_list()]
+
+    labelled_examples = hf_example_builder.iter_examples(
+        df["deannotated_text"], [f'example-labelled-{uid}' for uid in uids], df['created_at'], intents=intents)
+    for example in labelled_examples:
+        labelled_workspace.add_example(example)
 
 def deannotate(text: str) -> str:
     """Deannotates a given string"""
@@ -0,0 +1,124 @@
+"""
+llm_cache.py
+
+Content addressed local cache of LLM responses so re-running a script with --rewrite,
+or after changing an unrelated setting, doesn't pay for the same prompt twice.
+
+Responses are keyed by a sha256 of model, temperature, max_tokens, any extra call settings and the prompt,
+and held in a SQLite file.  Once the file holds more than max_megabytes of responses the least recently used
+are evicted.  A hit returns without any network call and is counted along with the tokens and dollars saved.
+
+Usage:
+    cache = llm_cache.LLMResponseCache('./data/llm_cache.sqlite')
+    cached = cache.get(model, prompt, temperature, max_tokens)
+    if cached is None:
+        response = openai.ChatCompletion.create(...)
+        cache.put(model, prompt, temperature, max_tokens,
+                  response.choices[0].message.content, response.usage.total_tokens)
+    print(cache.summary())
+
+"""
+# ******************************************************************************************************************120
+
+# standard imports
+import time
+import hashlib
+import sqlite3
+import threading
+from typing import Union
+
+# Approximate blended dollars per 1,000 tokens used to estimate savings, unknown models count as 0
+DOLLARS_PER_1K_TOKENS = {
+    "gpt-3.5-turbo": 0.002,
+    "gpt-3.5-turbo-16k": 0.004,
+    "gpt-3.5-turbo-0301": 0.002,
+    "gpt-3.5-turbo-0613": 0.002,
+    "gpt-4": 0.06,
+    "gpt-4-32k": 0.12,
+    "gpt-4o": 0.01,
+    "mistral-small": 0.002
+}
+
+
+class LLMResponseCache:
+    """SQLite backed LRU cache of LLM responses, safe to share between threads"""
+
+    def __init__(self, filename: str, max_megabytes: float = 512, prices: dict = None):
+        self.filename = filename
+        self.max_bytes = int(max_megabytes * 1024 * 1024)
+        self.prices = prices if prices is not None else DOLLARS_PER_1K_TOKENS
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(filename, check_same_thread=False)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS responses '
+                          '(key TEXT PRIMARY KEY, model TEXT, content TEXT, total_tokens INTEGER, '
+                          'size_bytes INTEGER, last_used REAL)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)')
+        self.conn.commit()
+        # kept up to date by put so eviction never has to sum the table
+        self.total_bytes = self.conn.execute('SELECT COALESCE(SUM(size_bytes), 0) FROM responses').fetchone()[0]
+        self.hits = 0
+        self.misses = 0
+        self.tokens_saved = 0
+        self.dollars_saved = 0.0
+
+    @staticmethod
+    def make_key(model: str, prompt: str, temperature: float, max_tokens: int, extra: str = '') -> str:
+        """Hash of everything that changes the response"""
+        key = '\x1f'.join([model, repr(float(temperature)), str(max_tokens), extra, prompt])
+        return hashlib.sha256(key.encode('utf8')).hexdigest()
+
+    def get(self, model: str, prompt: str, temperature: float, max_tokens: int,
+            extra: str = '') -> Union[dict, None]:
+        """Returns dict of content and total_tokens for a previous identical call or None"""
+        key = self.make_key(model, prompt, temperature, max_tokens, extra)
+        with self.lock:
+            row = self.conn.execute('SELECT content, total_tokens FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses = self.misses + 1
+                return None
+            self.conn.execute('UPDATE responses SET last_used = ? WHERE key = ?', (time.time(), key))
+            self.conn.commit()
+            self.hits = self.hits + 1
+            self.tokens_saved = self.tokens_saved + row[1]
+            self.dollars_saved = self.dollars_saved + row[1] / 1000 * self.prices.get(model, 0.0)
+        return {"content": row[0], "total_tokens": row[1]}
+
+    def put(self, model: str, prompt: str, temperature: float, max_tokens: int,
+            content: str, total_tokens: int = 0, extra: str = ''):
+        """Store a response evicting the least recently used if over size"""
+        key = self.make_key(model, prompt, temperature, max_tokens, extra)
+        size_bytes = len(content.encode('utf8')) + len(key)
+        with self.lock:
+            replaced = self.conn.execute('SELECT size_bytes FROM responses WHERE key = ?', (key,)).fetchone()
+            self.conn.execute('INSERT OR REPLACE INTO responses VALUES (?,?,?,?,?,?)',
+                              (key, model, content, int(total_tokens), size_bytes, time.time()))
+            self.total_bytes = self.total_bytes + size_bytes - (replaced[0] if replaced is not None else 0)
+            self._evict()
+            self.conn.commit()
+
+    def _evict(self):
+        """Delete least recently used responses until under max_bytes, caller holds the lock"""
+        if self.total_bytes <= self.max_bytes:
+            return
+        evict = []
+        for key, size_bytes in self.conn.execute('SELECT key, size_bytes FROM responses ORDER BY last_used'):
+            if self.total_bytes <= self.max_bytes:
+                break
+            evict.append((key,))
+            self.total_bytes = self.total_bytes - size_bytes
+        self.conn.executemany('DELETE FROM responses WHERE key = ?', evict)
+
+    def hit_rate(self) -> float:
+        """Fraction of gets that were hits"""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups > 0 else 0.0
+
+    def summary(self) -> str:
+        """One line report for the end of a run"""
+        return (f'LLM cache hits: {self.hits} misses: {self.misses} hit rate: {self.hit_rate():.1%} '
+                f'tokens saved: {self.tokens_saved} dollars saved: ${self.dollars_saved:.2f}')
+
+    def close(self):
+        """Close the underlying connection"""
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,66 @@
+"""
+Test llm_cache.py returns identical calls from disk and evicts least recently used
+
+"""
+# ***************************************************************************80**************************************120
+
+# standard imports
+import os
+
+# custom imports
+import llm_cache # file under test
+
+def test_hit_only_for_identical_call(tmp_path):
+    """Any change in model, prompt, temperature, max_tokens or extra is a miss"""
+    cache = llm_cache.LLMResponseCache(os.path.join(tmp_path, "cache.sqlite"))
+    cache.put("gpt-4", "summarise this", 0.0, 500, "a summary", 1000)
+    assert cache.get("gpt-4", "summarise this", 0.0, 500) == {"content": "a summary", "total_tokens": 1000}
+    assert cache.get("gpt-3.5-turbo", "summarise this", 0.0, 500) is None
+    assert cache.get("gpt-4", "summarise that", 0.0, 500) is None
+    assert cache.get("gpt-4", "summarise this", 1.0, 500) is None
+    assert cache.get("gpt-4", "summarise this", 0.0, 400) is None
+    assert cache.get("gpt-4", "summarise this", 0.0, 500, extra="json_object") is None
+    assert cache.hits == 1
+    assert cache.misses == 5
+    assert cache.tokens_saved == 1000
+    assert abs(cache.dollars_saved - 0.06) < 1e-9
+    assert "hit rate: 16.7%" in cache.summary()
+    cache.close()
+
+def test_persists_between_runs(tmp_path):
+    """A second run reads what the first wrote"""
+    filename = os.path.join(tmp_path, "cache.sqlite")
+    cache = llm_cache.LLMResponseCache(filename)
+    cache.put("gpt-4o", "prompt", 1.0, 4096, "{}", 10)
+    cache.close()
+    cache = llm_cache.LLMResponseCache(filename)
+    assert cache.get("gpt-4o", "prompt", 1.0, 4096)["content"] == "{}"
+    cache.close()
+
+def test_evicts_least_recently_used(tmp_path):
+    """Over size the oldest unused responses go first"""
+    content = "x" * 1000
+    cache = llm_cache.LLMResponseCache(os.path.join(tmp_path, "cache.sqlite"), max_megabytes=3500 / 1024 / 1024)
+    cache.put("gpt-4", "one", 0.0, 10, content)
+    cache.put("gpt-4", "two", 0.0, 10, content)
+    cache.put("gpt-4", "three", 0.0, 10, content)
+    # touching one makes two the least recently used
+    assert cache.get("gpt-4", "one", 0.0, 10) is not None
+    cache.put("gpt-4", "four", 0.0, 10, content)
+    assert cache.get("gpt-4", "two", 0.0, 10) is None
+    for prompt in ["one", "three", "four"]:
+        assert cache.get("gpt-4", prompt, 0.0, 10) is not None
+    cache.close()
+
+def test_running_size_total(tmp_path):
+    """Replacing a response counts only its new size, the total carries over to the next run"""
+    filename = os.path.join(tmp_path, "cache.sqlite")
+    cache = llm_cache.LLMResponseCache(filename)
+    cache.put("gpt-4", "one", 0.0, 10, "x" * 100)
+    cache.put("gpt-4", "one", 0.0, 10, "x" * 300)
+    cache.put("gpt-4", "two", 0.0, 10, "x" * 200)
+    assert cache.total_bytes == 500 + 2 * 64
+    cache.close()
+    cache = llm_cache.LLMResponseCache(filename)
+    assert cache.total_bytes == 500 + 2 * 64
+    cache.close()
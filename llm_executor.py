@@ -0,0 +1,238 @@
+"""
+llm_executor.py
+
+Runs many LLM calls concurrently on an asyncio event loop within request-per-minute
+and token-per-minute budgets.
+
+- A fixed number of workers pull the next job from a shared queue as soon as they are free,
+  so one long conversation never leaves the others waiting on a static partition.
+- Each call first takes a request and its estimated tokens from token buckets refilled
+  continuously at requests_per_minute / tokens_per_minute.
+- An optional lookup, e.g. of a response cache, answers a job before any budget is taken.
+- Failed calls are retried with full jitter exponential backoff, unless retryable says the error is permanent.
+- Throughput is logged every stats_interval seconds.
+
+The call can be a coroutine function or a plain blocking function (like openai.ChatCompletion.create
+or the mistral client), blocking calls are run in a thread so they don't hold up the loop.
+
+Usage:
+    executor = llm_executor.LLMExecutor(call=summarize, concurrency=16,
+                                        requests_per_minute=3500, tokens_per_minute=90000,
+                                        on_result=write_summary)
+    results = executor.run_sync([llm_executor.LLMJob(key=id, payload=row, tokens=n) for ...])
+
+"""
+# ******************************************************************************************************************120
+
+# standard imports
+import time
+import random
+import asyncio
+import logging
+import inspect
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Iterable, Optional
+
+
+@dataclass
+class LLMJob:
+    """One call to make, tokens is the estimate of prompt plus max output tokens used for the budget"""
+    key: Any
+    payload: Any
+    tokens: int = 0
+
+
+@dataclass
+class LLMResult:
+    """What happened to a job, error is '' on success"""
+    key: Any
+    value: Any = None
+    error: str = ''
+    attempts: int = 0
+    seconds: float = 0.0
+
+
+@dataclass
+class LLMExecutorStats:
+    """Running totals for the throughput log"""
+    submitted: int = 0
+    completed: int = 0
+    failed: int = 0
+    retries: int = 0
+    cached: int = 0
+    tokens: int = 0
+    start: float = field(default_factory=time.monotonic)
+
+    def elapsed(self) -> float:
+        """Seconds since the run started"""
+        return max(time.monotonic() - self.start, 1e-9)
+
+    def summary(self) -> str:
+        """One line of throughput"""
+        minutes = self.elapsed() / 60
+        return (f'completed: {self.completed}/{self.submitted} failed: {self.failed} retries: {self.retries} '
+                f'cached: {self.cached} '
+                f'requests/min: {self.completed / minutes:.1f} tokens/min: {self.tokens / minutes:.0f} '
+                f'elapsed: {self.elapsed():.1f}s')
+
+
+class TokenBucket:
+    """Continuously refilled budget of rate_per_minute, holding at most burst_seconds worth.
+    A rate of 0 or less is unlimited"""
+
+    def __init__(self, rate_per_minute: float, burst_seconds: float = 1.0):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(self.rate * burst_seconds, 1.0)
+        self.level = self.capacity
+        self.last = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def take(self, amount: float = 1.0):
+        """Wait until amount is available then take it.  An amount above capacity waits for a full bucket
+        and takes all of it, leaving the bucket in debt so later takers wait for the rest to accrue"""
+        if self.rate <= 0:
+            return
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.level = min(self.capacity, self.level + (now - self.last) * self.rate)
+                self.last = now
+                needed = min(amount, self.capacity)
+                if self.level >= needed:
+                    self.level = self.level - amount
+                    return
+                await asyncio.sleep((needed - self.level) / self.rate)
+
+
+class LLMExecutor:
+    """Bounded concurrency, rate limited, retrying executor for LLM calls.
+
+    call(payload) returns the value for a job, raising to trigger a retry.
+    lookup(payload) returns a value to use without calling or None, hits take nothing from the budgets.
+    retryable(exception) says whether a failed call is worth retrying, by default every failure is.
+    on_result(job, value) is called on the event loop as soon as each job succeeds, e.g. to write it to disk."""
+
+    def __init__(self, call: Callable,
+                 concurrency: int = 8,
+                 requests_per_minute: float = 0,
+                 tokens_per_minute: float = 0,
+                 max_retries: int = 5,
+                 backoff_base: float = 1.0,
+                 backoff_max: float = 60.0,
+                 stats_interval: float = 10.0,
+                 sleep_seconds: float = 0.0,
+                 on_result: Optional[Callable] = None,
+                 lookup: Optional[Callable] = None,
+                 retryable: Optional[Callable] = None,
+                 logger: Optional[logging.Logger] = None):
+        if concurrency < 1:
+            raise RuntimeError(f'concurrency must be 1 or more not: {concurrency}')
+        self.call = call
+        self.concurrency = concurrency
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.stats_interval = stats_interval
+        self.sleep_seconds = sleep_seconds
+        self.on_result = on_result
+        self.lookup = lookup
+        self.retryable = retryable
+        self.logger = logger if logger is not None else logging.getLogger('humanfirst.llm_executor')
+        self.stats = LLMExecutorStats()
+        self.threads = None
+
+    def run_sync(self, jobs: Iterable[LLMJob]) -> list:
+        """Run all the jobs from synchronous code returning LLMResults in job order"""
+        return asyncio.run(self.run(jobs))
+
+    async def run(self, jobs: Iterable[LLMJob]) -> list:
+        """Run all the jobs returning LLMResults in job order"""
+        jobs = list(jobs)
+        self.stats = LLMExecutorStats(submitted=len(jobs))
+        request_bucket = TokenBucket(self.requests_per_minute)
+        token_bucket = TokenBucket(self.tokens_per_minute)
+
+        queue = asyncio.Queue()
+        for i, job in enumerate(jobs):
+            queue.put_nowait((i, job))
+        results = [None] * len(jobs)
+
+        # blocking calls get a thread per worker rather than sharing the loop's default pool
+        self.threads = ThreadPoolExecutor(max_workers=self.concurrency)
+        reporter = asyncio.create_task(self._report())
+        workers = [asyncio.create_task(self._worker(queue, results, request_bucket, token_bucket))
+                   for _ in range(min(self.concurrency, max(len(jobs), 1)))]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            reporter.cancel()
+            self.threads.shutdown(wait=False)
+        self.logger.info('Finished %s', self.stats.summary())
+        return results
+
+    async def _worker(self, queue: asyncio.Queue, results: list,
+                      request_bucket: TokenBucket, token_bucket: TokenBucket):
+        """Take the next job whenever free until the queue is empty"""
+        while True:
+            try:
+                i, job = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            results[i] = await self._run_job(job, request_bucket, token_bucket)
+
+    async def _run_job(self, job: LLMJob, request_bucket: TokenBucket, token_bucket: TokenBucket) -> LLMResult:
+        """Call with retries and backoff"""
+        start = time.monotonic()
+        if self.lookup is not None:
+            value = self.lookup(job.payload)
+            if value is not None:
+                self.stats.completed = self.stats.completed + 1
+                self.stats.cached = self.stats.cached + 1
+                if self.on_result is not None:
+                    self.on_result(job, value)
+                return LLMResult(key=job.key, value=value, seconds=time.monotonic() - start)
+        attempt = 0
+        while True:
+            attempt = attempt + 1
+            await request_bucket.take(1)
+            await token_bucket.take(job.tokens)
+            try:
+                value = await self._call(job.payload)
+            except Exception as e: # pylint: disable=broad-exception-caught
+                if attempt > self.max_retries or (self.retryable is not None and not self.retryable(e)):
+                    self.stats.failed = self.stats.failed + 1
+                    self.logger.error('Giving up on %s after %i attempts: %s', job.key, attempt, e)
+                    return LLMResult(key=job.key, error=f'{type(e).__name__}: {e}', attempts=attempt,
+                                     seconds=time.monotonic() - start)
+                self.stats.retries = self.stats.retries + 1
+                delay = self.backoff_delay(attempt)
+                self.logger.warning('Retrying %s in %.2fs after attempt %i: %s', job.key, delay, attempt, e)
+                await asyncio.sleep(delay)
+                continue
+
+            self.stats.completed = self.stats.completed + 1
+            self.stats.tokens = self.stats.tokens + job.tokens
+            if self.on_result is not None:
+                self.on_result(job, value)
+            if self.sleep_seconds > 0:
+                await asyncio.sleep(self.sleep_seconds)
+            return LLMResult(key=job.key, value=value, attempts=attempt, seconds=time.monotonic() - start)
+
+    async def _call(self, payload: Any) -> Any:
+        """Await coroutine functions directly, run blocking ones in a thread"""
+        if inspect.iscoroutinefunction(self.call):
+            return await self.call(payload)
+        return await asyncio.get_running_loop().run_in_executor(self.threads, self.call, payload)
+
+    def backoff_delay(self, attempt: int) -> float:
+        """Full jitter exponential backoff"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+
+    async def _report(self):
+        """Log throughput periodically until cancelled"""
+        while True:
+            await asyncio.sleep(self.stats_interval)
+            self.logger.info('Progress %s', self.stats.summary())
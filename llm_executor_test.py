@@ -0,0 +1,128 @@
+"""
+Test llm_executor.py against a local mock chat completions server
+
+"""
+# ***************************************************************************80**************************************120
+
+# standard imports
+import json
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# 3rd party imports
+import pytest
+import requests
+
+# custom imports
+import llm_executor # file under test
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    """Echoes the prompt back reversed, every third request gets a 429"""
+
+    def do_POST(self): # pylint: disable=invalid-name
+        """OpenAI style /v1/chat/completions"""
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with self.server.lock:
+            self.server.requests = self.server.requests + 1
+            throttle = self.server.requests % 3 == 0
+        if throttle:
+            self.send_response(429)
+            self.end_headers()
+            return
+        # longer prompts take longer
+        prompt = body["messages"][0]["content"]
+        time.sleep(0.001 * len(prompt))
+        response = {
+            "choices": [{"message": {"role": "assistant", "content": prompt[::-1]}}],
+            "usage": {"total_tokens": len(prompt)}
+        }
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(json.dumps(response).encode("utf8"))
+
+    def log_message(self, format, *args): # pylint: disable=redefined-builtin
+        """Quiet"""
+
+@pytest.fixture
+def mock_llm_url():
+    """Run the mock server on a free port for the test"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockLLMHandler)
+    server.lock = threading.Lock()
+    server.requests = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_address[1]}/v1/chat/completions'
+    server.shutdown()
+
+def _make_call(url: str):
+    """A blocking call like the openai sdk which raises on a non 200"""
+    def call(prompt: str) -> str:
+        response = requests.post(url, json={"messages": [{"role": "user", "content": prompt}]}, timeout=5)
+        response.raise_for_status()
+        return response.json()["choices"][0]["message"]["content"]
+    return call
+
+def test_all_jobs_complete_with_retries(mock_llm_url):
+    """429s are retried and results come back in job order"""
+    written = {}
+    executor = llm_executor.LLMExecutor(call=_make_call(mock_llm_url), concurrency=8,
+                                        backoff_base=0.01, backoff_max=0.05,
+                                        on_result=lambda job, value: written.update({job.key: value}))
+    jobs = [llm_executor.LLMJob(key=i, payload="x" * (i % 7) + f"prompt {i}", tokens=10) for i in range(30)]
+    results = executor.run_sync(jobs)
+    assert [r.key for r in results] == list(range(30))
+    assert all(r.error == '' for r in results)
+    assert [r.value for r in results] == [j.payload[::-1] for j in jobs]
+    assert len(written) == 30
+    assert executor.stats.completed == 30
+    assert executor.stats.retries > 0
+
+def test_requests_per_minute_budget(mock_llm_url):
+    """1200 a minute is 20 a second, 40 jobs are at least 53 requests with the 429s so 33 after the burst"""
+    executor = llm_executor.LLMExecutor(call=_make_call(mock_llm_url), concurrency=16,
+                                        requests_per_minute=1200, max_retries=10,
+                                        backoff_base=0.001, backoff_max=0.002)
+    start = time.monotonic()
+    results = executor.run_sync([llm_executor.LLMJob(key=i, payload=f"p{i}") for i in range(40)])
+    assert all(r.error == '' for r in results)
+    # 40 jobs plus the retries of every third request, less the one second burst
+    assert time.monotonic() - start >= 1.0
+
+def test_gives_up_after_max_retries():
+    """A job that always fails is reported rather than raised"""
+    async def always_fails(_):
+        raise RuntimeError("nope")
+    executor = llm_executor.LLMExecutor(call=always_fails, max_retries=2, backoff_base=0.001)
+    results = executor.run_sync([llm_executor.LLMJob(key="a", payload=None)])
+    assert results[0].attempts == 3
+    assert results[0].error == 'RuntimeError: nope'
+    assert executor.stats.failed == 1
+
+def test_jobs_bigger_than_a_second_of_tokens_are_charged_in_full():
+    """60000 a minute is 1000 a second, each 1500 token job after the first waits 1.5s rather than 1s"""
+    async def echo(payload):
+        return payload
+    executor = llm_executor.LLMExecutor(call=echo, concurrency=3, tokens_per_minute=60000)
+    start = time.monotonic()
+    results = executor.run_sync([llm_executor.LLMJob(key=i, payload=i, tokens=1500) for i in range(3)])
+    assert [r.value for r in results] == [0, 1, 2]
+    assert time.monotonic() - start >= 2.9
+
+def test_lookup_hits_take_no_budget():
+    """At 60 a minute only one request is free, the four answered by lookup neither wait nor call"""
+    calls = []
+    def echo(payload):
+        calls.append(payload)
+        return f"called {payload}"
+    written = []
+    executor = llm_executor.LLMExecutor(call=echo, concurrency=2, requests_per_minute=60, tokens_per_minute=60,
+                                        lookup=lambda payload: f"cached {payload}" if payload != 3 else None,
+                                        on_result=lambda job, value: written.append(value))
+    start = time.monotonic()
+    results = executor.run_sync([llm_executor.LLMJob(key=i, payload=i, tokens=1) for i in range(5)])
+    assert time.monotonic() - start < 0.5
+    assert [r.value for r in results] == ["cached 0", "cached 1", "cached 2", "called 3", "cached 4"]
+    assert calls == [3] and sorted(written) == sorted(r.value for r in results)
+    assert executor.stats.cached == 4 and executor.stats.completed == 5
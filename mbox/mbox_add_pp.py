@@ -10,15 +10,19 @@ Write to the new breaking out new fields
 - sorting out the formatting
 - removing the underlying link (which often contain a lot of trackers and use a lot of tokens)
 
-TODO: if this were a dataframe could multi thread.
-But could also with months by slicing through a map of the sub docs?
+Files are processed by a pool of --workers processes, any output which already exists is skipped
+so an interrupted run can be restarted, use --rebuild to redo everything.
+Each record is tokenised at most once for truncation and counting, only re-encoded if links were removed.
+
+With --shards the directory is read as jsonl shards and the output written as shards
+in the same year/month partitions, --years and --months limit which are read.
 
 """
 # ******************************************************************************************************************120
 
 # standard imports
 import os
-import json
+import sys
 import typing
 import re
 import pathlib
@@ -55,6 +59,10 @@ import tiktoken
 #  CASE INSENSITIVE
 
 # custom imports
+import mbox_shards
+hf_module_path = str(pathlib.Path(os.path.dirname(os.path.realpath(__file__))).parent)
+sys.path.insert(1, hf_module_path)
+import directory_map # pylint: disable=wrong-import-position
 
 # REGEX setup - emails
 PT_A_EMAIL = r"[a-z0-9!#$%&'*+/=?^_`{|}~-]+(?:\.[a-z0-9!#$%&'*+/=?^_`{|}~-]+)*"
@@ -87,30 +95,50 @@ TRUNCATE_AT_TOKENS = 8191
               help='String sort ascheding or descending')
 @click.option('-m', '--max_records', type=int, required=False, default=0,
               help='Stop after this many')
+@click.option('-s', '--shards', is_flag=True, required=False, default=False,
+              help='Directory contains jsonl shards rather than a json file per email')
+@click.option('-y', '--years', type=str, required=False, default='',
+              help='Comma separated years to read from shards, default all')
+@click.option('-n', '--months', type=str, required=False, default='',
+              help='Comma separated months to read from shards i.e 01,02 default all')
+@click.option('-w', '--workers', type=int, required=False, default=os.cpu_count(),
+              help='Number of processes to use')
+@click.option('-a', '--rebuild', is_flag=True, required=False, default=False,
+              help='Process every file even if the output already exists')
 def main(directory: str,
          output_directory: str,
          reverse: bool,
-         max_records: int) -> None: # pylint: disable=unused-argument
+         max_records: int,
+         shards: bool,
+         years: str,
+         months: str,
+         workers: int,
+         rebuild: bool) -> None: # pylint: disable=unused-argument
     """Main Function
     make sure output directory fully relative path """
 
-    # regex replacement quite simple for target
-    re_replace_original = re.compile(f'{directory}')
-    print(f'Writing to output_directory: {work_out_target(re_replace_original,directory,output_directory)}')
-    assert directory != output_directory
+    if shards:
+        assert directory != output_directory
+        process_shards(directory,output_directory,do_all_these_things,max_records,
+                       mbox_shards.parse_filter(years),mbox_shards.parse_filter(months))
+        return
 
-    process_dir(directory,reverse,re_replace_original,output_directory,do_all_these_things,max_records)
+    print(f'Writing to output_directory: {output_directory}')
+    assert directory != output_directory
 
-def work_out_target(re_replace_original: re, directory: str, output_directory: str):
-    """Just replaces output_directory in directory using re without recompiling it"""
-    return re_replace_original.sub(output_directory,directory)
+    process_dir(directory,reverse,output_directory,do_all_these_things,max_records,workers,not rebuild)
 
 def do_all_these_things(record: dict) -> dict:
     """ Orchestratator function"""
 
+    # the splitter counted the content tokens so only encode if it needs truncating
+    content_tokens = record["tokens"]
+
     # if the text is too_big it's just not worth dealing with - going to truncate it at tokens
     if record["tokens"] >= TRUNCATE_AT_TOKENS:
-        record["content"] = embeddings.decode(embeddings.encode(record["content"])[0:TRUNCATE_AT_TOKENS-1])
+        truncated = embeddings.encode(record["content"])[0:TRUNCATE_AT_TOKENS-1]
+        record["content"] = embeddings.decode(truncated)
+        content_tokens = len(truncated)
         print(f'Trimmed: {record["filename"]}')
 
     # get the participants
@@ -127,18 +155,22 @@ def do_all_these_things(record: dict) -> dict:
     # work on links
     record["shrunk_content"] = replace_long_links(record["content"])
 
-    # recalculate tokens
-    record["tokens_shrunk"] = len(embeddings.encode(record["shrunk_content"]))
+    # recalculate tokens only if removing links changed anything
+    if record["shrunk_content"] == record["content"]:
+        record["tokens_shrunk"] = content_tokens
+    else:
+        record["tokens_shrunk"] = len(embeddings.encode(record["shrunk_content"]))
     record["tokens_difference"] = record["tokens"] - record["tokens_shrunk"]
 
     return record
 
 def extract_emails(content: str) -> list:
-    """Return a deduplicated set of emails from anywhere in the text transformed record"""
+    """Return a deduplicated set of emails from anywhere in the text transformed record
+    in order of first appearance so the output is the same whichever worker does it"""
     # has no groups so should return the list
     matches = re_extract_emails.findall(content)
     if isinstance(matches,list):
-        return list(set(matches))
+        return list(dict.fromkeys(matches))
     else:
         return []
 
@@ -147,58 +179,48 @@ def replace_long_links(content: str) -> list:
     # has no groups so should return the list
     return re_long_links.sub("link",content)
 
-def write_output(record: dict, re_replace_original: re, fqp: str, output_directory: str):
-    """Writes the file"""
-    output_fqp = work_out_target(re_replace_original,fqp,output_directory)
-    with open(output_fqp,mode='w',encoding='utf8') as file_out:
-        json.dump(record,file_out,indent=2)
-
-def process_dir(directory:str, reverse: bool,
-                re_replace_original: str, output_directory: str,
-                call_this: typing.Callable, max_records: int):
-    """Iterate through the folder structure creating a mirror one
-    call_this must be a function accepting a dict representing a json, a directory and a fn"""
-
-
-    # zero directory json ount
-    dir_count = 0
-    assert os.path.isdir(directory)
-
-    # check output
-    working_output_dir = work_out_target(re_replace_original, directory, output_directory)
-    if not os.path.isdir(working_output_dir):
-        thispath = pathlib.Path(working_output_dir)
-        thispath.mkdir(parents=True)
-        print(f'Created: {working_output_dir}')
-
-    # create list
-    list_files = os.listdir(directory)
-    list_files.sort(reverse=reverse)
-
-    # for every file here
-    for fn in list_files:
-        # work out fully qualified
-        fqp = os.path.join(directory,fn)
-
-        # if it is a file do the job passing the json
-        if os.path.isfile(fqp):
-            if fqp.endswith('.json'):
-                with open(fqp,mode='r',encoding='utf8') as file_in:
-                    json_dict = json.load(file_in)
-                    json_dict['filename'] = fn
-                    json_dict = call_this(json_dict)
-                    write_output(json_dict,re_replace_original,fqp,output_directory)
-                    dir_count = dir_count + 1
-        elif os.path.isdir(fqp):
-            sub_count = process_dir(fqp,reverse,re_replace_original,output_directory,call_this,max_records)
-            dir_count=dir_count + sub_count
-        else:
-            print(fqp)
-            raise RuntimeError("WTF?")
-        if max_records > 0 and dir_count > max_records:
-            break
-    print(f'{dir_count:>10}    {directory}')
-    return dir_count
+def process_dir(directory:str, reverse: bool, output_directory: str,
+                call_this: typing.Callable, max_records: int,
+                workers: int = os.cpu_count(), skip_existing: bool = True) -> int:
+    """Call call_this on every json in the folder structure in parallel writing to a mirror one
+    call_this must be a module level function accepting a dict representing a json"""
+
+    if not os.path.isdir(output_directory):
+        pathlib.Path(output_directory).mkdir(parents=True)
+        print(f'Created: {output_directory}')
+
+    count = 0
+    errors = 0
+    for result in directory_map.map_files(directory, call_this, output_directory=output_directory,
+                                          reverse=reverse, workers=workers, skip_existing=skip_existing,
+                                          max_records=max_records):
+        if result.skipped:
+            continue
+        if result.error != '':
+            errors = errors + 1
+            print(f'Can\'t process {result.path}: {result.error}')
+        count = count + 1
+        if count % 10000 == 0:
+            print(f'{count:>10}    {result.path}')
+    print(f'{count:>10}    {directory} errors: {errors}')
+    return count
+
+def process_shards(directory: str, output_directory: str, call_this: typing.Callable, max_records: int,
+                   years: list = None, months: list = None) -> int:
+    """Read the chosen partitions of shards calling call_this on each record and writing
+    the results to shards in the same partitions of output_directory"""
+
+    count = 0
+    with mbox_shards.ShardWriter(output_directory) as writer:
+        for shard_name in mbox_shards.list_shards(directory, years, months):
+            for record in mbox_shards.read_shard(shard_name):
+                writer.write(call_this(record))
+                count = count + 1
+                if max_records > 0 and count >= max_records:
+                    print(f'{count:>10}    {directory}')
+                    return count
+            print(f'{count:>10}    {shard_name}')
+    return count
 
 if __name__ == '__main__':
     main()  # pylint: disable=no-value-for-parameter
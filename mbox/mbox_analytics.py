@@ -3,10 +3,14 @@ python mbox_analytics.py
 
 Pickup the CSV and do some analytics
 
+Or with --shards_directory read just the participants and filename columns straight from the
+jsonl shards written by mbox_add_pp --shards, limited to any --years and --months
+
 """
 # ******************************************************************************************************************120
 
 # standard imports
+import os
 
 # 3rd party imports
 import click
@@ -14,23 +18,45 @@ import pandas
 import plotly.express as px
 
 # custom imports
+import mbox_shards
 
 @click.command()
-@click.option('-f', '--filename', type=str, required=True, help='Filename CSV')
+@click.option('-f', '--filename', type=str, required=False, default='', help='Filename CSV')
+@click.option('-s', '--shards_directory', type=str, required=False, default='',
+              help='Read from jsonl shards in this directory instead of a CSV')
+@click.option('-y', '--years', type=str, required=False, default='',
+              help='Comma separated years to read from shards, default all')
+@click.option('-m', '--months', type=str, required=False, default='',
+              help='Comma separated months to read from shards i.e 01,02 default all')
 @click.option('-h', '--home_org', type=str, required=True, help='Home org to drop')
 @click.option('-o', '--more_than_n', type=int, required=False, default=10,
               help='Ignore any email only done once')
 def main(filename: str,
+         shards_directory: str,
+         years: str,
+         months: str,
          home_org:str,
          more_than_n: int) -> None: # pylint: disable=unused-argument
     """Main Function"""
 
     columns_care_about = ['participants','filename']
-    df = pandas.read_csv(
-        filename,
-        usecols=columns_care_about,
-        dtype={'participants':str,'filename':str}
-    )
+    if shards_directory != '':
+        df = mbox_shards.read_dataframe(shards_directory,
+                                        years=mbox_shards.parse_filter(years),
+                                        months=mbox_shards.parse_filter(months),
+                                        columns=columns_care_about)
+        # same string form as the csv column
+        df["participants"] = df["participants"].apply(str)
+        if filename == '':
+            filename = os.path.join(shards_directory,"mbox_analytics.csv")
+    elif filename != '':
+        df = pandas.read_csv(
+            filename,
+            usecols=columns_care_about,
+            dtype={'participants':str,'filename':str}
+        )
+    else:
+        raise RuntimeError("Provide either --filename or --shards_directory")
     print(df)
 
     df["participants_list"] = df["participants"].apply(get_str_list)
@@ -4,12 +4,16 @@ python mbox_make_csv.py
 Recursively scan a directory and load the json and turn into a CSV which can then be
 csv_json_to_unlabelled
 
+With --shards the directory is read as jsonl shards written with --output_format jsonl
+only reading the chosen --years, --months and --columns
+
 """
 # ******************************************************************************************************************120
 
 # standard imports
 import os
-import json
+import sys
+import pathlib
 import datetime
 
 # 3rd party imports
@@ -17,18 +21,50 @@ import click
 import pandas
 
 # custom imports
+import mbox_shards
+hf_module_path = str(pathlib.Path(os.path.dirname(os.path.realpath(__file__))).parent)
+sys.path.insert(1, hf_module_path)
+import directory_map # pylint: disable=wrong-import-position
+
+# read from shards even if not in --columns as main needs them
+REQUIRED_COLUMNS = ["timestamp", "content", "tokens", "filename"]
 
 @click.command()
 @click.option('-d', '--directory', type=str, required=True, help='Directory')
 @click.option('-r', '--reverse', type=bool, required=False, default=False,
               help='String sort ascheding or descending')
+@click.option('-s', '--shards', is_flag=True, required=False, default=False,
+              help='Directory contains jsonl shards rather than a json file per email')
+@click.option('-y', '--years', type=str, required=False, default='',
+              help='Comma separated years to read from shards, default all')
+@click.option('-m', '--months', type=str, required=False, default='',
+              help='Comma separated months to read from shards i.e 01,02 default all')
+@click.option('-c', '--columns', type=str, required=False, default='',
+              help='Comma separated columns to read from shards as well as timestamp, content, tokens '
+                   'and filename, default all')
+@click.option('-w', '--workers', type=int, required=False, default=os.cpu_count(),
+              help='Number of processes to read json files with')
 def main(directory: str,
-         reverse: bool) -> None: # pylint: disable=unused-argument
+         reverse: bool,
+         shards: bool,
+         years: str,
+         months: str,
+         columns: str,
+         workers: int) -> None: # pylint: disable=unused-argument
     """Main Function"""
 
-    all_dicts = []
-    process_dir(directory,reverse,all_dicts)
-    df = pandas.json_normalize(all_dicts)
+    if shards:
+        columns = mbox_shards.parse_filter(columns)
+        if columns is not None:
+            columns = columns + [column for column in REQUIRED_COLUMNS if column not in columns]
+        df = mbox_shards.read_dataframe(directory,
+                                        years=mbox_shards.parse_filter(years),
+                                        months=mbox_shards.parse_filter(months),
+                                        columns=columns)
+    else:
+        all_dicts = []
+        process_dir(directory,reverse,all_dicts,workers)
+        df = pandas.json_normalize(all_dicts)
     df["timestamp"].fillna(datetime.datetime.now().isoformat())
     df.loc[df["timestamp"]=='',"timestamp"] = datetime.datetime.now().isoformat()
     print("Why do these error?")
@@ -76,33 +112,22 @@ def bucket_tokens(tokens: int) -> int:
         return 0
 
 
-def process_dir(directory:str, reverse: bool, all_dicts: list):
-    """Cycle through the directories"""
+def process_dir(directory:str, reverse: bool, all_dicts: list, workers: int = os.cpu_count()) -> int:
+    """Read every json in the directories in parallel appending them to all_dicts in file order"""
     dir_count = 0
-    assert os.path.isdir(directory)
-    list_files = os.listdir(directory)
-    list_files.sort(reverse=reverse)
-    for fn in list_files:
-        fqp = os.path.join(directory,fn)
-        if os.path.isfile(fqp):
-            if fqp.endswith('.json'):
-                with open(fqp,mode='r',encoding='utf8') as file_in:
-                    try:
-                        json_dict = json.load(file_in)
-                        json_dict['filename'] = fn
-                        all_dicts.append(json_dict)
-                    except Exception as e:
-                        print(f'Can\'t read {fqp}')
-                        print(e)
-                    dir_count = dir_count + 1
-        elif os.path.isdir(fqp):
-            sub_count = process_dir(fqp,reverse,all_dicts)
-            dir_count=dir_count + sub_count
+    for result in directory_map.map_files(directory, keep_record, reverse=reverse, workers=workers):
+        if result.error != '':
+            print(f'Can\'t read {result.path}')
+            print(result.error)
         else:
-            print(fqp)
-            raise RuntimeError("WTF?")
+            all_dicts.append(result.value)
+        dir_count = dir_count + 1
     print(f'{dir_count:>10}    {directory}')
     return dir_count
 
+def keep_record(record: dict) -> dict:
+    """Records are used as read"""
+    return record
+
 if __name__ == '__main__':
     main()  # pylint: disable=no-value-for-parameter
@@ -0,0 +1,151 @@
+"""
+mbox_shards.py
+
+Partitioned JSONL shard store for split emails, an alternative to one indented json file per email.
+
+Records are appended one per line to shards under
+    <directory>/year=<Year>/month=<Month>/part-<pid>-<n>.jsonl
+so each process writes its own files without locking, a shard is rolled over every max_records,
+and readers can pick years and months from the folder names without opening anything else.
+Emails without a date go in year=unknown/month=unknown.
+
+Records written by the splitter carry the source_offset of the message in the mbox, a resumed run
+can rewrite a few messages after its checkpoint, readers keep the last copy of each offset.
+
+Usage:
+    writer = mbox_shards.ShardWriter('./data/mbox/output_shards')
+    writer.write(record)
+    writer.close()
+    df = mbox_shards.read_dataframe('./data/mbox/output_shards', years=['2024'], columns=['content', 'tokens'])
+
+"""
+# ******************************************************************************************************************120
+
+# standard imports
+import os
+import json
+import typing
+
+# 3rd party imports
+import pandas
+
+UNKNOWN = "unknown"
+
+
+class ShardWriter:
+    """Appends records to JSONL shards partitioned by Year and Month"""
+
+    def __init__(self, directory: str, max_records: int = 10000):
+        self.directory = directory
+        self.max_records = max_records
+        self.files = {}
+        self.counts = {}
+        self.sequence = 0
+
+    def write(self, record: dict):
+        """Append record to the shard for its Year and Month"""
+        partition = partition_path(self.directory, record.get("Year", ""), record.get("Month", ""))
+        if partition not in self.files or self.counts[partition] >= self.max_records:
+            self._roll(partition)
+        file_out = self.files[partition]
+        file_out.write(json.dumps(record, ensure_ascii=False))
+        file_out.write("\n")
+        # a killed worker still leaves complete lines
+        file_out.flush()
+        self.counts[partition] = self.counts[partition] + 1
+
+    def _roll(self, partition: str):
+        """Close the current shard for a partition and start the next"""
+        if partition in self.files:
+            self.files[partition].close()
+        os.makedirs(partition, exist_ok=True)
+        self.sequence = self.sequence + 1
+        shard_name = os.path.join(partition, f'part-{os.getpid()}-{self.sequence:05d}.jsonl')
+        self.files[partition] = open(shard_name, mode="a", encoding="utf8")
+        self.counts[partition] = 0
+
+    def close(self):
+        """Close all the open shards"""
+        for file_out in self.files.values():
+            file_out.close()
+        self.files = {}
+        self.counts = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def partition_path(directory: str, year: str, month: str) -> str:
+    """Folder for a Year and Month"""
+    if year == "" or month == "":
+        year = UNKNOWN
+        month = UNKNOWN
+    return os.path.join(directory, f'year={year}', f'month={month}')
+
+
+def list_shards(directory: str, years: list = None, months: list = None) -> list:
+    """Shard files in the chosen partitions only listing the matching folders"""
+    shards = []
+    for year_dir in sorted(os.listdir(directory)):
+        if not year_dir.startswith("year="):
+            continue
+        if years and year_dir[5:] not in years:
+            continue
+        for month_dir in sorted(os.listdir(os.path.join(directory, year_dir))):
+            if not month_dir.startswith("month="):
+                continue
+            if months and month_dir[6:] not in months:
+                continue
+            partition = os.path.join(directory, year_dir, month_dir)
+            for shard_name in sorted(os.listdir(partition)):
+                if shard_name.endswith(".jsonl"):
+                    shards.append(os.path.join(partition, shard_name))
+    return shards
+
+
+def iter_records(directory: str, years: list = None, months: list = None,
+                 columns: list = None) -> typing.Iterator[dict]:
+    """Records from the chosen partitions with only the chosen columns"""
+    for shard_name in list_shards(directory, years, months):
+        for record in read_shard(shard_name):
+            if columns:
+                record = {column: record.get(column) for column in columns}
+            yield record
+
+
+def read_shard(shard_name: str) -> list:
+    """Every complete record in one shard"""
+    records = []
+    with open(shard_name, mode="r", encoding="utf8") as file_in:
+        for line in file_in:
+            if not line.endswith("\n"):
+                # a half written last line from an interrupted run
+                continue
+            records.append(json.loads(line))
+    return records
+
+
+def read_dataframe(directory: str, years: list = None, months: list = None,
+                   columns: list = None) -> pandas.DataFrame:
+    """DataFrame of the chosen partitions and columns, deduplicated on source_offset if present"""
+    read_columns = columns
+    if columns and "source_offset" not in columns:
+        read_columns = columns + ["source_offset"]
+    df = pandas.DataFrame(list(iter_records(directory, years, months, read_columns)))
+    if "source_offset" in df.columns:
+        has_offset = df["source_offset"].notna()
+        df = pandas.concat([df[has_offset].drop_duplicates("source_offset", keep="last"), df[~has_offset]])
+        df = df.sort_index()
+        if columns and "source_offset" not in columns:
+            df = df.drop(columns=["source_offset"])
+    return df.reset_index(drop=True)
+
+
+def parse_filter(filter_string: str) -> list:
+    """Comma separated option to a list, '' is everything"""
+    if filter_string == '':
+        return None
+    return [value.strip() for value in filter_string.split(",")]
@@ -1,30 +1,28 @@
 """
 python mbox_splitter.py --filename <yourmboxfullpath>
 
-This will read a very large mailbox file squentially from first prinicples.
+This will read a very large mailbox file from first prinicples.
 It will write out to a directory in the same location as the filenmae named 
 output or any --run_name within which will be folders by year, with subfolders by month
 in each folder will be a json file per email.
-It provides for progress reporting and keeps memory use low whilst relying on 
-It provides email corruption tolerance and restartability 
-(note where the last run got up to and provide that email)
+
+It first builds an index of the byte offset of every "From " line starting a message by
+searching a memory map of the file, this is linear and doesn't decode anything.
+Each message is then parsed, tokenised and written by a pool of worker processes which
+each memory map the file and read just their message's slice, so nothing is rebuilt line by line.
+Progress is reported in messages per second and the offset everything before which has been
+written is checkpointed to <run_name>_checkpoint.json beside the output directory.
+It provides email corruption tolerance, a message which fails to parse is reported and skipped.
+
 Other options can be used to control restart or test limited runs but are not required
---max_lines        use to run on a sample head of the file
+--max_bytes        use to run on a sample head of the file, rounded up to a whole message
 --max_emails       use to run on a sample of x emails of the file
---dummy            skips processing and just tests the directory looping
---count_increment  how often to give a count increment
---begin_line       which line of the file to start on, providing restartability.
-
-@click.option('-n', '--max_emails', type=int, required=False, default=0,
-              help='Max emails')
-@click.option('-r', '--run_name', type=str, required=False, default="output",
-              help='Run name otherwise defaults to output')
-@click.option('-d', '--dummy', is_flag=True, required=False, default=False,
-              help='Skip all processing')
-@click.option('-c', '--count_increment', type=int, required=False, default=10000000,
-              help='How often to give a report on process')
-@click.option('-b', '--begin_line', type=int, required=False, default=0,
-              help='How often to give a report on process')
+--dummy            only builds the index and counts the messages
+--count_increment  how often in messages to give a progress report and checkpoint
+--begin_offset     which byte of the file to start from
+--resume           start from the offset in the checkpoint of a previous run
+--workers          how many processes to parse with
+--output_format    json for a file per email or jsonl for partitioned shards see mbox_shards.py
 
 https://www.loc.gov/preservation/digital/formats/fdd/fdd000383.shtml#:~:text=MBOX%20(sometimes%20known%20as%20Berkeley,the%20end%20of%20the%20file.
 
@@ -35,9 +33,11 @@ https://www.loc.gov/preservation/digital/formats/fdd/fdd000383.shtml#:~:text=MBO
 # standard imports
 from email.message import Message
 from email import policy
+from multiprocessing import Pool
 import email
 import os
 import re
+import mmap
 import time
 import json
 import collections
@@ -50,41 +50,49 @@ import click
 import tiktoken
 
 # custom imports
+import mbox_shards
+
+CHECKPOINT_FILE_SUFFIX = "_checkpoint.json"
+
+# set in each worker by init_worker
+worker_state = {}
 
 @click.command()
 @click.option('-f', '--filename', type=str, required=True, help='Input File Path')
-@click.option('-m', '--max_lines', type=int, required=False, default=0,
-              help='Max lines to process')
+@click.option('-m', '--max_bytes', type=int, required=False, default=0,
+              help='Max bytes of the file to process')
 @click.option('-n', '--max_emails', type=int, required=False, default=0,
               help='Max emails')
 @click.option('-r', '--run_name', type=str, required=False, default="output",
               help='Run name otherwise defaults to output')
 @click.option('-d', '--dummy', is_flag=True, required=False, default=False,
-              help='Skip all processing')
-@click.option('-c', '--count_increment', type=int, required=False, default=10000000,
-              help='How often to give a report on process')
-@click.option('-b', '--begin_line', type=int, required=False, default=0,
-              help='How often to give a report on process')
+              help='Only build the index and count messages')
+@click.option('-c', '--count_increment', type=int, required=False, default=10000,
+              help='How often in messages to give a report on progress and checkpoint')
+@click.option('-b', '--begin_offset', type=int, required=False, default=0,
+              help='Byte offset of the file to start from')
+@click.option('-k', '--resume', is_flag=True, required=False, default=False,
+              help='Start from the offset checkpointed by a previous run')
+@click.option('-w', '--workers', type=int, required=False, default=os.cpu_count(),
+              help='Number of processes to parse messages with')
+@click.option('-o', '--output_format', type=click.Choice(['json', 'jsonl']), required=False, default='json',
+              help='json file per email in year/month folders or jsonl shards partitioned by year and month')
 def main(filename: str,
-         max_lines: int,
+         max_bytes: int,
          max_emails: int,
          run_name: str,
          dummy: bool,
          count_increment: int,
-         begin_line: int) -> None:
+         begin_offset: int,
+         resume: bool,
+         workers: int,
+         output_format: str) -> None:
     """Main Function"""
 
     # start perf logging
     loglist = []
     loglist = perf_log("Begin",loglist)
 
-    # work out embeddings
-    embeddings = tiktoken.encoding_for_model("gpt-4o")
-
-    # compile re
-    re_from_line = re.compile(f'^From ')
-    re_file_name_removals = re.compile(r'[^A-Za-z0-9-_@\.]+')
-
     # output location
     input_path = os.path.split(filename)[0] # Head
     output_dir = os.path.join(input_path,run_name)
@@ -92,124 +100,167 @@ def main(filename: str,
         os.mkdir(output_dir)
     print(f'Writing to: {output_dir}')
 
-    # cycle through file without examining all of it.
-    file_in = open(filename,mode="r",encoding="utf8")
+    # restart from the checkpoint, kept out of the output so later scripts don't read it as an email
+    checkpoint_file_name = os.path.join(input_path,run_name + CHECKPOINT_FILE_SUFFIX)
+    if resume:
+        begin_offset = read_checkpoint(checkpoint_file_name)
+        print(f'Resuming from offset: {begin_offset}')
 
     # shouldn't matter than utf8 here
     # enca <takeout> --language=none
     # 7bit ASCII characters
     # CRLF line terminators
-
-    current_email_str = ""
+    with open(filename,mode="rb") as file_in:
+        with mmap.mmap(file_in.fileno(),0,access=mmap.ACCESS_READ) as mm:
+            end_offset = mm.size()
+            if max_bytes > 0 and begin_offset + max_bytes < end_offset:
+                # finish the message the limit falls in so the checkpoint is where the next one starts
+                end_offset = next_message_start(mm, begin_offset + max_bytes)
+            spans = message_spans(mm, build_offset_index(mm, begin_offset, end_offset), end_offset)
+    if max_emails > 0:
+        spans = spans[0:max_emails]
+    loglist = perf_log("Indexed",loglist)
+    print(f'Indexed {len(spans)} messages in {loglist[-1]["duration"]:.2f}s')
+
+    if dummy:
+        return
+
+    # parse in parallel, results come back in file order so the checkpoint is everything before
     count_emails = 0
-    count_lines = 0
-    count_unit = count_increment
-    started = False
-
-    # cycling through every line in the file
-    for line in file_in:
-
-        # exit if we've done enough
-        if max_lines > 0 and count_lines > max_lines:
-            break
-
-        # don't start mid way through an email
-        if count_lines >= begin_line and not dummy:
-
-            # overall try and catch resetting the started in case there is something serious
-            try:
-
-                # see id it's the start od a new message
-                if re_from_line.match(line):
-
-                    # id not started, or restarted in the middel of message clear the incomplete message
-                    if started == False:
-                        current_email_str = ""
-                        started = True
-                        print("Started")
-                        continue
-
-                    # get the message object and parse it down.
-                    msg = email.message_from_string(current_email_str,policy=policy.default)
-                    custom = parse_message(msg,get_skeleton(),embeddings)
-
-                    # workout output name
-                    if custom["timestamp"] != '':
-                        output_file_year = os.path.join(output_dir,custom["Year"])
-                        if not os.path.isdir(output_file_year):
-                            os.mkdir(output_file_year)
-                        output_file_month = os.path.join(output_dir,custom["Year"],custom["Month"])
-                        timestamp = custom["timestamp"]
-                    else:
-                        output_file_month = os.path.join(output_dir,"date_unknown")
-                        timestamp = "unknown"
-                    if not os.path.isdir(output_file_month):
-                        os.mkdir(output_file_month)
-
-                    try:
-                        # From cleansed
-                        if isinstance(custom["From"],list):
-                            from_cleansed = '-'.join(custom["From"])
-                        elif isinstance(custom["From"],str):
-                            from_cleansed = custom["From"]
-                        else:
-                            raise RuntimeError("Unknown type of custom[From]")
-                        from_cleansed = re_file_name_removals.sub("-",from_cleansed)
-                        from_cleansed = from_cleansed.strip("-")
-                        output_file_name = os.path.join(output_file_month,f'{timestamp}-{from_cleansed}.json')
-                        if(len(output_file_name)>200):
-                            print("SKIPPING")
-                        else:
-                            with open(output_file_name,mode="w",encoding="utf8") as file_out:
-                                if(len(output_file_name)>200):
-                                    raise RuntimeError("NameTooLong")
-                                else:
-                                    json.dump(custom,file_out,indent=2)
-                                    # print(output_file_name)
-                                file_out.close()
-                    except Exception as e:
-                        print(custom)
-                        quit()
-                        output_file_month = os.path.join(output_dir,"error")
-                        if not os.path.isdir(output_file_month):
-                            os.mkdir(output_file_month)
-                        output_file_name = os.path.join(output_file_month,f'{datetime.datetime.now().isoformat()}-{from_cleansed}.json')
-                        with open(output_file_name,mode="w",encoding="utf8") as file_out:
-                            file_out.write(str(e))
-
-                    current_email_str = ""
-                    if max_emails > 0 and count_emails + 1 > max_emails:
-                        print("Finishing")
-                        break
-                    count_emails = count_emails + 1
-                else:
-                    current_email_str = current_email_str + line
-            except Exception as e:
-                print("Foobar resetting started")
-                print(str(e))
-                print(custom)
-                started = False
-
-        #iterate counter
-        count_lines = count_lines + 1
-
-        # Log progress according to an interval
-        if count_lines > count_unit:
-            loglist = perf_log(count_unit, loglist)
-            print(loglist[-1])
-            count_unit = count_unit + count_increment
-
-
-    print(f"Processed lines:  {max_lines}")
-    print(f"Processed emails: {count_emails}")
+    count_errors = 0
+    started = time.perf_counter()
+    with Pool(max(1, workers), initializer=init_worker, initargs=[filename, output_dir, output_format]) as pool:
+        for end, error in pool.imap(process_span, spans, chunksize=64):
+            count_emails = count_emails + 1
+            if error != '':
+                count_errors = count_errors + 1
+                print(f'Error in message ending at offset {end}: {error}')
+            if count_emails % count_increment == 0:
+                write_checkpoint(checkpoint_file_name, end)
+                rate = count_emails / (time.perf_counter() - started)
+                print(f'Processed emails: {count_emails} errors: {count_errors} '
+                      f'offset: {end} emails per second: {rate:.1f}')
+    if len(spans) > 0:
+        write_checkpoint(checkpoint_file_name, spans[-1][1])
+
+    elapsed = time.perf_counter() - started
+    print(f"Processed bytes:  {begin_offset} to {end_offset}")
+    print(f"Processed emails: {count_emails} errors: {count_errors}")
+    print(f"Emails per second: {count_emails / max(elapsed, 1e-9):.1f}")
     loglist = perf_log("Finish",loglist)
     for l in loglist:
         print(l)
 
-    # 7 seconds per 10M lines
-    # 2326 emails per 10M lines
-    # ~ 4,300 lines per email
-    file_in.close()
+def build_offset_index(mm: mmap.mmap, begin_offset: int, end_offset: int) -> list:
+    """Byte offsets of every line starting "From " from the first at or after begin_offset up to end_offset"""
+    offsets = []
+    if begin_offset == 0 and mm[0:5] == b'From ':
+        offsets.append(0)
+    position = max(begin_offset - 1, 0)
+    while True:
+        position = mm.find(b'\nFrom ', position, end_offset)
+        if position < 0:
+            break
+        offsets.append(position + 1)
+        position = position + 1
+    return offsets
+
+def next_message_start(mm: mmap.mmap, offset: int) -> int:
+    """Offset of the first "From " line starting at or after offset, or the end of the file"""
+    if offset == 0 and mm[0:5] == b'From ':
+        return 0
+    position = mm.find(b'\nFrom ', max(offset - 1, 0))
+    return position + 1 if position >= 0 else mm.size()
+
+def message_spans(mm: mmap.mmap, offsets: list, end_offset: int) -> list:
+    """(start, end) of each message body after its From line, the last one running to end_offset"""
+    spans = []
+    for i, offset in enumerate(offsets):
+        start = mm.find(b'\n', offset, end_offset)
+        if start < 0:
+            continue
+        end = offsets[i + 1] if i + 1 < len(offsets) else end_offset
+        spans.append((start + 1, end))
+    return spans
+
+def init_worker(filename: str, output_dir: str, output_format: str = 'json'):
+    """Each worker maps the file and builds its own encoder once, and its own shard writer for jsonl"""
+    file_in = open(filename,mode="rb")
+    worker_state["mm"] = mmap.mmap(file_in.fileno(),0,access=mmap.ACCESS_READ)
+    worker_state["output_dir"] = output_dir
+    worker_state["embeddings"] = tiktoken.encoding_for_model("gpt-4o")
+    worker_state["re_file_name_removals"] = re.compile(r'[^A-Za-z0-9-_@\.]+')
+    worker_state["shard_writer"] = None
+    if output_format == 'jsonl':
+        worker_state["shard_writer"] = mbox_shards.ShardWriter(output_dir)
+
+def process_span(span: tuple) -> tuple:
+    """Parse and write the message in span returning (end offset, error)"""
+    start, end = span
+    try:
+        # same newline handling as reading the file in text mode
+        text = worker_state["mm"][start:end].decode("utf8", errors="replace")
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+        msg = email.message_from_string(text,policy=policy.default)
+        custom = parse_message(msg,get_skeleton(),worker_state["embeddings"])
+        if worker_state["shard_writer"] is not None:
+            output_file_name = get_output_file_name(custom, worker_state["output_dir"],
+                                                    worker_state["re_file_name_removals"])
+            custom["filename"] = os.path.basename(output_file_name)
+            custom["source_offset"] = start
+            worker_state["shard_writer"].write(custom)
+        else:
+            write_message(custom, worker_state["output_dir"], worker_state["re_file_name_removals"])
+    except Exception as e: # pylint: disable=broad-exception-caught
+        return (end, f'{type(e).__name__}: {e}')
+    return (end, '')
+
+def write_message(custom: dict, output_dir: str, re_file_name_removals: re.Pattern) -> str:
+    """Write the parsed message into its year/month folder returning the file name or '' if skipped"""
+
+    output_file_name = get_output_file_name(custom, output_dir, re_file_name_removals)
+    if len(output_file_name) > 200:
+        print("SKIPPING")
+        return ''
+    os.makedirs(os.path.dirname(output_file_name),exist_ok=True)
+    with open(output_file_name,mode="w",encoding="utf8") as file_out:
+        json.dump(custom,file_out,indent=2)
+    return output_file_name
+
+def get_output_file_name(custom: dict, output_dir: str, re_file_name_removals: re.Pattern) -> str:
+    """Year/month folder and file name for a parsed message"""
+
+    # workout output name
+    if custom["timestamp"] != '':
+        output_file_month = os.path.join(output_dir,custom["Year"],custom["Month"])
+        timestamp = custom["timestamp"]
+    else:
+        output_file_month = os.path.join(output_dir,"date_unknown")
+        timestamp = "unknown"
+
+    # From cleansed
+    if isinstance(custom["From"],list):
+        from_cleansed = '-'.join(custom["From"])
+    elif isinstance(custom["From"],str):
+        from_cleansed = custom["From"]
+    else:
+        raise RuntimeError("Unknown type of custom[From]")
+    from_cleansed = re_file_name_removals.sub("-",from_cleansed)
+    from_cleansed = from_cleansed.strip("-")
+    return os.path.join(output_file_month,f'{timestamp}-{from_cleansed}.json')
+
+def read_checkpoint(checkpoint_file_name: str) -> int:
+    """Offset everything before which a previous run wrote"""
+    if not os.path.isfile(checkpoint_file_name):
+        return 0
+    with open(checkpoint_file_name,mode="r",encoding="utf8") as file_in:
+        return json.load(file_in)["offset"]
+
+def write_checkpoint(checkpoint_file_name: str, offset: int):
+    """Record the offset to resume from, replaced in one step so it is never half written"""
+    with open(checkpoint_file_name + ".tmp",mode="w",encoding="utf8") as file_out:
+        json.dump({"offset": offset, "updated": datetime.datetime.now().isoformat()},file_out)
+    os.replace(checkpoint_file_name + ".tmp", checkpoint_file_name)
 
 def parse_message(msg: Message,output_dict: collections.OrderedDict, embeddings) -> dict:
     """Parse and object and produce simplified dict"""
@@ -0,0 +1,112 @@
+"""
+Test mbox/mbox_shards.py partitions, projects and deduplicates records and mbox_add_pp.py --shards round trips them
+
+"""
+# ***************************************************************************80**************************************120
+
+# standard imports
+import os
+import sys
+import pathlib
+import importlib
+
+# 3rd party imports
+import pytest
+import tiktoken
+from click.testing import CliRunner
+
+# custom imports
+sys.path.insert(1, str(pathlib.Path(os.path.dirname(os.path.realpath(__file__))) / "mbox"))
+import mbox_shards # file under test # pylint: disable=wrong-import-position
+
+class FakeEncoder:
+    """Stands in for tiktoken so nothing is downloaded, a token per word"""
+
+    def encode(self, text: str) -> list:
+        """Words as tokens"""
+        return text.split()
+
+@pytest.fixture
+def mbox_add_pp(monkeypatch):
+    """mbox_add_pp builds its encoder on import so import it with the fake one"""
+    monkeypatch.setattr(tiktoken, "encoding_for_model", lambda model: FakeEncoder())
+    return importlib.import_module("mbox_add_pp")
+
+def make_record(offset: int, year: str, month: str, subject: str = '') -> dict:
+    """A record as the splitter writes it"""
+    content = f'From: a{offset}@example.com Body: see https://example.com/track?id={offset} thanks'
+    return {"From": f'a{offset}@example.com', "To": "b@example.com", "Cc": "", "Subject": subject or f'm{offset}',
+            "Year": year, "Month": month, "content": content, "tokens": len(content.split()),
+            "filename": f'{offset}.json', "source_offset": offset}
+
+def write_shards(directory: str) -> None:
+    """Two months of 2023, one of 2024 and an undated record, small shards so partitions roll over"""
+    with mbox_shards.ShardWriter(directory, max_records=2) as writer:
+        writer.write(make_record(0, "2023", "01"))
+        writer.write(make_record(10, "2023", "02"))
+        writer.write(make_record(20, "2023", "02"))
+        writer.write(make_record(30, "2023", "02"))
+        writer.write(make_record(40, "2024", "01"))
+        writer.write(make_record(50, "", ""))
+        # a resumed run rewrote the message at offset 20
+        writer.write(make_record(20, "2023", "02", subject="rewritten"))
+
+def test_list_shards_filters_partitions(tmp_path):
+    """Years and months pick folders, an undated record goes to unknown"""
+    write_shards(str(tmp_path))
+    shards = mbox_shards.list_shards(str(tmp_path))
+    partitions = sorted({os.path.relpath(os.path.dirname(shard), tmp_path) for shard in shards})
+    assert partitions == [os.path.join("year=2023", "month=01"), os.path.join("year=2023", "month=02"),
+                          os.path.join("year=2024", "month=01"), os.path.join("year=unknown", "month=unknown")]
+    # max_records=2 rolled 2023/02 over into a second shard
+    assert len(mbox_shards.list_shards(str(tmp_path), years=["2023"], months=["02"])) == 2
+    assert len(mbox_shards.list_shards(str(tmp_path), years=["2024"])) == 1
+    assert len(mbox_shards.list_shards(str(tmp_path), months=["01"])) == 2
+    assert not mbox_shards.list_shards(str(tmp_path), years=["2022"])
+
+def test_read_dataframe_projects_and_keeps_last_per_offset(tmp_path):
+    """Only the chosen columns come back and a rewritten offset keeps its last copy"""
+    write_shards(str(tmp_path))
+    df = mbox_shards.read_dataframe(str(tmp_path), years=["2023"], columns=["Subject"])
+    assert list(df.columns) == ["Subject"]
+    assert sorted(df["Subject"].to_list()) == ["m0", "m10", "m30", "rewritten"]
+
+    df = mbox_shards.read_dataframe(str(tmp_path), years=["2023"], months=["02"], columns=["Subject", "source_offset"])
+    assert list(df.columns) == ["Subject", "source_offset"]
+    assert sorted(zip(df["source_offset"], df["Subject"])) == [(10, "m10"), (20, "rewritten"), (30, "m30")]
+
+    df = mbox_shards.read_dataframe(str(tmp_path))
+    assert len(df) == 6
+
+def test_half_written_line_is_skipped(tmp_path):
+    """An interrupted write leaves a partial last line which readers ignore"""
+    write_shards(str(tmp_path))
+    shard = mbox_shards.list_shards(str(tmp_path), years=["2024"])[0]
+    with open(shard, mode="a", encoding="utf8") as file_out:
+        file_out.write('{"Subject": "half')
+    assert [record["Subject"] for record in mbox_shards.read_shard(shard)] == ["m40"]
+
+def test_add_pp_shards_round_trip(tmp_path, mbox_add_pp):
+    """--shards reads the chosen partitions and writes processed records to the same partitions"""
+    input_dir = str(tmp_path / "shards")
+    output_dir = str(tmp_path / "shards_pp")
+    write_shards(input_dir)
+    runner = CliRunner()
+    result = runner.invoke(mbox_add_pp.main, ["-d", input_dir, "-o", output_dir, "-s", "-y", "2023"])
+    assert result.exit_code == 0, result.output
+
+    partitions = sorted({os.path.relpath(os.path.dirname(shard), output_dir)
+                         for shard in mbox_shards.list_shards(output_dir)})
+    assert partitions == [os.path.join("year=2023", "month=01"), os.path.join("year=2023", "month=02")]
+    df = mbox_shards.read_dataframe(output_dir, columns=["Subject", "from_participant", "shrunk_content",
+                                                         "tokens_difference"])
+    assert sorted(df["Subject"].to_list()) == ["m0", "m10", "m30", "rewritten"]
+    record = df[df["Subject"] == "m10"].iloc[0]
+    assert record["from_participant"] == "a10@example.com"
+    assert record["shrunk_content"] == "From: a10@example.com Body: see link thanks"
+    assert record["tokens_difference"] == 0
+
+    # max_records stops early
+    count = mbox_add_pp.process_shards(input_dir, str(tmp_path / "limited"), mbox_add_pp.do_all_these_things, 3)
+    assert count == 3
+    assert len(mbox_shards.read_dataframe(str(tmp_path / "limited"))) == 3
@@ -0,0 +1,125 @@
+"""
+Test mbox/mbox_splitter.py indexes message boundaries, rounds --max_bytes to a message and resumes from its checkpoint
+
+"""
+# ***************************************************************************80**************************************120
+
+# standard imports
+import os
+import sys
+import mmap
+import json
+import pathlib
+
+# 3rd party imports
+from click.testing import CliRunner
+
+# custom imports
+sys.path.insert(1, str(pathlib.Path(os.path.dirname(os.path.realpath(__file__))) / "mbox"))
+import mbox_splitter # file under test # pylint: disable=wrong-import-position
+import mbox_shards # pylint: disable=wrong-import-position
+
+# a quoted From line and one mid line which must not start a message
+BODY_WITH_FROM = ">From the archive, quoted\nSent From my phone\n"
+
+class FakeEncoder:
+    """Stands in for tiktoken so nothing is downloaded, a token per word"""
+
+    def encode(self, text: str) -> list:
+        """Words as tokens"""
+        return text.split()
+
+def make_message(i: int, body: str = '') -> str:
+    """A plain text message dated the i+1th of January"""
+    return (f"From sender{i}@example.com Mon Jan {i + 1} 10:00:00 2024\n"
+            f"From: Sender {i} <sender{i}@example.com>\n"
+            "To: someone@example.com\n"
+            f"Date: {i + 1:02d} Jan 2024 10:00:00 +0000\n"
+            f"Subject: Message {i}\n"
+            "Content-Type: text/plain; charset=utf-8\n"
+            "\n"
+            f"Body of message {i}\n{body}\n")
+
+def write_mbox(directory: pathlib.Path, count: int) -> tuple:
+    """Writes count messages, the second with From in its body, returning the file name and message offsets"""
+    messages = [make_message(i, BODY_WITH_FROM if i == 1 else '') for i in range(count)]
+    offsets = []
+    position = 0
+    for message in messages:
+        offsets.append(position)
+        position = position + len(message.encode("utf8"))
+    filename = directory / "test.mbox"
+    filename.write_bytes("".join(messages).encode("utf8"))
+    return str(filename), offsets
+
+def test_offset_index_and_spans(tmp_path):
+    """Every From line starting a message is indexed and nothing in a body is"""
+    filename, offsets = write_mbox(tmp_path, 4)
+    with open(filename, mode="rb") as file_in:
+        with mmap.mmap(file_in.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            assert mbox_splitter.build_offset_index(mm, 0, mm.size()) == offsets
+            # from inside the first message or exactly on the second
+            assert mbox_splitter.build_offset_index(mm, 10, mm.size()) == offsets[1:]
+            assert mbox_splitter.build_offset_index(mm, offsets[1], mm.size()) == offsets[1:]
+            # up to the end offset only
+            assert mbox_splitter.build_offset_index(mm, 0, offsets[2]) == offsets[0:2]
+
+            assert mbox_splitter.next_message_start(mm, 0) == 0
+            assert mbox_splitter.next_message_start(mm, 1) == offsets[1]
+            assert mbox_splitter.next_message_start(mm, offsets[1]) == offsets[1]
+            assert mbox_splitter.next_message_start(mm, offsets[1] + 1) == offsets[2]
+            assert mbox_splitter.next_message_start(mm, offsets[3] + 1) == mm.size()
+
+            spans = mbox_splitter.message_spans(mm, offsets, mm.size())
+            assert [end for _, end in spans] == offsets[1:] + [mm.size()]
+            for (start, end), offset in zip(spans, offsets):
+                # each body starts after its From line
+                assert mm[offset:start].startswith(b'From ')
+                assert mm[offset:start].endswith(b'\n')
+                assert mm[start:end].startswith(b'From: Sender')
+            assert BODY_WITH_FROM.encode("utf8") in mm[spans[1][0]:spans[1][1]]
+
+def run_splitter(monkeypatch, filename: str, *args) -> str:
+    """Runs main with one worker and the fake encoder returning its output"""
+    monkeypatch.setattr(mbox_splitter.tiktoken, "encoding_for_model", lambda model: FakeEncoder())
+    runner = CliRunner()
+    result = runner.invoke(mbox_splitter.main, ["-f", filename, "-w", "1", *args])
+    assert result.exit_code == 0, result.output
+    return result.output
+
+def read_checkpoint(directory: pathlib.Path, run_name: str = "output") -> int:
+    """Offset the run checkpointed"""
+    with open(directory / (run_name + mbox_splitter.CHECKPOINT_FILE_SUFFIX), mode="r", encoding="utf8") as file_in:
+        return json.load(file_in)["offset"]
+
+def test_max_bytes_rounds_up_to_a_whole_message(tmp_path, monkeypatch):
+    """A limit inside the second message finishes it and checkpoints the third's From line"""
+    filename, offsets = write_mbox(tmp_path, 4)
+    run_splitter(monkeypatch, filename, "-m", str(offsets[1] + 5))
+    assert read_checkpoint(tmp_path) == offsets[2]
+    written = sorted(os.listdir(tmp_path / "output" / "2024" / "01"))
+    assert written == ["2024-01-01T10:00:00+00:00-Sender-0-sender0@example.com.json",
+                       "2024-01-02T10:00:00+00:00-Sender-1-sender1@example.com.json"]
+    with open(tmp_path / "output" / "2024" / "01" / written[1], mode="r", encoding="utf8") as file_in:
+        message = json.load(file_in)
+    assert message["content"].endswith("Body: Body of message 1\n" + BODY_WITH_FROM + "\n")
+    assert message["tokens"] == len(message["content"].split())
+
+    # a limit exactly on a message start stops there
+    run_splitter(monkeypatch, filename, "-m", str(offsets[3]), "-r", "exact")
+    assert read_checkpoint(tmp_path, "exact") == offsets[3]
+
+def test_resume_from_checkpoint_neither_drops_nor_repeats(tmp_path, monkeypatch):
+    """A limited run then a resumed one write every message exactly once"""
+    filename, offsets = write_mbox(tmp_path, 6)
+    run_splitter(monkeypatch, filename, "-m", str(offsets[2] + 20), "-o", "jsonl")
+    assert read_checkpoint(tmp_path) == offsets[3]
+    output = run_splitter(monkeypatch, filename, "-k", "-o", "jsonl")
+    assert f'Resuming from offset: {offsets[3]}' in output
+    assert read_checkpoint(tmp_path) == os.path.getsize(filename)
+
+    records = list(mbox_shards.iter_records(str(tmp_path / "output"), columns=["Subject", "source_offset"]))
+    assert sorted(record["Subject"] for record in records) == [f'Message {i}' for i in range(6)]
+    # source offsets are where each body starts, after its From line
+    assert sorted(record["source_offset"] for record in records) == [
+        offset + len(make_message(i).split("\n", 1)[0]) + 1 for i, offset in enumerate(offsets)]
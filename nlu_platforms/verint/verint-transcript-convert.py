@@ -12,7 +12,11 @@
 # --threshold to split utterances based on silence - default 150 (ms)
 # --skip      through warning and skip bad files
 # --maxms     discard utterances starting after this threshold (default infinity == 0)
-# 
+# --workers   processes converting files in directory mode (default number of cpus)
+#
+# In directory mode every file in every sub directory is converted in a pool of processes
+# and the examples for each sub directory are written once all of its files are done.
+#
 # *****************************************************************************
 
 # standard imports
@@ -20,16 +24,22 @@ import os
 from io import TextIOWrapper
 import json
 from dateutil import parser
-import copy
+from multiprocessing import Pool
+import functools
+import sys
+import pathlib
 
 # third party imports
+import numpy
 import pandas
 import click
-import datetime
 
 
 # custom imports
-import common
+import humanfirst
+hf_module_path = str(pathlib.Path(os.path.dirname(os.path.realpath(__file__))).parent.parent)
+sys.path.insert(1, hf_module_path)
+import conversation_index # pylint: disable=wrong-import-position
 
 
 @click.command()
@@ -38,7 +48,8 @@ import common
 @click.option('-t', '--threshold',type=int,default=150,help='Word gap threshold ms')
 @click.option('-k', '--skip',is_flag=True,default=False,help='Log and continue if a single file failes')
 @click.option('-m', '--maxms',type=int,default=0,help='Maximum number of miliseconds of call to process')
-def main(directory: str, file: str, threshold: int, skip: bool, maxms: int):
+@click.option('-w', '--workers',type=int,default=os.cpu_count(),help='Processes to convert files with in directory mode')
+def main(directory: str, file: str, threshold: int, skip: bool, maxms: int, workers: int):
 
 
     # single file mode, products
@@ -52,35 +63,53 @@ def main(directory: str, file: str, threshold: int, skip: bool, maxms: int):
     # produces a single json per sub directory
     else:
         dir_name_list = get_directory_list(directory)
-        for dir in dir_name_list:    
-            print(f'Processing directory {dir}')
-            file_name_list = get_file_list(dir)
-            df = pandas.DataFrame()
-            for file in file_name_list:
-                try:
-                    directory, file_uri = validate_args(dir, file)
-                    json_obj = read_json(file_uri)
-                    df_temp = process(json_obj,threshold,maxms)
-                except Exception as e:
-                    print(e)
+        dir_file_list = []
+        for dir in dir_name_list:
+            for file in get_file_list(dir):
+                dir_file_list.append((dir, file))
+        print(f'Converting {len(dir_file_list)} files from {len(dir_name_list)} directories with {workers} workers')
+
+        # files come back in order so a sub directory is written as soon as its last file is converted
+        last_file_in_dir = dict(dir_file_list)
+        convert = functools.partial(convert_file, threshold=threshold, maxms=maxms)
+        examples_by_dir = {dir: [] for dir in last_file_in_dir.keys()}
+        with Pool(workers) as pool:
+            for dir, file, examples, error in pool.imap(convert, dir_file_list, chunksize=16):
+                if error != '':
+                    print(error)
                     print(f'WARNING Failed on file: {file}')
                     if skip:
                         print(f'Skip mode on - continuing')
                     else:
                         quit()
-                if df.empty:
-                    df = df_temp
                 else:
                     # batch all the files within a subfolder for easier uploading
-                    df = pandas.concat([df,df_temp],axis=0)
-            file_out = f'{dir}-hf.json'
-            file_out = file_out.replace(' ','-')
-            write_output(df['example'].to_list(),file_out)
+                    examples_by_dir[dir].extend(examples)
+                if last_file_in_dir[dir] == file:
+                    write_dir_output(dir, examples_by_dir.pop(dir))
+
+def write_dir_output(dir: str, examples: list):
+    '''Write the examples of a sub directory next to it'''
+    file_out = f'{dir}-hf.json'
+    file_out = file_out.replace(' ','-')
+    write_output(examples,file_out)
+
+def convert_file(dir_file: tuple, threshold: int, maxms: int) -> tuple:
+    '''Convert one file in a worker returning (dir, file, examples, error)'''
+    dir, file = dir_file
+    try:
+        directory, file_uri = validate_args(dir, file)
+        json_obj = read_json(file_uri)
+        df = process(json_obj,threshold,maxms)
+        examples = df['example'].to_list() if 'example' in df.columns else []
+        return dir, file, examples, ''
+    except Exception as e:
+        return dir, file, [], str(e)
 
 def write_output(examples: list, output_file_uri: str):
         '''Build a workspace from the examples and write it to file'''
         # write output 
-        unlabelled_workspace = common.HFWorkspace()
+        unlabelled_workspace = humanfirst.objects.HFWorkspace()
         for example in examples:
             unlabelled_workspace.add_example(example)
         
@@ -111,85 +140,65 @@ def process(json_obj:dict, threshold: int, maxms: int):
     metadata = build_metadata(metadata,metadata_subobj_fields,json_obj['metadata'])
     
     # better word level - assembling own passages with a configurable silence threshold to split speaker segments.
-    if len(json_obj["transcript_detailed"]["words"]) <= 1:
-        return pandas.DataFrame()
-    prev = {
-        "p":0,
-        "s":0,
-        "e":0,
-        "w":"",
-        "sp":""
-    }
     words = json_obj["transcript_detailed"]["words"]
-    utterances = []
-    u = {
-        "g":0,
-        "s":0,
-        "e":0,
-        "utterance": "",
-        "sp":""
-    }
-    gap = 0
-    for i, word_obj in enumerate(words):
-        begin = False
-        gap = words[i]["s"] - prev["e"]
-        if prev["sp"] != words[i]["sp"]:
-            gap = 0
-            begin = True
-        if gap > threshold:
-            begin = True
-        if begin:
-            if u["s"] > 0:
-                utterances.append(u)
-            u = {
-                "g": gap,
-                "s":words[i]["s"],
-                "e":words[i]["e"],
-                "utterance": words[i]["w"],
-                "sp": words[i]["sp"]
-            }
-            begin = True
-        else:
-            u["utterance"] = u["utterance"] + " " + words[i]["w"]
-            u["e"] = words[i]["e"]
-
-        words[i]["b"] = begin
-        words[i]["g"] = gap
-        prev = word_obj
-
-    df = pandas.json_normalize(utterances)
-    df = df.rename(columns={'g':'gap','s':'start_ms','e':'end_ms','sp':'verint_role'})
+    if len(words) <= 1:
+        return pandas.DataFrame()
+    df = segment_words(words, threshold)
 
     # verint to hf role mapping
     role_mapping = {
         'Customer': 'client',
         'Agent':    'expert',
     }
-    df['role'] = df['verint_role'].apply(map_roles,args=[role_mapping])
+    df['role'] = df['verint_role'].map(role_mapping)
+    unmapped = df.loc[df['role'].isna(), 'verint_role']
+    if len(unmapped) > 0:
+        map_roles(unmapped.iloc[0], role_mapping)
 
     # created_at
     convo_start =  parser.parse(metadata['AUDIO_START_TIME'])
-    df['created_at'] = df['start_ms'].apply(created_at,args=[convo_start])
+    df['created_at'] = convo_start + pandas.to_timedelta(df['start_ms'], unit='ms')
 
     # index the speakers by speaker
-    df['idx'] = df.index
-    df['idx_max'] = df.index.max()
-    df['idx_client'] = df.groupby(['role']).cumcount().where(df.role == 'client', 0)
-    df['idx_client_max'] = df['idx_client'].max()
-    df['idx_expert'] = df.groupby(['role']).cumcount().where(df.role == 'expert', 0)
-    df['idx_expert_max'] = df['idx_expert'].max()
-
-    df = df.apply(index_utt_flags,axis=1)
-    
+    df = index_utt_flags(df)
+
     # if only care about first section of call
     if maxms > 0:
         df = df[df["start_ms"]<=maxms]
 
     # build examples
-    df = df.apply(build_example,args=[metadata],axis=1)
+    df['example'] = build_examples(df, metadata)
 
     return df
 
+def segment_words(words: list, threshold: int) -> pandas.DataFrame:
+    '''Splits the words into utterances wherever the speaker changes or the silence
+    since the previous word is more than threshold ms, working on arrays of the word fields
+
+    Returns a row per utterance of gap, start_ms, end_ms, utterance, verint_role'''
+    starts = numpy.array([word["s"] for word in words])
+    ends = numpy.array([word["e"] for word in words])
+    speakers = numpy.array([word["sp"] for word in words], dtype=object)
+    texts = [word["w"] for word in words]
+
+    # gap to the previous word, 0 where the speaker changes which always begins an utterance
+    speaker_change = numpy.ones(len(words), dtype=bool)
+    speaker_change[1:] = speakers[1:] != speakers[:-1]
+    gaps = numpy.zeros(len(words), dtype=starts.dtype)
+    gaps[1:] = starts[1:] - ends[:-1]
+    gaps[speaker_change] = 0
+    begins = speaker_change | (gaps > threshold)
+
+    first_words = numpy.flatnonzero(begins)
+    last_words = numpy.append(first_words[1:], len(words)) - 1
+    return pandas.DataFrame({
+        'gap': gaps[first_words],
+        'start_ms': starts[first_words],
+        'end_ms': ends[last_words],
+        'utterance': [" ".join(texts[first:last + 1]) for first, last in zip(first_words, last_words)],
+        'verint_role': speakers[first_words]
+    })
+
 def get_directory_list(directory: str) -> list:
     '''Get a list of sub directories'''
     if not directory.endswith('/'):
@@ -220,64 +229,40 @@ def get_file_list(directory: str) -> list:#
             file_name_list.append(file_name)
     return file_name_list  
 
-def index_utt_flags(row: pandas.Series) -> pandas.Series:
+def index_utt_flags(df: pandas.DataFrame) -> pandas.DataFrame:
     '''Build flags for first, second, final client/expert
     This allows filtering to look at just the start or end of the conversation'''
 
-    # create fallback/initial part metadata
-    row["final_utt"] = False
-    if row['idx'] == row['idx_max']:
-        row["final_utt"] = True
-
-    # client
-    row["first_client_utt"] = False
-    row["second_client_utt"] = False
-    row["final_client_utt"] = False
-    if row["role"] == "client":
-        if row['idx_client'] == 0:
-            row["first_client_utt"] = True
-        if row['idx_client'] == 1:
-            row["second_client_utt"] = True 
-        if row['idx_client'] == row['idx_client_max']:
-            row["final_client_utt"] = True
-
-    # expert
-    row["first_expert_utt"] = False
-    row["second_expert_utt"] = False
-    row["final_expert_utt"] = False
-    if row["role"] == "expert":
-        if row['idx_expert'] == 0:
-            row["first_expert_utt"] = True
-        if row['idx_expert'] == 1:
-            row["second_expert_utt"] = True
-        if row['idx_expert'] == row['idx_expert_max']:
-            row["final_expert_utt"] = True
-    
-    return row    
-    
-def created_at(start_ms: int, convo_start: datetime) -> datetime:
-    '''Calculate an utterance start time based on a delta from start of conversation'''
-    return convo_start + datetime.timedelta(milliseconds=start_ms)
+    # one call per frame so the whole frame is the conversation
+    df = conversation_index.index_conversations(df)
+    df["final_utt"] = df['idx'] == df['idx_max']
+    for role in ['client', 'expert']:
+        df = df.rename(columns={f'idx_max_{role}': f'idx_{role}_max', f'last_{role}_utt': f'final_{role}_utt'})
+    return df
 
-def build_example(row: pandas.Series, metadata: dict) -> pandas.Series:
-    '''Creates a HumanFirst unlabelled utterance example linking it to it's conversation and adding metadata'''
+def build_examples(df: pandas.DataFrame, metadata: dict) -> list:
+    '''Creates a HumanFirst unlabelled utterance example for each row linking it to it's conversation and adding metadata'''
 
     key_fields = ['gap','start_ms','end_ms','idx','final_utt',\
         'first_client_utt','second_client_utt','final_client_utt',\
         'first_expert_utt','second_expert_utt','final_expert_utt']
-    row_metadata = copy.deepcopy(build_metadata(metadata,key_fields,row))
-
-    example = common.HFExample(
-        text=row['utterance'],
-        id=f'{row_metadata["mediaId"]}-{row["start_ms"]}',
-        created_at=row['created_at'],
-        intents=[], # no intents as unlabelled
-        tags=[], # no tags only metadata on unlabelled
-        metadata=row_metadata,
-        context=common.HFContext(str(row_metadata['mediaId']),'conversation',row['role'])
-    )
-    row['example'] = example
-    return row
+    columns = {key: df[key].to_list() for key in key_fields + ['utterance','created_at','role']}
+
+    examples = []
+    for i in range(df.shape[0]):
+        row_metadata = dict(metadata)
+        for key in key_fields:
+            row_metadata[key] = str(columns[key][i])
+        examples.append(humanfirst.objects.HFExample(
+            text=columns['utterance'][i],
+            id=f'{row_metadata["mediaId"]}-{columns["start_ms"][i]}',
+            created_at=columns['created_at'][i],
+            intents=[], # no intents as unlabelled
+            tags=[], # no tags only metadata on unlabelled
+            metadata=row_metadata,
+            context=humanfirst.objects.HFContext(str(row_metadata['mediaId']),'conversation',columns['role'][i])
+        ))
+    return examples
 
 def map_roles(role_in: str, role_mapping: dict) -> str:
     '''Converts verint roles to hf roles'''
@@ -292,9 +277,8 @@ def build_metadata(metadata: dict, field_list: list, source_obj: dict) -> dict:
         try:
             metadata[key] = str(source_obj[key])
         except Exception as e:
-            print(e)
-            print(f'Can\'t find {key} in {",".join(source_obj.keys())}')
-            quit()
+            # raised rather than quit so a worker reports it like any other bad file
+            raise Exception(f'Can\'t find {key} in {",".join(source_obj.keys())}') from e
     return metadata
 
 def validate_args(directory: str, file: str):
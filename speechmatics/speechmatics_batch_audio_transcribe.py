@@ -48,6 +48,13 @@ import speechmatics_helpers
               default='info',
               help='Log levels')
 @click.option('-y', '--speaker_sensitivity', type=float, default = 0.0, help='speaker sensitivity')
+@click.option('-j', '--checkpoint_file', type=str, required=False, default="",
+              help='Submitted job ids for resuming, default speechmatics_jobs.json in the audio folder')
+@click.option('-q', '--poll_interval', type=float, default=5.0, help='Seconds between polls of outstanding jobs')
+@click.option('-u', '--notification_url', type=str, required=False, default="",
+              help='Public url Speechmatics calls as each job finishes, forwarded to --notification_port')
+@click.option('-o', '--notification_port', type=int, required=False, default=0,
+              help='Local port to receive job notifications on so jobs are collected without waiting to poll')
 def main(audio_folder_path: str,
          api_key: str,
          audio_type: str,
@@ -64,7 +71,11 @@ def main(audio_folder_path: str,
          low_confidence_action: str,
          log_folder_path: str,
          log_level: str,
-         speaker_sensitivity: float) -> None:
+         speaker_sensitivity: float,
+         checkpoint_file: str,
+         poll_interval: float,
+         notification_url: str,
+         notification_port: int) -> None:
     """Main Function"""
 
     # set log level
@@ -135,31 +146,40 @@ def main(audio_folder_path: str,
     if process_n > 0:
         untranscribed_audio_file_paths = untranscribed_audio_file_paths[:process_n]
 
-    if untranscribed_audio_file_paths:
-        transcripts, rejected_transcriptions = speechmatics_helpers.batch_transcribe(untranscribed_audio_file_paths,
-                                                            settings,
-                                                            transcription_config,
-                                                            concurrency)
-
-        print(f"Number of Transcriptions successfully completed: {len(transcripts)}")
-        print(f"Number of Transcriptions rejected: {len(rejected_transcriptions)}")
-        end_time = datetime.now()
-        print("Execution time for transcribing:", end_time - start_time)
-
-        if rejected_transcriptions:
-            print("List of rejected transcriptions")
-            for audio, err_msg in rejected_transcriptions.items():
-                print(f"{audio} - {err_msg}")
-
-        start_time = datetime.now()
-        for file_path, transcript in transcripts.items():
-            assert isinstance(file_path,str)
-            file_output = file_path.replace(audio_type,".json")
-            with open(file_output,mode="w",encoding="utf8") as f:
-                json.dump(transcript,f,indent=2)
-
-        end_time = datetime.now()
-        print("Execution time for writing all the transcripts:", end_time - start_time)
+    if not untranscribed_audio_file_paths:
+        return
+
+    if notification_url != "":
+        # speechmatics calls this when each job finishes, it must reach notification_port
+        transcription_config["notification_config"] = [{"url": notification_url}]
+    if checkpoint_file == "":
+        checkpoint_file = os.path.join(audio_folder_path, "speechmatics_jobs.json")
+
+    # write each transcript as soon as its job finishes, whatever order they were submitted in
+    transcribed = 0
+    rejected_transcriptions = {}
+    for file_path, transcript, error in speechmatics_helpers.iter_batch_transcribe(
+            untranscribed_audio_file_paths, settings, transcription_config, concurrency,
+            checkpoint_file=checkpoint_file, poll_interval=poll_interval, notification_port=notification_port):
+        if error is not None:
+            rejected_transcriptions[file_path] = error
+            continue
+        file_output = file_path.replace(audio_type,".json")
+        # write beside and rename so an interrupted run never leaves a partial transcript to be skipped
+        with open(file_output + ".tmp",mode="w",encoding="utf8") as f:
+            json.dump(transcript,f,indent=2)
+        os.replace(file_output + ".tmp", file_output)
+        transcribed = transcribed + 1
+
+    print(f"Number of Transcriptions successfully completed: {transcribed}")
+    print(f"Number of Transcriptions rejected: {len(rejected_transcriptions)}")
+    end_time = datetime.now()
+    print("Execution time for transcribing:", end_time - start_time)
+
+    if rejected_transcriptions:
+        print("List of rejected transcriptions")
+        for audio, err_msg in rejected_transcriptions.items():
+            print(f"{audio} - {err_msg}")
 
 
 def setup_logging(log_file_path: str, log_level: logging):
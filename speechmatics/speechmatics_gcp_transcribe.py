@@ -10,7 +10,8 @@ Make sure your speechmatics is setup (hint: speechmatcis_audio_transcribe.py)
 Takes a bucket name.
 Looks for wavs.
 Compares wavs that have been transcribed with ones that haven't been
-Starts transcribing
+Downloads, transcribes (--transcribe) and uploads (--write_back) them at the same time,
+see speechmatics_pipeline.py, deleting local audio once its transcript is uploaded.
 
 """
 
@@ -25,12 +26,14 @@ import sys
 
 # 3rd party imports
 import click
+from speechmatics.batch_client import BatchClient
 
 # custom imports
 import speechmatics_helpers # Humanfirst Speechmatics helps
+import speechmatics_pipeline # download -> transcribe -> upload stages
 from google_storage_helpers import GoogleStorageHelper # GCP helpers
 
-FOLDER_FILE_SPLIT_DELIMITER = "---"
+STATE_FILE_NAME = "speechmatics_worklist_state.jsonl"
 
 @click.command()
 @click.option('-a', '--api_key', type=str, required=True, help='Api key from speechmatics portal')
@@ -62,6 +65,12 @@ FOLDER_FILE_SPLIT_DELIMITER = "---"
 @click.option('-h', '--default_language', required = False, default="en",
               help='Default language to use in case automatic laguagee detection couldn\'t able to decide')
 @click.option('-y', '--speaker_sensitivity', type=float, default = 0.0, help='speaker sensitivity')
+@click.option('-d', '--download_workers', type=int, default=4, help='Number of downloads at a time')
+@click.option('-e', '--upload_workers', type=int, default=4, help='Number of uploads at a time')
+@click.option('-q', '--queue_size', type=int, default=10,
+              help='Downloaded audio files waiting to be transcribed before downloads pause')
+@click.option('-f', '--state_file', type=str, required=False, default="",
+              help=f'Worklist state file, defaults to {STATE_FILE_NAME} in the working dir')
 def main(
         api_key: str,
         bucket_name: str,
@@ -80,7 +89,11 @@ def main(
         low_confidence_action: str,
         log_folder_path: str,
         log_level: str,
-        speaker_sensitivity: float) -> None:
+        speaker_sensitivity: float,
+        download_workers: int,
+        upload_workers: int,
+        queue_size: int,
+        state_file: str) -> None:
     """Main Function"""
 
     # set log level
@@ -134,127 +147,39 @@ def main(
                                     impersonate_service_account=impersonate_service_account)
 
     df_worklist = gs_helper.get_blob_df_worklist(bucket_name, audio_type, max_results=process_n)
-
-    # Creating a list of all .wav files in the folder
-    audio_files = [f for f in os.listdir(working_dir) if f.endswith(audio_type)]
-
-    # Creating a list of all .json files in the folder
-    transcription_files = [f for f in os.listdir(working_dir) if f.endswith('.json')]
-
-    # Concert source name to audio file name format
-    df_worklist['filename'] = df_worklist['source_name'].apply(lambda x: x.replace("/",FOLDER_FILE_SPLIT_DELIMITER))
-
-    # Check if each file in the DataFrame is in the audio_files list from the local storage
-    df_worklist['downloaded_audio_locally'] = df_worklist['filename'].apply(lambda x: x in audio_files)
-
-    # Check if each file in the DataFrame is in the transcribed list from the local storage
-    df_worklist['completed_locally'] = df_worklist['filename'].apply(
-        lambda x: x.replace(".wav",".json") in transcription_files)
-
-    print(df_worklist)
-    print(f'Total: {df_worklist.shape[0]}')
-
-    # Audio file downloaded locally or not
-    print("Audio file downloaded locally")
-    print(f'To do: {df_worklist.loc[df_worklist["downloaded_audio_locally"] == False].shape[0]}') # pylint: disable=singleton-comparison
-    print(f'Done:  {df_worklist.loc[df_worklist["downloaded_audio_locally"] == True].shape[0]}') # pylint: disable=singleton-comparison
-
-    # Transcription available locally or not
-    print("Transcription available locally")
-    print(f'To do: {df_worklist.loc[df_worklist["completed_locally"] == False].shape[0]}') # pylint: disable=singleton-comparison
-    print(f'Done:  {df_worklist.loc[df_worklist["completed_locally"] == True].shape[0]}') # pylint: disable=singleton-comparison
-
-    # Transcription available in GCP bucket or not
-    print("Transcription available in GCP bucket")
-    print(f'To do: {df_worklist.loc[df_worklist["done"] == False].shape[0]}') # pylint: disable=singleton-comparison
-    print(f'Done:  {df_worklist.loc[df_worklist["done"] == True].shape[0]}') # pylint: disable=singleton-comparison
-
-    # if process_n > 0:
-    #     df_worklist = df_worklist.sample(process_n)
-
-    for i,row in df_worklist.iterrows():
-
-        # replace "/" with "---"
-        input_file = row["filename"]
-
-        # Download file
-        if not row["downloaded_audio_locally"]:
-            gs_helper.download_blob_to_file(bucket_name, row["source_name"], os.path.join(working_dir, input_file))
-
-            # Set 'downloaded_audio_locally' to True after successful download
-            df_worklist.at[i, 'downloaded_audio_locally'] = True
-
-            print(f'{row["source_name"]} Downloaded')
-
-        if row["done"] and not row["completed_locally"]:
-            output_file = input_file.replace(audio_type,".json")
-            gs_helper.download_blob_to_file(bucket_name, row["target_name"], os.path.join(working_dir, output_file))
-
-            # Set 'completed_locally' to True after successful download
-            df_worklist.at[i, 'completed_locally'] = True
-
-            print(f'{row["target_name"]} Downloaded')
-
-    if transcribe:
-        # Filtering to find filenames where audio is downloaded but transcription is not completed locally
-        df_audio_downloaded_but_not_transcribed = df_worklist.loc[
-            (df_worklist["downloaded_audio_locally"] == True) & # pylint: disable=singleton-comparison
-            (df_worklist["completed_locally"] == False) & # pylint: disable=singleton-comparison
-            (df_worklist["done"] == False), # pylint: disable=singleton-comparison
-            "filename"
-        ]
-
-        audio_downloaded_but_not_transcribed = [
-            os.path.join(working_dir,file) for file in df_audio_downloaded_but_not_transcribed.to_list()]
-        index_audio_downloaded_but_not_transcribed = df_audio_downloaded_but_not_transcribed.index
-
-        if audio_downloaded_but_not_transcribed:
-            print(f"Transcribing: {len(audio_downloaded_but_not_transcribed)} audio files")
-            # print(f"{audio_downloaded_but_not_transcribed}")
-            start_time = datetime.now()
-            transcripts, rejected_transcriptions = speechmatics_helpers.batch_transcribe(
-                audio_downloaded_but_not_transcribed,
-                settings,
-                transcription_configuration,
-                concurrency
-            )
-
-            print(f"Number of Transcriptions successfully completed: {len(transcripts)}")
-            print(f"Number of Transcriptions rejected: {len(rejected_transcriptions)}")
-            end_time = datetime.now()
-            print("Execution time for transcribing:", end_time - start_time)
-
-            if rejected_transcriptions:
-                print("List of rejected transcriptions")
-                for audio, err_msg in rejected_transcriptions.items():
-                    print(f"{audio} - {err_msg}")
-
-            for file_path, transcript in transcripts.items():
-                assert isinstance(file_path,str)
-                file_output = file_path.replace(audio_type,".json")
-                with open(file_output,mode="w",encoding="utf8") as f:
-                    json.dump(transcript,f,indent=2)
-                    print(f"{file_output} saved locally")
-                index_df = index_audio_downloaded_but_not_transcribed[
-                    audio_downloaded_but_not_transcribed.index(file_path)]
-                # Set 'completed_locally' to True after successful download
-                df_worklist.at[index_df, 'completed_locally'] = True
-
-    # upload the file again - don't have priviledges for test project - so makes everything irrelevant so far
-    if write_back:
-        # Filtering to find transcribed filenames
-        local_transcription_files = df_worklist.loc[
-            (df_worklist["downloaded_audio_locally"] == True) & # pylint: disable=singleton-comparison
-            (df_worklist["completed_locally"] == True) & # pylint: disable=singleton-comparison
-            (df_worklist["done"] == False), # pylint: disable=singleton-comparison
-            "filename"
-        ].to_list()
-        print("Uploading transcriptions to GCP")
-        for file in local_transcription_files:
-            assert isinstance(file, str)
-            output_file = file.replace(audio_type,".json")
-            gs_helper.upload_file_to_blob(bucket_name,output_file,os.path.join(working_dir,output_file))
-            print(f"{output_file} is uploaded to GCP bucket")
+    items = speechmatics_pipeline.build_work_items(df_worklist, working_dir, audio_type)
+
+    # what is already local or in the bucket
+    print(f'Total: {len(items)}')
+    print(f'Audio file downloaded locally: {sum(os.path.isfile(item.audio_file) for item in items)}')
+    print(f'Transcription available locally: {sum(os.path.isfile(item.transcript_file) for item in items)}')
+    print(f'Transcription available in GCP bucket: {sum(item.done for item in items)}')
+
+    if state_file == "":
+        state_file = os.path.join(working_dir, STATE_FILE_NAME)
+    state = speechmatics_pipeline.WorklistState(state_file)
+    print(f'Worklist state from {state_file}: {state.counts()}')
+
+    # download, transcribe and upload run at the same time, audio is deleted once its transcript is uploaded
+    start_time = datetime.now()
+    with BatchClient(settings) as client:
+        pipeline = speechmatics_pipeline.TranscriptionPipeline(
+            gs_helper, bucket_name, client, transcription_configuration, state,
+            download_workers=download_workers,
+            transcribe_workers=concurrency,
+            upload_workers=upload_workers,
+            queue_size=queue_size,
+            transcribe=transcribe,
+            write_back=write_back
+        )
+        counts = pipeline.run(items)
+    state.close()
+    print(f"Worklist state: {counts}")
+    print("Execution time:", datetime.now() - start_time)
+
+    for record in state.records.values():
+        if record["stage"] == speechmatics_pipeline.FAILED:
+            print(f"{record['root_name']} - {record['step']} - {record['error']}")
 
 
 def setup_logging(log_file_path: str, log_level: logging):
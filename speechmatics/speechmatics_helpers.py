@@ -14,12 +14,16 @@ pip install -r ./speechmatics/speechmatics_requirements.txt
 # *********************************************************************************************************************
 
 # standard imports
+from typing import Iterator
 
 # 3rd party imports
 from httpx import HTTPStatusError
 from speechmatics.models import ConnectionSettings
 from speechmatics.batch_client import BatchClient
 
+# custom imports
+import speechmatics_job_tracker
+
 class TranscriptionError(Exception):
     """
     Indicates an error in transcription.
@@ -142,30 +146,21 @@ def get_transcript(audio_file_path: str, settings: dict, transcription_config: d
         except HTTPStatusError as e:
             print(f"Speechmatics API returned something bad - {e}")
 
-def batch_transcribe(audio_file_paths: list, settings: dict, transcription_config: dict, concurrency: int) -> dict:
+def iter_batch_transcribe(audio_file_paths: list, settings: dict, transcription_config: dict, concurrency: int,
+                          checkpoint_file: str = "", poll_interval: float = 5.0,
+                          notification_port: int = 0) -> Iterator[tuple]:
     """
-    Get transcript for an audio file
+    Yields (audio path, transcript, None) or (audio path, None, error) in the order jobs finish.
+    Job ids are checkpointed to checkpoint_file if given so a rerun collects rather than resubmits them.
+    notification_port starts a receiver for the notification_config callbacks to cut polling short
     """
 
-    transcript = {}
-    rejected_transcriptions = {}
-    # Open the client using a context manager
     with BatchClient(settings) as client:
-        # list all the jobs
-        # list_of_jobs = client.list_jobs()
-
-        try:
-            for result in client.submit_jobs(audio_paths=audio_file_paths,
-                                             transcription_config=transcription_config,
-                                             concurrency=concurrency):
-                try:
-                    transcript[result[0]] = client.wait_for_completion(result[1], transcription_format="json-v2")
-                except Exception as e:
-                    rejected_transcriptions[result[0]] = e
-
-        #     # Note that in production, you should set up notifications instead of polling.
-        #     # Notifications are described here: https://docs.speechmatics.com/features-other/notifications
-
-            return transcript, rejected_transcriptions
-        except HTTPStatusError as e:
-            print(f"Speechmatics API returned something bad - {e}")
\ No newline at end of file
+        tracker = speechmatics_job_tracker.JobTracker(client, transcription_config, concurrency=concurrency,
+                                                      checkpoint_file=checkpoint_file,
+                                                      poll_interval=poll_interval)
+        if notification_port > 0:
+            with speechmatics_job_tracker.NotificationReceiver(tracker, notification_port):
+                yield from tracker.run(audio_file_paths)
+        else:
+            yield from tracker.run(audio_file_paths)
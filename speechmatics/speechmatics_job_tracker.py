@@ -0,0 +1,176 @@
+"""
+speechmatics_job_tracker.py
+
+Keeps up to concurrency Speechmatics batch jobs running and yields each transcript as soon as its job finishes,
+whatever order they were submitted in.
+
+- Every outstanding job is polled together each round with one list_jobs request, falling back to
+  check_job_status for any job too old to be in the last 100 listed.  A failed poll is logged and
+  asked again next round rather than ending the run.
+- A round can be cut short by notify(job_id), e.g. from NotificationReceiver handling Speechmatics
+  notification callbacks, so finished jobs are collected straight away instead of at the next poll.
+- The audio path -> job id map of outstanding jobs is checkpointed to a json file as jobs are submitted
+  and collected, a crashed run given the same checkpoint collects those jobs rather than submitting them again.
+  Jobs in the checkpoint for paths not asked for are kept for a later run.
+
+client is a speechmatics.batch_client.BatchClient or anything with the same
+submit_job, list_jobs, check_job_status and get_job_result.
+
+Usage:
+    with BatchClient(settings) as client:
+        tracker = speechmatics_job_tracker.JobTracker(client, transcription_config, concurrency=5,
+                                                      checkpoint_file='./data/jobs.json')
+        for path, transcript, error in tracker.run(audio_paths):
+            ...
+
+"""
+# ******************************************************************************************************************120
+
+# standard imports
+import os
+import json
+import logging
+import threading
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Iterator
+
+RUNNING = "running"
+DONE = "done"
+
+logger = logging.getLogger(__name__)
+
+
+class JobTracker:
+    """Submits, polls and collects Speechmatics batch jobs in completion order"""
+
+    def __init__(self, client, transcription_config: dict, concurrency: int = 5, checkpoint_file: str = "",
+                 poll_interval: float = 5.0, transcription_format: str = "json-v2"):
+        self.client = client
+        self.transcription_config = transcription_config
+        self.concurrency = concurrency
+        self.checkpoint_file = checkpoint_file
+        self.poll_interval = poll_interval
+        self.transcription_format = transcription_format
+        self.jobs = {}
+        self.notified = threading.Event()
+        if checkpoint_file != "" and os.path.isfile(checkpoint_file):
+            with open(checkpoint_file, mode="r", encoding="utf8") as file_in:
+                self.jobs = json.load(file_in)
+
+    def notify(self, job_id: str):
+        """A job has changed state, poll now rather than waiting for the next round. Safe from any thread"""
+        logger.debug("Notified about %s", job_id)
+        self.notified.set()
+
+    def run(self, audio_paths: list) -> Iterator[tuple]:
+        """Yields (audio path, transcript, None) or (audio path, None, error) for each path as its job finishes.
+        Paths with a job in the checkpoint are collected without being submitted again"""
+
+        # anything else in the checkpoint is left there for a run that asks for it
+        resumed = [path for path in audio_paths if path in self.jobs]
+        todo = [path for path in audio_paths if path not in self.jobs]
+        if resumed:
+            logger.info("Collecting %i jobs from the checkpoint", len(resumed))
+        pool = {self.jobs[path]: path for path in resumed}
+
+        while todo or pool:
+            while todo and len(pool) < self.concurrency:
+                path = todo.pop(0)
+                try:
+                    job_id = self.client.submit_job(audio=path, transcription_config=self.transcription_config)
+                except Exception as e: # pylint: disable=broad-exception-caught
+                    logger.warning("%s submit failed with %s", path, e)
+                    yield path, None, e
+                    continue
+                logger.info("%s submitted as job %s", path, job_id)
+                pool[job_id] = path
+                self.jobs[path] = job_id
+                self._checkpoint()
+
+            finished = False
+            for job_id, status in self._statuses(list(pool)).items():
+                if status == RUNNING:
+                    continue
+                path = pool.pop(job_id)
+                finished = True
+                try:
+                    if status != DONE:
+                        raise RuntimeError(f"{job_id} status {status}")
+                    yield path, self.client.get_job_result(job_id, self.transcription_format), None
+                except Exception as e: # pylint: disable=broad-exception-caught
+                    logger.warning("%s job %s failed with %s", path, job_id, e)
+                    yield path, None, e
+                del self.jobs[path]
+                self._checkpoint()
+
+            # go straight round to submit more if something finished
+            if pool and not finished:
+                self.notified.wait(self.poll_interval)
+                self.notified.clear()
+
+    def _statuses(self, job_ids: list) -> dict:
+        """job id -> status for every job in one request where they are in the last 100 jobs.
+        A job whose status can't be got this round, e.g. the request timed out, is left out to be asked again"""
+        if not job_ids:
+            return {}
+        try:
+            listed = {job["id"]: job["status"] for job in self.client.list_jobs()}
+        except Exception as e: # pylint: disable=broad-exception-caught
+            logger.warning("Listing jobs failed with %s, trying again next round", e)
+            return {}
+        statuses = {}
+        for job_id in job_ids:
+            if job_id in listed:
+                statuses[job_id] = listed[job_id]
+                continue
+            try:
+                statuses[job_id] = self.client.check_job_status(job_id)["job"]["status"]
+            except Exception as e: # pylint: disable=broad-exception-caught
+                logger.warning("Checking job %s failed with %s, trying again next round", job_id, e)
+        return statuses
+
+    def _checkpoint(self):
+        """Write the outstanding jobs beside and rename so the checkpoint is never half written"""
+        if self.checkpoint_file == "":
+            return
+        with open(self.checkpoint_file + ".tmp", mode="w", encoding="utf8") as file_out:
+            json.dump(self.jobs, file_out, indent=2)
+        os.replace(self.checkpoint_file + ".tmp", self.checkpoint_file)
+
+
+class NotificationReceiver:
+    """Local http server for Speechmatics notification callbacks, notifies the tracker of the job in ?id=
+
+    The notification_config url in the transcription config must reach this port, e.g. through a tunnel"""
+
+    def __init__(self, tracker: JobTracker, port: int, host: str = "0.0.0.0"):
+
+        class Handler(BaseHTTPRequestHandler):
+            """Any GET or POST with an id"""
+
+            def _notify(self):
+                job_id = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query).get("id", [""])[0]
+                if "Content-Length" in self.headers:
+                    self.rfile.read(int(self.headers["Content-Length"]))
+                if job_id != "":
+                    tracker.notify(job_id)
+                self.send_response(200)
+                self.end_headers()
+
+            do_GET = _notify # pylint: disable=invalid-name
+            do_POST = _notify # pylint: disable=invalid-name
+
+            def log_message(self, format, *args): # pylint: disable=redefined-builtin
+                """Quiet"""
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self) -> 'NotificationReceiver':
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,246 @@
+"""
+speechmatics_pipeline.py
+
+Download -> transcribe -> upload as concurrent stages joined by bounded queues, used by speechmatics_gcp_transcribe.py
+
+- Each stage has its own pool of worker threads, downloads block once queue_size files are waiting to be
+  transcribed so the working dir never holds more than about queue_size + transcribe_workers audio files.
+- Local audio is deleted as soon as its transcript is uploaded.
+- Every step is appended to a JSONL worklist state file, including the Speechmatics job id as soon as a job is
+  submitted, so a restarted run waits for jobs already running rather than paying for them again.
+- A failure is recorded against the file in the state and the rest carry on.
+
+storage is anything with GoogleStorageHelper's download_blob_to_file and upload_file_to_blob,
+client anything with the speechmatics BatchClient's submit_job and wait_for_completion.
+
+Usage:
+    with BatchClient(settings) as client:
+        pipeline = speechmatics_pipeline.TranscriptionPipeline(gs_helper, bucket_name, client, config, state)
+        counts = pipeline.run(speechmatics_pipeline.build_work_items(df_worklist, working_dir, ".wav"))
+
+"""
+# ******************************************************************************************************************120
+
+# standard imports
+import os
+import json
+import queue
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Callable
+
+# 3rd party imports
+import pandas
+
+FOLDER_FILE_SPLIT_DELIMITER = "---"
+
+# stages recorded in the state file
+DOWNLOADED = "downloaded"
+SUBMITTED = "submitted"
+TRANSCRIBED = "transcribed"
+UPLOADED = "uploaded"
+FAILED = "failed"
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class WorkItem:
+    """One audio blob and where its files go"""
+    root_name: str
+    source_name: str
+    target_name: str
+    audio_file: str
+    transcript_file: str
+    done: bool = False
+
+
+class WorklistState:
+    """Append only JSONL of what happened to each file, the last line for a file wins"""
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.records = {}
+        if os.path.isfile(filename):
+            with open(filename, mode="r", encoding="utf8") as file_in:
+                for line in file_in:
+                    if not line.endswith("\n"):
+                        # a half written last line from an interrupted run
+                        continue
+                    record = json.loads(line)
+                    self.records[record["root_name"]] = record
+        self.file_out = open(filename, mode="a", encoding="utf8") # pylint: disable=consider-using-with
+
+    def get(self, root_name: str) -> dict:
+        """Latest record for a file or an empty dict"""
+        with self.lock:
+            return dict(self.records.get(root_name, {}))
+
+    def update(self, root_name: str, stage: str, **fields):
+        """Record a file reaching a stage"""
+        record = {"root_name": root_name, "stage": stage, **fields}
+        with self.lock:
+            self.records[root_name] = record
+            self.file_out.write(json.dumps(record) + "\n")
+            self.file_out.flush()
+
+    def counts(self) -> dict:
+        """Number of files at each stage"""
+        with self.lock:
+            stages = [record["stage"] for record in self.records.values()]
+        return {stage: stages.count(stage) for stage in sorted(set(stages))}
+
+    def close(self):
+        """Close the state file"""
+        self.file_out.close()
+
+
+def build_work_items(df_worklist: pandas.DataFrame, working_dir: str, audio_type: str) -> list:
+    """WorkItems from GoogleStorageHelper.get_blob_df_worklist, transcripts go beside their audio in the bucket"""
+    items = []
+    for root_name, source_name, target_name, done in zip(df_worklist["root_name"], df_worklist["source_name"],
+                                                         df_worklist["target_name"], df_worklist["done"]):
+        if source_name == "":
+            # a transcript with no audio
+            continue
+        filename = source_name.replace("/", FOLDER_FILE_SPLIT_DELIMITER)
+        items.append(WorkItem(
+            root_name=root_name,
+            source_name=source_name,
+            target_name=target_name if target_name != "" else root_name + ".json",
+            audio_file=os.path.join(working_dir, filename),
+            transcript_file=os.path.join(working_dir, filename.replace(audio_type, ".json")),
+            done=bool(done)
+        ))
+    return items
+
+
+class TranscriptionPipeline:
+    """Runs the download, transcribe and upload stages concurrently"""
+
+    def __init__(self, storage, bucket_name: str, client, transcription_config: dict,
+                 state: WorklistState, download_workers: int = 4, transcribe_workers: int = 5,
+                 upload_workers: int = 4, queue_size: int = 10, transcribe: bool = True,
+                 write_back: bool = True, delete_audio: bool = True):
+        self.storage = storage
+        self.bucket_name = bucket_name
+        self.client = client
+        self.transcription_config = transcription_config
+        self.state = state
+        self.download_workers = download_workers
+        self.transcribe_workers = transcribe_workers
+        self.upload_workers = upload_workers
+        self.queue_size = queue_size
+        self.transcribe = transcribe
+        self.write_back = write_back
+        self.delete_audio = delete_audio
+
+    def run(self, items: list) -> dict:
+        """Push every item through as far as the options allow, returns the state counts"""
+        download_queue = queue.Queue()
+        transcribe_queue = queue.Queue(maxsize=self.queue_size)
+        upload_queue = queue.Queue(maxsize=self.queue_size)
+
+        for item in items:
+            download_queue.put(item)
+
+        stages = [
+            (self._download, download_queue, transcribe_queue, self.download_workers),
+            (self._transcribe, transcribe_queue, upload_queue, self.transcribe_workers),
+            (self._upload, upload_queue, None, self.upload_workers)
+        ]
+        threads = [self._start_workers(call, in_queue, out_queue, workers)
+                   for call, in_queue, out_queue, workers in stages]
+
+        # each stage is finished once its input is, tell its workers then wait for them before the next
+        for (_, in_queue, _, workers), stage_threads in zip(stages, threads):
+            for _ in range(workers):
+                in_queue.put(None)
+            for thread in stage_threads:
+                thread.join()
+
+        counts = self.state.counts()
+        logger.info("Pipeline finished %s", counts)
+        return counts
+
+    def _download(self, item: WorkItem) -> WorkItem:
+        """Get the audio unless it or its transcript is already local, or the transcript if already in the bucket"""
+        if item.done:
+            if not os.path.isfile(item.transcript_file):
+                self.storage.download_blob_to_file(self.bucket_name, item.target_name, item.transcript_file)
+                logger.info("%s Downloaded", item.target_name)
+            if self.state.get(item.root_name).get("stage") != UPLOADED:
+                self.state.update(item.root_name, UPLOADED)
+            return None
+        if not os.path.isfile(item.transcript_file) and not os.path.isfile(item.audio_file):
+            download_file = item.audio_file + ".part"
+            self.storage.download_blob_to_file(self.bucket_name, item.source_name, download_file)
+            os.replace(download_file, item.audio_file)
+            self.state.update(item.root_name, DOWNLOADED)
+            logger.info("%s Downloaded", item.source_name)
+        return item
+
+    def _transcribe(self, item: WorkItem) -> WorkItem:
+        """Transcribe to the local transcript file if not already there"""
+        if os.path.isfile(item.transcript_file):
+            return item
+        if not self.transcribe:
+            return None
+        record = self.state.get(item.root_name)
+        transcript = None
+        if record.get("stage") == SUBMITTED:
+            # submitted by a run that stopped, collect it rather than paying for it again
+            try:
+                transcript = self.client.wait_for_completion(record["job_id"], transcription_format="json-v2")
+                logger.info("Collected job %s for %s", record["job_id"], item.source_name)
+            except Exception as e: # pylint: disable=broad-exception-caught
+                logger.warning("Could not collect job %s for %s resubmitting: %s", record["job_id"],
+                               item.source_name, e)
+        if transcript is None:
+            job_id = self.client.submit_job(audio=item.audio_file, transcription_config=self.transcription_config)
+            self.state.update(item.root_name, SUBMITTED, job_id=job_id)
+            logger.info("job %s submitted for %s", job_id, item.source_name)
+            transcript = self.client.wait_for_completion(job_id, transcription_format="json-v2")
+        with open(item.transcript_file + ".part", mode="w", encoding="utf8") as file_out:
+            json.dump(transcript, file_out, indent=2)
+        os.replace(item.transcript_file + ".part", item.transcript_file)
+        self.state.update(item.root_name, TRANSCRIBED)
+        logger.info("%s saved locally", item.transcript_file)
+        return item
+
+    def _upload(self, item: WorkItem) -> None:
+        """Upload the transcript next to its audio and delete the local audio"""
+        if not self.write_back:
+            return None
+        self.storage.upload_file_to_blob(self.bucket_name, item.target_name, item.transcript_file)
+        self.state.update(item.root_name, UPLOADED)
+        logger.info("%s is uploaded to GCP bucket", item.target_name)
+        if self.delete_audio and os.path.isfile(item.audio_file):
+            os.remove(item.audio_file)
+        return None
+
+    def _start_workers(self, call: Callable, in_queue: queue.Queue, out_queue: queue.Queue, workers: int) -> list:
+        """Start workers threads taking items from in_queue until they get None,
+        putting what call returns on out_queue unless None.  A failing item is recorded and dropped"""
+
+        def work():
+            while True:
+                item = in_queue.get()
+                if item is None:
+                    return
+                try:
+                    result = call(item)
+                except Exception as e: # pylint: disable=broad-exception-caught
+                    logger.error("Failed %s in %s: %s", item.source_name, call.__name__, e)
+                    self.state.update(item.root_name, FAILED, step=call.__name__.lstrip('_'),
+                                      error=f'{type(e).__name__}: {e}')
+                    continue
+                if result is not None and out_queue is not None:
+                    out_queue.put(result)
+
+        threads = [threading.Thread(target=work, daemon=True) for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+        return threads
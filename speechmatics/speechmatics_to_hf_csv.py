@@ -20,12 +20,19 @@ import json
 import uuid
 from datetime import datetime, timedelta
 import os
+import sys
+import pathlib
 
 # third Party imports
 import pandas
 import click
 from google_storage_helpers import GoogleStorageHelper # GCP helpers
 
+# custom imports
+hf_module_path = str(pathlib.Path(os.path.dirname(os.path.realpath(__file__))).parent)
+sys.path.insert(1, hf_module_path)
+import conversation_index # pylint: disable=wrong-import-position
+
 BUCKET_BASE_URL = "https://storage.cloud.google.com/"
 FOLDER_FILE_SPLIT_DELIMITER = "---"
 
@@ -130,41 +137,7 @@ def process(data: str, client_channel: str, bucket_name: str, bucket_exists: int
     convo_id_col = "convo_guid"
 
     # index the speakers
-    merged_df['idx'] = merged_df.groupby([convo_id_col]).cumcount()
-    merged_df['idx_max'] = merged_df.groupby([convo_id_col])[
-        'idx'].transform("max")
-
-    # This info lets you filter for the first or last thing the client says
-    # this is very useful in boot strapping bot design
-    # 0s for expert
-    merged_df['idx_client'] = merged_df.groupby(
-        [convo_id_col, 'role']).cumcount().where(merged_df.role == 'client', 0)
-    merged_df['idx_max_client'] = merged_df.groupby([convo_id_col])[
-        'idx_client'].transform("max")
-    merged_df['first_client_utt'] = merged_df.apply(decide_role_filter_values,
-                                        args=['idx_client','client',0,"idx_max_client"],
-                                        axis=1)
-    merged_df['second_client_utt'] = merged_df.apply(decide_role_filter_values,
-                                        args=['idx_client','client',1,"idx_max_client"],
-                                        axis=1)
-    merged_df['last_client_utt'] = merged_df.apply(decide_role_filter_values,
-                                        args=['idx_client','client',-1,"idx_max_client"],
-                                        axis=1)
-
-    # same for expert
-    merged_df['idx_expert'] = merged_df.groupby(
-        [convo_id_col, 'role']).cumcount().where(merged_df.role == 'expert', 0)
-    merged_df['idx_max_expert'] = merged_df.groupby([convo_id_col])[
-        'idx_expert'].transform("max")
-    merged_df['first_expert_utt'] = merged_df.apply(decide_role_filter_values,
-                                        args=['idx_expert','expert',0,'idx_max_expert'],
-                                        axis=1)
-    merged_df['second_expert_utt'] = merged_df.apply(decide_role_filter_values,
-                                        args=['idx_expert','expert',1,'idx_max_expert'],
-                                        axis=1)
-    merged_df['last_expert_utt'] = merged_df.apply(decide_role_filter_values,
-                                        args=['idx_expert','expert',-1,'idx_max_expert'],
-                                        axis=1)
+    merged_df = conversation_index.index_conversations(merged_df, convo_id_col)
 
     merged_df.drop(['idx',
                     'idx_max',
@@ -187,21 +160,6 @@ def process(data: str, client_channel: str, bucket_name: str, bucket_exists: int
     return merged_df
 
 
-def decide_role_filter_values(row: pandas.Series,
-                              column_name: str,
-                              role_filter: str,
-                              value_filter: str,
-                              idx_max_col_name: str) -> bool:
-    """Determine whether this is the 0,1,2 where the role is also somthing"""
-    if value_filter >=0 and row[column_name] == value_filter and row["role"] == role_filter:
-        return True
-    elif value_filter < 0 and row[column_name] == row[
-        idx_max_col_name] and row["role"] == role_filter:
-        return True
-    else:
-        return False
-
-
 def merge_info(df:pandas.DataFrame) -> pandas.DataFrame:
     """merges contents, start time, and end time"""
 
@@ -1,37 +1,224 @@
 """
-python total_duration_of_all_audio_files
+python total_duration_of_all_audio_files.py -f <audio folder> -t .wav,.mp3 -r -o ./data/audio_inventory.csv
 
 Parse through folder containing audio files and calculates the total duration of all audio files.
-Gives the results in Hrs
+Gives the results in Hrs and writes a per file inventory csv of duration, sample rate and channels
+for planning transcription cost and concurrency.
 
-Make sure to install ffmpeg before running the script
+Only headers are read, nothing is decoded
+- WAV (RIFF, RF64 and WAVE_FORMAT_EXTENSIBLE) and FLAC are parsed here
+- anything else, e.g. .mp3, is probed with ffprobe which needs ffmpeg installed
+Directories are listed and files probed by a pool of threads.
 """
 
 # *********************************************************************************************************************
 
 # standard imports
 import os
-import click
+import csv
+import json
+import struct
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 # 3rd party imports
-from pydub import AudioSegment
+import click
+
+INVENTORY_COLUMNS = ["file", "format", "duration_seconds", "sample_rate", "channels", "bits_per_sample",
+                     "size_bytes", "error"]
+
+# wav chunk sizes this large mean the real size is somewhere else, ds64 or the end of the file
+UNKNOWN_SIZE = 0xFFFFFFFF
 
 @click.command()
-@click.option('-f', '--audio_folder_path', type=str, required=True, help='Folder containing auido .wav files')
-def main(audio_folder_path: str):
+@click.option('-f', '--audio_folder_path', type=str, required=True, help='Folder containing audio files')
+@click.option('-t', '--audio_types', type=str, required=False, default='.wav',
+              help='Comma delimited extensions to include e.g. .wav,.mp3')
+@click.option('-r', '--recursive', is_flag=True, default=False, help='Include sub folders')
+@click.option('-o', '--output_filename', type=str, required=False, default='',
+              help='Inventory csv, default audio_inventory.csv in the audio folder')
+@click.option('-w', '--workers', type=int, required=False, default=16,
+              help='Threads listing folders and reading headers')
+def main(audio_folder_path: str, audio_types: str, recursive: bool, output_filename: str, workers: int):
     """Get total duration"""
 
-    total_duration_ms = 0
-    for filename in os.listdir(audio_folder_path):
-        if filename.endswith('.wav'):
-            file_path = os.path.join(audio_folder_path, filename)
-            print(file_path)
-            audio = AudioSegment.from_wav(file_path)
-            total_duration_ms += len(audio)  # duration in milliseconds
-
-    # Convert milliseconds to hours
-    total_duration_hours = total_duration_ms / (1000 * 60 * 60)
-    print(f"Total duration of all .wav files: {total_duration_hours:.2f} hours")
+    if output_filename == '':
+        output_filename = os.path.join(audio_folder_path, 'audio_inventory.csv')
+    audio_types = tuple(audio_type.strip().lower() for audio_type in audio_types.split(','))
+
+    files = list_audio_files(audio_folder_path, audio_types, recursive=recursive, workers=workers)
+    print(f'Audio files found: {len(files)}')
+
+    total_seconds = 0.0
+    failed = 0
+    with open(output_filename, mode='w', encoding='utf8', newline='') as file_out:
+        writer = csv.DictWriter(file_out, fieldnames=INVENTORY_COLUMNS)
+        writer.writeheader()
+        for row in inventory(files, workers=workers):
+            writer.writerow(row)
+            if row['error'] != '':
+                failed = failed + 1
+                print(f'{row["file"]} - {row["error"]}')
+            else:
+                total_seconds = total_seconds + row['duration_seconds']
+
+    print(f'Wrote {output_filename}, could not read {failed} files')
+    # Convert seconds to hours
+    total_duration_hours = total_seconds / (60 * 60)
+    print(f'Total duration of all {",".join(audio_types)} files: {total_duration_hours:.2f} hours')
+
+def list_audio_files(audio_folder_path: str, audio_types: tuple, recursive: bool = False, workers: int = 16) -> list:
+    """Sorted paths of files ending with any of audio_types, sub folders are listed in parallel"""
+
+    def scan(folder: str) -> tuple:
+        files = []
+        folders = []
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    folders.append(entry.path)
+                elif entry.name.lower().endswith(audio_types):
+                    files.append(entry.path)
+        return files, folders
+
+    if not recursive:
+        return sorted(scan(audio_folder_path)[0])
+
+    files = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = {pool.submit(scan, audio_folder_path)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                folder_files, folders = future.result()
+                files.extend(folder_files)
+                pending.update(pool.submit(scan, folder) for folder in folders)
+    return sorted(files)
+
+def inventory(files: list, workers: int = 16):
+    """Yields an inventory row per file in the order given, headers are read by a pool of threads
+    a batch at a time so millions of files are not all queued at once"""
+    batch_size = workers * 64
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for i in range(0, len(files), batch_size):
+            yield from pool.map(inventory_row, files[i:i + batch_size])
+
+def inventory_row(file_path: str) -> dict:
+    """Header details for one file, a failure to read it goes in error rather than raising"""
+    row = {column: '' for column in INVENTORY_COLUMNS}
+    row['file'] = file_path
+    try:
+        row['size_bytes'] = os.path.getsize(file_path)
+        with open(file_path, mode='rb') as file_in:
+            magic = file_in.read(4)
+            file_in.seek(0)
+            if magic in (b'RIFF', b'RF64'):
+                row.update(read_wav_header(file_in, row['size_bytes']))
+            elif magic == b'fLaC':
+                row.update(read_flac_header(file_in))
+            else:
+                row.update(ffprobe(file_path))
+    except (OSError, ValueError, KeyError, struct.error, subprocess.SubprocessError) as e:
+        row['error'] = f'{type(e).__name__}: {e}'
+    return row
+
+def read_wav_header(file_in, size_bytes: int) -> dict:
+    """format, duration_seconds, sample_rate, channels and bits_per_sample from the fmt, fact, ds64 and data chunks"""
+    riff, _, wave = struct.unpack('<4sI4s', file_in.read(12))
+    if riff not in (b'RIFF', b'RF64') or wave != b'WAVE':
+        raise ValueError('Not a WAVE file')
+
+    fmt = None
+    frames = None
+    ds64_data_size = None
+    data_size = None
+    while True:
+        header = file_in.read(8)
+        if len(header) < 8:
+            break
+        chunk_id, chunk_size = struct.unpack('<4sI', header)
+        start = file_in.tell()
+        if chunk_id == b'fmt ':
+            fmt = struct.unpack('<HHIIHH', file_in.read(16))
+        elif chunk_id == b'fact' and chunk_size >= 4:
+            frames = struct.unpack('<I', file_in.read(4))[0]
+        elif chunk_id == b'ds64':
+            _, ds64_data_size, ds64_frames = struct.unpack('<QQQ', file_in.read(24))
+            if ds64_frames > 0:
+                frames = ds64_frames
+        elif chunk_id == b'data':
+            if chunk_size == UNKNOWN_SIZE and ds64_data_size is not None:
+                chunk_size = ds64_data_size
+            # still being written or truncated, count what is there
+            data_size = min(chunk_size, size_bytes - start)
+            break
+        # chunks are word aligned
+        file_in.seek(start + chunk_size + chunk_size % 2)
+
+    if fmt is None or data_size is None:
+        raise ValueError('WAVE file has no fmt or data chunk')
+    audio_format, channels, sample_rate, byte_rate, _, bits_per_sample = fmt
+    if sample_rate == 0:
+        raise ValueError('WAVE fmt has a zero sample rate')
+    # PCM and its extensible form are exact from the data size, compressed formats should say how many frames
+    if frames is not None and audio_format not in (1, 3, 0xFFFE):
+        duration_seconds = frames / sample_rate
+    elif byte_rate > 0:
+        duration_seconds = data_size / byte_rate
+    else:
+        raise ValueError('WAVE fmt has a zero byte rate')
+    return {
+        'format': 'wav',
+        'duration_seconds': round(duration_seconds, 3),
+        'sample_rate': sample_rate,
+        'channels': channels,
+        'bits_per_sample': bits_per_sample
+    }
+
+def read_flac_header(file_in) -> dict:
+    """Details from the STREAMINFO block which always comes first"""
+    magic, block_header, streaminfo = struct.unpack('<4s4s34s', file_in.read(42))
+    if magic != b'fLaC' or block_header[0] & 0x7F != 0:
+        raise ValueError('FLAC file does not start with STREAMINFO')
+    # 20 bits sample rate, 3 bits channels - 1, 5 bits bits per sample - 1, 36 bits total samples
+    packed = int.from_bytes(streaminfo[10:18], 'big')
+    sample_rate = packed >> 44
+    channels = ((packed >> 41) & 0x7) + 1
+    bits_per_sample = ((packed >> 36) & 0x1F) + 1
+    frames = packed & 0xFFFFFFFFF
+    if sample_rate == 0:
+        raise ValueError('FLAC STREAMINFO has a zero sample rate')
+    return {
+        'format': 'flac',
+        'duration_seconds': round(frames / sample_rate, 3),
+        'sample_rate': sample_rate,
+        'channels': channels,
+        'bits_per_sample': bits_per_sample
+    }
+
+def ffprobe(file_path: str) -> dict:
+    """Container details from ffprobe, which reads headers and estimates rather than decoding"""
+    try:
+        completed = subprocess.run(
+            ['ffprobe', '-v', 'error', '-select_streams', 'a:0',
+             '-show_entries', 'format=format_name,duration:stream=sample_rate,channels,bits_per_sample',
+             '-of', 'json', file_path],
+            capture_output=True, check=True, text=True, timeout=60)
+    except FileNotFoundError as e:
+        raise OSError('ffprobe not found, install ffmpeg to probe non WAV/FLAC files') from e
+    except subprocess.CalledProcessError as e:
+        raise ValueError(e.stderr.strip()) from e
+    probe = json.loads(completed.stdout)
+    if not probe.get('streams'):
+        raise ValueError('No audio stream')
+    stream = probe['streams'][0]
+    return {
+        'format': probe['format'].get('format_name', ''),
+        'duration_seconds': round(float(probe['format']['duration']), 3),
+        'sample_rate': int(stream.get('sample_rate', 0)),
+        'channels': int(stream.get('channels', 0)),
+        'bits_per_sample': int(stream.get('bits_per_sample', 0))
+    }
 
 if __name__ == '__main__':
     main() # pylint: disable=no-value-for-parameter
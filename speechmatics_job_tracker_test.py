@@ -0,0 +1,146 @@
+"""
+Test speechmatics/speechmatics_job_tracker.py collects jobs in completion order and resumes from its checkpoint
+
+"""
+# ***************************************************************************80**************************************120
+
+# standard imports
+import os
+import sys
+import json
+import pathlib
+import threading
+import urllib.request
+
+# custom imports
+sys.path.insert(1, str(pathlib.Path(os.path.dirname(os.path.realpath(__file__))) / "speechmatics"))
+import speechmatics_job_tracker # file under test # pylint: disable=wrong-import-position
+
+class FakeBatchClient:
+    """Jobs finish after the number of status polls in the audio name, list_jobs only shows the latest 2 jobs,
+    audio named bad is rejected"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.submitted = []
+        self.list_calls = 0
+
+    def submit_job(self, audio: str, transcription_config: dict) -> str:
+        """Job id for the audio"""
+        assert transcription_config == {"type": "transcription"}
+        with self.lock:
+            job_id = f'job-{len(self.submitted)}'
+            self.submitted.append(audio)
+            polls = 0 if audio.startswith("bad") else int(audio.split("-")[1])
+            self.jobs[job_id] = {"audio": audio, "polls": polls}
+        return job_id
+
+    def _status(self, job_id: str) -> str:
+        job = self.jobs[job_id]
+        if job["polls"] > 0:
+            job["polls"] = job["polls"] - 1
+            return "running"
+        return "rejected" if job["audio"].startswith("bad") else "done"
+
+    def list_jobs(self) -> list:
+        """Latest jobs first"""
+        with self.lock:
+            self.list_calls = self.list_calls + 1
+            return [{"id": job_id, "status": self._status(job_id)} for job_id in list(self.jobs)[-2:]]
+
+    def check_job_status(self, job_id: str) -> dict:
+        """One job"""
+        with self.lock:
+            return {"job": {"id": job_id, "status": self._status(job_id)}}
+
+    def get_job_result(self, job_id: str, transcription_format: str) -> dict:
+        """Transcript"""
+        assert transcription_format == "json-v2"
+        return {"job": {"id": job_id}, "results": [{"content": self.jobs[job_id]["audio"]}]}
+
+def test_completion_order_and_errors():
+    """Quick jobs are not held up by a slow one submitted before them, rejected jobs are reported"""
+    client = FakeBatchClient()
+    tracker = speechmatics_job_tracker.JobTracker(client, {"type": "transcription"}, concurrency=3,
+                                                  poll_interval=0.001)
+    results = list(tracker.run(["a-6", "b-0", "bad", "c-1", "d-0"]))
+    assert [path for path, _, _ in results] == ["b-0", "bad", "d-0", "c-1", "a-6"]
+    assert results[0][1]["results"] == [{"content": "b-0"}]
+    assert results[1][1] is None and "rejected" in str(results[1][2])
+    assert all(error is None for path, _, error in results if path != "bad")
+    assert len(client.submitted) == 5
+
+def test_checkpoint_resumes_without_resubmitting(tmp_path):
+    """A run that dies picks up the outstanding jobs next time, a job leaves the checkpoint only once its result
+    has been handled"""
+    checkpoint_file = str(tmp_path / "jobs.json")
+    client = FakeBatchClient()
+    tracker = speechmatics_job_tracker.JobTracker(client, {"type": "transcription"}, concurrency=4,
+                                                  checkpoint_file=checkpoint_file, poll_interval=0.001)
+    results = tracker.run(["a-9", "b-0", "c-9", "d-9", "e-0"])
+    assert next(results)[0] == "b-0"
+    assert next(results)[0] == "e-0"
+    del results
+    with open(checkpoint_file, mode="r", encoding="utf8") as file_in:
+        assert json.load(file_in) == {"a-9": "job-0", "c-9": "job-2", "d-9": "job-3", "e-0": "job-4"}
+
+    # a checkpointed path not asked for is left for later
+    tracker = speechmatics_job_tracker.JobTracker(client, {"type": "transcription"}, concurrency=4,
+                                                  checkpoint_file=checkpoint_file, poll_interval=0.001)
+    results = list(tracker.run(["a-9", "c-9", "e-0"]))
+    assert sorted(path for path, _, _ in results) == ["a-9", "c-9", "e-0"]
+    assert client.submitted == ["a-9", "b-0", "c-9", "d-9", "e-0"]
+    with open(checkpoint_file, mode="r", encoding="utf8") as file_in:
+        assert json.load(file_in) == {"d-9": "job-3"}
+
+def test_notification_cuts_poll_short():
+    """A callback on the receiver wakes the tracker rather than waiting out the poll interval"""
+    client = FakeBatchClient()
+    tracker = speechmatics_job_tracker.JobTracker(client, {"type": "transcription"}, concurrency=2,
+                                                  poll_interval=60)
+    with speechmatics_job_tracker.NotificationReceiver(tracker, 0, host="127.0.0.1") as receiver:
+        port = receiver.server.server_address[1]
+
+        def notify():
+            while len(client.submitted) < 2 or client.list_calls < 2:
+                with urllib.request.urlopen(f'http://127.0.0.1:{port}/?id=job-0&status=success',
+                                            data=b'{}') as response:
+                    assert response.status == 200
+
+        thread = threading.Thread(target=notify, daemon=True)
+        thread.start()
+        results = list(tracker.run(["a-1", "b-1"]))
+        thread.join()
+    assert sorted(path for path, _, _ in results) == ["a-1", "b-1"]
+
+class FlakyBatchClient(FakeBatchClient):
+    """The first two list_jobs and check_job_status requests time out"""
+
+    def __init__(self):
+        super().__init__()
+        self.failures = {"list_jobs": 2, "check_job_status": 2}
+
+    def _flake(self, name: str):
+        with self.lock:
+            if self.failures[name] > 0:
+                self.failures[name] = self.failures[name] - 1
+                raise TimeoutError(f"{name} timed out")
+
+    def list_jobs(self) -> list:
+        self._flake("list_jobs")
+        return super().list_jobs()
+
+    def check_job_status(self, job_id: str) -> dict:
+        self._flake("check_job_status")
+        return super().check_job_status(job_id)
+
+def test_failed_polls_are_tried_again():
+    """Timeouts listing or checking jobs are logged and polled again next round, every job still finishes"""
+    client = FlakyBatchClient()
+    tracker = speechmatics_job_tracker.JobTracker(client, {"type": "transcription"}, concurrency=4,
+                                                  poll_interval=0.001)
+    results = list(tracker.run(["a-2", "b-1", "c-0", "d-0"]))
+    assert sorted(path for path, _, _ in results) == ["a-2", "b-1", "c-0", "d-0"]
+    assert all(error is None for _, _, error in results)
+    assert client.failures == {"list_jobs": 0, "check_job_status": 0}
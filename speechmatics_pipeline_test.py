@@ -0,0 +1,155 @@
+"""
+Test speechmatics/speechmatics_pipeline.py against a local folder standing in for the bucket and a fake batch client
+
+"""
+# ***************************************************************************80**************************************120
+
+# standard imports
+import os
+import sys
+import json
+import time
+import shutil
+import pathlib
+import threading
+
+# 3rd party imports
+import pandas
+
+# custom imports
+sys.path.insert(1, str(pathlib.Path(os.path.dirname(os.path.realpath(__file__))) / "speechmatics"))
+import speechmatics_pipeline # file under test # pylint: disable=wrong-import-position
+
+class LocalBucket:
+    """GoogleStorageHelper's download and upload against a folder, tracks how many audio files are local"""
+
+    def __init__(self, root: str, working_dir: str):
+        self.root = root
+        self.working_dir = working_dir
+        self.lock = threading.Lock()
+        self.max_local_audio = 0
+        self.uploaded = []
+
+    def blob_df_worklist(self, audio_type: str) -> pandas.DataFrame:
+        """What get_blob_df_worklist gives for the folder"""
+        rows = {}
+        for folder, _, files in os.walk(self.root):
+            for file in files:
+                name = os.path.relpath(os.path.join(folder, file), self.root)
+                root_name, suffix = os.path.splitext(name)
+                row = rows.setdefault(root_name, {"root_name": root_name, "source_name": "",
+                                                  "target_name": "", "done": False})
+                if suffix == audio_type:
+                    row["source_name"] = name
+                else:
+                    row["target_name"] = name
+                    row["done"] = True
+        return pandas.DataFrame(sorted(rows.values(), key=lambda row: row["root_name"]))
+
+    def download_blob_to_file(self, bucket_name: str, blob_name: str, target_file_name: str):
+        """Copy out of the bucket"""
+        assert bucket_name == "bucket"
+        shutil.copyfile(os.path.join(self.root, blob_name), target_file_name)
+        with self.lock:
+            local = [f for f in os.listdir(self.working_dir) if not f.endswith(".json")]
+            self.max_local_audio = max(self.max_local_audio, len(local))
+
+    def upload_file_to_blob(self, bucket_name: str, destination_blob_name: str, source_file_name: str):
+        """Copy into the bucket"""
+        assert bucket_name == "bucket"
+        shutil.copyfile(source_file_name, os.path.join(self.root, destination_blob_name))
+        with self.lock:
+            self.uploaded.append(destination_blob_name)
+
+class FakeBatchClient:
+    """submit_job and wait_for_completion like the speechmatics BatchClient, rejects audio saying 'bad'"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.submitted = 0
+
+    def submit_job(self, audio: str, transcription_config: dict) -> str:
+        """Job id for the audio"""
+        with open(audio, mode="r", encoding="utf8") as file_in:
+            content = file_in.read()
+        with self.lock:
+            self.submitted = self.submitted + 1
+            job_id = f'job-{self.submitted}'
+            self.jobs[job_id] = (content, transcription_config["transcription_config"]["language"])
+        return job_id
+
+    def wait_for_completion(self, job_id: str, transcription_format: str) -> dict:
+        """Transcript or an error for a rejected job"""
+        assert transcription_format == "json-v2"
+        time.sleep(0.02)
+        with self.lock:
+            content, language = self.jobs[job_id]
+        if content == "bad":
+            raise RuntimeError("Job rejected")
+        return {"job": {"id": job_id}, "results": [{"content": content}], "language": language}
+
+def _setup(tmp_path) -> tuple:
+    """Bucket with nested wavs, one already transcribed and one the fake client rejects"""
+    root = tmp_path / "bucket"
+    working_dir = tmp_path / "work"
+    os.makedirs(root / "2024" / "01")
+    os.makedirs(working_dir)
+    for i in range(10):
+        (root / "2024" / "01" / f'call{i}.wav').write_text("bad" if i == 7 else f'audio {i}', encoding="utf8")
+    (root / "2024" / "01" / "call0.json").write_text(json.dumps({"results": "already"}), encoding="utf8")
+    return LocalBucket(str(root), str(working_dir)), str(working_dir)
+
+def _run(bucket: LocalBucket, working_dir: str, client: FakeBatchClient, **kwargs) -> dict:
+    """One run of the pipeline with a fresh state object"""
+    items = speechmatics_pipeline.build_work_items(bucket.blob_df_worklist(".wav"), working_dir, ".wav")
+    state = speechmatics_pipeline.WorklistState(os.path.join(working_dir, "state.jsonl"))
+    pipeline = speechmatics_pipeline.TranscriptionPipeline(
+        bucket, "bucket", client, {"transcription_config": {"language": "en"}}, state,
+        download_workers=2, transcribe_workers=3, upload_workers=2, queue_size=2, **kwargs)
+    counts = pipeline.run(items)
+    state.close()
+    return counts
+
+def test_pipeline_transcribes_uploads_and_cleans_up(tmp_path):
+    """Everything ends up in the bucket beside its audio, local audio is removed and disk use stays bounded"""
+    bucket, working_dir = _setup(tmp_path)
+    client = FakeBatchClient()
+    counts = _run(bucket, working_dir, client)
+    assert counts == {"failed": 1, "uploaded": 9}
+    assert sorted(bucket.uploaded) == [f'2024/01/call{i}.json' for i in range(1, 10) if i != 7]
+    with open(os.path.join(bucket.root, "2024", "01", "call3.json"), mode="r", encoding="utf8") as file_in:
+        assert json.load(file_in)["results"] == [{"content": "audio 3"}]
+    # the existing transcript was brought down, only the rejected audio is left locally
+    local = sorted(os.listdir(working_dir))
+    assert "2024---01---call0.json" in local
+    assert [f for f in local if f.endswith(".wav")] == ["2024---01---call7.wav"]
+    # queue_size 2 + 3 transcribing + 2 downloading + 2 waiting to upload + 2 uploading
+    assert bucket.max_local_audio <= 11
+
+    # a second run only retries the failure
+    client = FakeBatchClient()
+    counts = _run(bucket, working_dir, client)
+    assert client.submitted == 1
+    assert counts == {"failed": 1, "uploaded": 9}
+
+def test_restart_collects_submitted_jobs(tmp_path):
+    """Jobs submitted before a crash are waited for not resubmitted, stages can be switched off"""
+    bucket, working_dir = _setup(tmp_path)
+    client = FakeBatchClient()
+    counts = _run(bucket, working_dir, client, transcribe=False, write_back=False)
+    assert counts == {"downloaded": 9, "uploaded": 1}
+    assert bucket.uploaded == []
+
+    # pretend three jobs were submitted by a run that died
+    state = speechmatics_pipeline.WorklistState(os.path.join(working_dir, "state.jsonl"))
+    for i in [1, 2, 3]:
+        job_id = client.submit_job(os.path.join(working_dir, f'2024---01---call{i}.wav'),
+                                   {"transcription_config": {"language": "en"}})
+        state.update(f'2024/01/call{i}', speechmatics_pipeline.SUBMITTED, job_id=job_id)
+    state.close()
+
+    counts = _run(bucket, working_dir, client, write_back=False)
+    assert client.submitted == 9
+    assert counts == {"failed": 1, "transcribed": 8, "uploaded": 1}
+    assert len([f for f in os.listdir(working_dir) if f.endswith(".wav")]) == 9
@@ -9,9 +9,6 @@ Then the individual parts of the file can be uploaded separately.
 """
 # *********************************************************************************************************************
 
-# standard imports
-import json
-
 # third Party imports
 import pandas
 import click
@@ -19,6 +16,7 @@ import numpy
 
 # custom imports
 import back_to_hf_unlabelled
+import hf_json_reader
 
 @click.command()
 @click.option('-f', '--filepath', type=str, required=True, help='Directory containing utterances as HF json')
@@ -26,16 +24,15 @@ import back_to_hf_unlabelled
 def main(filepath: str, parts: int) -> None:
     """Main Function"""
 
-    with open(filepath, mode="r", encoding="utf-8") as utterance_file:
-        data = json.load(utterance_file)
-
-    df = pandas.json_normalize(data["examples"], sep="-")
+    # every field is written back out, streamed so the file is not held as json and as a dataframe
+    df = hf_json_reader.read_examples(filepath)
     print(df.columns)
     df.sort_values(["context-context_id","created_at"],inplace=True)
     df.set_index(["context-context_id","created_at"],inplace=True,drop=True)
 
     # divide large dataframe into multiple parts
-    dfs = numpy.array_split(df, parts)
+    # split the positions, newer numpy no longer splits a dataframe into dataframes
+    dfs = [df.iloc[positions] for positions in numpy.array_split(numpy.arange(len(df)), parts)]
 
     # parse through every part of the divided dataframe
     for i,sub_df in enumerate(dfs):
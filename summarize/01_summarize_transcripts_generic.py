@@ -9,26 +9,32 @@
 # *********************************************************************************************************************
 
 # standard imports
-import time
-import json
 import os
+import sys
+import pathlib
 import logging
 import logging.config
-from multiprocessing import Pool
-from time import perf_counter
 import datetime
 import re
+from typing import Union
+import functools
 
 # 3rd party imports
 import openai
 import pandas
-import numpy
 import click
 import tiktoken
 import humanfirst
 
 DIR_PATH = os.path.dirname(os.path.realpath(__file__))
 
+# Custom Imports
+hf_module_path = str(pathlib.Path(DIR_PATH).parent)
+sys.path.insert(1, hf_module_path)
+import llm_executor # pylint: disable=wrong-import-position
+import llm_cache # pylint: disable=wrong-import-position
+import hf_json_reader # pylint: disable=wrong-import-position
+
 @click.command()
 @click.option('-i', '--input_filepath', type=str, required=True,
               help='Path containing HF Unlabelled conversations in json format or a txt format if utterances')
@@ -36,7 +42,7 @@ DIR_PATH = os.path.dirname(os.path.realpath(__file__))
 @click.option('-p', '--prompt', type=str, default='./prompts/abcd_example_prompt.txt',
               help='location of prompt file to read')
 @click.option('-t', '--output_tokens', type=int, default=500, help='Tokens to reserve for output')
-@click.option('-n', '--num_cores', type=int, default=2, help='Number of cores for parallelisation')
+@click.option('-n', '--num_cores', type=int, default=2, help='Number of calls to have in flight at once')
 @click.option('-s', '--sample_size', type=int, default=0, help='Number of conversations/utterances to sample')
 @click.option('-m', '--model_override', default='', type=str, required=False,
               help='Use this model name')
@@ -54,6 +60,12 @@ DIR_PATH = os.path.dirname(os.path.realpath(__file__))
               help='Configurable timeout for openai calls')
 @click.option('-f', '--filterstring', type=str, default='', required=False,
               help='Filter in columnname:value1,valuen format df will be reduced to only those acceptable values')
+@click.option('-w', '--requests_per_minute', type=int, default=0, required=False,
+              help='Maximum requests per minute across all calls default 0 no limit')
+@click.option('-k', '--tokens_per_minute', type=int, default=90000, required=False,
+              help='Maximum prompt plus output tokens per minute across all calls default 90000')
+@click.option('-c', '--cache_filename', type=str, default='', required=False,
+              help='SQLite file to cache responses in so identical prompts are not resent, default no cache')
 def main(input_filepath: str,
          openai_api_key: str,
          num_cores: int,
@@ -69,12 +81,16 @@ def main(input_filepath: str,
          verbose: bool,
          sleep_seconds: int,
          timeout_seconds: int,
-         filterstring: str
+         filterstring: str,
+         requests_per_minute: int,
+         tokens_per_minute: int,
+         cache_filename: str
          ) -> None:
     '''Main Function'''
     process(input_filepath, openai_api_key, num_cores, prompt, output_tokens,
             sample_size, model_override, log_file_path, drop_list, output_file_path,
-            rewrite, dummy, verbose, sleep_seconds, timeout_seconds, filterstring)
+            rewrite, dummy, verbose, sleep_seconds, timeout_seconds, filterstring,
+            requests_per_minute, tokens_per_minute, cache_filename)
 
 def process(input_filepath: str,
             openai_api_key: str,
@@ -91,7 +107,10 @@ def process(input_filepath: str,
             verbose: bool,
             sleep_seconds: int = 0,
             timeout_seconds: int = 15,
-            filterstring: str = ''):
+            filterstring: str = '',
+            requests_per_minute: int = 0,
+            tokens_per_minute: int = 90000,
+            cache_filename: str = ''):
     '''Summarization of Conversations'''
 
     # set log level
@@ -136,12 +155,11 @@ def process(input_filepath: str,
 
     # load input data
     if input_filepath.endswith(".json"):
-        with open(input_filepath, mode="r", encoding="utf8") as file:
-            data = json.load(file)
-        df = pandas.json_normalize(data=data["examples"], sep="-",)
-
-        # enforce id is string
-        df["context-context_id"] = df["context-context_id"].astype(str)
+        # only the fields used including any filter column, enforcing id is string
+        columns = ["context-context_id", "created_at", "text", "context-role"]
+        if filterstring != '' and filterstring.split(':')[0] not in columns:
+            columns.append(filterstring.split(':')[0])
+        df = hf_json_reader.read_examples(input_filepath, columns=columns, dtypes={"context-context_id": str})
 
         # give a sequence number to each utterance
         df = df.sort_values(["context-context_id", "created_at"])
@@ -315,13 +333,31 @@ def process(input_filepath: str,
     # verbose setting
     df["verbose"] = verbose
 
-    # parallelization
-    pool = Pool(num_cores)
-    dfs = numpy.array_split(df, num_cores)
-    pool_results = pool.map(parallelise_calls, [(df, logger) for df in dfs])
-    pool.close()
-    pool.join()
-    df = pandas.concat(pool_results, axis=1)
+    # identical prompts from previous runs are answered from the cache without taking any of the budget
+    cache = None
+    lookup = None
+    if cache_filename != '':
+        cache = llm_cache.LLMResponseCache(cache_filename)
+        lookup = functools.partial(lookup_summary, cache=cache)
+
+    # run the calls concurrently within the rate limits, each worker takes the next conversation
+    # as soon as it is free and each summary is written as soon as it is returned
+    executor = llm_executor.LLMExecutor(call=functools.partial(call_api, cache=cache),
+                                        concurrency=num_cores,
+                                        requests_per_minute=requests_per_minute,
+                                        tokens_per_minute=tokens_per_minute,
+                                        sleep_seconds=sleep_seconds,
+                                        on_result=write_summary,
+                                        lookup=lookup,
+                                        logger=logger)
+    jobs = []
+    for context_id, row in df[~df["skip"]].iterrows():
+        jobs.append(llm_executor.LLMJob(key=context_id, payload=row, tokens=int(row["tokens"]) + output_tokens))
+    logger.info('Skipping %i and summarizing %i', df.shape[0] - len(jobs), len(jobs))
+    executor.run_sync(jobs)
+    if cache is not None:
+        logger.info(cache.summary())
+        cache.close()
 
 
 def get_completed_files(output_file_path: str) -> pandas.DataFrame:
@@ -351,50 +387,39 @@ def merge_prompt_and_string(text: str, prompt: str, re_tag: re) -> str:
     return prompt
 
 
-def parallelise_calls(args) -> pandas.DataFrame:
-    '''Parallelise dataframe processing'''
-    df,logger = args
-    return df.apply(call_api, axis=1, args=[logger])
-
+def call_api(row: pandas.Series, cache: llm_cache.LLMResponseCache = None) -> pandas.Series:
+    '''Call OpenAI API for summarization, exceptions are retried by the executor'''
 
-def call_api(row: pandas.Series, logger: logging) -> pandas.Series:
-    '''Call OpenAI API for summarization'''
-
-    start_time = perf_counter()
-    logger.info(
-        "Call model: %s convo: %s, sleep: %i and timeout: %i",
-        row["model"], row.name, row["sleep_seconds"], row["timeout_seconds"])
+    logger = logging.getLogger('humanfirst.summarize')
+    logger.info("Call model: %s convo: %s and timeout: %i", row["model"], row.name, row["timeout_seconds"])
     if row["verbose"]:
         logger.info("Prompt: %s", row["prompt"])
+    return summarize(row.copy(), output_tokens=row["max_tokens"], cache=cache)
 
-    row["summary"] = ''
-    row["total_tokens"] = 0
-    if not row["skip"]:
-        try:
-            row = summarize(row, output_tokens=row["max_tokens"])
-        except Exception as e:  # pylint: disable=broad-except
-            logger.error('Exception for %s is %s', row.name, e)
-            return row["summary"]
-
-    logger.info('Total tokens for conversation id %s is %s',
-                 row.name, row["total_tokens"])
-    logger.info('Conversation - %s is summarized', row.name)
-
-    # write the file to output if not in dummy mode
-    if not row["skip"]:
-        with open(os.path.join(row["summary_path"],f'{row["context-context_id"]}.txt'),
-                  mode="w", encoding="utf8") as file:
-            file.write(row["summary"])
 
-    logger.info('Summary is saved at: %s', row["summary_path"])
-    end_time = perf_counter()
-    logger.info('Took %.2f seconds', end_time-start_time)
-    if row["sleep_seconds"] > 0:
-        logger.info('Sleeping for %i seconds', row["sleep_seconds"])
-        time.sleep(row["sleep_seconds"])
+def lookup_summary(row: pandas.Series, cache: llm_cache.LLMResponseCache) -> Union[pandas.Series, None]:
+    '''The row with the summary of an identical previous call from the cache or None'''
+
+    cached = cache.get(row["model"], row["prompt"], 0.0, row["max_tokens"])
+    if cached is None:
+        return None
+    row = row.copy()
+    row["summary"] = cached["content"]
+    row["total_tokens"] = cached["total_tokens"]
     return row
 
 
+def write_summary(job: llm_executor.LLMJob, row: pandas.Series) -> None:
+    '''Write the summary to output as soon as it is returned'''
+
+    logger = logging.getLogger('humanfirst.summarize')
+    logger.info('Total tokens for conversation id %s is %s', job.key, row["total_tokens"])
+    with open(os.path.join(row["summary_path"],f'{row["context-context_id"]}.txt'),
+              mode="w", encoding="utf8") as file:
+        file.write(row["summary"])
+    logger.info('Summary is saved at: %s', row["summary_path"])
+
+
 def calculate_which_model(row: pandas.Series, output_tokens: int) -> str:
     '''Works out which model for data line based on tokens'''
 
@@ -412,8 +437,8 @@ def calculate_which_model(row: pandas.Series, output_tokens: int) -> str:
         raise RuntimeError(error_string)
 
 
-def summarize(row: pandas.Series, output_tokens: int) -> str:
-    '''Summarizes single conversation using prompt'''
+def summarize(row: pandas.Series, output_tokens: int, cache: llm_cache.LLMResponseCache = None) -> str:
+    '''Summarizes single conversation using prompt, storing the response in the cache if there is one'''
 
     response = openai.ChatCompletion.create(
         model=row["model"],
@@ -429,6 +454,8 @@ def summarize(row: pandas.Series, output_tokens: int) -> str:
     )
     row["summary"] = response.choices[0].message.content + "\n"
     row["total_tokens"] = response.usage.total_tokens
+    if cache is not None:
+        cache.put(row["model"], row["prompt"], 0.0, output_tokens, row["summary"], row["total_tokens"])
     return row
 
 def count_tokens(text: str, encoding):
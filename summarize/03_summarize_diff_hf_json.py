@@ -23,6 +23,7 @@ import numpy
 import_path = os.path.dirname(os.path.realpath(__file__))
 hf_module_path = str(pathlib.Path(import_path).parent)
 sys.path.insert(1, hf_module_path)
+import embedding_store # pylint: disable=wrong-import-position
 
 
 @click.command()
@@ -115,10 +116,9 @@ def write_workspace(uri: str, df: pandas.DataFrame):
     print(f"Wrote to: {uri_out}")
 
 
-def similarity(row: pandas.Series) -> numpy.float64:
-    "Calculate dot product cosine similarity for already normalised USE results"
-    similarty_results = numpy.inner(row["embeddings_a"], row["embeddings_b"])
-    return similarty_results
+def similarity(embeddings_a: numpy.ndarray, embeddings_b: numpy.ndarray) -> numpy.ndarray:
+    "Calculate cosine similarity of each row of a with the same row of b in one go"
+    return embedding_store.row_cosine(embeddings_a, embeddings_b)
 
 
 def get_df(uri: str) -> pandas.DataFrame:
@@ -26,11 +26,14 @@ import tensorflow_hub # pylint: disable=import-error
 import_path = os.path.dirname(os.path.realpath(__file__))
 hf_module_path = str(pathlib.Path(import_path).parent)
 sys.path.insert(1, hf_module_path)
+import embedding_store # pylint: disable=wrong-import-position
 
 @click.command()
 @click.option('-a', '--lhs', type=str, required=True, help='URI for HF Workspace Json for LHS of compare')
 @click.option('-b', '--rhs', type=str, required=True, help='URI for HF Workspace Json for RHS of compare')
-def main(lhs: str, rhs: str):
+@click.option('-e', '--embeddings_dir', type=str, required=False, default='',
+              help='Directory to store embeddings in so a rerun does not re-embed, default not stored')
+def main(lhs: str, rhs: str, embeddings_dir: str):
     '''Main function'''
    
     df_lhs = get_df(lhs)
@@ -41,12 +44,17 @@ def main(lhs: str, rhs: str):
     module_url = "https://tfhub.dev/google/universal-sentence-encoder/3"
     model = tensorflow_hub.load(module_url)
 
-    # 
-    df["embeddings_lhs"] = numpy.array(model(df_lhs['text'])["outputs"]).tolist()
-    df["embeddings_rhs"] = numpy.array(model(df_rhs['text'])["outputs"]).tolist()
+    # embed anything not already stored, the model runs in process so one worker
+    store = embedding_store.EmbeddingStore(embeddings_dir, "universal-sentence-encoder-3")
+    embeddings_lhs = embedding_store.embed_texts(df_lhs['text'].to_list(),
+                                                 lambda chunk: numpy.array(model(chunk)["outputs"]),
+                                                 store=store, workers=1)
+    embeddings_rhs = embedding_store.embed_texts(df_rhs['text'].to_list(),
+                                                 lambda chunk: numpy.array(model(chunk)["outputs"]),
+                                                 store=store, workers=1)
     df.rename(columns={"text":"text_lhs"},inplace=True)
     df["text_rhs"] = df_rhs["text"]
-    df["similarity"] = df.apply(calc_similarity,axis=1)
+    df["similarity"] = embedding_store.row_cosine(embeddings_lhs, embeddings_rhs)
     df["quartile"] = df["similarity"].apply(calc_quartile)
 
     with pandas.option_context('display.max_colwidth', 75):
@@ -67,11 +75,6 @@ def calc_quartile(sim: numpy.float64) -> int:
     else:
         return 1
     
-def calc_similarity(row:pandas.Series) -> numpy.float64:
-    "Calculate dot product cosine similarity for already normalised USE results"
-    similarty_results = numpy.inner(row["embeddings_lhs"],row["embeddings_rhs"])
-    return similarty_results
-
 def get_df(uri:str) -> pandas.DataFrame:
     "Get dataframe of examples"
     print(f"Reading {uri}")
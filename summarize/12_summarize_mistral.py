@@ -11,16 +11,17 @@
 # standard imports
 import json
 import os
+import sys
+import pathlib
+import functools
 import logging
 import logging.config
-from multiprocessing import Pool
-from time import perf_counter
 import datetime
 import re
+from typing import Union
 
 # 3rd party imports
 import pandas
-import numpy
 import click
 import tiktoken
 import humanfirst
@@ -31,6 +32,12 @@ from mistralai.models.chat_completion import ChatMessage
 
 DIR_PATH = os.path.dirname(os.path.realpath(__file__))
 
+# Custom Imports
+hf_module_path = str(pathlib.Path(DIR_PATH).parent)
+sys.path.insert(1, hf_module_path)
+import llm_executor # pylint: disable=wrong-import-position
+import llm_cache # pylint: disable=wrong-import-position
+
 @click.command()
 @click.option('-i', '--input_filepath', type=str, required=True,
               help='Path containing HF Unlabelled conversations in json format or a txt format if utterances')
@@ -38,7 +45,7 @@ DIR_PATH = os.path.dirname(os.path.realpath(__file__))
 @click.option('-p', '--prompt', type=str, default='./prompts/abcd_01_issue_example_prompt.txt',
               help='location of prompt file to read')
 @click.option('-t', '--output_tokens', type=int, default=500, help='Tokens to reserve for output')
-@click.option('-n', '--num_cores', type=int, default=2, help='Number of cores for parallelisation')
+@click.option('-n', '--num_cores', type=int, default=2, help='Number of calls to have in flight at once')
 @click.option('-s', '--sample_size', type=int, default=0, help='Number of conversations/utterances to sample')
 @click.option('-m', '--model_override', default='', type=str, required=False,
               help='Use this model name')
@@ -50,6 +57,12 @@ DIR_PATH = os.path.dirname(os.path.realpath(__file__))
 @click.option('-d', '--dummy', is_flag=True, type=bool, default=False, help='Skip the actual openai call')
 @click.option('-v', '--verbose', is_flag=True, type=bool, default=False,
               help='Set logging level to DEBUG otherwise INFO')
+@click.option('-w', '--requests_per_minute', type=int, default=0, required=False,
+              help='Maximum requests per minute across all calls default 0 no limit')
+@click.option('-k', '--tokens_per_minute', type=int, default=90000, required=False,
+              help='Maximum prompt plus output tokens per minute across all calls default 90000')
+@click.option('-c', '--cache_filename', type=str, default='', required=False,
+              help='SQLite file to cache responses in so identical prompts are not resent, default no cache')
 def main(input_filepath: str,
          api_key: str,
          num_cores: int,
@@ -62,11 +75,14 @@ def main(input_filepath: str,
          output_file_path: str,
          rewrite: bool,
          dummy: bool,
-         verbose: bool) -> None:
+         verbose: bool,
+         requests_per_minute: int,
+         tokens_per_minute: int,
+         cache_filename: str) -> None:
     '''Main Function'''
     process(input_filepath, api_key, num_cores, prompt, output_tokens,
             sample_size, model_override, log_file_path, drop_list, output_file_path,
-            rewrite, dummy, verbose)
+            rewrite, dummy, verbose, requests_per_minute, tokens_per_minute, cache_filename)
 
 
 def process(input_filepath: str,
@@ -81,7 +97,10 @@ def process(input_filepath: str,
             output_file_path: str,
             rewrite: bool,
             dummy: bool,
-            verbose: bool):
+            verbose: bool,
+            requests_per_minute: int = 0,
+            tokens_per_minute: int = 90000,
+            cache_filename: str = ''):
     '''Summarization of Conversations'''
 
     # set log level
@@ -279,13 +298,29 @@ def process(input_filepath: str,
 
     print(df)
 
-    # parallelization
-    pool = Pool(num_cores)
-    dfs = numpy.array_split(df, num_cores)
-    pool_results = pool.map(parallelise_calls, [(df, logger, api_key) for df in dfs])
-    pool.close()
-    pool.join()
-    df = pandas.concat(pool_results, axis=1)
+    # run the calls concurrently within the rate limits, each worker takes the next conversation
+    # as soon as it is free and each summary is written as soon as it is returned
+    client = MistralClient(api_key=api_key)
+    cache = None
+    lookup = None
+    if cache_filename != '':
+        cache = llm_cache.LLMResponseCache(cache_filename)
+        lookup = functools.partial(lookup_summary, cache=cache)
+    executor = llm_executor.LLMExecutor(call=functools.partial(call_api, client=client, cache=cache),
+                                        concurrency=num_cores,
+                                        requests_per_minute=requests_per_minute,
+                                        tokens_per_minute=tokens_per_minute,
+                                        on_result=write_summary,
+                                        lookup=lookup,
+                                        logger=logger)
+    jobs = []
+    for context_id, row in df[~df["skip"]].iterrows():
+        jobs.append(llm_executor.LLMJob(key=context_id, payload=row, tokens=int(row["tokens"]) + output_tokens))
+    logger.info('Skipping %i and summarizing %i', df.shape[0] - len(jobs), len(jobs))
+    executor.run_sync(jobs)
+    if cache is not None:
+        logger.info(cache.summary())
+        cache.close()
 
 
 def get_completed_files(output_file_path: str) -> pandas.DataFrame:
@@ -315,47 +350,40 @@ def merge_prompt_and_string(text: str, prompt: str, re_tag: re) -> str:
     return prompt
 
 
-def parallelise_calls(args) -> pandas.DataFrame:
-    '''Parallelise dataframe processing'''
-    df,logger, api_key = args
-    client = MistralClient(api_key=api_key)
-    return df.apply(call_api, axis=1, args=[logger, client])
-
+def call_api(row: pandas.Series, client: MistralClient,
+             cache: llm_cache.LLMResponseCache = None) -> pandas.Series:
+    '''Call Mistral API for summarization, exceptions are retried by the executor'''
 
-def call_api(row: pandas.Series, logger: logging, client: MistralClient) -> pandas.Series:
-    '''Call Mistral API for summarization'''
-
-    start_time = perf_counter()
-    logger.info(
-        "Calling OpenAI model %s to summarize conversation: %s", row["model"], row.name)
+    logger = logging.getLogger('humanfirst.summarize')
+    logger.info("Calling Mistral model %s to summarize conversation: %s", row["model"], row.name)
     if row["verbose"]:
         logger.info("Prompt: %s", row["prompt"])
+    return summarize(row.copy(), output_tokens=row["max_tokens"], client=client, cache=cache)
 
-    row["summary"] = ''
-    row["total_tokens"] = 0
-    if not row["skip"]:
-        try:
-            row = summarize(row, output_tokens=row["max_tokens"], client=client)
-        except Exception as e:  # pylint: disable=broad-except
-            logger.error('Exception for %s is %s', row.name, e)
-            return row["summary"]
-
-    logger.info('Total tokens for conversation id %s is %s',
-                 row.name, row["total_tokens"])
-    logger.info('Conversation - %s is summarized', row.name)
-
-    # write the file to output if not in dummy mode
-    if not row["skip"]:
-        with open(os.path.join(row["summary_path"],f'{row["context-context_id"]}.txt'),
-                  mode="w", encoding="utf8") as file:
-            file.write(row["summary"])
 
-    logger.info('Summary is saved at: %s', row["summary_path"])
-    end_time = perf_counter()
-    logger.info('Took %.2f seconds', end_time-start_time)
+def lookup_summary(row: pandas.Series, cache: llm_cache.LLMResponseCache) -> Union[pandas.Series, None]:
+    '''The row with the summary of an identical previous call from the cache or None'''
+
+    cached = cache.get(row["model"], row["prompt"], 0.0, row["max_tokens"])
+    if cached is None:
+        return None
+    row = row.copy()
+    row["summary"] = cached["content"]
+    row["total_tokens"] = cached["total_tokens"]
     return row
 
 
+def write_summary(job: llm_executor.LLMJob, row: pandas.Series) -> None:
+    '''Write the summary to output as soon as it is returned'''
+
+    logger = logging.getLogger('humanfirst.summarize')
+    logger.info('Total tokens for conversation id %s is %s', job.key, row["total_tokens"])
+    with open(os.path.join(row["summary_path"],f'{row["context-context_id"]}.txt'),
+              mode="w", encoding="utf8") as file:
+        file.write(row["summary"])
+    logger.info('Summary is saved at: %s', row["summary_path"])
+
+
 def calculate_which_model(row: pandas.Series, output_tokens: int) -> str:
     '''Works out which model for data line based on tokens'''
 
@@ -369,8 +397,9 @@ def calculate_which_model(row: pandas.Series, output_tokens: int) -> str:
         raise RuntimeError(error_string)
 
 
-def summarize(row: pandas.Series, output_tokens: int, client: MistralClient) -> str:
-    '''Summarizes single conversation using prompt'''
+def summarize(row: pandas.Series, output_tokens: int, client: MistralClient,
+              cache: llm_cache.LLMResponseCache = None) -> str:
+    '''Summarizes single conversation using prompt, storing the response in the cache if there is one'''
 
     user_message = ChatMessage(role = "user", content = row["prompt"])
     messages = [user_message]
@@ -382,6 +411,8 @@ def summarize(row: pandas.Series, output_tokens: int, client: MistralClient) ->
     )
     row["summary"] = response.choices[0].message.content + "\n"
     row["total_tokens"] = response.usage.total_tokens
+    if cache is not None:
+        cache.put(row["model"], row["prompt"], 0.0, output_tokens, row["summary"], row["total_tokens"])
     return row
 
 
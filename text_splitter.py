@@ -1,8 +1,8 @@
 """
 python text_splitter.py
--filepath <unlabelled hf json>
+-filepath <unlabelled hf json>  ending .gz to read gzip compressed
 --split <text_to_split>
---output <output_path>
+--output <output_path>       ending .gz to write gzip compressed
 --timestamp <created_at_time>
 --key_id <unique_id>
 
@@ -14,16 +14,19 @@ text_to_split,created_at_time,key_id - in case of nested object start the
 # *****************************************************************************
 
 # standard imports
-import json
 import re
-from datetime import datetime
-from dateutil import parser
+from typing import Iterator
 
 # third Party imports
 import pandas
 import click
 import nltk
-import humanfirst
+
+# custom imports
+import date_parsing
+import hf_example_builder
+import hf_json_reader
+import hf_json_writer
 
 try:
     nltk.data.find('tokenizers/punkt')
@@ -42,13 +45,12 @@ class MetadataNotStingException(Exception):
 def main(filepath: str, split: str, output: str, key_id: str, timestamp: str) -> None:
     """Main Function"""
 
-    with open(filepath, mode="r", encoding="utf-8") as utterance_file:
-        utterances = json.load(utterance_file)
-
-    df = pandas.json_normalize(utterances["examples"], sep="-")
+    # only the fields used here, every metadata key is carried over to the split examples
+    columns = list(dict.fromkeys([key_id, timestamp, split, "text", "metadata-*"]))
+    df = hf_json_reader.read_examples(filepath, columns=columns)
     # print(df)
 
-    df["created_at"] = df[timestamp].apply(convert_timestamps)
+    df["created_at"] = convert_timestamps_column(df[timestamp])
 
     # split the utterances into logical units
     pt = nltk.tokenize.PunktSentenceTokenizer()
@@ -72,23 +74,15 @@ def main(filepath: str, split: str, output: str, key_id: str, timestamp: str) ->
 
     df["metadata"] = df.apply(create_metadata, args=[metadata_keys_to_extract], axis=1)
 
-    df = df.set_index(["utterance_id", "idx"])
     print(f"Number of rows after splitting text is {df.shape[0]}")
 
-    # build examples
-    df = df.apply(build_examples, axis=1)
-
-    # A workspace is used to upload labelled or unlabelled data
     # unlabelled data will have no intents on the examples and no intents defined.
-    unlabelled = humanfirst.objects.HFWorkspace()
-    # add the examples to workspace
-    for example in df['example']:
-        unlabelled.add_example(example)
-
-    # write to output
-    file_out = open(output, mode='w', encoding='utf8')
-    unlabelled.write_json(file_out)
-    file_out.close()
+    # stream the examples to output in the order HFWorkspace.write_json would use, by the created_at string
+    df["created_at"] = df["created_at"].map(hf_example_builder.format_created_at)
+    df = df.sort_values("created_at", kind="stable")
+    with hf_json_writer.open_output_atomic(output) as file_out:
+        with hf_json_writer.HFJsonStreamWriter(file_out) as writer:
+            writer.write_example_dicts(build_example_dicts(df))
     print(f"{output} is successfully created")
 
 
@@ -100,11 +94,12 @@ def set_first_utterance_and_seq(index: int) -> list:
     return row
 
 
-def convert_timestamps(datestring: str) -> datetime:
-    """Convert datestring to isoformat"""
+def convert_timestamps_column(datestrings: pandas.Series) -> pandas.Series:
+    """Convert a column of datestrings to isoformat parsing each distinct value once"""
 
-    datestring = re.sub(" UTC$", "", datestring)
-    return parser.parse(datestring).isoformat()
+    datestrings = datestrings.astype(str).str.replace(" UTC$", "", regex=True)
+    parsed = date_parsing.parse_dates_column(datestrings)
+    return pandas.Series([d.isoformat() for d in parsed.to_list()], index=datestrings.index)
 
 
 def split_utterance(text: str, pt) -> list:
@@ -140,28 +135,15 @@ def create_metadata(row: pandas.Series, metadata_keys_to_extract: list) -> dict:
     return metadata
 
 
-def build_examples(row: pandas.Series) -> pandas.Series:
-    '''Build the examples'''
-
-    # build examples
-    example = humanfirst.objects.HFExample(
-        id=f"example-{row.name[0]}-{row.name[1]}",
-        text=row['split_text'],
-        created_at=row["created_at"],
-        intents=[],  # no intents as unlabelled
-        tags=[],  # recommend uploading metadata for unlabelled and tags for labelled
-        metadata=row['metadata'],
-        # this links the individual utterances into their conversation
-        context=humanfirst.objects.HFContext(
-            str(row.name[0]),
-            # any ID can be used recommend a hash of the text
-            # which is repeatable or the external conversation id if there is one.
-            'conversation',  # the type of document
-            "client"  # the speakers role in the conversations
-        )
-    )
-    row['example'] = example
-    return row
+def build_example_dicts(df: pandas.DataFrame) -> Iterator[dict]:
+    '''Build the examples from the whole columns'''
+
+    # the split sentences of an utterance are linked as a conversation on the original utterance id
+    utterance_ids = df["utterance_id"].astype(str).to_list()
+    ids = [f"example-{utterance_id}-{idx}" for utterance_id, idx in zip(utterance_ids, df["idx"].to_list())]
+    return hf_example_builder.iter_example_dicts(df["split_text"], ids, df["created_at"],
+                                                 metadata=df["metadata"].to_list(),
+                                                 context_ids=utterance_ids, roles="client")
 
 
 if __name__ == '__main__':
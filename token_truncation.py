@@ -0,0 +1,75 @@
+"""
+token_truncation.py
+
+Tokenises and truncates whole columns of text with one shared tiktoken encoder.
+
+- Each model's encoder is looked up once per column rather than once per cell.
+- Columns are split into one slice per thread and each thread encodes its slice, the rust encoder
+  releases the GIL so this scales with cores.  tiktoken's own encode_batch hands every text to the pool
+  separately which costs more than encoding a short cell, so it isn't used.
+- Special token text like <|endoftext|> is encoded as ordinary text as encode(text, disallowed_special=False) did.
+
+Usage:
+    trimmed, counts = token_truncation.encode_and_truncate(df["text"].to_list(), trim_to=8190, model="gpt-4")
+
+"""
+# ******************************************************************************************************************120
+
+# standard imports
+import os
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+# 3rd party imports
+import tiktoken
+
+DEFAULT_THREADS = min(8, os.cpu_count() or 1)
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoding(model: str = "gpt-4") -> tiktoken.Encoding:
+    """The encoder for a model built once per process"""
+    return tiktoken.encoding_for_model(model)
+
+
+def encode_texts(texts: list, model: str = "gpt-4", num_threads: int = DEFAULT_THREADS,
+                 encoding: tiktoken.Encoding = None) -> list:
+    """Returns a list of token lists one per text, non strings are converted with str"""
+    if encoding is None:
+        encoding = get_encoding(model)
+    texts = [text if isinstance(text, str) else str(text) for text in texts]
+    return map_in_slices(encoding.encode_ordinary, texts, num_threads)
+
+
+def encode_and_truncate(texts: list, trim_to: int, model: str = "gpt-4", num_threads: int = DEFAULT_THREADS,
+                        encoding: tiktoken.Encoding = None) -> tuple:
+    """Returns (token lists cut to trim_to tokens, original token counts)"""
+    tokens = encode_texts(texts, model=model, num_threads=num_threads, encoding=encoding)
+    counts = [len(t) for t in tokens]
+    return [t[0:trim_to] for t in tokens], counts
+
+
+def truncate_texts(texts: list, trim_to: int, model: str = "gpt-4", num_threads: int = DEFAULT_THREADS,
+                   encoding: tiktoken.Encoding = None) -> tuple:
+    """Returns (texts cut to at most trim_to tokens, original token counts, truncated token counts)
+
+    Texts under the limit are returned untouched rather than round tripped through decode."""
+    if encoding is None:
+        encoding = get_encoding(model)
+    trimmed, counts = encode_and_truncate(texts, trim_to, num_threads=num_threads, encoding=encoding)
+    over = [i for i, count in enumerate(counts) if count > trim_to]
+    decoded = map_in_slices(encoding.decode, [trimmed[i] for i in over], num_threads)
+    result = [text if isinstance(text, str) else str(text) for text in texts]
+    for i, text in zip(over, decoded):
+        result[i] = text
+    return result, counts, [len(t) for t in trimmed]
+
+
+def map_in_slices(function, values: list, num_threads: int) -> list:
+    """[function(v) for v in values] with values split into one slice per thread"""
+    if num_threads <= 1 or len(values) < num_threads * 2:
+        return [function(v) for v in values]
+    size = -(-len(values) // num_threads)
+    slices = [values[i:i + size] for i in range(0, len(values), size)]
+    with ThreadPoolExecutor(max_workers=num_threads) as pool:
+        return [result for part in pool.map(lambda s: [function(v) for v in s], slices) for result in part]
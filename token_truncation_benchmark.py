@@ -0,0 +1,68 @@
+"""
+python token_truncation_benchmark.py -r 200000
+
+Compares the per row tokenise and trim previously used by compare_metadata_results.encode_column,
+looking up the encoder for every cell, against token_truncation.encode_and_truncate
+on a synthetic column.  Checks both produce the same tokens.
+
+"""
+# ******************************************************************************************************************120
+
+# standard imports
+import time
+import random
+
+# 3rd party imports
+import click
+import pandas
+import tiktoken
+
+# custom imports
+import token_truncation
+
+WORDS = ['the', 'customer', 'asked', 'about', 'their', 'refund', 'order', 'delivery', 'was', 'late', 'and',
+         'agent', 'apologised', 'password', 'reset', 'account', 'locked', 'please', 'help', 'thanks']
+
+@click.command()
+@click.option('-r', '--rows', type=int, required=False, default=200000, help='Number of synthetic cells')
+@click.option('-w', '--words', type=int, required=False, default=60, help='Average words per cell')
+@click.option('-t', '--trim_to', type=int, required=False, default=50, help='Tokens to trim to')
+@click.option('-m', '--model', type=str, required=False, default='gpt-4', help='Model to take the encoder for')
+@click.option('-n', '--num_threads', type=int, required=False, default=token_truncation.DEFAULT_THREADS,
+              help='Threads for the batch encoder')
+@click.option('-s', '--seed', type=int, required=False, default=42, help='Random seed')
+def main(rows: int, words: int, trim_to: int, model: str, num_threads: int, seed: int) -> None:
+    """Main Function"""
+
+    rng = random.Random(seed)
+    df = pandas.DataFrame({'text': [' '.join(rng.choices(WORDS, k=rng.randint(1, words * 2)))
+                                    for _ in range(rows)]})
+    print(f'Synthetic column: {df.shape[0]} cells')
+
+    # warm both so neither pays for loading the bpe file
+    token_truncation.get_encoding(model)
+
+    start = time.perf_counter()
+    per_row = df['text'].apply(encode_per_row, args=[model]).apply(lambda tokens: tokens[0:trim_to])
+    per_row_secs = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batched, _ = token_truncation.encode_and_truncate(df['text'].to_list(), trim_to,
+                                                      model=model, num_threads=num_threads)
+    batched_secs = time.perf_counter() - start
+
+    assert per_row.to_list() == batched
+    print('Outputs identical')
+
+    print(f'{"path":<10} {"seconds":>10} {"rows_per_s":>14}')
+    print(f'{"per_row":<10} {per_row_secs:>10.3f} {rows/per_row_secs:>14,.0f}')
+    print(f'{"batched":<10} {batched_secs:>10.3f} {rows/batched_secs:>14,.0f}')
+    print(f'Speedup: {per_row_secs/batched_secs:.1f}x')
+
+def encode_per_row(text: str, model: str) -> list:
+    """What compare_metadata_results.encode_this did before, encoder looked up for every cell"""
+    enc = tiktoken.encoding_for_model(model)
+    return enc.encode(str(text), disallowed_special=False)
+
+if __name__ == '__main__':
+    main() # pylint: disable=no-value-for-parameter
@@ -0,0 +1,40 @@
+"""
+Test token_truncation.py gives the same tokens and text as encoding cell by cell
+
+"""
+# ***************************************************************************80**************************************120
+
+# 3rd party imports
+import tiktoken
+
+# custom imports
+import token_truncation # file under test
+
+# a byte level encoder so the test doesn't need to download a bpe file
+ENCODING = tiktoken.Encoding(name="test_bytes",
+                             pat_str=r"""\S+|\s+""",
+                             mergeable_ranks={bytes([i]): i for i in range(256)},
+                             special_tokens={"<|endoftext|>": 256})
+
+TEXTS = ["hello world", "", "a much longer piece of text than the limit", 12345, "café <|endoftext|>"]
+
+def test_encode_and_truncate_matches_per_cell():
+    """Same tokens as encode then slice on every cell with special tokens treated as text"""
+    trimmed, counts = token_truncation.encode_and_truncate(TEXTS, 8, encoding=ENCODING, num_threads=2)
+    for text, tokens, count in zip(TEXTS, trimmed, counts):
+        expected = ENCODING.encode(str(text), disallowed_special=False)
+        assert count == len(expected)
+        assert tokens == expected[0:8]
+
+def test_threads_keep_order():
+    """Slicing over threads gives the same list in the same order"""
+    texts = [f"text number {i}" for i in range(101)]
+    assert token_truncation.encode_texts(texts, encoding=ENCODING, num_threads=4) == \
+        token_truncation.encode_texts(texts, encoding=ENCODING, num_threads=1)
+
+def test_truncate_texts():
+    """Only texts over the limit are cut"""
+    texts, counts, truncated_counts = token_truncation.truncate_texts(TEXTS, 8, encoding=ENCODING)
+    assert texts == ["hello wo", "", "a much l", "12345", "café <|"]
+    assert counts == [11, 0, 42, 5, 19]
+    assert truncated_counts == [8, 0, 8, 5, 8]
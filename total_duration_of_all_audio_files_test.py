@@ -0,0 +1,80 @@
+"""
+Test speechmatics/total_duration_of_all_audio_files.py reads durations from headers only
+
+"""
+# ***************************************************************************80**************************************120
+
+# standard imports
+import os
+import csv
+import sys
+import wave
+import struct
+import pathlib
+
+# 3rd party imports
+from click.testing import CliRunner
+
+# custom imports
+sys.path.insert(1, str(pathlib.Path(os.path.dirname(os.path.realpath(__file__))) / "speechmatics"))
+import total_duration_of_all_audio_files # file under test # pylint: disable=wrong-import-position
+
+def _write_wav(path: str, seconds: float, sample_rate: int, channels: int, sample_width: int = 2):
+    """Silent PCM wav written by the wave module"""
+    with wave.open(path, "wb") as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(sample_width)
+        wav.setframerate(sample_rate)
+        wav.writeframes(b"\x00" * int(seconds * sample_rate) * channels * sample_width)
+
+def _write_list_chunk_wav(path: str, seconds: float, sample_rate: int):
+    """Mono 16 bit wav with an odd sized LIST chunk between fmt and data, as call recorders write"""
+    data = b"\x00" * int(seconds * sample_rate) * 2
+    fmt = struct.pack("<HHIIHH", 1, 1, sample_rate, sample_rate * 2, 2, 16)
+    chunks = (b"fmt " + struct.pack("<I", len(fmt)) + fmt
+              + b"LIST" + struct.pack("<I", 5) + b"INFOx\x00"
+              + b"data" + struct.pack("<I", len(data)) + data)
+    with open(path, "wb") as file_out:
+        file_out.write(b"RIFF" + struct.pack("<I", 4 + len(chunks)) + b"WAVE" + chunks)
+
+def _write_flac_header(path: str, frames: int, sample_rate: int, channels: int, bits_per_sample: int):
+    """fLaC marker and a STREAMINFO block, enough for the header"""
+    packed = (sample_rate << 44) | ((channels - 1) << 41) | ((bits_per_sample - 1) << 36) | frames
+    streaminfo = b"\x00" * 10 + packed.to_bytes(8, "big") + b"\x00" * 16
+    with open(path, "wb") as file_out:
+        file_out.write(b"fLaC" + bytes([0x80]) + (34).to_bytes(3, "big") + streaminfo)
+
+def test_inventory_of_nested_folders(tmp_path):
+    """Durations, rates and channels for nested wav and flac files, unreadable files are reported not fatal"""
+    os.makedirs(tmp_path / "2024" / "01")
+    _write_wav(str(tmp_path / "a.wav"), 2.5, 8000, 1)
+    _write_wav(str(tmp_path / "2024" / "b.WAV"), 1.0, 16000, 2)
+    _write_wav(str(tmp_path / "2024" / "01" / "c.wav"), 0.25, 44100, 2, sample_width=3)
+    _write_list_chunk_wav(str(tmp_path / "2024" / "01" / "d.wav"), 3.0, 8000)
+    _write_flac_header(str(tmp_path / "2024" / "e.flac"), 48000 * 90, 48000, 1, 24)
+    (tmp_path / "2024" / "01" / "broken.wav").write_bytes(b"RIFF\x00\x00")
+    (tmp_path / "notes.txt").write_text("not audio", encoding="utf8")
+
+    assert total_duration_of_all_audio_files.list_audio_files(str(tmp_path), (".wav",)) == [str(tmp_path / "a.wav")]
+
+    output = str(tmp_path / "inventory.csv")
+    result = CliRunner().invoke(total_duration_of_all_audio_files.main,
+                                ["-f", str(tmp_path), "-t", ".wav,.flac", "-r", "-o", output, "-w", "3"])
+    assert result.exit_code == 0, result.output
+    assert "Total duration of all .wav,.flac files: 0.03 hours" in result.output
+
+    with open(output, mode="r", encoding="utf8") as file_in:
+        rows = {os.path.relpath(row["file"], tmp_path): row for row in csv.DictReader(file_in)}
+    assert sorted(rows) == ["2024/01/broken.wav", "2024/01/c.wav", "2024/01/d.wav", "2024/b.WAV",
+                            "2024/e.flac", "a.wav"]
+    summary = {name: (row["format"], float(row["duration_seconds"]), int(row["sample_rate"]), int(row["channels"]))
+               for name, row in rows.items() if row["error"] == ""}
+    assert summary == {
+        "a.wav": ("wav", 2.5, 8000, 1),
+        "2024/b.WAV": ("wav", 1.0, 16000, 2),
+        "2024/01/c.wav": ("wav", 0.25, 44100, 2),
+        "2024/01/d.wav": ("wav", 3.0, 8000, 1),
+        "2024/e.flac": ("flac", 90.0, 48000, 1)
+    }
+    assert rows["2024/01/c.wav"]["bits_per_sample"] == "24"
+    assert rows["2024/01/broken.wav"]["error"].startswith("error")
@@ -20,19 +20,44 @@ From the response, it extracts the follwoing information:
 Using the above extracted information the script produces coverage metric of the model
 ,i.e., percentage of utterances that are above specific confidence threshold
 
+Pages are fetched on a background thread one page ahead of the parsing, a failed page is retried
+with exponential backoff up to --max_retries times, and every page is written straight to the
+JSON, JSONL and CSV outputs so memory doesn't grow with the size of the conversation set
+
+With --incremental the extracted rows are kept in <workspace_name>_coverage.sqlite in the output directory
+keyed by conversation id with the conv_updated_at they were downloaded at.  A run that gets through every page
+without --quit_after_pages records in the store the startisodate it covers and the latest conv_updated_at seen
+as the watermark.  A repeat run only asks for conversations updated since the watermark, merges them in replacing
+older versions, then writes the CSV and calculates the coverage from everything in the store between
+startisodate and endisodate.  A run with no watermark yet, or a startisodate outside the range already covered,
+downloads everything from startisodate again.  The JSON and JSONL only hold the raw results of the conversations
+fetched.
+Stored predictions aren't refreshed for conversations that haven't changed, use --rebuild after retraining.
+
 Set HF_USERNAME and HF_PASSWORD as environment variables
 """
 # *****************************************************************************
 
 # standard imports
+import os
+import csv
 import json
-import copy
+import sqlite3
+import time
+import typing
+import textwrap
+import functools
 from os.path import isdir, join
+from concurrent.futures import ThreadPoolExecutor
 
 # third part imports
 import pandas
 import click
 import humanfirst
+from dateutil import parser
+
+COLUMNS = ["convoid", "conv_created_at", "conv_updated_at", "utterance", "utterance_created_at",
+           "role", "intent_id", "score", "intent", "seq"]
 
 
 @click.command()
@@ -52,18 +77,28 @@ import humanfirst
 @click.option('-t', '--confidence_threshold', type=float, default=0.4, help='Confidence threshold = 0.0 to 1.0')
 @click.option('-d', '--debug', is_flag=True, default=False, help='Debug')
 @click.option('-l','--delimiter',type=str,default="-",help='Intent name delimiter')
+@click.option('-z', '--page_size', type=int, default=50, help='Conversations per page from the query end point')
+@click.option('-r', '--max_retries', type=int, default=5,
+              help='Times to retry a failed page with exponential backoff before giving up')
+@click.option('-i', '--incremental', is_flag=True, default=False,
+              help='Only download conversations updated since the last run and merge them into the local store')
+@click.option('-a', '--rebuild', is_flag=True, default=False,
+              help='With --incremental delete the local store and download everything again')
 def main(username: str, password: str, output_filedir: str,
          namespace: bool, playbook: str,
          convsetsource: str, searchtext: str, startisodate: str,
          endisodate: str, quit_after_pages: int,
-         debug: bool, delimiter: str, confidence_threshold: float):
+         debug: bool, delimiter: str, confidence_threshold: float,
+         page_size: int, max_retries: int, incremental: bool, rebuild: bool):
     '''Main function'''
     write_coverage_csv(username, password, namespace, playbook,
                        convsetsource, searchtext,
                        startisodate=startisodate, endisodate=endisodate,
                        delimiter=delimiter,
                        quit_after_pages=quit_after_pages, debug=debug,
-                       confidence_threshold=confidence_threshold, output_filedir=output_filedir)
+                       confidence_threshold=confidence_threshold, output_filedir=output_filedir,
+                       page_size=page_size, max_retries=max_retries,
+                       incremental=incremental, rebuild=rebuild)
 
 
 def write_coverage_csv(username: str,
@@ -80,23 +115,24 @@ def write_coverage_csv(username: str,
                        separator: str = ',',
                        page_size: int = 50,
                        quit_after_pages: int = 0,
-                       debug: bool = False):
+                       debug: bool = False,
+                       max_retries: int = 5,
+                       incremental: bool = False,
+                       rebuild: bool = False):
     '''Download the full unlabelled model for the conversation set source with all the data science statistics
     inferred from the provided playbook then write a csv containing prediction data to the path provided with the
-    separator provided'''
+    separator provided.
+
+    Each page is written to the JSON, JSONL and CSV outputs as it arrives rather than held in memory.
+    With incremental only the conversations updated since the last run are downloaded and merged into
+    the local CoverageStore which the CSV and coverage are then produced from'''
 
     if not isdir(output_filedir):
         raise RuntimeError(f"Provied output directory {output_filedir} does not exists")
 
     hf_api = humanfirst.apis.HFAPI(username=username, password=password)
     playbook_dict = hf_api.get_playbook(namespace, playbook)
-
-    df, response_json_list = get_conversationset_df(hf_api, namespace, playbook, convsetsource,
-                                searchtext, startisodate, endisodate, playbook_dict, delimiter,
-                                page_size=page_size, quit_after_pages=quit_after_pages, debug=debug)
-
-    assert isinstance(df, pandas.DataFrame)
-    assert isinstance(response_json_list, list)
+    intent_name_index = get_intent_name_index(playbook_dict, delimiter)
 
     workspace_name = str(playbook_dict["name"]).replace(" ","_")
     workspace_name = workspace_name.replace("-","_")
@@ -107,34 +143,201 @@ def write_coverage_csv(username: str,
 
     output_file_uri_jsonl = join(output_filedir,f'{workspace_name}.jsonl')
 
-    print(f"Total number of conversation is {len(response_json_list)}")
-    print(f"Total number of records returned by query end point is {len(response_json_list)}")
-    with open(output_file_uri_json,mode="w",encoding="utf8") as fileobj:
-        json.dump(response_json_list,fileobj,indent=2)
+    store = None
+    fetch_startisodate = startisodate
+    if incremental:
+        store_filename = join(output_filedir, f'{workspace_name}_coverage.sqlite')
+        if rebuild and os.path.isfile(store_filename):
+            os.remove(store_filename)
+        store = CoverageStore(store_filename, {"namespace": namespace, "playbook": playbook,
+                                               "convsetsource": convsetsource, "searchtext": searchtext})
+        fetch_startisodate = store.delta_start(startisodate)
+        print(f"Store has {len(store)} conversations, fetching those updated since {fetch_startisodate}")
+
+    total_conversations = 0
+    counts = {"utterance": 0, "client": 0, "above_threshold": 0}
+    pages = iter_pages(hf_api, namespace, playbook, convsetsource, searchtext, fetch_startisodate, endisodate,
+                       page_size=page_size, quit_after_pages=quit_after_pages, max_retries=max_retries)
+    with open(output_file_uri_json, mode="w", encoding="utf8") as json_file, \
+         open(output_file_uri_jsonl, mode="w", encoding="utf8") as jsonl_file, \
+         open(output_file_uri_csv, mode="w", encoding="utf8", newline="") as csv_file:
+        csv_writer = csv.writer(csv_file, delimiter=separator)
+        csv_writer.writerow(COLUMNS)
+        json_file.write("[")
+        for i, response_json in enumerate(pages):
+            for item in response_json["results"]:
+                # same layout as json.dump of the whole list with indent=2
+                json_file.write(",\n" if total_conversations > 0 else "\n")
+                json_file.write(textwrap.indent(json.dumps(item, indent=2), "  "))
+                jsonl_file.write(json.dumps(item))
+                jsonl_file.write("\n")
+                total_conversations = total_conversations + 1
+
+            rows = extract_results([], intent_name_index, response_json, debug=debug)
+            if store is not None:
+                store.merge(rows)
+            else:
+                for row in rows:
+                    csv_writer.writerow([row[column] for column in COLUMNS])
+                    tally_row(counts, row, confidence_threshold)
+            print(f'Page {i}: {len(rows)}')
+        json_file.write("\n]" if total_conversations > 0 else "]")
+
+        if store is not None:
+            # only a run that saw every page can move the watermark on
+            if quit_after_pages == 0:
+                store.complete_sync(startisodate, fetch_startisodate)
+            for row in store.iter_rows(startisodate, endisodate):
+                csv_writer.writerow([row[column] for column in COLUMNS])
+                tally_row(counts, row, confidence_threshold)
+            print(f"Merged {total_conversations} conversations, store has {len(store)}")
+            store.close()
+
+    print(f"Total number of conversation is {total_conversations}")
     print(f'Raw results(JSON) are stored at: {output_file_uri_json}')
-
-    # Write the JSON objects as JSONL
-    with open(output_file_uri_jsonl, 'w', encoding="utf8") as jsonl_file:
-        for item in response_json_list:
-            json.dump(item, jsonl_file)
-            jsonl_file.write('\n')
     print(f'Raw results(JSONL) are stored at: {output_file_uri_jsonl}')
-
-    df.to_csv(output_file_uri_csv, sep=separator, encoding="utf8", index=False)
-    print(df)
     print(f'Extracted results are stored at : {output_file_uri_csv}')
 
-    df_client = copy.deepcopy(df.loc[df["role"]=="client"]).reset_index(drop=True)
-    total_utterance = df.shape[0]
-    total_client_utterance = df_client.shape[0]
+    total_utterance = counts["utterance"]
+    total_client_utterance = counts["client"]
     total_expert_utterance = total_utterance - total_client_utterance
     print(f"Total number of utterance is {total_utterance}")
     print(f"Total number of client utterance is {total_client_utterance}")
     print(f"Total number of expert utterance is {total_expert_utterance}")
-    utt_above_threshold_count = df_client.loc[df_client["score"] >= confidence_threshold].shape[0]
-    coverage = round((utt_above_threshold_count/total_client_utterance)*100,2)
+    if total_client_utterance == 0:
+        print("No client utterances so no coverage")
+        return
+    coverage = round((counts["above_threshold"]/total_client_utterance)*100,2)
     print(f"Coverage is {coverage}% at confidence threshold {confidence_threshold}")
 
+
+def tally_row(counts: dict, row: dict, confidence_threshold: float):
+    '''Add an extracted row to the utterance, client and above threshold counts'''
+    counts["utterance"] = counts["utterance"] + 1
+    if row["role"] == "client":
+        counts["client"] = counts["client"] + 1
+        if row["score"] is not None and row["score"] >= confidence_threshold:
+            counts["above_threshold"] = counts["above_threshold"] + 1
+
+
+class CoverageStore:
+    '''SQLite store of extracted rows holding the latest version of each conversation
+    for one namespace, playbook, conversation set and search text'''
+
+    def __init__(self, filename: str, scope: dict):
+        self.filename = filename
+        self.conn = sqlite3.connect(filename)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS scope (key TEXT PRIMARY KEY, value TEXT)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS conversations '
+                          '(convoid TEXT PRIMARY KEY, conv_updated_at TEXT, updated_epoch REAL)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS utterances '
+                          '(convoid TEXT, seq INTEGER, conv_created_at TEXT, conv_updated_at TEXT, '
+                          'utterance TEXT, utterance_created_at TEXT, role TEXT, intent_id TEXT, '
+                          'score REAL, intent TEXT, updated_epoch REAL, PRIMARY KEY (convoid, seq))')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS sync (key TEXT PRIMARY KEY, value TEXT)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS utterances_updated ON utterances (updated_epoch)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS conversations_updated ON conversations (updated_epoch)')
+        stored_scope = dict(self.conn.execute('SELECT key, value FROM scope').fetchall())
+        if len(stored_scope) == 0:
+            self.conn.executemany('INSERT INTO scope (key, value) VALUES (?, ?)', list(scope.items()))
+        elif stored_scope != scope:
+            raise RuntimeError(f'{filename} was built for {stored_scope} not {scope}, '
+                               'use a different output directory or --rebuild')
+        self.conn.commit()
+        # latest conv_updated_at merged by this instance
+        self.newest = ''
+
+    def __len__(self) -> int:
+        return self.conn.execute('SELECT COUNT(*) FROM conversations').fetchone()[0]
+
+    def watermark(self) -> str:
+        '''Latest conv_updated_at of the last complete sync, '' if there hasn't been one'''
+        return self._sync_value('watermark')
+
+    def covered_start(self) -> str:
+        '''startisodate everything up to the watermark has been downloaded from, '' if not synced'''
+        return self._sync_value('start')
+
+    def delta_start(self, startisodate: str) -> str:
+        '''Start of the date range to download, the watermark if startisodate is within the range already covered.
+        Conversations updated at the watermark itself come again and merge over themselves'''
+        watermark = self.watermark()
+        if watermark == '':
+            return startisodate
+        start_epoch = iso_to_epoch(startisodate)
+        if iso_to_epoch(self.covered_start()) <= start_epoch <= iso_to_epoch(watermark):
+            return watermark
+        return startisodate
+
+    def complete_sync(self, startisodate: str, fetch_startisodate: str):
+        '''Record that every conversation updated since fetch_startisodate has been merged,
+        extending the range covered if that was the watermark or starting it again at startisodate'''
+        start = self.covered_start() if fetch_startisodate != startisodate else startisodate
+        watermark = max([date for date in [fetch_startisodate, self.watermark(), self.newest] if date != ''],
+                        key=iso_to_epoch)
+        self.conn.executemany('INSERT OR REPLACE INTO sync (key, value) VALUES (?, ?)',
+                              [('start', start), ('watermark', watermark)])
+        self.conn.commit()
+
+    def _sync_value(self, key: str) -> str:
+        '''Value from the sync table or '''''
+        row = self.conn.execute('SELECT value FROM sync WHERE key = ?', (key,)).fetchone()
+        return row[0] if row is not None else ''
+
+    def merge(self, rows: list) -> int:
+        '''Replace the rows of each conversation unless the store already has a later version of it,
+        returns the number of conversations written'''
+        conversations = {}
+        for row in rows:
+            conversations.setdefault(row["convoid"], []).append(row)
+        merged = 0
+        for convoid, conversation_rows in conversations.items():
+            conv_updated_at = conversation_rows[0]["conv_updated_at"]
+            updated_epoch = iso_to_epoch(conv_updated_at)
+            if self.newest == '' or updated_epoch > iso_to_epoch(self.newest):
+                self.newest = conv_updated_at
+            stored = self.conn.execute('SELECT updated_epoch FROM conversations WHERE convoid = ?',
+                                       (convoid,)).fetchone()
+            if stored is not None and stored[0] > updated_epoch:
+                continue
+            self.conn.execute('DELETE FROM utterances WHERE convoid = ?', (convoid,))
+            self.conn.executemany(f'INSERT INTO utterances ({", ".join(COLUMNS)}, updated_epoch) '
+                                  f'VALUES ({", ".join(["?"] * (len(COLUMNS) + 1))})',
+                                  [[row[column] for column in COLUMNS] + [updated_epoch]
+                                   for row in conversation_rows])
+            self.conn.execute('INSERT OR REPLACE INTO conversations (convoid, conv_updated_at, updated_epoch) '
+                              'VALUES (?, ?, ?)', (convoid, conv_updated_at, updated_epoch))
+            merged = merged + 1
+        self.conn.commit()
+        return merged
+
+    def iter_rows(self, startisodate: str, endisodate: str) -> typing.Iterator[dict]:
+        '''Rows of the conversations last updated between startisodate and endisodate'''
+        cursor = self.conn.execute(f'SELECT {", ".join(COLUMNS)} FROM utterances '
+                                   'WHERE updated_epoch >= ? AND updated_epoch <= ? '
+                                   'ORDER BY updated_epoch, convoid, seq',
+                                   (iso_to_epoch(startisodate), iso_to_epoch(endisodate)))
+        for row in cursor:
+            yield dict(zip(COLUMNS, row))
+
+    def close(self):
+        '''Close the connection'''
+        self.conn.close()
+
+
+def iso_to_epoch(isodate: str) -> float:
+    '''Seconds since the epoch for an ISO 8601 date, so differently formatted dates compare correctly'''
+    return parser.isoparse(isodate).timestamp()
+
+
+def get_intent_name_index(playbook_dict: dict, delimiter: str) -> dict:
+    '''Intent id to full intent name for the playbook'''
+    labelled_workspace = humanfirst.objects.HFWorkspace.from_json(playbook_dict,delimiter=delimiter)
+    assert isinstance(labelled_workspace, humanfirst.objects.HFWorkspace)
+    print("Got playbook and parsed it")
+    return labelled_workspace.get_intent_index(delimiter="-")
+
+
 def get_conversationset_df(
         hf_api : humanfirst.apis.HFAPI,
         namespace: str,
@@ -147,87 +350,84 @@ def get_conversationset_df(
         delimiter: str,
         page_size: int = 50,
         quit_after_pages: int = 0,
-        debug: bool = False) -> tuple:
+        debug: bool = False,
+        max_retries: int = 5) -> tuple:
     '''Download the inferred statistics for the conversation set source for the provided
-    playbook and return a data frame.  Pages through the very large data science data
-    with each page of page_size'''
-    labelled_workspace = humanfirst.objects.HFWorkspace.from_json(playbook_dict,delimiter=delimiter)
-    assert isinstance(labelled_workspace, humanfirst.objects.HFWorkspace)
-    intent_name_index = labelled_workspace.get_intent_index(delimiter="-")
-    print("Got playbook and parsed it")
+    playbook and return a data frame and the raw results.  Holds everything in memory,
+    write_coverage_csv streams to file for large conversation sets'''
+    intent_name_index = get_intent_name_index(playbook_dict, delimiter)
 
-    i = 0
     results = []
-    response_json = hf_api.query_conversation_set(
-        namespace,
-        playbook,
-        search_text=searchtext,
-        start_isodate=startisodate,
-        end_isodate=endisodate,
-        convsetsource=convsetsource,
-        page_size=page_size
-    )
-
-    # helps in analysing the response and debug the query endpoint
-    # with open("./data/testing_coverage.json",mode="w",encoding="utf8") as fileobj:
-    #     json.dump(response_json,fileobj,indent=2)
-    # quit()
-
-    # bigquery doesn't accept a field name with @ symbol
-    # @type property occurs in 6 places in a single record returned query end point
-    # Replace Unsupported empty struct type for field
-    # - 'annotatedConversation.annotations.entities.inputEntities' with None
-    if "results" in response_json:
-        response_json["results"] = rename_type_property(response_json["results"])
-    else:
-        print(json.dumps(response_json,indent=2))
-        print("Results keyword does not exist")
-    response_json_list = response_json["results"]
-
-    results = extract_results(
-        results, intent_name_index, response_json, debug=debug)
-    assert isinstance(response_json, dict)
-    print(f'Page {i}: {len(results)}')
-    i = i + 1
-
+    response_json_list = []
     print(f"Quit after pages {quit_after_pages}")
-    while "nextPageToken" in response_json:
-        if quit_after_pages > 0 and i >= quit_after_pages:
-            break
-        try:
-            response_json = hf_api.query_conversation_set(
-                namespace,
-                playbook,
-                search_text=searchtext,
-                start_isodate=startisodate,
-                end_isodate=endisodate,
-                convsetsource=convsetsource,
-                page_size=page_size,
-                next_page_token=response_json["nextPageToken"]
-            )
-        except Exception as e: # pylint: disable=broad-exception-caught
-            print(f"Error - {e}")
-            print("Retrying")
-            continue
-
-        assert isinstance(response_json, dict)
-        if not "results" in response_json.keys() and "totalCount" in response_json.keys():
-            print(f'totalCount: {response_json["totalCount"]}')
-            break
-        else:
+    for i, response_json in enumerate(iter_pages(hf_api, namespace, playbook, convsetsource, searchtext,
+                                                 startisodate, endisodate, page_size=page_size,
+                                                 quit_after_pages=quit_after_pages, max_retries=max_retries)):
+        response_json_list.extend(response_json["results"])
+        results = extract_results(results, intent_name_index, response_json, debug=debug)
+        print(f'Page {i}: {len(results)}')
+
+    return pandas.DataFrame(results, columns=COLUMNS), response_json_list
+
+
+def iter_pages(hf_api : humanfirst.apis.HFAPI,
+               namespace: str,
+               playbook: str,
+               convsetsource: str,
+               searchtext: str,
+               startisodate: str,
+               endisodate: str,
+               page_size: int = 50,
+               quit_after_pages: int = 0,
+               max_retries: int = 5,
+               backoff: float = 1.0) -> typing.Iterator[dict]:
+    '''Yields each page from the query end point with the @type properties renamed.
+    The next page is requested on a background thread as soon as its token is known
+    so it downloads while the caller works through the current page'''
+    fetch = functools.partial(fetch_page, hf_api, namespace, playbook, max_retries=max_retries, backoff=backoff,
+                              search_text=searchtext, start_isodate=startisodate, end_isodate=endisodate,
+                              convsetsource=convsetsource, page_size=page_size)
+    pages = 0
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        future = pool.submit(fetch, next_page_token='')
+        while future is not None:
+            response_json = future.result()
+            future = None
+            if not "results" in response_json.keys():
+                if "totalCount" in response_json.keys():
+                    print(f'totalCount: {response_json["totalCount"]}')
+                else:
+                    print(json.dumps(response_json,indent=2))
+                    print("Results keyword does not exist")
+                break
+            pages = pages + 1
+            if "nextPageToken" in response_json and not (quit_after_pages > 0 and pages >= quit_after_pages):
+                future = pool.submit(fetch, next_page_token=response_json["nextPageToken"])
+
             # bigquery doesn't accept a field name with @ symbol
             # @type property occurs in 6 places in a single record returned query end point
             # Replace Unsupported empty struct type for field
             # - 'annotatedConversation.annotations.entities.inputEntities' with None
             response_json["results"] = rename_type_property(response_json["results"])
-            response_json_list.extend(response_json["results"])
+            yield response_json
 
-            results = extract_results(
-                results, intent_name_index, response_json)
-        print(f'Page {i}: {len(results)}')
-        i = i + 1
 
-    return pandas.DataFrame(results), response_json_list
+def fetch_page(hf_api : humanfirst.apis.HFAPI, namespace: str, playbook: str,
+               max_retries: int = 5, backoff: float = 1.0, **query) -> dict:
+    '''One page from the query end point retrying failures with exponential backoff'''
+    for attempt in range(max_retries + 1):
+        try:
+            response_json = hf_api.query_conversation_set(namespace, playbook, **query)
+            assert isinstance(response_json, dict)
+            return response_json
+        except Exception as e: # pylint: disable=broad-exception-caught
+            if attempt == max_retries:
+                raise RuntimeError(f"Query end point failed {max_retries + 1} times") from e
+            wait = backoff * 2 ** attempt
+            print(f"Error - {e}")
+            print(f"Retrying in {wait}s")
+            time.sleep(wait)
+    return {}
 
 
 def rename_type_property(results: list) -> list:
@@ -271,39 +471,51 @@ def dump_this(text: str, filename: str):
 def extract_results(results: list, intent_name_index: dict, response_json, debug: bool = False):
     '''Extacts the desired data for the data frame from a set of results from the query end point in HumanFirst'''
     for result in response_json["results"]:
-
-        conv_obj = {}
-        conv_obj["convoid"] = result["annotatedConversation"]["conversation"]["id"]
-        # conv_obj["sources"] = result["annotatedConversation"]["conversation"]["sources"]
-        conv_obj["conv_created_at"] = result["annotatedConversation"]["conversation"]["createdAt"]
-        conv_obj["conv_updated_at"] = result["annotatedConversation"]["conversation"]["updatedAt"]
+        conversation = result["annotatedConversation"]["conversation"]
+        try:
+            predictions = result["annotatedConversation"]["annotations"]["inputs_intents"]["inputs"]
+        except KeyError:
+            # each utterance is reported and skipped below
+            predictions = []
+        convoid = conversation["id"]
+        conv_created_at = conversation["createdAt"]
+        conv_updated_at = conversation["updatedAt"]
 
         if debug:
-            dump_this(result, conv_obj["convoid"])
+            dump_this(result, convoid)
 
-        for i in range(len(result["annotatedConversation"]["conversation"]["inputs"])):
+        for i, utterance in enumerate(conversation["inputs"]):
             try:
-                if "value" in result["annotatedConversation"]["conversation"]["inputs"][i].keys():
-                    conv_obj["utterance"] = result["annotatedConversation"]["conversation"]["inputs"][i]["value"]
-                    conv_obj["utterance_created_at"] = result[
-                        "annotatedConversation"]["conversation"]["inputs"][i]["createdAt"]
+                if "value" in utterance.keys():
+                    text = utterance["value"]
+                    utterance_created_at = utterance["createdAt"]
                 else:
-                    conv_obj["utterance"] = ""
-                    conv_obj["utterance_created_at"] = ""
-                conv_obj["role"] = result["annotatedConversation"]["conversation"]["inputs"][i]["source"]
-                if "matches" in result["annotatedConversation"]["annotations"]["inputs_intents"]["inputs"][i].keys():
-                    conv_obj["intent_id"] = result["annotatedConversation"]["annotations"]["inputs_intents"]["inputs"][i]["matches"][0]["intentId"] # pylint: disable=line-too-long
-                    conv_obj["score"] = result["annotatedConversation"]["annotations"]["inputs_intents"]["inputs"][i]["matches"][0]["score"] # pylint: disable=line-too-long
-                    conv_obj["intent"] = intent_name_index[conv_obj["intent_id"]]
+                    text = ""
+                    utterance_created_at = ""
+                if "matches" in predictions[i].keys():
+                    intent_id = predictions[i]["matches"][0]["intentId"]
+                    score = predictions[i]["matches"][0]["score"]
+                    intent = intent_name_index[intent_id]
                 else:
-                    for field in ["intent_id", "score", "intent"]:
-                        conv_obj[field] = None
-                conv_obj["seq"] = i
-                results.append(copy.deepcopy(conv_obj))
+                    intent_id = None
+                    score = None
+                    intent = None
+                # a new dict per utterance, nothing is shared between rows so no copy is needed
+                results.append({
+                    "convoid": convoid,
+                    "conv_created_at": conv_created_at,
+                    "conv_updated_at": conv_updated_at,
+                    "utterance": text,
+                    "utterance_created_at": utterance_created_at,
+                    "role": utterance["source"],
+                    "intent_id": intent_id,
+                    "score": score,
+                    "intent": intent,
+                    "seq": i
+                })
             except Exception: # pylint: disable=broad-exception-caught
                 print("No idea what's up with this:")
-                print(json.dumps(result["annotatedConversation"]
-                      ["conversation"]["inputs"][i], indent=2))
+                print(json.dumps(utterance, indent=2))
     return results
 
 